@@ -0,0 +1,130 @@
+"""
+Benchmark hors ligne de /api/chat, /api/generate_contract et /api/modify_contract
+L'application tourne en mémoire (ASGI) contre le backend LLM simulé : les latences mesurées
+sont celles du modèle simulé plus le surcoût du serveur, à concurrence croissante
+
+Usage (depuis backend/):
+    python benchmarks/bench_endpoints.py
+    python benchmarks/bench_endpoints.py --concurrency 1 8 32 --requests 64 --ttft-ms 100
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/<référence>.json
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from bench_utils import compare_results, save_results, summarize, use_backend_path
+
+use_backend_path()
+# Pas de cache de contrats : chaque requête doit exécuter la cascade
+os.environ.setdefault("CONTRACT_CACHE_ENABLED", "0")
+
+import httpx  # noqa: E402
+from fake_llm import FakeLLMConfig  # noqa: E402
+from main import app, is_chat_error  # noqa: E402
+from model_pool import model_pool  # noqa: E402
+
+HISTORY = [
+    {"role": "model", "parts": [{"text": "For this new mandate, what is the primary strategic objective your client is seeking to achieve?"}]},
+    {"role": "user", "parts": [{"text": "Acquire 100% of the shares of Beta Ltd for EUR 25m, closing in Q3."}]},
+    {"role": "model", "parts": [{"text": "Who are the sellers and which law should govern the agreement?"}]},
+    {"role": "user", "parts": [{"text": "The two founders; English law, LCIA arbitration in London."}]},
+]
+
+CONTRACT_HTML = "\n".join(
+    [f"<h1>SHARE PURCHASE AGREEMENT</h1>"]
+    + [f"<h2>Article {i} - Clause {i}</h2>\n<p>{'The parties agree to the terms of this clause. ' * 20}</p>" for i in range(1, 41)]
+)
+
+SCENARIOS = {
+    "chat": ("/api/chat", {"text": "The purchase price is payable at closing.", "history": HISTORY}),
+    "generate_contract": ("/api/generate_contract", {"history": HISTORY, "use_cache": False}),
+    "modify_contract": ("/api/modify_contract", {
+        "current_html": CONTRACT_HTML,
+        "modification_request": "In Article 12, add that notices may be sent by email.",
+    }),
+}
+
+
+async def run_scenario(client: httpx.AsyncClient, path: str, payload: dict, concurrency: int, total: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one_request():
+        nonlocal errors
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                await response.aread()
+                # Le chat signale ses erreurs dans le corps d'une réponse 200
+                if response.status_code != 200 or (path == "/api/chat" and is_chat_error(response.text)):
+                    errors += 1
+                    return
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(total)))
+    return summarize(latencies, errors, time.perf_counter() - started_at)
+
+
+async def main(args) -> int:
+    fake_config = FakeLLMConfig(
+        ttft=args.ttft_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        chunk_tokens=args.chunk_tokens,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        seed=42,
+    )
+    model_pool.set_backend("fake", fake_config)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        for name in args.scenarios:
+            path, payload = SCENARIOS[name]
+            results[name] = {}
+            for concurrency in args.concurrency:
+                summary = await run_scenario(client, path, payload, concurrency, max(args.requests, concurrency))
+                results[name][f"c{concurrency}"] = summary
+                print(f"{name:<18} c={concurrency:<4} p50={summary['p50_ms']:>9.1f}ms "
+                      f"p99={summary['p99_ms']:>9.1f}ms  {summary['throughput_rps']:>8.1f} req/s  "
+                      f"errors={summary['errors']}")
+
+    meta = {"fake_llm": vars(fake_config), "requests": args.requests, "concurrency": args.concurrency}
+    path = save_results("bench_endpoints", results, meta, args.output)
+    print(f"\nRésultats enregistrés dans {path}")
+
+    if args.compare:
+        print(f"\nComparaison avec {args.compare}:")
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} régression(s) au-delà de {args.tolerance:.0%}")
+            return 1
+        print("\n✅ Pas de régression")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=32, help="requêtes par palier de concurrence")
+    parser.add_argument("--ttft-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument("--chunk-tokens", type=int, default=20)
+    parser.add_argument("--output-tokens", type=int, default=400)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="fichier de résultats (par défaut benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
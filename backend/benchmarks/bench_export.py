@@ -0,0 +1,132 @@
+"""
+Benchmark de l'export PDF/DOCX des contrats, en pages par seconde
+- rendu direct (un cœur) de contrats de tailles croissantes, pour chaque format
+- débit du pool d'export : exports simultanés de contrats distincts (cache désactivé), selon le nombre de workers
+- pendant le débit du pool, latence de la boucle d'événements : elle doit rester proche de zéro
+Les pages sont celles du PDF ; le DOCX d'un même contrat est compté avec le même nombre de pages
+
+Usage (depuis backend/):
+    python benchmarks/bench_export.py
+    python benchmarks/bench_export.py --articles 50 200 800 --workers 1 2 4 --compare benchmarks/results/<référence>.json
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from bench_utils import compare_results, save_results, use_backend_path
+
+use_backend_path()
+
+from contract_export import EXPORT_FORMATS, pdf_page_count, render_document, render_pdf  # noqa: E402
+from export_pool import ContractExporter, ExportCache, ExportConfig  # noqa: E402
+
+ARTICLE = (
+    '<h2>ARTICLE {n}. PURCHASE PRICE</h2>\n'
+    '<p>{n}.1 The Purchaser shall pay to the Seller the Purchase Price of EUR {price},000 &amp; the '
+    '<strong>Escrow Amount</strong> in accordance with Article {n}.2, subject to the adjustments set out in '
+    'Schedule {n} and to the <em>Locked Box</em> mechanism agreed between the Parties.</p>\n'
+    '<ol><li>on the Closing Date;</li><li>by wire transfer to the <em>Escrow Account</em>.</li></ol>\n'
+    '<table><tr><th>Instalment</th><td>&#8364; 2,500,000</td></tr><tr><th>Due date</th><td>Closing + 30 days</td></tr></table>\n'
+)
+
+
+def make_contract(articles: int, seed: int = 0) -> str:
+    return "".join(ARTICLE.format(n=n, price=10_000 + seed) for n in range(1, articles + 1))
+
+
+def best_of(runs: int, fn, *args) -> float:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+async def loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    """Retard du réveil de la boucle par rapport à l'intervalle attendu"""
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started_at - interval)
+
+
+async def pool_throughput(workers: int, articles: int, exports: int, export_format: str) -> dict:
+    exporter = ContractExporter(ExportConfig(workers=workers), ExportCache("", enabled=False))
+    try:
+        # Démarrage de tous les processus hors mesure
+        await asyncio.gather(*(exporter.export(make_contract(1, seed=-1 - index), export_format) for index in range(workers)))
+        contracts = [make_contract(articles, seed=index) for index in range(exports)]
+        pages = sum(pdf_page_count(render_pdf(contract)) for contract in contracts)
+        stop, lags = asyncio.Event(), []
+        lag_task = asyncio.create_task(loop_lag(stop, lags))
+        started_at = time.perf_counter()
+        await asyncio.gather(*(exporter.export(contract, export_format) for contract in contracts))
+        seconds = time.perf_counter() - started_at
+        stop.set()
+        await lag_task
+    finally:
+        await exporter.shutdown()
+    return {
+        'seconds_s': round(seconds, 3),
+        'pages_per_second': round(pages / seconds, 1),
+        'max_loop_lag_ms': round(max(lags, default=0) * 1000, 2),
+    }
+
+
+def main(args) -> int:
+    results = {}
+    print("Rendu direct")
+    for articles in args.articles:
+        contract = make_contract(articles)
+        pages = pdf_page_count(render_pdf(contract))
+        entry = {'pages': pages}
+        for export_format in EXPORT_FORMATS:
+            seconds = best_of(args.runs, render_document, export_format, contract)
+            entry[export_format] = {'seconds_s': round(seconds, 4), 'pages_per_second': round(pages / seconds, 1)}
+        results[f"direct_{articles}_articles"] = entry
+        print(f"  {articles:5d} articles, {pages:4d} pages  " + "  ".join(
+            f"{export_format}: {entry[export_format]['seconds_s'] * 1000:8.1f} ms "
+            f"({entry[export_format]['pages_per_second']:7.1f} pages/s)" for export_format in EXPORT_FORMATS
+        ))
+
+    print(f"\nPool d'export : {args.exports} exports simultanés de {args.pool_articles} articles")
+    for workers in args.workers:
+        for export_format in EXPORT_FORMATS:
+            entry = asyncio.run(pool_throughput(workers, args.pool_articles, args.exports, export_format))
+            results[f"pool_{workers}_workers_{export_format}"] = entry
+            print(f"  {workers} worker(s) {export_format:4s}: {entry['seconds_s']:6.2f}s  "
+                  f"{entry['pages_per_second']:7.1f} pages/s  retard max de la boucle {entry['max_loop_lag_ms']:.1f} ms")
+
+    meta = {'articles': args.articles, 'pool_articles': args.pool_articles, 'exports': args.exports,
+            'workers': args.workers, 'runs': args.runs}
+    path = save_results("bench_export", results, meta, args.output)
+    print(f"\nRésultats enregistrés dans {path}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions:
+            print("\n⚠️ Régressions :")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\n✅ Aucune régression")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", nargs="+", type=int, default=[25, 100, 400])
+    parser.add_argument("--pool-articles", type=int, default=100, help="taille des contrats exportés via le pool")
+    parser.add_argument("--exports", type=int, default=8, help="exports simultanés via le pool")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--runs", type=int, default=3, help="meilleur temps sur N exécutions")
+    parser.add_argument("--output", help="fichier de résultats (par défaut benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
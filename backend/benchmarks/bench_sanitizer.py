@@ -0,0 +1,127 @@
+"""
+Benchmark du nettoyage HTML des réponses du LLM sur des contrats de plusieurs mégaoctets
+- ancien post-traitement (recherches répétées et re.sub successifs sur le document entier)
+- HtmlSanitizer en une passe, sur le texte entier et morceau par morceau (comme un flux)
+Le débit doit rester constant quand la taille double : le traitement est linéaire
+
+Usage (depuis backend/):
+    python benchmarks/bench_sanitizer.py
+    python benchmarks/bench_sanitizer.py --sizes-mb 1 4 16 --compare benchmarks/results/<référence>.json
+"""
+import argparse
+import re
+import sys
+import time
+
+from bench_utils import compare_results, save_results, use_backend_path
+
+use_backend_path()
+
+from html_sanitizer import HtmlSanitizer, sanitize_html  # noqa: E402
+
+ARTICLE = (
+    '<h2>ARTICLE {n}. PURCHASE PRICE</h2>\n'
+    '<p>{n}.1 The Purchaser shall pay to the Seller the Purchase Price of EUR 10,000,000 &amp; the '
+    '<strong>Escrow Amount</strong> in accordance with Article {n}.2.</p>\n'
+    '<ol><li>on the Closing Date;</li><li>by wire transfer to the <em>Escrow Account</em>.</li></ol>\n'
+    '<table><tr><td>Instalment</td><td>&#8364; 2,500,000</td></tr></table>\n'
+)
+HEAD = '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>SPA</title><style>p { margin: 0 }</style></head>\n<body>\n'
+
+
+def make_document(size_mb: float) -> str:
+    """Réponse typique du LLM : bloc de code, document HTML complet autour du contrat"""
+    target = int(size_mb * 1_000_000)
+    parts, length, n = [], 0, 1
+    while length < target:
+        part = ARTICLE.format(n=n)
+        parts.append(part)
+        length += len(part)
+        n += 1
+    return "```html\n" + HEAD + "".join(parts) + "</body></html>\n```"
+
+
+def legacy_clean(html_content: str) -> str:
+    """Post-traitement d'origine de format_to_html, pour comparaison"""
+    if html_content.strip().startswith('```html'):
+        html_content = html_content.strip()[7:]
+    elif html_content.strip().startswith('```'):
+        html_content = html_content.strip()[3:]
+    if html_content.strip().endswith('```'):
+        html_content = html_content.strip()[:-3]
+    if '<body' in html_content.lower():
+        body_match = re.search(r'<body[^>]*>(.*)</body>', html_content, re.DOTALL | re.IGNORECASE)
+        if body_match:
+            html_content = body_match.group(1)
+    if '<style' in html_content.lower():
+        html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+        html_content = re.sub(r'<meta[^>]*>', '', html_content, flags=re.IGNORECASE)
+        html_content = re.sub(r'<title[^>]*>.*?</title>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+    return html_content.strip()
+
+
+def chunked(document: str, chunk_chars: int) -> str:
+    sanitizer = HtmlSanitizer()
+    parts = [sanitizer.feed(document[i:i + chunk_chars]) for i in range(0, len(document), chunk_chars)]
+    parts.append(sanitizer.close())
+    return "".join(parts)
+
+
+def best_of(runs: int, fn, *args) -> float:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def main(args) -> int:
+    results = {}
+    for size_mb in args.sizes_mb:
+        document = make_document(size_mb)
+        megabytes = len(document) / 1_000_000
+        if sanitize_html(document) != chunked(document, args.chunk_chars):
+            print(f"❌ Résultat différent en morceaux ({size_mb} Mo)")
+            return 1
+        timings = {
+            'legacy': best_of(args.runs, legacy_clean, document),
+            'sanitizer': best_of(args.runs, sanitize_html, document),
+            'sanitizer_chunked': best_of(args.runs, chunked, document, args.chunk_chars),
+        }
+        results[f"{size_mb}mb"] = {
+            name: {'seconds_s': round(seconds, 4), 'mb_per_second': round(megabytes / seconds, 2)}
+            for name, seconds in timings.items()
+        }
+        print(f"{megabytes:6.2f} Mo  " + "  ".join(
+            f"{name}: {seconds * 1000:8.1f} ms ({megabytes / seconds:6.1f} Mo/s)" for name, seconds in timings.items()
+        ))
+
+    meta = {'sizes_mb': args.sizes_mb, 'chunk_chars': args.chunk_chars, 'runs': args.runs}
+    path = save_results("bench_sanitizer", results, meta, args.output)
+    print(f"\nRésultats enregistrés dans {path}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions:
+            print("\n⚠️ Régressions :")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\n✅ Aucune régression")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", nargs="+", type=float, default=[1, 2, 4, 8])
+    parser.add_argument("--chunk-chars", type=int, default=256, help="taille des morceaux du flux simulé")
+    parser.add_argument("--runs", type=int, default=3, help="meilleur temps sur N exécutions")
+    parser.add_argument("--output", help="fichier de résultats (par défaut benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
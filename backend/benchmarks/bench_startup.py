@@ -0,0 +1,129 @@
+"""
+Benchmark du démarrage à froid
+- durée d'import de main dans un processus neuf (et les modules les plus coûteux, via -X importtime)
+- délai entre le lancement d'uvicorn et la première réponse 200 sur /
+
+Usage (depuis backend/):
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --compare benchmarks/results/<référence>.json
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench_utils import BACKEND_DIR, compare_results, percentile, save_results
+
+IMPORT_SNIPPET = (
+    "import sys, time; started_at = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started_at); print(int('google.generativeai' in sys.modules))"
+)
+
+
+def _environment() -> dict:
+    # Démarrage sans réseau ni préchauffage : on mesure le coût propre au serveur
+    return {**os.environ, "LLM_WARMUP": "0"}
+
+
+def measure_import() -> tuple:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=_environment(),
+                            capture_output=True, text=True, check=True).stdout.strip().splitlines()
+    return float(output[-2]), output[-1] == "1"
+
+
+def slowest_imports(limit: int = 8) -> list:
+    """Modules les plus coûteux (temps cumulé) d'après python -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                            env=_environment(), capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1e6, name.strip()))
+    return [{'module': name, 'seconds': round(seconds, 3)} for seconds, name in sorted(modules, reverse=True)[:limit]]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_response(timeout: float = 30) -> float:
+    port = _free_port()
+    started_at = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=_environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started_at < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started_at
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"Pas de réponse sur / après {timeout}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main(args) -> int:
+    import_times, first_responses = [], []
+    sdk_imported = False
+    for _ in range(args.runs):
+        seconds, sdk_loaded = measure_import()
+        import_times.append(seconds)
+        sdk_imported = sdk_imported or sdk_loaded
+        first_responses.append(measure_first_response())
+
+    results = {
+        "import_main": {
+            "p50_s": round(percentile(import_times, 50), 3),
+            "max_s": round(max(import_times), 3),
+        },
+        "first_response": {
+            "p50_s": round(percentile(first_responses, 50), 3),
+            "max_s": round(max(first_responses), 3),
+        },
+    }
+    print(f"import main       p50={results['import_main']['p50_s']:.3f}s  max={results['import_main']['max_s']:.3f}s")
+    print(f"premier 200 sur / p50={results['first_response']['p50_s']:.3f}s  max={results['first_response']['max_s']:.3f}s")
+    if sdk_imported:
+        print("⚠️ google.generativeai est importé au démarrage")
+    print("\nImports les plus coûteux :")
+    top = slowest_imports()
+    for entry in top:
+        print(f"  {entry['seconds']:.3f}s  {entry['module']}")
+
+    path = save_results("bench_startup", results, {"runs": args.runs, "sdk_imported_at_startup": sdk_imported,
+                                                  "slowest_imports": top}, args.output)
+    print(f"\nRésultats enregistrés dans {path}")
+
+    if args.compare:
+        print(f"\nComparaison avec {args.compare}:")
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions or sdk_imported:
+            print(f"\n❌ Régression du démarrage à froid")
+            return 1
+        print("\n✅ Pas de régression")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="fichier de résultats (par défaut benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="régression tolérée (0.25 = 25%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,95 @@
+"""
+Outils communs aux benchmarks : percentiles, sauvegarde et comparaison des résultats
+"""
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+
+def use_backend_path():
+    """Rend les modules du backend importables quand le script est lancé directement"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile par interpolation linéaire (pct entre 0 et 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> Dict[str, float]:
+    """Résumé d'une série de requêtes : latences en ms, débit en requêtes/s"""
+    count = len(latencies)
+    return {
+        "requests": count + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        "throughput_rps": round(count / wall_time, 2) if wall_time else 0.0,
+    }
+
+
+def save_results(name: str, results: Dict, meta: Dict, output: Optional[str] = None) -> str:
+    """Enregistre les résultats en JSON (benchmarks/results/<name>_<horodatage>.json par défaut)"""
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = output or os.path.join(RESULTS_DIR, f"{name}_{timestamp}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {
+        "benchmark": name,
+        "timestamp": timestamp,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "meta": meta,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    return path
+
+
+def _flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare_results(baseline_path: str, results: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    Compare aux résultats de référence et retourne les régressions au-delà de la tolérance
+    (latences plus élevées ou débit plus faible)
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = _flatten(json.load(f)["results"])
+    current = _flatten(results)
+    regressions = []
+    for name, value in sorted(current.items()):
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        change = (value - reference) / reference
+        worse = change > tolerance if name.endswith("_ms") or name.endswith("_s") else (
+            change < -tolerance if name.endswith("_rps") or name.endswith("per_second") or name.endswith("per_minute") else False
+        )
+        print(f"  {name:<55} {reference:>10} -> {value:>10} ({change:+.0%}){'  ⚠️' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
@@ -0,0 +1,336 @@
+"""
+Simulation de charge de bout en bout : des centaines de sessions complètes en parallèle
+Chaque session enchaîne les tours de l'assistant (/api/chat) et de l'avocat simulé
+(/api/generate_lawyer_response), puis la génération (/api/generate_contract) et une modification
+(/api/modify_contract). L'application tourne en mémoire (ASGI) contre :
+- le backend simulé (--backend fake, par défaut)
+- des réponses enregistrées rejouées avec leurs temps réels (--backend replay --replay <fichier>)
+- Gemini (--backend gemini), éventuellement avec --record <fichier> pour produire un enregistrement
+Rapport : sessions/minute, distribution des latences par étape, taux d'échec par étape
+
+Usage (depuis backend/):
+    python benchmarks/simulate_sessions.py --sessions 200 --concurrency 100
+    python benchmarks/simulate_sessions.py --backend gemini --sessions 3 --record benchmarks/results/recording.jsonl
+    python benchmarks/simulate_sessions.py --backend replay --replay benchmarks/results/recording.jsonl --sessions 300
+    python benchmarks/simulate_sessions.py --compare benchmarks/results/<référence>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from bench_utils import compare_results, percentile, save_results, use_backend_path
+
+use_backend_path()
+# Chaque session doit exécuter sa cascade : pas de cache de contrats, ni de fiches d'opération
+# laissées par une simulation précédente (les conversations simulées se répètent d'un lancement à l'autre)
+os.environ.setdefault("CONTRACT_CACHE_ENABLED", "0")
+os.environ.setdefault("DEAL_SHEET_DIR", tempfile.mkdtemp(prefix="counselai_simulation_"))
+
+import httpx  # noqa: E402
+from fake_llm import FakeLLMConfig, response_kind  # noqa: E402
+from main import app, is_chat_error  # noqa: E402
+from model_pool import model_pool  # noqa: E402
+
+STAGES = ("chat", "lawyer", "generate_contract", "modify_contract")
+FIRST_QUESTION = "For this new mandate, what is the primary strategic objective your client is seeking to achieve?"
+MODIFICATION_REQUEST = "In the article on notices, add that notices may also be sent by email."
+
+
+class StageFailure(Exception):
+    def __init__(self, stage: str, detail: str):
+        super().__init__(f"{stage}: {detail}")
+        self.stage = stage
+
+
+class Recorder:
+    """Enregistre chaque réponse du modèle (texte, appel d'outil, TTFT, durée) pour le rejeu"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, kind: str, text: str, function_call: Optional[str], ttft: float, duration: float):
+        entry = {"kind": kind, "text": text, "function_call": function_call,
+                 "ttft_ms": round(ttft * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def _chunk_content(chunk: Any):
+    """(texte, nom de l'outil appelé) d'un morceau ou d'une réponse du SDK"""
+    for candidate in getattr(chunk, "candidates", None) or []:
+        for part in getattr(getattr(candidate, "content", None), "parts", None) or []:
+            function_call = getattr(part, "function_call", None)
+            if function_call and getattr(function_call, "name", ""):
+                return "", function_call.name
+    try:
+        return chunk.text or "", None
+    except Exception:
+        return "", None
+
+
+class RecordingStream:
+    """Stream du SDK relayé tel quel, enregistré une fois consommé"""
+
+    def __init__(self, response: Any, on_done):
+        self._response = response
+        self._on_done = on_done
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._response, name)
+
+    async def __aiter__(self):
+        parts, function_call, first_at = [], None, None
+        try:
+            async for chunk in self._response:
+                first_at = first_at or time.perf_counter()
+                text, called = _chunk_content(chunk)
+                parts.append(text)
+                function_call = function_call or called
+                yield chunk
+        finally:
+            # Lecture interrompue (objet JSON complet, client parti) : enregistré tel que consommé
+            self._on_done("".join(parts), function_call, first_at)
+
+
+class RecordingModel:
+    """Enveloppe d'un GenerativeModel : chaque réponse est enregistrée avec sa catégorie de rejeu"""
+
+    def __init__(self, model: Any, recorder: Recorder, system_instruction: Optional[str], generation_config: Any):
+        self._model = model
+        self._recorder = recorder
+        self._system_instruction = system_instruction
+        self._generation_config = generation_config
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._model, name)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs):
+        return await self._record(contents, stream, self._model.generate_content_async(contents, stream=stream, **kwargs))
+
+    def start_chat(self, history: Optional[List[Dict]] = None):
+        chat = self._model.start_chat(history=history)
+        model = self
+
+        class RecordingChat:
+            def __getattr__(self, name: str) -> Any:
+                return getattr(chat, name)
+
+            async def send_message_async(self, content: Any, stream: bool = False, **kwargs):
+                return await model._record(content, stream, chat.send_message_async(content, stream=stream, **kwargs))
+
+        return RecordingChat()
+
+    async def _record(self, contents: Any, stream: bool, pending):
+        kind = response_kind(self._system_instruction, self._generation_config, contents)
+        started_at = time.perf_counter()
+        response = await pending
+
+        def done(text: str, function_call: Optional[str], first_at: Optional[float]):
+            finished_at = time.perf_counter()
+            self._recorder.write(kind, text, function_call, (first_at or finished_at) - started_at, finished_at - started_at)
+
+        if stream:
+            return RecordingStream(response, done)
+        text, function_call = _chunk_content(response)
+        done(text, function_call, None)
+        return response
+
+
+def install_recorder(recorder: Recorder):
+    """Enveloppe les modèles distribués par le pool (le cache de contexte est désactivé en enregistrement)"""
+    model_pool.context_cache = False
+    get = model_pool.get
+
+    def recording_get(model_name: str, system_instruction: Optional[str] = None, generation_config: Any = None):
+        return RecordingModel(get(model_name, system_instruction, generation_config), recorder,
+                              system_instruction, generation_config)
+
+    model_pool.get = recording_get
+
+
+async def timed(stage: str, timings: Dict[str, List[float]], request):
+    started_at = time.perf_counter()
+    try:
+        response = await request
+        await response.aread()
+    except Exception as e:
+        raise StageFailure(stage, f"{type(e).__name__}: {e}")
+    if response.status_code != 200:
+        raise StageFailure(stage, f"HTTP {response.status_code}")
+    timings[stage].append(time.perf_counter() - started_at)
+    return response
+
+
+async def run_session(client: httpx.AsyncClient, args, timings: Dict[str, List[float]]):
+    """Une session complète ; la première étape en échec interrompt la session"""
+    history = [{"role": "model", "parts": [{"text": FIRST_QUESTION}]}]
+    for _ in range(args.turns):
+        response = await timed("lawyer", timings, client.post("/api/generate_lawyer_response", json={
+            "history": history, "model_name": args.model
+        }))
+        lawyer_text = response.json()["response"]
+        response = await timed("chat", timings, client.post("/api/chat", json={
+            "text": lawyer_text, "history": history, "model_name": args.model
+        }))
+        reply = response.text
+        if is_chat_error(reply):
+            raise StageFailure("chat", reply[:120])
+        history += [{"role": "user", "parts": [{"text": lawyer_text}]}]
+        if reply.startswith("TOOL_CALL:"):
+            break
+        history += [{"role": "model", "parts": [{"text": reply}]}]
+
+    response = await timed("generate_contract", timings, client.post("/api/generate_contract", json={
+        "history": history, "model_name": args.model, "use_cache": False
+    }))
+    contract_html = response.json()["contract_html"]
+    await timed("modify_contract", timings, client.post("/api/modify_contract", json={
+        "current_html": contract_html, "modification_request": MODIFICATION_REQUEST,
+        "history": history, "model_name": args.model
+    }))
+
+
+async def simulate(args) -> Dict[str, Any]:
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    failures: Dict[str, int] = {stage: 0 for stage in STAGES}
+    session_times: List[float] = []
+    unexpected: List[str] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one_session(client: httpx.AsyncClient):
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await run_session(client, args, timings)
+            except StageFailure as e:
+                failures[e.stage] += 1
+                return
+            except Exception as e:
+                # Réponse HTTP 200 illisible : la session échoue sans étape imputable
+                unexpected.append(f"{type(e).__name__}: {e}")
+                return
+            session_times.append(time.perf_counter() - started_at)
+
+    transport = httpx.ASGITransport(app=app)
+    started_at = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://simulation", timeout=args.timeout) as client:
+        await asyncio.gather(*(one_session(client) for _ in range(args.sessions)))
+    wall_time = time.perf_counter() - started_at
+
+    stages = {}
+    for stage in STAGES:
+        latencies = timings[stage]
+        attempts = len(latencies) + failures[stage]
+        stages[stage] = {
+            "requests": attempts,
+            "failures": failures[stage],
+            "failure_rate": round(failures[stage] / attempts, 4) if attempts else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        }
+    return {
+        "sessions": {
+            "started": args.sessions,
+            "completed": len(session_times),
+            "failure_rate": round(1 - len(session_times) / args.sessions, 4) if args.sessions else 0.0,
+            "sessions_per_minute": round(len(session_times) / wall_time * 60, 2) if wall_time else 0.0,
+            "p50_s": round(percentile(session_times, 50), 3),
+            "p99_s": round(percentile(session_times, 99), 3),
+            "wall_time_s": round(wall_time, 2),
+            "unexpected_errors": len(unexpected),
+        },
+        "stages": stages,
+    }
+
+
+def print_report(results: Dict[str, Any]):
+    sessions = results["sessions"]
+    print(f"\n{sessions['completed']}/{sessions['started']} sessions en {sessions['wall_time_s']}s  "
+          f"→ {sessions['sessions_per_minute']} sessions/min  "
+          f"(session p50={sessions['p50_s']}s p99={sessions['p99_s']}s, échecs {sessions['failure_rate']:.1%})")
+    print(f"\n{'étape':<18}{'requêtes':>9}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'échecs':>9}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<18}{summary['requests']:>9}{summary['p50_ms']:>8.0f}ms{summary['p90_ms']:>8.0f}ms"
+              f"{summary['p99_ms']:>8.0f}ms{summary['max_ms']:>8.0f}ms{summary['failure_rate']:>9.1%}")
+
+
+async def main(args) -> int:
+    fake_config = None
+    if args.backend in ("fake", "replay"):
+        fake_config = FakeLLMConfig(
+            ttft=args.ttft_ms / 1000,
+            tokens_per_second=args.tokens_per_second,
+            output_tokens=args.output_tokens,
+            function_call_rate=args.function_call_rate,
+            error_rate=args.error_rate,
+            seed=42,
+            replay_path=args.replay if args.backend == "replay" else None,
+        )
+        model_pool.set_backend("fake", fake_config)
+    recorder = Recorder(args.record) if args.record else None
+    if recorder is not None:
+        install_recorder(recorder)
+
+    try:
+        results = await simulate(args)
+    finally:
+        if recorder is not None:
+            recorder.close()
+            print(f"\n🎙️ {recorder.count} réponses enregistrées dans {args.record}")
+    print_report(results)
+
+    meta = {"backend": args.backend, "sessions": args.sessions, "concurrency": args.concurrency,
+            "turns": args.turns, "fake_llm": vars(fake_config) if fake_config else None}
+    path = save_results("simulate_sessions", results, meta, args.output)
+    print(f"\nRésultats enregistrés dans {path}")
+
+    if args.compare:
+        print(f"\nComparaison avec {args.compare}:")
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} régression(s) au-delà de {args.tolerance:.0%}")
+            return 1
+        print("\n✅ Pas de régression")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("fake", "replay", "gemini"), default="fake")
+    parser.add_argument("--replay", help="enregistrement JSONL à rejouer (--backend replay)")
+    parser.add_argument("--record", help="enregistre les réponses du modèle dans ce fichier JSONL")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="sessions simultanées")
+    parser.add_argument("--turns", type=int, default=4, help="tours avocat/assistant avant la génération")
+    parser.add_argument("--model", default="gemini-2.5-pro")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--output-tokens", type=int, default=400)
+    parser.add_argument("--function-call-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="fichier de résultats (par défaut benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    args = parser.parse_args()
+    if args.backend == "replay" and not args.replay:
+        parser.error("--backend replay nécessite --replay <fichier>")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,411 @@
+"""
+Bibliothèque locale de clauses standard, indexée en mémoire (BM25)
+Les articles de pure forme (intégralité, notifications, droit applicable...) sont insérés tels quels
+dans le contrat au lieu d'être rédigés par le modèle : seules les parties propres à l'opération
+coûtent des tokens de sortie. La sélection dépend du type de contrat, des termes extraits de la
+conversation (une clause à compléter n'est retenue que si la fiche en fournit les valeurs) et des
+clauses particulières demandées par l'avocat : elles restent rédigées sur mesure, comme les clauses
+dont le sujet fait l'objet d'un terme négocié (cession, frais...)
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from observability import STANDARD_ARTICLES
+from settings import LazySingleton
+
+# Ligne que le modèle écrit après son dernier article, remplacée par les articles standard
+STANDARD_ARTICLES_MARKER = "[[STANDARD ARTICLES]]"
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clauses", "standard_clauses.json")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+FIELD_RE = re.compile(r"\{(\w+)\}")
+SUBCLAUSE_RE = re.compile(r"\{article\}\.(\d+)")
+# Début du bloc de signature : sans marqueur, les articles standard sont insérés juste avant
+SIGNATURE_BLOCK_RE = re.compile(
+    r'^\s*(?:#{1,6}\s*)?[*_]*\s*(?:IN WITNESS WHEREOF\b|(?:SIGNATURES?|SIGNATURE PAGE|EXECUTION PAGE)[\s*_:]*$)',
+    re.IGNORECASE
+)
+SIGNATURE_BLOCK_STARTS = ("IN WITNESS WHEREOF", "SIGNATURE", "EXECUTION PAGE")
+ARTICLE_NUMBER_RE = re.compile(r'^\s*(?:#{1,6}\s*)?[*_]*\s*(?:ARTICLE|SECTION|CLAUSE)\s+(\d+)\b', re.IGNORECASE)
+STOPWORDS = frozenset(
+    "a an and any are as at be by for from in into is it its no non not of on or other shall such that the their "
+    "this to under with which who will".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Mots en minuscules, sans mots vides, pluriels ramenés au singulier"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(TOKEN_RE.findall(name.lower()))
+
+
+@dataclass(frozen=True)
+class ClauseField:
+    """Valeur à reprendre des termes clés ; wrap complète une valeur nue ("France" -> "the laws of France")"""
+    name: str
+    aliases: Tuple[str, ...]
+    expects: str = ""
+    wrap: str = "{value}"
+    as_is: str = "{value}"
+
+    def find(self, terms: Dict[str, str]) -> Optional[str]:
+        for name, value in terms.items():
+            normalized = normalize_name(name)
+            if value and (normalized == normalize_name(self.name) or any(alias in normalized for alias in self.aliases)):
+                return self.format(str(value).strip().rstrip("."))
+        return None
+
+    def format(self, value: str) -> str:
+        if self.expects and self.expects not in value.lower():
+            return self.wrap.format(value=value)
+        if value.lower().startswith("the "):
+            value = value[4:]
+        return self.as_is.format(value=value)
+
+
+@dataclass(frozen=True)
+class Clause:
+    id: str
+    heading: str
+    text: str
+    keywords: Tuple[str, ...] = ()
+    standard: bool = False                # ajouté d'office aux contrats du type, sinon seulement sur un article du plan
+    contract_types: Tuple[str, ...] = ()  # vide : tous les types
+    excluded_types: Tuple[str, ...] = ()
+    fields: Tuple[ClauseField, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Clause":
+        return cls(
+            id=data["id"],
+            heading=data["heading"],
+            text=data["text"],
+            keywords=tuple(data.get("keywords") or ()),
+            standard=bool(data.get("standard")),
+            contract_types=tuple(normalize_name(name) for name in data.get("contract_types") or ()),
+            excluded_types=tuple(normalize_name(name) for name in data.get("excluded_types") or ()),
+            fields=tuple(
+                ClauseField(name, tuple(normalize_name(alias) for alias in spec.get("aliases") or ()),
+                            spec.get("expects", ""), spec.get("wrap", "{value}"), spec.get("as_is", "{value}"))
+                for name, spec in (data.get("fields") or {}).items()
+            ),
+        )
+
+    def applies_to(self, contract_type: str) -> bool:
+        if any(name in contract_type for name in self.excluded_types):
+            return False
+        return not self.contract_types or any(name in contract_type for name in self.contract_types)
+
+    def resolve(self, terms: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Valeurs des champs de la clause, ou None s'il en manque une (l'article est alors rédigé par le modèle)"""
+        values = {}
+        for clause_field in self.fields:
+            value = clause_field.find(terms)
+            if value is None:
+                return None
+            values[clause_field.name] = value
+        return values
+
+    @property
+    def paragraphs(self) -> int:
+        return max((int(number) for number in SUBCLAUSE_RE.findall(self.text)), default=0)
+
+    def body(self, number: int, values: Dict[str, str], offset: int = 0) -> str:
+        """Texte de la clause dans l'article number, ses paragraphes numérotés à partir de offset + 1"""
+        text = SUBCLAUSE_RE.sub(lambda match: f"{number}.{int(match.group(1)) + offset}", self.text)
+        values = {**values, "article": str(number)}
+        return FIELD_RE.sub(lambda match: values.get(match.group(1), match.group(0)), text)
+
+    def render(self, number: int, values: Dict[str, str]) -> str:
+        return render_article(number, self.heading, [(self, values)])
+
+    def document(self) -> List[str]:
+        # Titre compté deux fois : il départage les clauses au vocabulaire proche
+        return tokenize(" ".join((self.heading, self.heading, " ".join(self.keywords), self.text)))
+
+
+def render_article(number: int, heading: str, clauses: List[Tuple[Clause, Dict[str, str]]]) -> str:
+    """Article composé d'une ou plusieurs clauses ("Governing Law and Jurisdiction"), paragraphes numérotés à la suite"""
+    bodies, offset = [], 0
+    for clause, values in clauses:
+        bodies.append(clause.body(number, values, offset))
+        offset += clause.paragraphs
+    return f"## ARTICLE {number}. {heading}\n\n" + "\n\n".join(bodies)
+
+
+class BM25Index:
+    """Index BM25 en mémoire : listes de postings par terme, scores accumulés sur les seuls documents concernés"""
+
+    def __init__(self, documents: Sequence[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lengths = [len(tokens) for tokens in documents]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for index, tokens in enumerate(documents):
+            for term, count in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((index, count))
+        size = len(documents)
+        self.idf = {term: math.log(1 + (size - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for term, postings in self.postings.items()}
+
+    def search(self, query: List[str], candidates: Optional[Set[int]] = None) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(query):
+            for index, count in self.postings.get(term, ()):
+                if candidates is not None and index not in candidates:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] = scores.get(index, 0.0) + self.idf[term] * count * (self.k1 + 1) / (count + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+@dataclass
+class ClauseLibraryConfig:
+    enabled: bool = True
+    path: str = DEFAULT_LIBRARY_PATH
+    min_score: float = 2.5  # score BM25 à partir duquel une clause particulière demandée remplace la clause standard
+    # Documents auxquels s'ajoutent des articles de pure forme (pas une lettre ni une procuration)
+    document_types: Tuple[str, ...] = field(default_factory=lambda: (
+        "agreement", "contract", "deed", "lease", "licence", "license", "pact", "memorandum", "terms"
+    ))
+
+    @classmethod
+    def from_env(cls) -> "ClauseLibraryConfig":
+        """CLAUSE_LIBRARY_ENABLED=0 pour désactiver, CLAUSE_LIBRARY_PATH, CLAUSE_LIBRARY_MIN_SCORE"""
+        default = cls()
+        return cls(
+            enabled=os.getenv("CLAUSE_LIBRARY_ENABLED", "1") == "1",
+            path=os.getenv("CLAUSE_LIBRARY_PATH", default.path),
+            min_score=float(os.getenv("CLAUSE_LIBRARY_MIN_SCORE", str(default.min_score))),
+        )
+
+
+class ClauseLibrary:
+    """
+    articles = clause_library.standard_articles(contract_type, key_terms, special_clauses)
+    match = clause_library.match_section(contract_type, heading, scope, key_terms, special_clauses)
+    Le fichier est lu et indexé au premier usage
+    """
+
+    def __init__(self, config: Optional[ClauseLibraryConfig] = None, clauses: Optional[List[Clause]] = None):
+        self.config = config or ClauseLibraryConfig()
+        self._clauses = clauses
+        self._fingerprint: Optional[str] = None
+        self._index: Optional[BM25Index] = None
+        self.counters = {'searches': 0, 'standard_articles': 0, 'matched_sections': 0, 'bespoke': 0}
+
+    def _load(self):
+        if self._index is not None:
+            return
+        if self._clauses is None:
+            try:
+                with open(self.config.path, 'rb') as f:
+                    raw = f.read()
+                self._clauses = [Clause.from_dict(entry) for entry in json.loads(raw)["clauses"]]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"⚠️ Bibliothèque de clauses illisible ({self.config.path}) : {e}")
+                self._clauses = []
+                raw = b""
+        else:
+            raw = json.dumps([clause.text for clause in self._clauses] + [clause.id for clause in self._clauses]).encode('utf-8')
+        self._fingerprint = hashlib.sha256(raw).hexdigest()[:16] if self._clauses else None
+        self._index = BM25Index([clause.document() for clause in self._clauses])
+
+    @property
+    def clauses(self) -> List[Clause]:
+        self._load()
+        return self._clauses
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Empreinte du contenu de la bibliothèque, pour les clés de cache des contrats ; None si inactive"""
+        if not self.config.enabled:
+            return None
+        self._load()
+        return self._fingerprint
+
+    def applies(self, contract_type: str) -> bool:
+        contract_type = normalize_name(contract_type)
+        return (self.config.enabled and bool(contract_type) and bool(self.clauses)
+                and any(name in contract_type for name in self.config.document_types))
+
+    def search(self, query: str, contract_type: str = "", limit: int = 3) -> List[Tuple[Clause, float]]:
+        """Clauses les plus proches de la requête, parmi celles applicables au type de contrat"""
+        self._load()
+        self.counters['searches'] += 1
+        contract_type = normalize_name(contract_type)
+        candidates = {index for index, clause in enumerate(self._clauses) if clause.applies_to(contract_type)}
+        return [(self._clauses[index], score) for index, score in self._index.search(tokenize(query), candidates)[:limit]]
+
+    def _bespoke(self, contract_type: str, special_clauses: Sequence[str], terms: Dict[str, str]) -> Set[str]:
+        """
+        Clauses couvertes par une demande particulière de l'avocat ou par un terme négocié ("Assignment",
+        "Transaction costs") : elles restent rédigées sur mesure. Les termes qui complètent les champs
+        d'une clause (droit applicable, tribunaux) n'en font pas partie
+        """
+        fields = [clause_field for clause in self.clauses for clause_field in clause.fields]
+        negotiated = [name for name, value in terms.items()
+                      if value and not any(clause_field.find({name: value}) for clause_field in fields)]
+        bespoke = set()
+        for request in (*special_clauses, *negotiated):
+            hits = self.search(request, contract_type, limit=1)
+            if not hits:
+                continue
+            clause, score = hits[0]
+            # Seuil bas : au moindre doute, la clause est rédigée sur mesure comme avant
+            if score >= self.config.min_score or set(tokenize(clause.heading)) <= set(tokenize(request)):
+                bespoke.add(clause.id)
+        return bespoke
+
+    def standard_articles(self, contract_type: str, terms: Dict[str, str],
+                          special_clauses: Sequence[str] = ()) -> List[Tuple[Clause, Dict[str, str]]]:
+        """Articles de pure forme à insérer tels quels, dans l'ordre de la bibliothèque"""
+        if not self.applies(contract_type):
+            return []
+        normalized_type = normalize_name(contract_type)
+        bespoke = self._bespoke(contract_type, special_clauses, terms)
+        self.counters['bespoke'] += len(bespoke)
+        articles = []
+        for clause in self.clauses:
+            if not clause.standard or clause.id in bespoke or not clause.applies_to(normalized_type):
+                continue
+            values = clause.resolve(terms)
+            if values is not None:
+                articles.append((clause, values))
+        self.counters['standard_articles'] += len(articles)
+        return articles
+
+    def match_section(self, contract_type: str, heading: str, scope: str, terms: Dict[str, str],
+                      special_clauses: Sequence[str] = ()) -> Optional[List[Tuple[Clause, Dict[str, str]]]]:
+        """
+        Clauses standard qui forment à elles seules un article du plan, ou None s'il doit être rédigé :
+        chaque clause retenue a un titre compris dans celui de l'article, ensemble elles en couvrent tous les mots
+        ("Governing Law and Jurisdiction" : deux clauses) et chaque élément du périmètre (séparés par des virgules)
+        y est traité ; valeurs disponibles, pas de demande particulière
+        """
+        if not self.applies(contract_type):
+            return None
+        heading_tokens = set(tokenize(heading))
+        if not heading_tokens:
+            return None
+        hits = self.search(f"{heading} {heading} {scope}", contract_type, limit=5)
+        clauses = [clause for clause, _ in hits if set(tokenize(clause.heading)) <= heading_tokens]
+        if not clauses:
+            return None
+        if not heading_tokens <= set().union(*(tokenize(f"{clause.heading} {' '.join(clause.keywords)}") for clause in clauses)):
+            return None
+        # Un élément du périmètre sans rapport avec les clauses (non-concurrence dans "Confidentiality") : article rédigé
+        vocabulary = set().union(*(clause.document() for clause in clauses))
+        if any(tokens and not tokens & vocabulary for tokens in (set(tokenize(item)) for item in re.split(r"[,;]", scope))):
+            return None
+        bespoke = self._bespoke(contract_type, special_clauses, terms)
+        matches = []
+        # Ordre de la bibliothèque : droit applicable avant juridiction, quel que soit le score
+        for clause in sorted(clauses, key=self.clauses.index):
+            values = clause.resolve(terms)
+            if clause.id in bespoke or values is None:
+                return None
+            matches.append((clause, values))
+        self.counters['matched_sections'] += 1
+        STANDARD_ARTICLES.inc(mode="outline")
+        return matches
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'enabled': self.config.enabled,
+                'clauses': len(self._clauses) if self._clauses is not None else None}
+
+
+class StandardArticleInserter:
+    """
+    Remplace la ligne STANDARD_ARTICLES_MARKER du markdown rédigé par les articles standard, numérotés
+    à la suite du dernier article du modèle ; fonctionne au fil du stream (feed) comme sur un texte complet
+    Sans marqueur, les articles sont insérés avant le bloc de signature ("IN WITNESS WHEREOF", "SIGNATURES"),
+    ou en fin de document s'il n'y en a pas
+    """
+
+    def __init__(self, articles: List[Tuple[Clause, Dict[str, str]]]):
+        self.articles = articles
+        self.inserted = not articles
+        self._last_number = 0
+        self._pending = ""  # fin de ligne reçue, qui peut encore devenir le marqueur
+        self._emitted = ""  # début de la ligne courante, déjà transmis
+
+    def feed(self, chunk: str) -> str:
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        output = ""
+        for line in lines:
+            output += (line if self._emitted else self._line(line)) + "\n"
+            self._track(self._emitted + line)
+            self._emitted = ""
+        # Seule une ligne qui peut encore devenir le marqueur ou le début du bloc de signature est retenue :
+        # le reste du texte passe aussitôt
+        if self._pending and (self._emitted or not self._may_insert_at(self._pending)):
+            output += self._pending
+            self._emitted += self._pending
+            self._pending = ""
+        return output
+
+    def flush(self) -> str:
+        output = self._line(self._pending) if self._pending and not self._emitted else self._pending
+        self._pending = self._emitted = ""
+        if not self.inserted:
+            output += "\n\n" + self._render()
+            self.inserted = True
+        return output
+
+    def _may_insert_at(self, partial: str) -> bool:
+        if STANDARD_ARTICLES_MARKER.startswith(partial.strip(" *`")):
+            return True
+        if self.inserted:
+            return False
+        text = partial.lstrip(" #*_").upper()
+        return any(start.startswith(text) or text.startswith(start) for start in SIGNATURE_BLOCK_STARTS)
+
+    def _line(self, line: str) -> str:
+        if line.strip(" *`") != STANDARD_ARTICLES_MARKER:
+            if not self.inserted and SIGNATURE_BLOCK_RE.match(line):
+                # Marqueur oublié par le modèle : jamais après les signatures
+                self.inserted = True
+                return self._render() + "\n\n" + line
+            return line
+        if self.inserted:
+            return ""
+        self.inserted = True
+        return self._render()
+
+    def _track(self, line: str):
+        match = ARTICLE_NUMBER_RE.match(line)
+        if match:
+            self._last_number = max(self._last_number, int(match.group(1)))
+
+    def _render(self) -> str:
+        STANDARD_ARTICLES.inc(len(self.articles), mode="single")
+        return "\n\n".join(clause.render(self._last_number + offset, values)
+                           for offset, (clause, values) in enumerate(self.articles, start=1))
+
+
+def insert_standard_articles(markdown: str, articles: List[Tuple[Clause, Dict[str, str]]]) -> str:
+    inserter = StandardArticleInserter(articles)
+    return inserter.feed(markdown) + inserter.flush()
+
+
+clause_library = LazySingleton(lambda: ClauseLibrary(ClauseLibraryConfig.from_env()))
@@ -0,0 +1,44 @@
+"""
+Compression GZip des réponses JSON (contrats complets, documents, diffs)
+Appliquée route par route plutôt qu'en middleware global : les réponses en flux (chat en text/plain,
+SSE, exports) passent telles quelles, sans être mises en tampon par la compression
+"""
+import asyncio
+import gzip
+from typing import Callable, Coroutine
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+
+MINIMUM_SIZE = 1024             # en dessous, la compression ne gagne rien
+OFFLOAD_MIN_BYTES = 256 * 1024  # corps volumineux compressés dans un thread, hors de la boucle d'événements
+COMPRESS_LEVEL = 6
+
+
+class GZipJSONRoute(APIRoute):
+    """
+    app.router.route_class = GZipJSONRoute   # avant la déclaration des routes
+    Corps complets compressés si le client accepte gzip ; StreamingResponse jamais
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+
+        async def gzip_handler(request: Request) -> Response:
+            response = await handler(request)
+            if (isinstance(response, StreamingResponse) or "content-encoding" in response.headers
+                    or "gzip" not in request.headers.get("accept-encoding", "")
+                    or len(response.body) < MINIMUM_SIZE):
+                return response
+            body = response.body
+            if len(body) < OFFLOAD_MIN_BYTES:
+                response.body = gzip.compress(body, COMPRESS_LEVEL)
+            else:
+                response.body = await asyncio.to_thread(gzip.compress, body, COMPRESS_LEVEL)
+            response.headers["Content-Encoding"] = "gzip"
+            response.headers["Content-Length"] = str(len(response.body))
+            response.headers.append("Vary", "Accept-Encoding")
+            return response
+
+        return gzip_handler
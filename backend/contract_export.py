@@ -0,0 +1,557 @@
+"""
+Rendu des contrats HTML en PDF et DOCX, sans dépendance externe
+Le HTML (déjà nettoyé par html_sanitizer) est réduit à une suite de blocs : titres, paragraphes,
+éléments de liste, tableaux, séparateurs, avec gras et italique
+- PDF : mise en page A4 en Helvetica (polices standard, encodage WinAnsi), flux compressés, numéros de page ;
+  un caractère hors WinAnsi lève UnsupportedCharacters plutôt que d'être remplacé par "?"
+- DOCX : paquet Office Open XML minimal (styles de titres, tableaux à bordures)
+Fonctions pures, sans état : exécutées dans les processus du pool d'export (export_pool)
+"""
+import io
+import re
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+EXPORT_FORMATS = ("pdf", "docx")
+
+
+class UnsupportedCharacters(ValueError):
+    """Texte non représentable avec les polices standard du PDF (WinAnsi) : le DOCX, lui, accepte l'Unicode"""
+
+# Run de texte : (texte, gras, italique) ; "\n" seul force un retour à la ligne
+Run = Tuple[str, bool, bool]
+
+HEADING_TAGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 3, 'h5': 3, 'h6': 3}
+PARAGRAPH_TAGS = {'p', 'div', 'blockquote', 'address', 'pre', 'section', 'article', 'header', 'footer'}
+BOLD_TAGS = {'b', 'strong', 'th'}
+ITALIC_TAGS = {'i', 'em', 'cite'}
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+@dataclass
+class Block:
+    kind: str                                  # "heading" | "paragraph" | "item" | "table" | "rule"
+    runs: List[Run] = field(default_factory=list)
+    level: int = 0                             # niveau du titre, ou profondeur de la liste
+    marker: str = ""                           # puce ou numéro de l'élément de liste
+    rows: List[List[List[Run]]] = field(default_factory=list)
+
+
+class _BlockParser(HTMLParser):
+    """HTML -> blocs ; les espaces sont regroupés comme à l'affichage"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Block] = []
+        self.current: Optional[Block] = None
+        self.bold = 0
+        self.italic = 0
+        self.lists: List[List] = []            # [ordonnée, compteur]
+        self.table: Optional[Block] = None
+        self.cell: Optional[List[Run]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BOLD_TAGS:
+            self.bold += 1
+        elif tag in ITALIC_TAGS:
+            self.italic += 1
+        if tag == 'br':
+            self._append("\n")
+        elif tag == 'hr':
+            self._flush()
+            self.blocks.append(Block("rule"))
+        elif tag in ('ul', 'ol'):
+            self._flush()
+            start = dict(attrs).get('start')
+            self.lists.append([tag == 'ol', int(start) - 1 if start and start.isdigit() else 0])
+        elif tag == 'li':
+            self._flush()
+            ordered, counter = self.lists[-1] if self.lists else (False, 0)
+            if self.lists:
+                self.lists[-1][1] += 1
+            marker = f"{counter + 1}." if ordered else "\u2022"
+            self.current = Block("item", level=max(len(self.lists), 1), marker=marker)
+        elif tag == 'table':
+            self._flush()
+            self.table = Block("table")
+        elif tag == 'tr' and self.table is not None:
+            self.table.rows.append([])
+        elif tag in ('td', 'th') and self.table is not None:
+            if not self.table.rows:
+                self.table.rows.append([])
+            self.cell = []
+            self.table.rows[-1].append(self.cell)
+        elif tag in HEADING_TAGS:
+            self._flush()
+            self.current = Block("heading", level=HEADING_TAGS[tag])
+        elif tag in PARAGRAPH_TAGS:
+            self._flush()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ('br', 'hr'):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in BOLD_TAGS:
+            self.bold = max(self.bold - 1, 0)
+        elif tag in ITALIC_TAGS:
+            self.italic = max(self.italic - 1, 0)
+        if tag in ('td', 'th'):
+            if self.cell is not None:
+                self.cell[:] = trim_runs(self.cell)
+            self.cell = None
+        elif tag == 'table' and self.table is not None:
+            self.table.rows = [row for row in self.table.rows if row]
+            if self.table.rows:
+                self.blocks.append(self.table)
+            self.table, self.cell = None, None
+        elif tag in ('ul', 'ol'):
+            self._flush()
+            if self.lists:
+                self.lists.pop()
+        elif tag == 'li' or tag in HEADING_TAGS or tag in PARAGRAPH_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        self._append(WHITESPACE_RE.sub(' ', data))
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _append(self, text: str):
+        if not text:
+            return
+        if self.cell is not None:
+            target = self.cell
+        elif self.table is not None:
+            return  # texte entre les cellules
+        else:
+            if self.current is None:
+                if not text.strip():
+                    return
+                self.current = Block("paragraph")
+            target = self.current.runs
+        run = (text, self.bold > 0, self.italic > 0)
+        if target and target[-1][1:] == run[1:] and text != "\n" and target[-1][0] != "\n":
+            target[-1] = (target[-1][0] + text, run[1], run[2])
+        else:
+            target.append(run)
+
+    def _flush(self):
+        block, self.current = self.current, None
+        if block is not None:
+            block.runs = trim_runs(block.runs)
+            if block.runs:
+                self.blocks.append(block)
+
+
+def trim_runs(runs: List[Run]) -> List[Run]:
+    """Espaces retirés en début et fin de bloc, et de part et d'autre des retours à la ligne"""
+    trimmed: List[Run] = []
+    for index, (text, bold, italic) in enumerate(runs):
+        if text == "\n":
+            trimmed.append((text, bold, italic))
+            continue
+        if not trimmed or trimmed[-1][0] == "\n" or trimmed[-1][0].endswith(' '):
+            text = text.lstrip(' ')
+        if index + 1 == len(runs) or runs[index + 1][0] == "\n":
+            text = text.rstrip(' ')
+        if text:
+            trimmed.append((text, bold, italic))
+    while trimmed and trimmed[-1][0] == "\n":
+        trimmed.pop()
+    return trimmed
+
+
+def parse_blocks(html: str) -> List[Block]:
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    return parser.blocks
+
+
+# --- PDF ---
+
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89   # A4 en points
+MARGIN = 56.7                              # 2 cm
+BODY_SIZE = 10.5
+HEADING_SIZES = {1: 16, 2: 13, 3: 11.5}
+LEADING = 1.35
+LIST_INDENT = 18
+CELL_PADDING = 4
+FOOTER_SIZE = 8
+
+# Polices standard du lecteur PDF : pas d'incorporation ; (gras, italique) -> ressource
+FONTS = {(False, False): "F1", (True, False): "F2", (False, True): "F3", (True, True): "F4"}
+FONT_NAMES = {"F1": "Helvetica", "F2": "Helvetica-Bold", "F3": "Helvetica-Oblique", "F4": "Helvetica-BoldOblique"}
+
+# Chasses Helvetica (millièmes de cadratin) des caractères ASCII imprimables, de l'espace au tilde
+_ASCII = ''.join(chr(code) for code in range(32, 127))
+_REGULAR_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+WIDTHS = {False: dict(zip(_ASCII, _REGULAR_WIDTHS)), True: dict(zip(_ASCII, _BOLD_WIDTHS))}
+DEFAULT_WIDTH = 556  # lettres accentuées et symboles : chasse d'une lettre moyenne
+
+
+def text_width(text: str, bold: bool, size: float) -> float:
+    widths = WIDTHS[bold]
+    return sum(widths.get(char, DEFAULT_WIDTH) for char in text) * size / 1000
+
+
+# Équivalents typographiques WinAnsi (espaces insécables, trait d'union insécable) ; caractères invisibles retirés
+PDF_TRANSLATION = str.maketrans({
+    '\u00a0': ' ', '\u202f': ' ', '\u2009': ' ', '\u2007': ' ', '\u2011': '-', '\u2010': '-',
+    '\u200b': None, '\u200c': None, '\u200d': None, '\ufeff': None, '\u00ad': None,
+})
+
+
+def pdf_string(text: str) -> bytes:
+    text = text.translate(PDF_TRANSLATION)
+    try:
+        data = text.encode('cp1252')
+    except UnicodeEncodeError:
+        unsupported = "".join(sorted({char for char in text if not _winansi(char)}))
+        raise UnsupportedCharacters(f"Caractères absents des polices PDF standard : {unsupported} (export DOCX possible)")
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'\\r') + b')'
+
+
+def _winansi(char: str) -> bool:
+    try:
+        char.encode('cp1252')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def wrap_runs(runs: List[Run], width: float, size: float) -> List[List[Run]]:
+    """Lignes de runs tenant dans la largeur ; un mot plus long que la ligne est coupé"""
+    lines: List[List[Run]] = [[]]
+    line_width = 0.0
+    for text, bold, italic in runs:
+        if text == "\n":
+            lines.append([])
+            line_width = 0.0
+            continue
+        for word in re.findall(r'\S+|\s+', text):
+            if word.isspace():
+                word = ' '
+                if not lines[-1]:
+                    continue
+            word_width = text_width(word, bold, size)
+            if line_width + word_width > width and lines[-1] and word != ' ':
+                lines.append([])
+                line_width = 0.0
+            while word_width > width and len(word) > 1:
+                cut = len(word)
+                while cut > 1 and text_width(word[:cut], bold, size) > width - line_width:
+                    cut -= 1
+                lines[-1].append((word[:cut], bold, italic))
+                lines.append([])
+                line_width = 0.0
+                word = word[cut:]
+                word_width = text_width(word, bold, size)
+            if word == ' ' and not lines[-1]:
+                continue
+            lines[-1].append((word, bold, italic))
+            line_width += word_width
+    # Espaces de fin de ligne retirés
+    for line in lines:
+        while line and line[-1][0] == ' ':
+            line.pop()
+    return lines
+
+
+class _PdfLayout:
+    """Mise en page : opérations de dessin par page, en coordonnées PDF (origine en bas à gauche)"""
+
+    def __init__(self):
+        self.pages: List[List[bytes]] = []
+        self.y = 0.0
+        self._new_page()
+
+    def _new_page(self):
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _ensure(self, height: float):
+        if self.y - height < MARGIN and self.y < PAGE_HEIGHT - MARGIN:
+            self._new_page()
+
+    def _line(self, x: float, runs: List[Run], size: float):
+        ops = [b"BT %.2f %.2f Td" % (x, self.y)]
+        font, text = None, ""
+        # Un seul Tj par suite de mots dans la même police
+        for word, bold, italic in runs:
+            if FONTS[(bold, italic)] != font:
+                if text:
+                    ops.append(pdf_string(text) + b" Tj")
+                font, text = FONTS[(bold, italic)], ""
+                ops.append(b"/%s %.2f Tf" % (font.encode(), size))
+            text += word
+        ops.append(pdf_string(text) + b" Tj ET")
+        self.pages[-1].append(b" ".join(ops))
+
+    def text(self, runs: List[Run], size: float, indent: float = 0, marker: str = "",
+             space_before: float = 0, space_after: float = 0):
+        leading = size * LEADING
+        lines = wrap_runs(runs, PAGE_WIDTH - 2 * MARGIN - indent, size)
+        if self.y < PAGE_HEIGHT - MARGIN:
+            self.y -= space_before
+        # Titre jamais seul en bas de page : gardé avec la ligne suivante
+        self._ensure(leading * min(len(lines), 2))
+        for index, line in enumerate(lines):
+            self._ensure(leading)
+            self.y -= size
+            if index == 0 and marker:
+                self._line(MARGIN + indent - LIST_INDENT * 0.75, [(marker, False, False)], size)
+            if line:
+                self._line(MARGIN + indent, line, size)
+            self.y -= leading - size
+        self.y -= space_after
+
+    def rule(self):
+        self._ensure(12)
+        self.y -= 6
+        self.pages[-1].append(b"0.5 w %.2f %.2f m %.2f %.2f l S" % (MARGIN, self.y, PAGE_WIDTH - MARGIN, self.y))
+        self.y -= 6
+
+    def table(self, rows: List[List[List[Run]]], size: float):
+        columns = max(len(row) for row in rows)
+        column_width = (PAGE_WIDTH - 2 * MARGIN) / columns
+        leading = size * LEADING
+        self.y -= 4
+        for row in rows:
+            cells = [wrap_runs(cell, column_width - 2 * CELL_PADDING, size) for cell in row]
+            height = max(len(lines) for lines in cells) * leading + 2 * CELL_PADDING
+            self._ensure(height)
+            top = self.y
+            for column, lines in enumerate(cells):
+                x = MARGIN + column * column_width
+                self.pages[-1].append(b"0.5 w %.2f %.2f %.2f %.2f re S" % (x, top - height, column_width, height))
+                self.y = top - CELL_PADDING
+                for line in lines:
+                    self.y -= size
+                    if line:
+                        self._line(x + CELL_PADDING, line, size)
+                    self.y -= leading - size
+            self.y = top - height
+        self.y -= 8
+
+
+def layout_pdf(blocks: List[Block]) -> List[List[bytes]]:
+    layout = _PdfLayout()
+    for block in blocks:
+        if block.kind == "heading":
+            size = HEADING_SIZES[block.level]
+            runs = [(text, True, italic) for text, _, italic in block.runs]
+            layout.text(runs, size, space_before=size * 0.8, space_after=size * 0.4)
+        elif block.kind == "item":
+            layout.text(block.runs, BODY_SIZE, indent=LIST_INDENT * block.level, marker=block.marker, space_after=2)
+        elif block.kind == "table":
+            layout.table(block.rows, BODY_SIZE)
+        elif block.kind == "rule":
+            layout.rule()
+        else:
+            layout.text(block.runs, BODY_SIZE, space_after=6)
+    return layout.pages
+
+
+def render_pdf(html: str) -> bytes:
+    pages = layout_pdf(parse_blocks(html))
+    total = len(pages)
+    font_ids = {name: 3 + index for index, name in enumerate(FONT_NAMES)}
+    first_page = 3 + len(FONT_NAMES)
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % (first_page + 2 * index) for index in range(total)), total
+        ),
+    ]
+    for name, base_font in FONT_NAMES.items():
+        objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % base_font.encode())
+    resources = b"<< /Font << %s >> >>" % b" ".join(b"/%s %d 0 R" % (name.encode(), id_) for name, id_ in font_ids.items())
+    for number, ops in enumerate(pages, start=1):
+        footer = f"{number} / {total}"
+        x = (PAGE_WIDTH - text_width(footer, False, FOOTER_SIZE)) / 2
+        ops = ops + [b"BT /F1 %d Tf %.2f %.2f Td %s Tj ET" % (FOOTER_SIZE, x, MARGIN / 2, pdf_string(footer))]
+        stream = zlib.compress(b"\n".join(ops), 6)
+        content_id = first_page + 2 * (number - 1) + 1
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources %s /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, resources, content_id)
+        )
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for id_, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (id_, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R /Info << /Producer (CounselAI) >> >>\nstartxref\n%d\n%%%%EOF\n"
+              % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def pdf_page_count(data: bytes) -> int:
+    match = re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count (\d+)", data)
+    return int(match.group(1)) if match else 0
+
+
+# --- DOCX ---
+
+# Caractères interdits en XML 1.0
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Date fixe des entrées du zip : même contrat, mêmes octets
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/></Relationships>'
+)
+DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+_BORDERS = ''.join(
+    f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+    for side in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')
+)
+STYLES = (
+    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:styles {W_NS}>'
+    '<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/>'
+    '<w:sz w:val="21"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault></w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    + ''.join(
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/>'
+        '<w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="{240 - 40 * level}" w:after="120"/><w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:sz w:val="{size}"/></w:rPr></w:style>'
+        for level, size in ((1, 32), (2, 26), (3, 23))
+    )
+    + '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="60"/></w:pPr></w:style>'
+    '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/>'
+    f'<w:tblPr><w:tblBorders>{_BORDERS}</w:tblBorders></w:tblPr></w:style>'
+    '</w:styles>'
+)
+SECTION = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1134" w:right="1134" w:bottom="1134" w:left="1134" w:header="709" w:footer="709" w:gutter="0"/>'
+    '</w:sectPr>'
+)
+
+
+def docx_runs(runs: List[Run]) -> str:
+    parts = []
+    for text, bold, italic in runs:
+        properties = ('<w:b/>' if bold else '') + ('<w:i/>' if italic else '')
+        properties = f'<w:rPr>{properties}</w:rPr>' if properties else ''
+        if text == "\n":
+            parts.append(f'<w:r>{properties}<w:br/></w:r>')
+        else:
+            parts.append(f'<w:r>{properties}<w:t xml:space="preserve">{escape(INVALID_XML_RE.sub("", text))}</w:t></w:r>')
+    return ''.join(parts)
+
+
+def docx_paragraph(runs: List[Run], style: Optional[str] = None, indent: int = 0) -> str:
+    properties = (f'<w:pStyle w:val="{style}"/>' if style else '') + (
+        f'<w:ind w:left="{indent}" w:hanging="360"/>' if indent else ''
+    )
+    return f'<w:p>{f"<w:pPr>{properties}</w:pPr>" if properties else ""}{docx_runs(runs)}</w:p>'
+
+
+def docx_table(rows: List[List[List[Run]]]) -> str:
+    columns = max(len(row) for row in rows)
+    width = 9638 // columns  # largeur utile A4 en vingtièmes de point
+    grid = ''.join(f'<w:gridCol w:w="{width}"/>' for _ in range(columns))
+    body = []
+    for row in rows:
+        cells = [
+            f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>{docx_paragraph(cell)}</w:tc>'
+            for cell in row + [[]] * (columns - len(row))
+        ]
+        body.append(f'<w:tr>{"".join(cells)}</w:tr>')
+    return (
+        '<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="0" w:type="auto"/></w:tblPr>'
+        f'<w:tblGrid>{grid}</w:tblGrid>{"".join(body)}</w:tbl>'
+    )
+
+
+def render_docx(html: str) -> bytes:
+    body = []
+    for block in parse_blocks(html):
+        if block.kind == "heading":
+            body.append(docx_paragraph(block.runs, f"Heading{block.level}"))
+        elif block.kind == "item":
+            body.append(docx_paragraph([(f"{block.marker}\t", False, False)] + block.runs,
+                                       "ListParagraph", indent=360 * (block.level + 1)))
+        elif block.kind == "table":
+            body.append(docx_table(block.rows))
+            body.append('<w:p/>')
+        elif block.kind == "rule":
+            body.append('<w:p><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="auto"/>'
+                        '</w:pBdr></w:pPr></w:p>')
+        else:
+            body.append(docx_paragraph(block.runs))
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {W_NS}>'
+        f'<w:body>{"".join(body)}{SECTION}</w:body></w:document>'
+    )
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in (("[Content_Types].xml", CONTENT_TYPES), ("_rels/.rels", PACKAGE_RELS),
+                              ("word/_rels/document.xml.rels", DOCUMENT_RELS), ("word/styles.xml", STYLES),
+                              ("word/document.xml", document)):
+            archive.writestr(zipfile.ZipInfo(name, ZIP_DATE), content, compress_type=zipfile.ZIP_DEFLATED)
+    return out.getvalue()
+
+
+def render_document(export_format: str, html: str) -> bytes:
+    """Point d'entrée des processus du pool d'export"""
+    if export_format == "pdf":
+        return render_pdf(html)
+    if export_format == "docx":
+        return render_docx(html)
+    raise ValueError(f"Format d'export inconnu : {export_format}")
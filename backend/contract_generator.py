@@ -1,11 +1,107 @@
 """
 Module de génération de contrats avec architecture en cascade
 """
-import google.generativeai as genai
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from dataclasses import dataclass, field, replace
 import json
 import asyncio
+import re
+import time
+from markdown_renderer import render_markdown_to_html
+from html_sanitizer import sanitize_html_async
+from model_pool import model_pool
+from result_cache import contract_cache, make_cache_key, single_flight
+from observability import track_llm_call, track_stage
+from hedging import hedging
+from token_budget import token_budget
+from llm_sdk import configure_once
+from clause_library import STANDARD_ARTICLES_MARKER, Clause, StandardArticleInserter, clause_library, render_article
+from conversation import Conversation
+from conversation_compactor import compactor, count_tokens
+from deal_sheet import deal_sheets, is_empty_deal_sheet
+from outline_drafting import (
+    OUTLINE_GENERATION_CONFIG,
+    OutlineSection,
+    assemble,
+    check_consistency,
+    normalize_section,
+    outline_prompt,
+    outline_report,
+    parse_outline_response,
+    section_prompt,
+)
+
+# Moteurs de mise en forme HTML : rendu local instantané, ou second appel au LLM
+HTML_RENDERERS = ("local", "llm")
+# Rédaction en un seul appel, ou plan puis sections en parallèle
+DRAFTING_MODES = ("single", "outline")
+
+# Premium prompt adapted for all types of legal documents
+CONTRACT_GENERATION_PROMPT = """
+You are the best business lawyer specializing in drafting high-value legal documents.
+
+COMPLETE PREVIOUS CONVERSATION BETWEEN LAWYER AND AI ASSISTANT:
+{full_conversation}
+
+Based on this conversation, draft an exceptional legal document in English. The document should demonstrate the highest level of legal sophistication and professionalism and be absolutely COMPLETE, ready to deliver.
+
+Key requirements:
+- Exceptional quality worthy of top-tier law firms
+- Comprehensive and detailed coverage
+- Sophisticated legal language and structure
+- Adapt intelligently to the specific type of document needed
+
+Begin directly with the document title.
+        """
+
+# Prompt HTML premium adapté pour tout format d'entrée
+HTML_FORMATTING_PROMPT = """
+Create a professional legal document in HTML format. Structure it properly with clear margins and formatting suitable for a high-quality contract. Do not include any commentary before or after, just deliver the html.
+
+{contract}
+        """
+
+# Prompt de mise en forme d'un extrait (section) pour la cascade streamée
+SECTION_HTML_PROMPT = """
+Convert the following excerpt of a professional legal document into an HTML fragment. It is one section of a larger contract that is rendered progressively, so do not add <html>, <head>, <body> or <style> tags and do not wrap it in a container. Use semantic tags (<h1>-<h3>, <p>, <ol>, <ul>, <strong>) and keep the wording exactly as is. Do not include any commentary before or after, just deliver the html.
+
+{contract}
+        """
+
+# Fiche de l'opération jointe au prompt de rédaction quand elle est renseignée
+DEAL_SHEET_PROMPT_SECTION = """
+
+STRUCTURED DEAL SHEET (extracted from the conversation above, which prevails in case of conflict):
+{deal_sheet}
+"""
+
+# Prompt de rédaction personnalisé en mode "outline" : ses consignes s'appliquent au plan et à chaque article
+CUSTOM_INSTRUCTIONS_PROMPT_SECTION = """
+
+DRAFTING INSTRUCTIONS (apply them to the outline and to every article):
+{instructions}
+"""
+
+# Variante d'un lot : placée en fin de prompt, pour que toutes les variantes partagent le même préfixe
+VARIANT_PROMPT_SECTION = """
+
+VARIANT OVERRIDES (these values take precedence over the conversation and the deal sheet):
+{overrides}
+"""
+
+# Articles de pure forme repris de la bibliothèque de clauses : le modèle ne rédige que le reste
+STANDARD_ARTICLES_PROMPT_SECTION = """
+
+STANDARD ARTICLES (vetted wording inserted automatically after your last article; do NOT draft them or any equivalent provision):
+{headings}
+Number your articles "ARTICLE 1", "ARTICLE 2"... and write the line {marker} on its own right after your last article, before the signature block.
+"""
+
+# Début de section : titres markdown, ou lignes "ARTICLE 1" / "SECTION 2" / "**Article 3**"
+SECTION_HEADING_PATTERN = re.compile(
+    r'^\s*(#{1,3}\s|\**\s*(ARTICLE|SECTION|SCHEDULE|ANNEX|EXHIBIT)\b)',
+    re.IGNORECASE
+)
 
 @dataclass
 class ContractData:
@@ -15,120 +111,77 @@ class ContractData:
     key_terms: Dict[str, str]
     special_clauses: List[str]
     context: str
-    full_conversation: List[Dict[str, str]]
+    full_conversation: Conversation
+    overrides: Dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Partagée entre variantes (dataclasses.replace) : la transcription n'est construite qu'une fois
+        self.full_conversation = Conversation.parse(self.full_conversation)
+
+    def deal_sheet(self) -> Dict[str, Any]:
+        """Fiche de l'opération dont proviennent ces données"""
+        return {
+            'contract_type': self.contract_type,
+            'parties': self.parties,
+            'key_terms': self.key_terms,
+            'special_clauses': self.special_clauses,
+            'context': self.context,
+        }
+
+class MarkdownSectionSplitter:
+    """
+    Découpe incrémentale du markdown streamé en sections complètes
+    Une section est considérée complète dès que le titre de la suivante est arrivé
+    """
+    
+    def __init__(self, min_section_chars: int = 800):
+        self.min_section_chars = min_section_chars
+        self._pending_line = ""
+        self._current: List[str] = []
+        
+    def feed(self, chunk: str) -> List[str]:
+        """Ajoute un morceau de texte et retourne les sections désormais complètes"""
+        completed = []
+        text = self._pending_line + chunk
+        lines = text.split("\n")
+        # La dernière ligne peut être incomplète : on la garde pour le prochain morceau
+        self._pending_line = lines.pop()
+        
+        for line in lines:
+            if (SECTION_HEADING_PATTERN.match(line) and "".join(self._current).strip()
+                    and self._current_size() >= self.min_section_chars):
+                completed.append("\n".join(self._current))
+                self._current = []
+            self._current.append(line)
+        return completed
+    
+    def flush(self) -> Optional[str]:
+        """Retourne la dernière section en fin de stream"""
+        if self._pending_line:
+            self._current.append(self._pending_line)
+            self._pending_line = ""
+        section = "\n".join(self._current).strip()
+        self._current = []
+        return section or None
+    
+    def _current_size(self) -> int:
+        return sum(len(line) + 1 for line in self._current)
 
 class ContractGenerator:
     """Générateur de contrats utilisant un LLM spécialisé"""
     
     def __init__(self, api_key: str, model_name: str):
-        genai.configure(api_key=api_key)
+        configure_once(api_key)
         self.model_name = model_name
         
-    async def extract_contract_data(self, conversation_history: List[Dict]) -> ContractData:
+    async def extract_contract_data(self, conversation_history: Union[Conversation, List[Dict]]) -> ContractData:
         """
-        Extrait les données structurées de la conversation
-        Utilise un LLM pour parser intelligemment la conversation
+        Données structurées de la conversation (fiche de l'opération)
+        La fiche est tenue à jour à chaque tour de chat : seuls les derniers messages restent à extraire
         """
-        extraction_prompt = """
-        Tu es un expert juridique chargé d'extraire les informations clés d'une conversation entre un avocat et son assistant IA.
-        
-        Analyse attentivement la conversation suivante et extrais TOUTES les informations pertinentes pour la rédaction du contrat.
-        
-        Conversation:
-        {conversation}
-        
-        Tu dois extraire et structurer les informations suivantes:
-        1. Le type exact de contrat ou de document juridique demandé
-        2. Toutes les parties impliquées (noms, rôles, structures juridiques)
-        3. Tous les termes clés négociés (montants, dates, pourcentages, localisations, etc.)
-        4. Toutes les clauses spéciales ou conditions particulières mentionnées
-        5. Le contexte général et l'objectif stratégique de l'opération
-        
-        Retourne les informations au format JSON structuré suivant:
-        {{
-            "contract_type": "Type exact du contrat",
-            "parties": {{
-                "role1": "Nom/Description partie 1",
-                "role2": "Nom/Description partie 2",
-                ...
-            }},
-            "key_terms": {{
-                "terme1": "valeur1",
-                "terme2": "valeur2",
-                ...
-            }},
-            "special_clauses": [
-                "Description clause spéciale 1",
-                "Description clause spéciale 2",
-                ...
-            ],
-            "context": "Résumé détaillé du contexte et des objectifs"
-        }}
-        
-        IMPORTANT: Sois exhaustif et précis. N'oublie aucun détail mentionné dans la conversation.
-        Retourne UNIQUEMENT le JSON, sans commentaire ni texte supplémentaire.
-        """
-        
-        model = genai.GenerativeModel(self.model_name)
-        
-        # Formater la conversation pour le prompt
-        conversation_text = "\n".join([
-            f"{msg['role'].upper()}: {msg['parts'][0]['text'] if 'parts' in msg else msg.get('text', '')}"
-            for msg in conversation_history
-        ])
-        
-        prompt = extraction_prompt.format(conversation=conversation_text)
-        
-        try:
-            response = await model.generate_content_async(prompt)
-            response_text = response.text.strip()
-            
-            # Essayer de parser comme JSON
-            try:
-                # Nettoyer la réponse si elle contient des balises markdown
-                json_text = response_text
-                if json_text.startswith("```json"):
-                    json_text = json_text[7:]
-                if json_text.startswith("```"):
-                    json_text = json_text[3:]
-                if json_text.endswith("```"):
-                    json_text = json_text[:-3]
-                
-                data = json.loads(json_text.strip())
-                
-                return ContractData(
-                    contract_type=data.get("contract_type", "Document juridique"),
-                    parties=data.get("parties", {}),
-                    key_terms=data.get("key_terms", {}),
-                    special_clauses=data.get("special_clauses", []),
-                    context=data.get("context", ""),
-                    full_conversation=conversation_history
-                )
-            except json.JSONDecodeError:
-                # Si ce n'est pas du JSON, extraire l'information du texte brut
-                print("Réponse non-JSON reçue, extraction basique des informations")
-                
-                # Extraction basique mais fonctionnelle
-                return ContractData(
-                    contract_type="Document juridique à définir",
-                    parties={"parties": "Voir conversation"},
-                    key_terms={"termes": "Extraits de la conversation"},
-                    special_clauses=["Clauses à définir selon la conversation"],
-                    context=response_text[:500],  # Premiers 500 caractères comme contexte
-                    full_conversation=conversation_history
-                )
-                
-        except Exception as e:
-            print(f"Erreur lors de l'extraction: {e}")
-            # Fallback simple
-            return ContractData(
-                contract_type="Document juridique",
-                parties={"parties": "Selon conversation"},
-                key_terms={"termes": "Selon conversation"},
-                special_clauses=["Selon conversation"],
-                context="Extraction automatique",
-                full_conversation=conversation_history
-            )
+        conversation = Conversation.parse(conversation_history)
+        sheet = await deal_sheets.update(conversation)
+        return ContractData(**sheet, full_conversation=conversation)
     
     async def generate_contract(self, contract_data: ContractData, 
                                custom_prompt: Optional[str] = None) -> str:
@@ -138,38 +191,156 @@ class ContractGenerator:
         """
         print("📝 Début de la génération du contrat...")
         
-        # Premium prompt adapted for all types of legal documents
-        generation_prompt = custom_prompt or """
-You are the best business lawyer specializing in drafting high-value legal documents.
-
-COMPLETE PREVIOUS CONVERSATION BETWEEN LAWYER AND AI ASSISTANT:
-{full_conversation}
-
-Based on this conversation, draft an exceptional legal document in English. The document should demonstrate the highest level of legal sophistication and professionalism and be absolutely COMPLETE, ready to deliver.
-
-Key requirements:
-- Exceptional quality worthy of top-tier law firms
-- Comprehensive and detailed coverage
-- Sophisticated legal language and structure
-- Adapt intelligently to the specific type of document needed
-
-Begin directly with the document title.
+        articles = self._standard_articles(contract_data)
+        prompt = self._build_generation_prompt(contract_data, custom_prompt, articles)
+        plan = await token_budget.plan("draft", self.model_name, prompt)
+        
+        with track_llm_call("draft", self.model_name) as call:
+            response = await hedging.call("draft", self.model_name, lambda name: model_pool.get(
+                name, generation_config=plan.generation_config()
+            ).generate_content_async(prompt))
+            call.chunk(response.text)
+            call.usage(response)
+        inserter = StandardArticleInserter(articles)
+        return inserter.feed(response.text) + inserter.flush()
+    
+    async def generate_contract_stream(self, contract_data: ContractData,
+                                       custom_prompt: Optional[str] = None) -> AsyncIterator[str]:
         """
+        Variante streamée de generate_contract
+        Produit le markdown du contrat morceau par morceau, au fil de la génération
+        """
+        print("📝 Début de la génération streamée du contrat...")
         
-        model = genai.GenerativeModel(self.model_name)
+        articles = self._standard_articles(contract_data)
+        inserter = StandardArticleInserter(articles)
+        prompt = self._build_generation_prompt(contract_data, custom_prompt, articles)
+        plan = await token_budget.plan("draft", self.model_name, prompt)
         
-        # Formater la conversation complète
-        conversation_text = "\n".join([
-            f"{msg['role'].upper()}: {msg['parts'][0]['text'] if 'parts' in msg else msg.get('text', '')}"
-            for msg in contract_data.full_conversation
-        ])
+        with track_llm_call("draft", self.model_name) as call:
+            async with hedging.stream("draft", self.model_name, lambda name: model_pool.get(
+                name, generation_config=plan.generation_config()
+            ).generate_content_async(prompt, stream=True)) as stream:
+                async for chunk in stream:
+                    if chunk.text:
+                        call.chunk(chunk.text)
+                        text = inserter.feed(chunk.text)
+                        if text:
+                            yield text
+                call.usage(stream)
+        # Articles standard en fin de stream si le modèle n'a pas écrit le marqueur
+        text = inserter.flush()
+        if text:
+            yield text
+    
+    def _build_generation_prompt(self, contract_data: ContractData,
+                                 custom_prompt: Optional[str] = None,
+                                 articles: Optional[List[Tuple[Clause, Dict[str, str]]]] = None) -> str:
+        """Construit le prompt de rédaction à partir de la conversation complète"""
+        generation_prompt = custom_prompt or CONTRACT_GENERATION_PROMPT
         
         prompt = generation_prompt.format(
-            full_conversation=conversation_text
+            full_conversation=contract_data.full_conversation.transcript
+        ) + self._deal_appendix(contract_data)
+        if articles:
+            prompt += STANDARD_ARTICLES_PROMPT_SECTION.format(
+                headings="\n".join(f"- {clause.heading}" for clause, _ in articles),
+                marker=STANDARD_ARTICLES_MARKER
+            )
+        return prompt
+    
+    def _clause_terms(self, contract_data: ContractData) -> Dict[str, str]:
+        """Termes clés de la fiche, valeurs de la variante prioritaires"""
+        return {**contract_data.key_terms, **contract_data.overrides}
+    
+    def _standard_articles(self, contract_data: ContractData) -> List[Tuple[Clause, Dict[str, str]]]:
+        """Articles de pure forme pris tels quels dans la bibliothèque de clauses, plutôt que rédigés"""
+        return clause_library.standard_articles(
+            contract_data.contract_type, self._clause_terms(contract_data), contract_data.special_clauses
         )
+    
+    def _deal_appendix(self, contract_data: ContractData) -> str:
+        """Fiche de l'opération et valeurs de la variante, ajoutées en fin de prompt quand elles existent"""
+        appendix = ""
+        deal_sheet = contract_data.deal_sheet()
+        if not is_empty_deal_sheet(deal_sheet):
+            appendix += DEAL_SHEET_PROMPT_SECTION.format(deal_sheet=json.dumps(deal_sheet, ensure_ascii=False, indent=1))
+        if contract_data.overrides:
+            appendix += VARIANT_PROMPT_SECTION.format(
+                overrides="\n".join(f"- {name}: {value}" for name, value in contract_data.overrides.items())
+            )
+        return appendix
+    
+    def _deal_context(self, contract_data: ContractData, custom_prompt: Optional[str] = None) -> str:
+        """
+        Contexte commun au plan et à chaque section en mode "outline" : conversation, consignes du prompt
+        de rédaction personnalisé (la conversation n'y est pas répétée), fiche et variante
+        """
+        conversation_text = contract_data.full_conversation.transcript
+        context = f"CONVERSATION BETWEEN LAWYER AND AI ASSISTANT:\n{conversation_text}"
+        if custom_prompt:
+            instructions = custom_prompt.format(full_conversation="(see the conversation above)").strip()
+            context += CUSTOM_INSTRUCTIONS_PROMPT_SECTION.format(instructions=instructions)
+        return context + self._deal_appendix(contract_data)
+    
+    async def generate_contract_outlined(self, contract_data: ContractData,
+                                         max_parallel_sections: int = 4,
+                                         custom_prompt: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Rédaction par plan : plan JSON, puis sections rédigées en parallèle (au plus max_parallel_sections
+        à la fois) et assemblées avec contrôle de cohérence. Le temps de rédaction devient celui de la plus
+        longue section plutôt que celui du document entier.
+        Plan inexploitable ou d'une seule section : rédaction en un seul appel (generate_contract).
+        custom_prompt : prompt de rédaction personnalisé, dont les consignes sont jointes au plan et aux sections.
+        
+        Returns:
+            (markdown, rapport {'sections', 'definitions', 'issues'} ou {'fallback': ...})
+        """
+        print("🗂️ Début de la rédaction par plan...")
+        context = self._deal_context(contract_data, custom_prompt)
+        prompt = outline_prompt(context)
+        plan = await token_budget.plan("outline", self.model_name, prompt)
+        with track_llm_call("outline", self.model_name) as call:
+            response = await hedging.call("outline", self.model_name, lambda name: model_pool.get(
+                name, generation_config=plan.generation_config(OUTLINE_GENERATION_CONFIG)
+            ).generate_content_async(prompt))
+            call.chunk(response.text)
+            call.usage(response)
+        outline = parse_outline_response(response.text)
+        if outline is None:
+            print("⚠️ Plan inexploitable, rédaction en un seul appel")
+            return await self.generate_contract(contract_data, custom_prompt), {'fallback': 'invalid_outline'}
         
-        response = await model.generate_content_async(prompt)
-        return response.text
+        semaphore = asyncio.Semaphore(max(max_parallel_sections, 1))
+        terms = self._clause_terms(contract_data)
+        standard_sections = []
+        
+        async def draft_section(section: OutlineSection) -> str:
+            standard = clause_library.match_section(
+                contract_data.contract_type, section.heading, section.scope, terms, contract_data.special_clauses
+            )
+            if standard is not None:
+                # Article de pure forme : texte de la bibliothèque, sans appel au modèle
+                standard_sections.append(section.number)
+                return render_article(section.number, section.heading, standard)
+            section_text = section_prompt(context, outline, section)
+            section_plan = await token_budget.plan("draft_section", self.model_name, section_text)
+            async with semaphore:
+                with track_llm_call("draft_section", self.model_name) as call:
+                    response = await hedging.call("draft_section", self.model_name, lambda name: model_pool.get(
+                        name, generation_config=section_plan.generation_config()
+                    ).generate_content_async(section_text))
+                    call.chunk(response.text)
+                    call.usage(response)
+            return normalize_section(response.text, section)
+        
+        sections = await asyncio.gather(*(draft_section(section) for section in outline.sections))
+        issues = check_consistency(outline, sections)
+        if issues:
+            print(f"⚠️ {len(issues)} incohérence(s) entre sections : {issues[:5]}")
+        report = outline_report(outline, issues)
+        report['standard_sections'] = sorted(standard_sections)
+        return assemble(outline, sections), report
     
     async def format_to_html(self, contract_text: str, 
                             html_prompt: Optional[str] = None) -> str:
@@ -177,55 +348,118 @@ Begin directly with the document title.
         Convertit le contrat en HTML professionnel
         Utilise un LLM spécialisé dans la mise en forme
         """
-        # Prompt HTML premium adapté pour tout format d'entrée
-        formatting_prompt = html_prompt or """
-Create a professional legal document in HTML format. Structure it properly with clear margins and formatting suitable for a high-quality contract. Do not include any commentary before or after, just deliver the html.
-
-{contract}
-        """
-        
-        model = genai.GenerativeModel(self.model_name)
+        formatting_prompt = html_prompt or HTML_FORMATTING_PROMPT
         
         prompt = formatting_prompt.format(contract=contract_text)
-        response = await model.generate_content_async(prompt)
-        html_content = response.text
+        plan = await token_budget.plan("format", self.model_name, prompt)
+        with track_llm_call("format", self.model_name) as call:
+            response = await hedging.call("format", self.model_name, lambda name: model_pool.get(
+                name, generation_config=plan.generation_config()
+            ).generate_content_async(prompt))
+            call.chunk(response.text)
+            call.usage(response)
+        # Balises de code, <head>/<style>/<meta> et structure nettoyés en une seule passe
+        html, _ = await sanitize_html_async(response.text)
+        return html
+    
+    async def render_html(self, contract_text: str,
+                          html_prompt: Optional[str] = None,
+                          renderer: str = "local") -> str:
+        """
+        Étape de mise en forme de la cascade
+        Rendu local déterministe par défaut, le LLM n'est sollicité que si renderer="llm"
+        """
+        if renderer not in HTML_RENDERERS:
+            raise ValueError(f"Moteur de rendu HTML inconnu : {renderer}")
+        if renderer == "local":
+            return render_markdown_to_html(contract_text)
         
-        # Nettoyer les balises markdown de code si présentes
-        if html_content.strip().startswith('```html'):
-            html_content = html_content.strip()[7:]  # Enlever ```html
-        elif html_content.strip().startswith('```'):
-            html_content = html_content.strip()[3:]  # Enlever ```
-            
-        if html_content.strip().endswith('```'):
-            html_content = html_content.strip()[:-3]  # Enlever ``` à la fin
+        # Mise en forme LLM mise en cache séparément : re-rendre un brouillon inchangé est instantané
+        cache_key = make_cache_key("html", self.model_name, html_prompt or HTML_FORMATTING_PROMPT, contract_text)
+        cached = await contract_cache.aget(cache_key)
+        if cached is not None:
+            return cached['html']
         
-        # Nettoyer le HTML si nécessaire - extraire seulement le contenu du body
-        if '<body' in html_content.lower():
-            import re
-            body_match = re.search(r'<body[^>]*>(.*)</body>', html_content, re.DOTALL | re.IGNORECASE)
-            if body_match:
-                html_content = body_match.group(1)
+        async def format_and_store():
+            html = await self.format_to_html(contract_text, html_prompt=html_prompt)
+            await contract_cache.aset(cache_key, {'html': html})
+            return html
         
-        # Enlever les balises <html>, <head>, <style> si présentes
-        if '<style' in html_content.lower():
-            import re
-            # Enlever tout le contenu entre <style> et </style>
-            html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-            # Enlever les meta tags et autres éléments de head
-            html_content = re.sub(r'<meta[^>]*>', '', html_content, flags=re.IGNORECASE)
-            html_content = re.sub(r'<title[^>]*>.*?</title>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-            
-        return html_content.strip()
+        return await single_flight.do(cache_key, format_and_store)
+
+def cascade_cache_key(conversation_history: Union[Conversation, List[Dict]], model_name: str,
+                      contract_prompt: Optional[str], html_prompt: Optional[str],
+                      html_renderer: str, overrides: Optional[Dict[str, str]] = None,
+                      drafting_mode: str = "single", deal_sheet: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Clé du cache de la cascade : historique normalisé, modèle, prompts effectifs, variante, mode de rédaction,
+    fiche de l'opération jointe au prompt et version de la bibliothèque de clauses
+    """
+    parts = [
+        "cascade",
+        Conversation.parse(conversation_history).normalized,
+        model_name,
+        contract_prompt or CONTRACT_GENERATION_PROMPT,
+        (html_prompt or HTML_FORMATTING_PROMPT) if html_renderer == "llm" else None,
+        html_renderer
+    ]
+    if overrides:
+        parts.append(overrides)
+    if drafting_mode != "single":
+        parts.append({'drafting_mode': drafting_mode})
+    if deal_sheet and not is_empty_deal_sheet(deal_sheet):
+        # Fiche complétée en tâche de fond après coup : même conversation, contrat différent
+        parts.append({'deal_sheet': deal_sheet})
+    if clause_library.fingerprint:
+        # Bibliothèque de clauses modifiée : les contrats qui en reprennent des articles sont régénérés
+        parts.append({'clause_library': clause_library.fingerprint})
+    return make_cache_key(*parts)
+
+async def _current_deal_sheet(conversation: Conversation, base_data: Optional[ContractData] = None) -> Dict[str, Any]:
+    """Fiche de l'opération extraite au fil du chat ; les tours encore en attente d'extraction sont extraits d'abord"""
+    if base_data is not None:
+        return base_data.deal_sheet()
+    return await deal_sheets.settle(conversation)
+
+async def _prepare_contract_data(conversation_history: Union[Conversation, List[Dict]],
+                                 contract_prompt: Optional[str],
+                                 sheet: Optional[Dict[str, Any]] = None) -> ContractData:
+    """
+    Données de rédaction : fiche de l'opération extraite au fil du chat (seuls les derniers tours
+    non couverts sont extraits) et conversation bornée
+    au plafond de tokens (anciens messages résumés, derniers messages intacts)
+    sheet : fiche déjà lue pour la clé de cache, pour rédiger avec celle-là même
+    """
+    conversation = Conversation.parse(conversation_history)
+    if sheet is None:
+        sheet = await _current_deal_sheet(conversation)
+    prompt_history = await compactor.compact(
+        conversation,
+        reserve_tokens=count_tokens((contract_prompt or CONTRACT_GENERATION_PROMPT) + json.dumps(sheet, ensure_ascii=False))
+    )
+    return ContractData(**sheet, full_conversation=prompt_history)
 
 # Fonction principale pour la cascade de génération
-async def generate_contract_cascade(conversation_history: List[Dict],
+async def generate_contract_cascade(conversation_history: Union[Conversation, List[Dict]],
                                    api_key: str,
                                    model_name: str,
                                    contract_prompt: Optional[str] = None,
-                                   html_prompt: Optional[str] = None) -> Dict[str, str]:
+                                   html_prompt: Optional[str] = None,
+                                   html_renderer: str = "local",
+                                   use_cache: bool = True,
+                                   on_progress: Optional[Callable[[str], None]] = None,
+                                   overrides: Optional[Dict[str, str]] = None,
+                                   base_data: Optional[ContractData] = None,
+                                   drafting_mode: str = "single") -> Dict[str, str]:
     """
     Fonction principale qui orchestre la cascade de génération
     Version simplifiée qui passe directement la conversation aux LLMs
+    Les résultats sont mis en cache par contenu, et les cascades identiques concurrentes
+    (double-clic, retry) partagent le même calcul. use_cache=False force une nouvelle génération.
+    on_progress reçoit le nom de chaque étape lancée ("drafting", "formatting").
+    overrides : valeurs propres à une variante (contrepartie, juridiction...), prioritaires sur la conversation.
+    base_data : données de rédaction déjà préparées, partagées par les variantes d'un lot.
+    drafting_mode : "single" (un seul appel) ou "outline" (plan puis sections rédigées en parallèle).
     
     Returns:
         Dict contenant:
@@ -233,35 +467,284 @@ async def generate_contract_cascade(conversation_history: List[Dict],
         - 'html': Le contrat au format HTML
         - 'data': Les données extraites
     """
+    if drafting_mode not in DRAFTING_MODES:
+        raise ValueError(f"Mode de rédaction inconnu : {drafting_mode}")
+    conversation_history = Conversation.parse(conversation_history)
+    sheet = await _current_deal_sheet(conversation_history, base_data)
+    cache_key = cascade_cache_key(conversation_history, model_name, contract_prompt, html_prompt, html_renderer,
+                                  overrides, drafting_mode, sheet)
+    
+    if use_cache:
+        cached = await contract_cache.aget(cache_key)
+        if cached is not None:
+            print("♻️ Contrat servi depuis le cache")
+            return {**cached, 'data': {**cached['data'], 'cache': 'hit'}}
+    
+    async def run_and_store():
+        result = await _run_cascade(conversation_history, api_key, model_name,
+                                    contract_prompt, html_prompt, html_renderer, on_progress,
+                                    overrides, base_data, drafting_mode, sheet)
+        await contract_cache.aset(cache_key, result)
+        return result
+    
+    if not use_cache:
+        return await run_and_store()
+    return await single_flight.do(cache_key, run_and_store)
+
+async def _run_cascade(conversation_history: Union[Conversation, List[Dict]],
+                       api_key: str,
+                       model_name: str,
+                       contract_prompt: Optional[str],
+                       html_prompt: Optional[str],
+                       html_renderer: str,
+                       on_progress: Optional[Callable[[str], None]] = None,
+                       overrides: Optional[Dict[str, str]] = None,
+                       base_data: Optional[ContractData] = None,
+                       drafting_mode: str = "single",
+                       deal_sheet: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """Exécute les deux étapes de la cascade, sans cache"""
+    report = on_progress or (lambda stage: None)
     generator = ContractGenerator(api_key, model_name)
     
-    # Créer un objet ContractData simple avec juste la conversation
-    contract_data = ContractData(
-        contract_type="Document juridique",
-        parties={},
-        key_terms={},
-        special_clauses=[],
-        context="Génération basée sur la conversation",
-        full_conversation=conversation_history
-    )
+    contract_data = base_data or await _prepare_contract_data(conversation_history, contract_prompt, deal_sheet)
+    if overrides:
+        contract_data = replace(contract_data, overrides=dict(overrides))
     
-    # Étape 1: Génération du contrat directement depuis la conversation
-    contract_markdown = await generator.generate_contract(
-        contract_data, 
-        custom_prompt=contract_prompt
-    )
+    # Étape 1: Génération du contrat directement depuis la conversation (ou par plan, sections en parallèle)
+    report("drafting")
+    outline_info = None
+    with track_stage("draft" if drafting_mode == "single" else "draft_outline"):
+        if drafting_mode == "outline":
+            contract_markdown, outline_info = await generator.generate_contract_outlined(
+                contract_data, custom_prompt=contract_prompt
+            )
+        else:
+            contract_markdown = await generator.generate_contract(
+                contract_data, 
+                custom_prompt=contract_prompt
+            )
     
-    # Étape 2: Mise en forme HTML
-    contract_html = await generator.format_to_html(
-        contract_markdown,
-        html_prompt=html_prompt
-    )
+    # Étape 2: Mise en forme HTML (locale par défaut, LLM sur demande)
+    report("formatting")
+    with track_stage(f"render_{html_renderer}"):
+        contract_html = await generator.render_html(
+            contract_markdown,
+            html_prompt=html_prompt,
+            renderer=html_renderer
+        )
     
+    data = {
+        'status': 'generated_from_conversation',
+        'conversation_length': len(conversation_history),
+        'html_renderer': html_renderer,
+        'cache': 'miss'
+    }
+    if outline_info is not None:
+        data['drafting_mode'] = drafting_mode
+        data['outline'] = outline_info
     return {
         'markdown': contract_markdown,
         'html': contract_html,
-        'data': {
-            'status': 'generated_from_conversation',
-            'conversation_length': len(conversation_history)
-        }
-    }
\ No newline at end of file
+        'data': data
+    }
+
+# Lot de variantes : une conversation, N contrats (contreparties, juridictions...)
+async def generate_contract_batch(conversation_history: Union[Conversation, List[Dict]],
+                                  api_key: str,
+                                  model_name: str,
+                                  variants: List[Dict[str, Any]],
+                                  contract_prompt: Optional[str] = None,
+                                  html_prompt: Optional[str] = None,
+                                  html_renderer: str = "local",
+                                  max_concurrency: int = 4,
+                                  use_cache: bool = True,
+                                  drafting_mode: str = "single") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Génère une variante du contrat par entrée de variants ({'name', 'overrides'}), au plus
+    max_concurrency à la fois. La conversation n'est préparée qu'une fois (compaction, fiche de
+    l'opération) et les prompts ne diffèrent qu'en fin de texte : le préfixe commun est réutilisé
+    par le cache de contexte implicite du fournisseur. Chaque variante garde son entrée de cache.
+    
+    Yields, dans l'ordre de fin des variantes:
+        - 'variant': {'index', 'name', 'markdown', 'html', 'data', 'seconds'}
+        - 'variant_error': {'index', 'name', 'message'}
+        - 'done': {'variants', 'succeeded', 'failed', 'seconds', 'contracts_per_minute'}
+    """
+    started_at = time.perf_counter()
+    conversation_history = Conversation.parse(conversation_history)
+    base_data = await _prepare_contract_data(conversation_history, contract_prompt)
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def run_variant(index: int, variant: Dict[str, Any]):
+        name = variant.get('name') or f"variant_{index + 1}"
+        async with semaphore:
+            variant_started_at = time.perf_counter()
+            try:
+                with track_stage("batch_variant"):
+                    result = await generate_contract_cascade(
+                        conversation_history, api_key, model_name,
+                        contract_prompt=contract_prompt,
+                        html_prompt=html_prompt,
+                        html_renderer=html_renderer,
+                        use_cache=use_cache,
+                        overrides=variant.get('overrides') or {},
+                        base_data=base_data,
+                        drafting_mode=drafting_mode
+                    )
+            except Exception as e:
+                print(f"❌ Variante {name} en échec : {e}")
+                await events.put({'event': 'variant_error', 'data': {'index': index, 'name': name, 'message': str(e)}})
+                return
+        await events.put({'event': 'variant', 'data': {
+            'index': index,
+            'name': name,
+            **result,
+            'seconds': round(time.perf_counter() - variant_started_at, 3)
+        }})
+    
+    tasks = [asyncio.create_task(run_variant(index, variant)) for index, variant in enumerate(variants)]
+    succeeded = 0
+    try:
+        for _ in tasks:
+            event = await events.get()
+            succeeded += event['event'] == 'variant'
+            yield event
+    finally:
+        # Client déconnecté : les variantes restantes sont abandonnées
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    
+    seconds = time.perf_counter() - started_at
+    yield {'event': 'done', 'data': {
+        'variants': len(variants),
+        'succeeded': succeeded,
+        'failed': len(variants) - succeeded,
+        'seconds': round(seconds, 3),
+        'contracts_per_minute': round(succeeded / seconds * 60, 2) if seconds > 0 else 0.0
+    }}
+
+# Variante streamée de la cascade : rédaction et mise en forme se recouvrent
+async def generate_contract_cascade_stream(conversation_history: Union[Conversation, List[Dict]],
+                                          api_key: str,
+                                          model_name: str,
+                                          contract_prompt: Optional[str] = None,
+                                          html_prompt: Optional[str] = None,
+                                          html_renderer: str = "local",
+                                          max_parallel_sections: int = 3,
+                                          use_cache: bool = True,
+                                          min_section_chars: int = 800) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Orchestre la cascade en flux continu
+    Le markdown est émis au fil de la génération, et chaque section complète
+    est mise en forme en HTML pendant que la suite du contrat est encore rédigée
+    min_section_chars : taille minimale d'une section mise en forme séparément (les plus petites sont regroupées)
+    
+    Yields:
+        Dicts {'event': ..., 'data': ...} avec les événements:
+        - 'markdown': un morceau du contrat markdown ({'text'})
+        - 'html_section': une section mise en forme, dans l'ordre ({'index', 'html'})
+        - 'done': le résultat complet, comme generate_contract_cascade ({'markdown', 'html', 'data'})
+        - 'error': une erreur survenue pendant la cascade ({'message'})
+    """
+    section_prompt = html_prompt or SECTION_HTML_PROMPT
+    conversation_history = Conversation.parse(conversation_history)
+    sheet = await _current_deal_sheet(conversation_history)
+    cache_key = cascade_cache_key(conversation_history, model_name, contract_prompt, section_prompt, html_renderer,
+                                  deal_sheet=sheet)
+    
+    if use_cache:
+        cached = await contract_cache.aget(cache_key)
+        if cached is not None:
+            print("♻️ Contrat servi depuis le cache")
+            yield {'event': 'markdown', 'data': {'text': cached['markdown']}}
+            yield {'event': 'html_section', 'data': {'index': 0, 'html': cached['html']}}
+            yield {'event': 'done', 'data': {**cached, 'data': {**cached['data'], 'cache': 'hit'}}}
+            return
+    
+    generator = ContractGenerator(api_key, model_name)
+    
+    contract_data = await _prepare_contract_data(conversation_history, contract_prompt, sheet)
+    
+    events: asyncio.Queue = asyncio.Queue()
+    section_tasks: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max_parallel_sections)
+    markdown_parts: List[str] = []
+    html_sections: List[str] = []
+    
+    async def format_section(section: str) -> str:
+        async with semaphore:
+            with track_stage(f"render_section_{html_renderer}"):
+                return await generator.render_html(section, html_prompt=section_prompt, renderer=html_renderer)
+    
+    async def draft():
+        # Étape 1: rédaction streamée, en lançant la mise en forme de chaque section complète
+        splitter = MarkdownSectionSplitter(min_section_chars)
+        try:
+            with track_stage("draft_stream"):
+                async for chunk in generator.generate_contract_stream(contract_data, custom_prompt=contract_prompt):
+                    markdown_parts.append(chunk)
+                    await events.put({'event': 'markdown', 'data': {'text': chunk}})
+                    for section in splitter.feed(chunk):
+                        await section_tasks.put(asyncio.create_task(format_section(section)))
+            last_section = splitter.flush()
+            if last_section:
+                await section_tasks.put(asyncio.create_task(format_section(last_section)))
+        finally:
+            await section_tasks.put(None)
+    
+    async def emit_sections():
+        # Étape 2: émission des sections HTML dans l'ordre du document
+        index = 0
+        while True:
+            task = await section_tasks.get()
+            if task is None:
+                return
+            html = await task
+            html_sections.append(html)
+            await events.put({'event': 'html_section', 'data': {'index': index, 'html': html}})
+            index += 1
+    
+    async def run_pipeline():
+        drafting = asyncio.create_task(draft())
+        emitting = asyncio.create_task(emit_sections())
+        try:
+            await asyncio.gather(drafting, emitting)
+            result = {
+                'markdown': "".join(markdown_parts),
+                'html': "\n".join(html_sections),
+                'data': {
+                    'status': 'generated_from_conversation',
+                    'conversation_length': len(conversation_history),
+                    'html_renderer': html_renderer,
+                    'sections': len(html_sections),
+                    'cache': 'miss'
+                }
+            }
+            await contract_cache.aset(cache_key, result)
+            await events.put({'event': 'done', 'data': result})
+        except Exception as e:
+            print(f"❌ Erreur dans la cascade streamée : {e}")
+            await events.put({'event': 'error', 'data': {'message': str(e)}})
+        finally:
+            for task in (drafting, emitting):
+                if not task.done():
+                    task.cancel()
+            await events.put(None)
+    
+    pipeline = asyncio.create_task(run_pipeline())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # Client déconnecté ou cascade terminée : on annule tout ce qui tourne encore
+        if not pipeline.done():
+            pipeline.cancel()
+        while not section_tasks.empty():
+            task = section_tasks.get_nowait()
+            if task is not None and not task.done():
+                task.cancel()
@@ -0,0 +1,195 @@
+"""
+Indexation des contrats HTML en sections adressables et application de patchs ciblés
+Permet à /api/modify_contract de n'envoyer au modèle que les sections concernées
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from html_sanitizer import sanitize_html
+
+# Début de section : titres, ou paragraphes commençant par "ARTICLE 3" / "<strong>Section 2</strong>"
+SECTION_START_RE = re.compile(
+    r'<h[1-4][\s>]|<p[^>]*>\s*(?:<(?:strong|b)>\s*)?(?:ARTICLE|SECTION|CLAUSE|SCHEDULE|ANNEX|EXHIBIT)\b',
+    re.IGNORECASE
+)
+# Frontières de blocs pour redécouper les sections trop longues en clauses
+BLOCK_END_RE = re.compile(r'</(?:p|ol|ul|table|blockquote|div)>', re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]+>')
+WORD_RE = re.compile(r"[a-zA-ZÀ-ÿ0-9][\w'-]{2,}")
+REFERENCE_RE = re.compile(r'\b(article|section|clause|schedule|annex|exhibit)\s+([0-9]+(?:\.[0-9]+)*|[ivxlc]+|[a-z])\b', re.IGNORECASE)
+QUOTED_RE = re.compile(r'["“«]([^"”»]{3,})["”»]')
+
+# Demandes portant sur tout le document : le protocole par patchs ne s'applique pas
+# ("complete the notice address", "the entire agreement clause" visent une seule section)
+GLOBAL_REQUEST_RE = re.compile(
+    r'\b(throughout|everywhere|(?:whole|entire|complete) (?:document|contract|agreement)(?! clause| article| section)|'
+    r'all (?:articles|instances|occurrences|references|sections|clauses)|rewrite the (?:document|contract|agreement)|'
+    r'translate|renumber|tout le (?:document|contrat)|partout)\b',
+    re.IGNORECASE
+)
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'into', 'about', 'please', 'add', 'change',
+    'modify', 'update', 'replace', 'remove', 'delete', 'make', 'should', 'would', 'could', 'contract',
+    'agreement', 'document', 'clause', 'section', 'article', 'new', 'all', 'any', 'are', 'its', 'our',
+    'their', 'them', 'then', 'than', 'also', 'more', 'less', 'instead', 'shall', 'will',
+}
+
+
+@dataclass
+class Section:
+    """Une section adressable du document (titre, article ou clause)"""
+    id: str
+    title: str
+    html: str
+
+    @property
+    def text(self) -> str:
+        return TAG_RE.sub(' ', self.html)
+
+
+def _split_long(chunk: str, max_chars: int) -> List[str]:
+    """Redécoupe une section trop longue aux frontières de blocs"""
+    if len(chunk) <= max_chars:
+        return [chunk]
+    parts, start, last_cut = [], 0, 0
+    for match in BLOCK_END_RE.finditer(chunk):
+        if match.end() - start > max_chars and last_cut > start:
+            parts.append(chunk[start:last_cut])
+            start = last_cut
+        last_cut = match.end()
+    parts.append(chunk[start:])
+    return [part for part in parts if part]
+
+
+def index_sections(html: str, max_section_chars: int = 6000) -> List[Section]:
+    """
+    Découpe le HTML en sections contiguës, dont la concaténation redonne exactement le document
+    La section s0 contient le préambule éventuel avant le premier titre
+    """
+    starts = sorted({0, *(m.start() for m in SECTION_START_RE.finditer(html))})
+    chunks = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(html)
+        chunks.extend(_split_long(html[start:end], max_section_chars))
+
+    sections = []
+    for chunk in chunks:
+        if not chunk:
+            continue
+        first_line = " ".join(TAG_RE.sub(' ', chunk).split())[:120]
+        sections.append(Section(id=f"s{len(sections)}", title=first_line, html=chunk))
+    return sections
+
+
+def is_global_request(modification_request: str) -> bool:
+    """Vrai si la demande concerne l'ensemble du document"""
+    return bool(GLOBAL_REQUEST_RE.search(modification_request))
+
+
+def _terms(text: str) -> set:
+    return {w.lower() for w in WORD_RE.findall(text)} - STOPWORDS
+
+
+def select_relevant_sections(sections: List[Section], modification_request: str,
+                             max_sections: int = 6) -> List[Section]:
+    """
+    Sélectionne les sections pertinentes pour la demande, dans l'ordre du document
+    Score : références explicites ("Article 5"), citations exactes, puis recouvrement de vocabulaire
+    """
+    request_terms = _terms(modification_request)
+    references = [f"{kind} {number}".lower() for kind, number in REFERENCE_RE.findall(modification_request)]
+    quotes = [q.lower() for q in QUOTED_RE.findall(modification_request)]
+
+    scored = []
+    for position, section in enumerate(sections):
+        text = section.text.lower()
+        title = section.title.lower()
+        score = 0.0
+        score += sum(10 for ref in references if re.search(rf'\b{re.escape(ref)}\b', title))
+        score += sum(8 for quote in quotes if quote in text)
+        if request_terms:
+            section_terms = _terms(text)
+            score += 3 * len(request_terms & _terms(title))
+            score += len(request_terms & section_terms) / len(request_terms)
+        if score > 0:
+            scored.append((score, position))
+
+    best = sorted(scored, reverse=True)[:max_sections]
+    return [sections[position] for _, position in sorted(best, key=lambda item: item[1])]
+
+
+def build_outline(sections: List[Section]) -> str:
+    """Table des matières compacte : un identifiant et un titre par section"""
+    return "\n".join(f"[{section.id}] {section.title}" for section in sections)
+
+
+def parse_patch_response(response_text: str) -> Dict:
+    """Parse la réponse JSON du modèle (tolère un bloc de code markdown autour)"""
+    text = response_text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    data = json.loads(text)
+    if not isinstance(data, dict) or not isinstance(data.get("patches", []), list):
+        raise ValueError("Réponse de patch mal formée")
+    return data
+
+
+def _patch_html(patch: Dict) -> str:
+    """Fragment du patch nettoyé : balises de code, <style>/<meta> et balises mal imbriquées"""
+    return sanitize_html(patch.get("html", ""))
+
+
+def apply_patches(sections: List[Section], patches: List[Dict], editable: Optional[Iterable[str]] = None) -> str:
+    """
+    Applique les patchs (replace / insert_before / insert_after / delete) et retourne le document complet
+    editable : sections envoyées au modèle, seules à pouvoir être remplacées ou supprimées (toutes par défaut) ;
+    les insertions peuvent viser n'importe quelle section de la table des matières
+    Lève ValueError sur un patch mal formé, une section inconnue ou non modifiable, une opération invalide,
+    ou deux remplacements / suppressions de la même section
+    """
+    known = {section.id for section in sections}
+    editable = known if editable is None else set(editable) & known
+    replacements: Dict[str, Optional[str]] = {}
+    before: Dict[str, List[str]] = {}
+    after: Dict[str, List[str]] = {}
+
+    for patch in patches:
+        if not isinstance(patch, dict):
+            raise ValueError(f"Patch mal formé : {str(patch)[:100]}")
+        op = patch.get("op")
+        section_id = patch.get("section_id")
+        if not isinstance(section_id, str) or section_id not in known:
+            raise ValueError(f"Section inconnue dans le patch : {section_id}")
+        if op in ("replace", "delete") and section_id not in editable:
+            raise ValueError(f"Section {section_id} non transmise au modèle, {op} refusé")
+        if op != "delete" and not isinstance(patch.get("html", ""), str):
+            raise ValueError(f"Fragment HTML mal formé dans le patch de {section_id}")
+        if op in ("replace", "delete") and section_id in replacements:
+            raise ValueError(f"Plusieurs patchs remplacent ou suppriment la section {section_id}")
+        if op == "replace":
+            replacements[section_id] = _patch_html(patch)
+        elif op == "delete":
+            replacements[section_id] = None
+        elif op == "insert_before":
+            before.setdefault(section_id, []).append(_patch_html(patch))
+        elif op == "insert_after":
+            after.setdefault(section_id, []).append(_patch_html(patch))
+        else:
+            raise ValueError(f"Opération de patch inconnue : {op}")
+
+    parts = []
+    for section in sections:
+        parts.extend(before.get(section.id, []))
+        if section.id in replacements:
+            replacement = replacements[section.id]
+            if replacement is not None:
+                parts.append(replacement)
+        else:
+            parts.append(section.html)
+        parts.extend(after.get(section.id, []))
+    return "".join(parts)
@@ -0,0 +1,167 @@
+"""
+Représentation typée des conversations, construite une seule fois à l'entrée de chaque requête
+Les messages reçus ({'role', 'parts'} au format Gemini, ou {'role', 'text'}) sont validés au parsing ;
+les vues dérivées (contenu au format du SDK, transcription "ROLE: texte", forme normalisée des clés
+de cache, empreintes des préfixes) sont calculées à la première demande puis réutilisées par chaque étape
+Une conversation est immuable : ajouter des messages en construit une nouvelle
+"""
+import hashlib
+import json
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pydantic_core import core_schema
+
+
+class Message:
+    __slots__ = ('role', 'text', '_content')
+
+    def __init__(self, role: str, text: str, content: Optional[Dict] = None):
+        self.role = role
+        self.text = text
+        self._content = content
+
+    @classmethod
+    def from_raw(cls, raw: Any) -> Optional["Message"]:
+        """Message validé, ou None si le dict reçu n'en est pas un"""
+        if isinstance(raw, Message):
+            return raw
+        if not isinstance(raw, dict) or not isinstance(raw.get('role'), str):
+            return None
+        parts = raw.get('parts')
+        if isinstance(parts, list):
+            # Dict d'origine conservé tel quel pour le SDK (parties autres que du texte comprises)
+            text = " ".join(part.get('text', '') for part in parts if isinstance(part, dict))
+            return cls(raw['role'], text, raw)
+        if parts is None and isinstance(raw.get('text'), str):
+            return cls(raw['role'], raw['text'])
+        return None
+
+    @property
+    def content(self) -> Dict:
+        """Message au format attendu par Gemini (start_chat / history)"""
+        if self._content is None:
+            self._content = {"role": self.role, "parts": [{"text": self.text}]}
+        return self._content
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Message) and (self.role, self.text) == (other.role, other.text)
+
+    def __hash__(self) -> int:
+        return hash((self.role, self.text))
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.text[:40]!r})"
+
+
+def history_prefix_keys(history: Iterable[Any]) -> List[str]:
+    """Empreintes chaînées : keys[n] identifie history[:n]"""
+    digest = hashlib.sha256()
+    keys = [digest.hexdigest()]
+    for msg in history:
+        digest.update(json.dumps(msg, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+class Conversation(Sequence):
+    """
+    conversation = Conversation.parse(request.history)   # une fois, à l'entrée
+    conversation.contents      # liste au format du SDK (compaction, start_chat)
+    conversation.transcript    # "USER: ...\\nMODEL: ..." pour les prompts de rédaction
+    conversation.normalized    # [rôle, texte sans espaces superflus] pour les clés de cache
+    conversation.prefix_keys   # prefix_keys[n] identifie les n premiers messages
+    conversation.last_model_text
+    Utilisable comme type de champ pydantic : l'historique des requêtes est parsé à la validation
+    """
+    __slots__ = ('messages', '_contents', '_transcript', '_normalized', '_prefix_keys')
+
+    def __init__(self, messages: Iterable[Message] = ()):
+        self.messages: Tuple[Message, ...] = tuple(messages)
+        self._contents: Optional[List[Dict]] = None
+        self._transcript: Optional[str] = None
+        self._normalized: Optional[List[List[str]]] = None
+        self._prefix_keys: Optional[List[str]] = None
+
+    @classmethod
+    def parse(cls, raw: Union["Conversation", Iterable[Any], None]) -> "Conversation":
+        """Conversation validée ; les messages mal formés sont écartés (et signalés)"""
+        if isinstance(raw, Conversation):
+            return raw
+        messages = []
+        for item in raw or ():
+            message = Message.from_raw(item)
+            if message is None:
+                print(f"⚠️ Message mal formé dans l'historique: {str(item)[:200]}")
+                continue
+            messages.append(message)
+        return cls(messages)
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        return core_schema.no_info_after_validator_function(
+            cls.parse,
+            core_schema.union_schema([core_schema.is_instance_schema(cls), core_schema.list_schema()]),
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda conversation: conversation.contents),
+        )
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self.messages[index]
+        sliced = Conversation(self.messages[index])
+        if index.start in (None, 0) and index.step is None:
+            # Préfixe : forme normalisée et empreintes déjà calculées reprises telles quelles
+            length = len(sliced.messages)
+            if self._normalized is not None:
+                sliced._normalized = self._normalized[:length]
+            if self._prefix_keys is not None:
+                sliced._prefix_keys = self._prefix_keys[:length + 1]
+        return sliced
+
+    def __add__(self, other: Iterable[Any]) -> "Conversation":
+        return Conversation(self.messages + Conversation.parse(other).messages)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Conversation) and self.messages == other.messages
+
+    def __repr__(self) -> str:
+        return f"Conversation({len(self.messages)} messages)"
+
+    @property
+    def contents(self) -> List[Dict]:
+        """Liste partagée entre les étapes : à copier avant toute modification"""
+        if self._contents is None:
+            self._contents = [message.content for message in self.messages]
+        return self._contents
+
+    @property
+    def transcript(self) -> str:
+        if self._transcript is None:
+            self._transcript = "\n".join(f"{message.role.upper()}: {message.text}" for message in self.messages)
+        return self._transcript
+
+    @property
+    def normalized(self) -> List[List[str]]:
+        if self._normalized is None:
+            self._normalized = [[message.role, " ".join(message.text.split())] for message in self.messages]
+        return self._normalized
+
+    @property
+    def prefix_keys(self) -> List[str]:
+        # Même dérivation que result_cache.normalize_history : les fiches déjà enregistrées restent valides
+        if self._prefix_keys is None:
+            self._prefix_keys = history_prefix_keys(self.normalized)
+        return self._prefix_keys
+
+    @property
+    def last_model_text(self) -> Optional[str]:
+        for message in reversed(self.messages):
+            if message.role == 'model':
+                return message.text
+        return None
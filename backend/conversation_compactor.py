@@ -0,0 +1,190 @@
+"""
+Compaction des longues conversations : plafond de tokens garanti pour chaque prompt
+Les derniers messages restent intacts, les plus anciens sont remplacés par un résumé glissant.
+Le résumé est enrichi par lots (seuls les nouveaux messages sont résumés, jamais tout
+l'historique), et mémorisé par préfixe de conversation pour être réutilisé aux tours suivants
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from conversation import Conversation, history_prefix_keys
+from hedging import hedging
+from model_pool import model_pool, thinking_tokens
+from observability import track_llm_call
+from settings import LazySingleton
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a lawyer and a legal drafting assistant.
+Merge the new messages into the existing summary. Keep EVERY fact needed to draft the document: parties, addresses,
+signatories, amounts, dates, percentages, governing law, jurisdiction, deal structure, requested clauses, decisions
+and open questions. Drop greetings and repetition. Write compact bullet points in English. Return ONLY the summary.
+
+Existing summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
+SUMMARY_HEADER = "Summary of the earlier conversation (older messages were compacted):\n"
+TRUNCATION_MARKER = "\n[...truncated...]"
+
+
+def count_tokens(text: str) -> int:
+    """Estimation (≈ 4 caractères par token) : un calcul de longueur, rien à mémoriser"""
+    return (len(text) + 3) // 4
+
+
+def message_text(msg: Dict) -> str:
+    if 'parts' in msg:
+        return " ".join(part.get('text', '') for part in msg.get('parts', []) if isinstance(part, dict))
+    return msg.get('text', '')
+
+
+def message_tokens(msg: Dict) -> int:
+    # Quelques tokens de structure par message (rôle, séparateurs)
+    return count_tokens(message_text(msg)) + 4
+
+
+@dataclass
+class CompactionConfig:
+    enabled: bool = True
+    max_prompt_tokens: int = 32000     # plafond du prompt complet (prompt système et message compris)
+    keep_recent_messages: int = 12     # messages toujours gardés intacts quand c'est possible
+    summary_max_tokens: int = 2000
+    summary_model: str = "gemini-2.5-flash"
+    max_summaries: int = 1000
+
+    @classmethod
+    def from_env(cls) -> "CompactionConfig":
+        """COMPACTION_ENABLED, COMPACTION_MAX_PROMPT_TOKENS, COMPACTION_KEEP_RECENT, COMPACTION_SUMMARY_MAX_TOKENS, COMPACTION_MODEL"""
+        return cls(
+            enabled=os.getenv("COMPACTION_ENABLED", "1") == "1",
+            max_prompt_tokens=int(os.getenv("COMPACTION_MAX_PROMPT_TOKENS", "32000")),
+            keep_recent_messages=int(os.getenv("COMPACTION_KEEP_RECENT", "12")),
+            summary_max_tokens=int(os.getenv("COMPACTION_SUMMARY_MAX_TOKENS", "2000")),
+            summary_model=os.getenv("COMPACTION_MODEL", "gemini-2.5-flash"),
+        )
+
+
+class ConversationCompactor:
+    """
+    history = await compactor.compact(history, reserve_tokens=count_tokens(SYSTEM_PROMPT + message))
+    Retourne l'historique tel quel s'il tient sous le plafond, sinon résumé + messages récents,
+    du même type que l'historique reçu (Conversation ou liste au format du SDK)
+    """
+
+    def __init__(self, config: Optional[CompactionConfig] = None):
+        self.config = config or CompactionConfig()
+        # Empreinte du préfixe résumé -> (nombre de messages couverts, résumé)
+        self._summaries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'compacted': 0, 'summary_reused': 0, 'summary_updates': 0, 'truncated': 0}
+
+    async def compact(self, history: Union[Conversation, List[Dict]], reserve_tokens: int = 0) -> Union[Conversation, List[Dict]]:
+        budget = self.config.max_prompt_tokens - reserve_tokens
+        conversation = Conversation.parse(history)
+        if not self.config.enabled or sum(count_tokens(message.text) + 4 for message in conversation) <= budget:
+            return history
+        compacted = await self._compact(conversation, budget)
+        return Conversation.parse(compacted) if isinstance(history, Conversation) else compacted
+
+    async def _compact(self, conversation: Conversation, budget: int) -> List[Dict]:
+        self.counters['compacted'] += 1
+        history = conversation.contents
+        # Résumés indexés par l'empreinte des messages au format du SDK, comme avant le modèle typé :
+        # les résumés déjà mémorisés restent retrouvés
+        prefix_keys = history_prefix_keys(history)
+        keep_from = max(len(history) - self.config.keep_recent_messages, 0)
+        covered, summary = self._best_summary(prefix_keys, keep_from)
+
+        # Le résumé existant suffit tant que les messages non résumés tiennent dans le budget
+        if summary and self._tokens(summary, history[covered:]) <= budget:
+            self.counters['summary_reused'] += 1
+            return self._build(summary, history[covered:])
+
+        if keep_from > covered:
+            # Nouveaux messages anciens : on les ajoute au résumé, sans reprendre ce qui est déjà résumé
+            updated = await self._summarize(summary, conversation[covered:keep_from])
+            if updated is not None:
+                summary, covered = updated, keep_from
+                self._remember(prefix_keys[covered], covered, summary)
+        return self._fit(summary, history[covered:], budget)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, 'summaries': len(self._summaries)}
+
+    def _best_summary(self, prefix_keys: List[str], limit: int) -> Tuple[int, str]:
+        """Résumé mémorisé du plus long préfixe de l'historique (au plus limit messages)"""
+        with self._lock:
+            for length in range(limit, 0, -1):
+                entry = self._summaries.get(prefix_keys[length])
+                if entry is not None:
+                    self._summaries.move_to_end(prefix_keys[length])
+                    return entry
+        return 0, ""
+
+    def _remember(self, key: str, covered: int, summary: str):
+        with self._lock:
+            self._summaries[key] = (covered, summary)
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.config.max_summaries:
+                self._summaries.popitem(last=False)
+
+    async def _summarize(self, summary: str, messages: Conversation) -> Optional[str]:
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", messages=messages.transcript)
+        model_name = self.config.summary_model
+        try:
+            with track_llm_call("compact", model_name) as call:
+                # Sortie plafonnée à la taille du résumé, plus la réflexion du modèle qui la décompte
+                # du même plafond (le module de budget dépend de celui-ci)
+                response = await hedging.call("compact", model_name, lambda name: model_pool.get(
+                    name, generation_config={"max_output_tokens": self.config.summary_max_tokens + thinking_tokens(name)}
+                ).generate_content_async(prompt))
+                call.chunk(response.text)
+                call.usage(response)
+        except Exception as e:
+            # Sans résumé, les messages les plus anciens sont simplement écartés
+            print(f"⚠️ Résumé de la conversation impossible ({type(e).__name__}: {e}), troncature")
+            return None
+        self.counters['summary_updates'] += 1
+        return _truncate(response.text.strip(), self.config.summary_max_tokens)
+
+    def _tokens(self, summary: str, messages: List[Dict]) -> int:
+        return sum(message_tokens(msg) for msg in self._build(summary, messages))
+
+    def _build(self, summary: str, messages: List[Dict]) -> List[Dict]:
+        if not summary:
+            return list(messages)
+        compacted = [{'role': 'user', 'parts': [{'text': SUMMARY_HEADER + summary}]}]
+        if messages and messages[0].get('role') == 'user':
+            # Alternance des rôles conservée
+            compacted.append({'role': 'model', 'parts': [{'text': "Noted."}]})
+        return compacted + list(messages)
+
+    def _fit(self, summary: str, messages: List[Dict], budget: int) -> List[Dict]:
+        """Garantit le plafond : messages les plus anciens écartés, puis résumé et dernier message tronqués"""
+        messages = list(messages)
+        while len(messages) > 1 and self._tokens(summary, messages) > budget:
+            messages.pop(0)
+            self.counters['truncated'] += 1
+        if self._tokens(summary, messages) > budget and summary:
+            summary = _truncate(summary, max(budget - sum(message_tokens(msg) for msg in messages) - 16, 0))
+        if self._tokens(summary, messages) > budget and messages:
+            last = messages[-1]
+            room = budget - self._tokens(summary, []) - 4
+            messages[-1] = {**last, 'parts': [{'text': _truncate(message_text(last), max(room, 0))}]}
+            self.counters['truncated'] += 1
+        return self._build(summary, messages)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens * 4 - len(TRUNCATION_MARKER), 0)
+    return text[:keep] + TRUNCATION_MARKER
+
+
+compactor = LazySingleton(lambda: ConversationCompactor(CompactionConfig.from_env()))
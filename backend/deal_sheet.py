@@ -0,0 +1,344 @@
+"""
+Fiche de l'opération (deal sheet) extraite au fil de la conversation
+Après chaque tour, seuls les nouveaux messages sont envoyés au modèle, avec la fiche courante :
+il répond par un delta JSON contraint par schéma, lu au fil du stream, fusionné puis enregistré
+sur disque. Les tours rapprochés d'une même conversation sont regroupés (debounce) : une seule
+extraction pour la rafale, sur le dernier historique. Avant la rédaction, une mise à jour encore en
+attente est lancée sans attendre la fin du délai : la cascade n'extrait au plus que les derniers tours
+"""
+import asyncio
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from conversation import Conversation
+from conversation_compactor import compactor, count_tokens
+from hedging import hedging
+from model_pool import model_pool
+from observability import track_llm_call
+from result_cache import DiskResultCache, SingleFlight
+from settings import LazySingleton
+from token_budget import token_budget
+
+# Sous-ensemble OpenAPI accepté par response_schema : les dictionnaires libres n'y sont pas
+# exprimables, parties et termes clés sont donc des listes de paires
+DEAL_SHEET_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "contract_type": {"type": "string"},
+        "parties": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"role": {"type": "string"}, "description": {"type": "string"}},
+                "required": ["role", "description"],
+            },
+        },
+        "key_terms": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "value": {"type": "string"}},
+                "required": ["name", "value"],
+            },
+        },
+        "special_clauses": {"type": "array", "items": {"type": "string"}},
+        "context": {"type": "string"},
+    },
+}
+
+DEAL_SHEET_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": DEAL_SHEET_SCHEMA}
+
+DEAL_SHEET_DELTA_PROMPT = """You maintain the deal sheet of a legal document being negotiated between a lawyer and a drafting assistant.
+Read the new messages and return ONLY what they add or change, as JSON:
+- contract_type: the exact type of document, only if it is new or changed
+- parties: new or updated parties (role, and names, legal form, address, signatory in description)
+- key_terms: new or updated terms (amounts, dates, percentages, durations, locations, governing law...)
+- special_clauses: special clauses or conditions requested in the new messages
+- context: the updated strategic context and objective of the deal, only if it changed
+Omit unchanged fields. Reuse the existing role or term name when updating an entry.
+
+Current deal sheet:
+{sheet}
+
+New messages:
+{messages}
+"""
+
+
+def empty_deal_sheet() -> Dict[str, Any]:
+    return {"contract_type": "", "parties": {}, "key_terms": {}, "special_clauses": [], "context": ""}
+
+
+def is_empty_deal_sheet(sheet: Dict[str, Any]) -> bool:
+    return not any(sheet.get(field) for field in empty_deal_sheet())
+
+
+def merge_deal_sheet(sheet: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fusionne un delta (format du schéma : listes de paires) dans la fiche (format ContractData : dictionnaires)
+    Textes remplacés s'ils sont renseignés, parties et termes mis à jour par clé, clauses ajoutées sans doublon
+    """
+    merged = {**empty_deal_sheet(), **sheet}
+    merged["parties"] = dict(merged["parties"])
+    merged["key_terms"] = dict(merged["key_terms"])
+    merged["special_clauses"] = list(merged["special_clauses"])
+
+    for field in ("contract_type", "context"):
+        value = delta.get(field)
+        if isinstance(value, str) and value.strip():
+            merged[field] = value.strip()
+    for field, key_name, value_name in (("parties", "role", "description"), ("key_terms", "name", "value")):
+        for entry in _pairs(delta.get(field), key_name, value_name):
+            merged[field][entry[0]] = entry[1]
+    known = {clause.strip().lower() for clause in merged["special_clauses"]}
+    for clause in delta.get("special_clauses") or []:
+        if isinstance(clause, str) and clause.strip() and clause.strip().lower() not in known:
+            merged["special_clauses"].append(clause.strip())
+            known.add(clause.strip().lower())
+    return merged
+
+
+def _pairs(entries: Any, key_name: str, value_name: str) -> List[Tuple[str, str]]:
+    """Paires (clé, valeur) d'une liste du schéma ; un dictionnaire simple est aussi accepté"""
+    if isinstance(entries, dict):
+        entries = [{key_name: key, value_name: value} for key, value in entries.items()]
+    pairs = []
+    for entry in entries or []:
+        if not isinstance(entry, dict):
+            continue
+        key, value = str(entry.get(key_name) or "").strip(), str(entry.get(value_name) or "").strip()
+        if key and value:
+            pairs.append((key, value))
+    return pairs
+
+
+class JsonObjectStream:
+    """
+    Lecture d'un objet JSON arrivant par morceaux : chaque caractère n'est examiné qu'une fois,
+    et l'objet est décodé dès que son accolade fermante arrive (sans attendre la fin du stream).
+    Le texte qui précède la première accolade (balises markdown, préambule) est ignoré
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.value: Optional[Dict[str, Any]] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.value is not None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """Ajoute un morceau ; retourne l'objet décodé dès qu'il est complet"""
+        if self.complete:
+            return self.value
+        start = 0
+        for index, char in enumerate(chunk):
+            if self._depth == 0:
+                if char == "{":
+                    start, self._depth = index, 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buffer.append(chunk[start:index + 1])
+                    self.value = json.loads("".join(self._buffer))
+                    return self.value
+        if self._depth:
+            self._buffer.append(chunk[start:])
+        return None
+
+
+@dataclass
+class DealSheetConfig:
+    enabled: bool = True
+    model_name: str = "gemini-2.5-flash"
+    max_delta_tokens: int = 16000   # au-delà, les nouveaux messages passent par la compaction
+    debounce_seconds: float = 2.0   # délai sans nouveau tour avant l'extraction de fond, plus court qu'un tour de l'avocat
+
+    @classmethod
+    def from_env(cls) -> "DealSheetConfig":
+        """DEAL_SHEET_ENABLED, DEAL_SHEET_MODEL, DEAL_SHEET_MAX_DELTA_TOKENS, DEAL_SHEET_DEBOUNCE_SECONDS"""
+        return cls(
+            enabled=os.getenv("DEAL_SHEET_ENABLED", "1") == "1",
+            model_name=os.getenv("DEAL_SHEET_MODEL", "gemini-2.5-flash"),
+            max_delta_tokens=int(os.getenv("DEAL_SHEET_MAX_DELTA_TOKENS", "16000")),
+            debounce_seconds=float(os.getenv("DEAL_SHEET_DEBOUNCE_SECONDS", "2")),
+        )
+
+
+class DealSheetTracker:
+    """
+    sheet = await deal_sheets.update(history)   # extrait les messages pas encore couverts
+    sheet = await deal_sheets.current(history)  # fiche déjà enregistrée, sans appel au modèle
+    sheet = await deal_sheets.settle(history)   # avant rédaction : fiche à jour, sans attendre le debounce
+    Les fiches sont enregistrées par empreinte du préfixe de conversation couvert (historique normalisé)
+    """
+
+    def __init__(self, store: DiskResultCache, config: Optional[DealSheetConfig] = None):
+        self.store = store
+        self.config = config or DealSheetConfig()
+        self._single_flight = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+        self._debounced: Dict[str, asyncio.Task] = {}  # empreinte de l'historique en attente -> tâche de mise à jour
+        self.counters = {'updates': 0, 'up_to_date': 0, 'messages_extracted': 0, 'failures': 0, 'debounced': 0, 'flushed': 0}
+
+    @classmethod
+    def from_env(cls) -> "DealSheetTracker":
+        """DEAL_SHEET_DIR, DEAL_SHEET_MAX_BYTES, plus les variables de DealSheetConfig"""
+        store = DiskResultCache(
+            directory=os.getenv("DEAL_SHEET_DIR", os.path.join(tempfile.gettempdir(), "counselai_deal_sheets")),
+            max_bytes=int(os.getenv("DEAL_SHEET_MAX_BYTES", str(50 * 1024 * 1024))),
+        )
+        return cls(store, DealSheetConfig.from_env())
+
+    async def current(self, history: Union[Conversation, List[Dict]]) -> Tuple[int, Dict[str, Any]]:
+        """(messages couverts, fiche) du plus long préfixe déjà extrait"""
+        return await asyncio.to_thread(self._best, Conversation.parse(history).prefix_keys)
+
+    async def update(self, history: Union[Conversation, List[Dict]]) -> Dict[str, Any]:
+        """
+        Fiche couvrant tout l'historique : seuls les messages postérieurs à la dernière fiche
+        enregistrée sont extraits. En cas d'échec, la dernière fiche connue est retournée
+        """
+        conversation = Conversation.parse(history)
+        if not self.config.enabled or not conversation:
+            return (await self.current(conversation))[1]
+        keys = conversation.prefix_keys
+        # Tours identiques concurrents (tâche de fond du chat et cascade) : une seule extraction
+        return await self._single_flight.do(keys[-1], lambda: self._update(conversation, keys))
+
+    async def settle(self, history: Union[Conversation, List[Dict]]) -> Dict[str, Any]:
+        """
+        Fiche couvrant tout l'historique, pour la rédaction : à jour, elle est retournée sans appel au modèle ;
+        en retard, la mise à jour en attente de cette conversation est annulée et faite tout de suite
+        """
+        conversation = Conversation.parse(history)
+        covered, sheet = await self.current(conversation)
+        if covered == len(conversation) or not self.config.enabled:
+            return sheet
+        pending = self._pending_update(conversation)
+        if pending is not None:
+            self.counters['flushed'] += 1
+            pending.cancel()
+        return await self.update(conversation)
+
+    def schedule(self, history: Union[Conversation, List[Dict]]):
+        """
+        Mise à jour en tâche de fond après un tour de chat ; la réponse n'attend pas l'extraction.
+        Un nouveau tour de la même conversation pendant le délai remplace la mise à jour en attente :
+        la conversation est reconnue à son historique, qui prolonge celui de la mise à jour en attente
+        (le message d'accueil, identique pour toutes les conversations, ne suffit pas à les distinguer)
+        """
+        if not self.config.enabled or not history:
+            return
+        conversation = Conversation.parse(history)
+        key = conversation.prefix_keys[-1]
+        try:
+            task = asyncio.get_running_loop().create_task(self._update_later(key, conversation))
+        except RuntimeError:
+            return
+        previous = self._pending_update(conversation)
+        if previous is not None:
+            self.counters['debounced'] += 1
+            previous.cancel()
+        self._debounced[key] = task
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _pending_update(self, conversation: Conversation) -> Optional[asyncio.Task]:
+        """Retire et retourne la mise à jour en attente d'un préfixe de cette conversation"""
+        for key in reversed(conversation.prefix_keys[1:]):
+            task = self._debounced.pop(key, None)
+            if task is not None:
+                return task
+        return None
+
+    async def _update_later(self, key: str, conversation: Conversation):
+        await asyncio.sleep(self.config.debounce_seconds)
+        # Extraction lancée : un tour suivant ne l'annule plus, il en attendra une nouvelle
+        if self._debounced.get(key) is asyncio.current_task():
+            del self._debounced[key]
+        await self.update(conversation)
+
+    async def shutdown(self):
+        tasks, self._background = list(self._background), set()
+        self._debounced.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'pending': len(self._background), 'store': self.store.stats()}
+
+    def _best(self, keys: List[str]) -> Tuple[int, Dict[str, Any]]:
+        for length in range(len(keys) - 1, 0, -1):
+            entry = self.store.get(keys[length])
+            if entry is not None:
+                return length, entry['sheet']
+        return 0, empty_deal_sheet()
+
+    async def _update(self, history: Conversation, keys: List[str]) -> Dict[str, Any]:
+        covered, sheet = await asyncio.to_thread(self._best, keys)
+        if covered == len(history):
+            self.counters['up_to_date'] += 1
+            return sheet
+        try:
+            delta = await self._extract_delta(sheet, history[covered:])
+        except Exception as e:
+            self.counters['failures'] += 1
+            print(f"⚠️ Mise à jour de la fiche de l'opération impossible ({type(e).__name__}: {e})")
+            return sheet
+        sheet = merge_deal_sheet(sheet, delta)
+        self.counters['updates'] += 1
+        self.counters['messages_extracted'] += len(history) - covered
+        try:
+            await self.store.aset(keys[-1], {'covered': len(history), 'sheet': sheet})
+        except OSError as e:
+            print(f"⚠️ Impossible d'enregistrer la fiche de l'opération : {e}")
+        return sheet
+
+    async def _extract_delta(self, sheet: Dict[str, Any], messages: Conversation) -> Dict[str, Any]:
+        sheet_json = json.dumps(sheet, ensure_ascii=False, indent=1)
+        if sum(count_tokens(message.text) for message in messages) > self.config.max_delta_tokens:
+            messages = await compactor.compact(messages, reserve_tokens=count_tokens(DEAL_SHEET_DELTA_PROMPT + sheet_json))
+        prompt = DEAL_SHEET_DELTA_PROMPT.format(sheet=sheet_json, messages=messages.transcript)
+        model_name = self.config.model_name
+        plan = await token_budget.plan("deal_sheet", model_name, prompt)
+        parser = JsonObjectStream()
+
+        def open_stream(name: str):
+            model = model_pool.get(name, generation_config=plan.generation_config(DEAL_SHEET_GENERATION_CONFIG))
+            return model.generate_content_async(prompt, stream=True)
+
+        with track_llm_call("deal_sheet", model_name) as call:
+            async with hedging.stream("deal_sheet", model_name, open_stream) as stream:
+                async for chunk in stream:
+                    if chunk.text:
+                        call.chunk(chunk.text)
+                        if parser.feed(chunk.text) is not None:
+                            # Objet complet : inutile d'attendre la fin du stream
+                            break
+                call.usage(stream)
+        if not parser.complete:
+            raise ValueError("réponse JSON incomplète")
+        return parser.value
+
+
+deal_sheets = LazySingleton(DealSheetTracker.from_env)
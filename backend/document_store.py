@@ -0,0 +1,306 @@
+"""
+Stockage versionné des contrats côté serveur
+Chaque contrat généré reçoit un identifiant et un hash de contenu : les modifications désignent
+doc_id + version de base au lieu de renvoyer le HTML, et la réponse ne contient que le diff.
+Seule la dernière version est stockée en entier ; les précédentes le sont en deltas inverses
+(dernière → précédente), ce qui rend l'annulation peu coûteuse
+"""
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import LazySingleton
+
+
+# Les diffs sont calculés sur des blocs (découpés avant chaque balise de bloc), exprimés en caractères :
+# chaque bloc porte son texte, les fragments comparés sont donc presque tous distincts
+BLOCK_SPLIT_RE = re.compile(
+    r'(?=<(?:h[1-6]|p|li|tr|div|table|ol|ul|dl|dt|dd|section|article|blockquote|pre|hr)[\s>/])', re.IGNORECASE
+)
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()[:16]
+
+
+def _tokens(html: str) -> List[str]:
+    return [token for token in BLOCK_SPLIT_RE.split(html) if token]
+
+
+def _common_length(a: str, b: str, limit: int, part) -> int:
+    """Longueur du préfixe (ou suffixe) commun, par dichotomie sur des comparaisons de tranches"""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if part(a, middle) == part(b, middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def diff_html(base: str, target: str) -> List[List[Any]]:
+    """
+    Diff compact de base vers target : ["=", n] conserve n caractères, ["-", n] en supprime n,
+    ["+", texte] insère le texte. Le préfixe et le suffixe communs sont retirés avant la comparaison
+    """
+    if base == target:
+        return [["=", len(base)]] if base else []
+    limit = min(len(base), len(target))
+    prefix = _common_length(base, target, limit, lambda text, n: text[:n])
+    suffix = _common_length(base, target, limit - prefix, lambda text, n: text[len(text) - n:])
+    a = _tokens(base[prefix:len(base) - suffix])
+    b = _tokens(target[prefix:len(target) - suffix])
+
+    ops: List[List[Any]] = []
+
+    def add(op: str, value):
+        if ops and ops[-1][0] == op:
+            ops[-1][1] += value
+        elif value:
+            ops.append([op, value])
+
+    add("=", prefix)
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            add("=", sum(len(token) for token in a[i1:i2]))
+            continue
+        if i2 > i1:
+            add("-", sum(len(token) for token in a[i1:i2]))
+        if j2 > j1:
+            add("+", "".join(b[j1:j2]))
+    add("=", suffix)
+    return ops
+
+
+def apply_diff(base: str, ops: List[List[Any]]) -> str:
+    """Applique un diff de diff_html ; lève ValueError s'il ne correspond pas au document"""
+    parts, position = [], 0
+    for op, value in ops:
+        if op == "=":
+            parts.append(base[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        elif op == "+":
+            parts.append(value)
+        else:
+            raise ValueError(f"Opération de diff inconnue : {op}")
+        if position > len(base):
+            raise ValueError("Le diff dépasse la fin du document")
+    if position != len(base):
+        raise ValueError("Le diff ne couvre pas tout le document")
+    return "".join(parts)
+
+
+class VersionConflict(Exception):
+    """La version de base de la modification n'est plus la dernière version du document"""
+
+    def __init__(self, doc_id: str, base_version: int, current: "Document"):
+        super().__init__(f"Document {doc_id} : version {base_version} périmée, version actuelle {current.version}")
+        self.doc_id = doc_id
+        self.base_version = base_version
+        self.current = current
+
+
+@dataclass
+class Document:
+    id: str
+    version: int
+    hash: str
+    html: str
+
+
+@dataclass
+class DocumentVersion:
+    version: int
+    hash: str
+    source: str       # generated, uploaded, modified, restored
+    note: str
+    size: int
+    created_at: float
+
+
+class DocumentStore:
+    """
+    Documents dans SQLite (en mémoire par défaut, fichier partagé entre workers avec DOCUMENT_DB_PATH)
+    document = store.create(html)
+    document, diff = store.commit(doc_id, new_html, base_version=document.version)
+    previous = store.get(doc_id, version=1)
+    Lève KeyError pour un document ou une version inconnue, VersionConflict si la base est périmée
+    """
+
+    def __init__(self, db_path: str = ":memory:", max_documents: int = 1000, max_versions: int = 50,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_documents = max_documents
+        self.max_versions = max_versions
+        self.ttl_seconds = ttl_seconds
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.counters = {'created': 0, 'commits': 0, 'conflicts': 0, 'restores': 0, 'evictions': 0,
+                         'html_bytes': 0, 'diff_bytes': 0}
+        with self._lock, self._db:
+            if db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "id TEXT PRIMARY KEY, version INTEGER NOT NULL, hash TEXT NOT NULL, html TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            # delta : diff de la version suivante vers celle-ci (NULL pour la dernière version)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS document_versions ("
+                "doc_id TEXT NOT NULL, version INTEGER NOT NULL, hash TEXT NOT NULL, source TEXT NOT NULL, "
+                "note TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, delta TEXT, "
+                "PRIMARY KEY (doc_id, version))"
+            )
+
+    @classmethod
+    def from_env(cls) -> "DocumentStore":
+        """
+        DOCUMENT_DB_PATH, DOCUMENT_MAX_ENTRIES, DOCUMENT_MAX_VERSIONS, DOCUMENT_TTL_SECONDS
+        La base en mémoire est propre à chaque processus : avec plusieurs workers (WEB_CONCURRENCY > 1),
+        un doc_id créé par l'un serait inconnu des autres, DOCUMENT_DB_PATH est donc obligatoire
+        """
+        db_path = os.getenv("DOCUMENT_DB_PATH", ":memory:")
+        if db_path == ":memory:" and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            raise ValueError("DOCUMENT_DB_PATH doit désigner un fichier partagé quand WEB_CONCURRENCY > 1")
+        return cls(
+            db_path=db_path,
+            max_documents=int(os.getenv("DOCUMENT_MAX_ENTRIES", "1000")),
+            max_versions=int(os.getenv("DOCUMENT_MAX_VERSIONS", "50")),
+            ttl_seconds=float(os.getenv("DOCUMENT_TTL_SECONDS", str(7 * 24 * 3600))),
+        )
+
+    def create(self, html: str, source: str = "generated", note: str = "") -> Document:
+        document = Document(uuid.uuid4().hex, 1, content_hash(html), html)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO documents (id, version, hash, html, updated_at) VALUES (?, ?, ?, ?, ?)",
+                             (document.id, 1, document.hash, html, now))
+            self._db.execute(
+                "INSERT INTO document_versions (doc_id, version, hash, source, note, size, created_at, delta) "
+                "VALUES (?, 1, ?, ?, ?, ?, ?, NULL)",
+                (document.id, document.hash, source, note, len(html), now)
+            )
+            self._evict(now)
+        self.counters['created'] += 1
+        return document
+
+    def get(self, doc_id: str, version: Optional[int] = None) -> Document:
+        """Dernière version, ou une version antérieure reconstruite à partir des deltas inverses"""
+        with self._lock:
+            current = self._current(doc_id)
+            if version is None or version == current.version:
+                return current
+            rows = self._db.execute(
+                "SELECT version, hash, delta FROM document_versions WHERE doc_id = ? AND version >= ? AND version < ? "
+                "ORDER BY version DESC",
+                (doc_id, version, current.version)
+            ).fetchall()
+        if not rows or rows[-1][0] != version:
+            raise KeyError(f"{doc_id}@{version}")
+        html = current.html
+        for _, _, delta in rows:
+            html = apply_diff(html, json.loads(delta))
+        return Document(doc_id, version, rows[-1][1], html)
+
+    def commit(self, doc_id: str, html: str, base_version: Optional[int] = None,
+               source: str = "modified", note: str = "") -> Tuple[Document, List[List[Any]]]:
+        """
+        Enregistre une nouvelle version et retourne le diff depuis la version de base
+        Contenu inchangé : pas de nouvelle version, diff réduit à la conservation du document
+        """
+        with self._lock:
+            current = self._current(doc_id)
+            if base_version is not None and base_version != current.version:
+                self.counters['conflicts'] += 1
+                raise VersionConflict(doc_id, base_version, current)
+            digest = content_hash(html)
+            if digest == current.hash:
+                return current, diff_html(current.html, html)
+            forward = diff_html(current.html, html)
+            backward = diff_html(html, current.html)
+            document = Document(doc_id, current.version + 1, digest, html)
+            now = time.time()
+            with self._db:
+                self._db.execute("UPDATE documents SET version = ?, hash = ?, html = ?, updated_at = ? WHERE id = ?",
+                                 (document.version, digest, html, now, doc_id))
+                self._db.execute("UPDATE document_versions SET delta = ? WHERE doc_id = ? AND version = ?",
+                                 (json.dumps(backward, ensure_ascii=False), doc_id, current.version))
+                self._db.execute(
+                    "INSERT INTO document_versions (doc_id, version, hash, source, note, size, created_at, delta) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, NULL)",
+                    (doc_id, document.version, digest, source, note, len(html), now)
+                )
+                self._db.execute("DELETE FROM document_versions WHERE doc_id = ? AND version <= ?",
+                                 (doc_id, document.version - self.max_versions))
+        self.counters['commits'] += 1
+        self.counters['html_bytes'] += len(html.encode('utf-8'))
+        self.counters['diff_bytes'] += len(json.dumps(forward, ensure_ascii=False).encode('utf-8'))
+        return document, forward
+
+    def restore(self, doc_id: str, version: int, base_version: Optional[int] = None) -> Tuple[Document, List[List[Any]]]:
+        """Nouvelle version reprenant le contenu d'une version antérieure (l'historique n'est pas réécrit)"""
+        previous = self.get(doc_id, version)
+        result = self.commit(doc_id, previous.html, base_version=base_version, source="restored",
+                             note=f"restored version {version}")
+        self.counters['restores'] += 1
+        return result
+
+    def versions(self, doc_id: str) -> List[DocumentVersion]:
+        with self._lock:
+            self._current(doc_id)
+            rows = self._db.execute(
+                "SELECT version, hash, source, note, size, created_at FROM document_versions "
+                "WHERE doc_id = ? ORDER BY version",
+                (doc_id,)
+            ).fetchall()
+        return [DocumentVersion(*row) for row in rows]
+
+    def delete(self, doc_id: str) -> bool:
+        with self._lock, self._db:
+            deleted = self._db.execute("DELETE FROM documents WHERE id = ?", (doc_id,)).rowcount > 0
+            self._db.execute("DELETE FROM document_versions WHERE doc_id = ?", (doc_id,))
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            documents, = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()
+        html_bytes = self.counters['html_bytes']
+        return {**self.counters, 'documents': documents,
+                'diff_ratio': round(self.counters['diff_bytes'] / html_bytes, 4) if html_bytes else 0.0}
+
+    def _current(self, doc_id: str) -> Document:
+        # Appelé avec le verrou
+        row = self._db.execute("SELECT version, hash, html, updated_at FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        if row is None or time.time() - row[3] > self.ttl_seconds:
+            raise KeyError(doc_id)
+        return Document(doc_id, row[0], row[1], row[2])
+
+    def _evict(self, now: float):
+        # Appelé avec le verrou : documents expirés, puis les moins récemment modifiés au-delà du maximum
+        stale = [row[0] for row in self._db.execute(
+            "SELECT id FROM documents WHERE updated_at < ?", (now - self.ttl_seconds,)
+        ).fetchall()]
+        stale += [row[0] for row in self._db.execute(
+            "SELECT id FROM documents WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+            (now - self.ttl_seconds, self.max_documents)
+        ).fetchall()]
+        for doc_id in stale:
+            self._db.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            self._db.execute("DELETE FROM document_versions WHERE doc_id = ?", (doc_id,))
+        self.counters['evictions'] += len(stale)
+
+
+document_store = LazySingleton(DocumentStore.from_env)
@@ -0,0 +1,187 @@
+"""
+Export des contrats en PDF et DOCX côté serveur
+Le rendu (contract_export) tourne dans un pool de processus : la mise en page d'un long contrat
+ne bloque jamais la boucle d'événements. Les fichiers sont mis en cache sur disque par empreinte
+du HTML et format, et les exports identiques simultanés partagent le même rendu
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from contract_export import EXPORT_FORMATS, render_document
+from observability import EXPORT_RENDER_DURATION, EXPORT_REQUESTS
+from result_cache import DiskResultCache, SingleFlight
+from settings import LazySingleton
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+# À incrémenter quand la mise en page change : les fichiers déjà en cache ne sont plus servis
+RENDERER_VERSION = 1
+
+
+def export_key(html: str, export_format: str) -> str:
+    digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    return f"{export_format}-v{RENDERER_VERSION}-{digest}"
+
+
+class ExportCache(DiskResultCache):
+    """Fichiers exportés sur disque (octets bruts), même éviction que le cache de résultats"""
+    suffix = ".export"
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        return data
+
+    def set(self, key: str, value: bytes):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        self.counters['writes'] += 1
+        self._evict()
+
+
+@dataclass
+class ExportConfig:
+    workers: int = 2                   # 0 : rendu dans un thread (environnements sans multiprocessing)
+    start_method: str = "spawn"        # les workers n'héritent ni des threads ni des connexions du serveur
+    timeout_seconds: float = 120
+    chunk_bytes: int = 64 * 1024
+    cache_dir: str = field(default_factory=lambda: os.path.join(tempfile.gettempdir(), "counselai_exports"))
+    cache_max_bytes: int = 500 * 1024 * 1024
+    cache_enabled: bool = True
+
+    @classmethod
+    def from_env(cls) -> "ExportConfig":
+        """
+        EXPORT_WORKERS, EXPORT_START_METHOD (spawn | forkserver | fork), EXPORT_TIMEOUT_SECONDS, EXPORT_CHUNK_BYTES,
+        EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_ENABLED=0 pour désactiver
+        """
+        default = cls()
+        return cls(
+            workers=int(os.getenv("EXPORT_WORKERS", str(default.workers))),
+            start_method=os.getenv("EXPORT_START_METHOD", default.start_method),
+            timeout_seconds=float(os.getenv("EXPORT_TIMEOUT_SECONDS", str(default.timeout_seconds))),
+            chunk_bytes=int(os.getenv("EXPORT_CHUNK_BYTES", str(default.chunk_bytes))),
+            cache_dir=os.getenv("EXPORT_CACHE_DIR", default.cache_dir),
+            cache_max_bytes=int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(default.cache_max_bytes))),
+            cache_enabled=os.getenv("EXPORT_CACHE_ENABLED", "1") == "1",
+        )
+
+
+class ContractExporter:
+    """
+    data = await exporter.export(html, "pdf")
+    Cache disque d'abord ; sinon rendu dans le pool (démarré au premier export), puis mise en cache
+    """
+
+    def __init__(self, config: Optional[ExportConfig] = None, cache: Optional[ExportCache] = None):
+        self.config = config or ExportConfig()
+        self.cache = cache or ExportCache(self.config.cache_dir, self.config.cache_max_bytes, self.config.cache_enabled)
+        self._single_flight = SingleFlight()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.counters = {'exports': 0, 'renders': 0, 'cache_hits': 0, 'shared': 0, 'failures': 0, 'pool_restarts': 0}
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.config.workers <= 0:
+            return None
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.config.workers, mp_context=multiprocessing.get_context(self.config.start_method)
+            )
+        return self._executor
+
+    async def export(self, html: str, export_format: str) -> bytes:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Format d'export inconnu : {export_format}")
+        self.counters['exports'] += 1
+        key = export_key(html, export_format)
+        data = await self.cache.aget(key)
+        if data is not None:
+            self.counters['cache_hits'] += 1
+            EXPORT_REQUESTS.inc(format=export_format, source="cache")
+            return data
+        if self._single_flight.is_inflight(key):
+            self.counters['shared'] += 1
+            EXPORT_REQUESTS.inc(format=export_format, source="shared")
+        else:
+            EXPORT_REQUESTS.inc(format=export_format, source="render")
+        return await self._single_flight.do(key, lambda: self._render(key, html, export_format))
+
+    async def _render(self, key: str, html: str, export_format: str) -> bytes:
+        started_at = time.perf_counter()
+        pool = self._pool()
+        try:
+            if pool is None:
+                pending = asyncio.to_thread(render_document, export_format, html)
+            else:
+                pending = asyncio.get_running_loop().run_in_executor(pool, render_document, export_format, html)
+            data = await asyncio.wait_for(pending, self.config.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.counters['failures'] += 1
+            if pool is not None:
+                # Le worker bloqué garderait son créneau : le pool est arrêté, un nouveau démarre au prochain export
+                self._kill_pool(pool)
+            raise
+        except BrokenProcessPool:
+            # Worker tué (mémoire, signal) : nouveau pool au prochain export
+            self.counters['failures'] += 1
+            self.counters['pool_restarts'] += 1
+            self._executor = None
+            raise
+        except Exception:
+            self.counters['failures'] += 1
+            raise
+        seconds = time.perf_counter() - started_at
+        self.counters['renders'] += 1
+        EXPORT_RENDER_DURATION.observe(seconds, format=export_format)
+        print(f"📄 Export {export_format} rendu en {seconds:.2f}s ({len(data) // 1024} Ko)")
+        await self.cache.aset(key, data)
+        return data
+
+    def _kill_pool(self, pool: ProcessPoolExecutor):
+        """Arrêt immédiat du pool : ses processus sont tués (les rendus en cours échouent en BrokenProcessPool)"""
+        if self._executor is pool:
+            self._executor = None
+        self.counters['pool_restarts'] += 1
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        print(f"⚠️ Export trop long : pool d'export arrêté ({len(processes)} processus), redémarré au prochain export")
+
+    async def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'workers': self.config.workers, 'pool_started': self._executor is not None,
+                'cache': self.cache.stats()}
+
+
+exporter = LazySingleton(lambda: ContractExporter(ExportConfig.from_env()))
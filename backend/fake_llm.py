@@ -0,0 +1,282 @@
+"""
+Backend LLM simulé, interchangeable avec google.generativeai.GenerativeModel
+Sert aux tests et aux benchmarks hors ligne : latence du premier token, débit, taille des
+morceaux, appels de fonction et erreurs sont configurables. Avec un fichier d'enregistrements
+(replay_path), les réponses et leurs temps de réponse réels sont rejoués
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from llm_sdk import api_exceptions
+from observability import current_llm_stage
+
+LEGAL_WORDS = (
+    "the parties hereby agree that the purchaser shall pay the purchase price in accordance with "
+    "the terms and conditions set forth herein and subject to the warranties indemnities and "
+    "covenants of the seller including any adjustment mechanism governing law and jurisdiction"
+).split()
+
+SECTION_MARKER_RE = re.compile(r'<!-- section (s\d+) -->\n(.*?)(?=\n\n<!-- section |\n\nModification Request:)', re.DOTALL)
+
+
+@dataclass
+class FakeLLMConfig:
+    """Paramètres de simulation du modèle"""
+    ttft: float = 0.3               # délai avant le premier morceau (s)
+    tokens_per_second: float = 200  # débit de génération après le premier token
+    chunk_tokens: int = 20          # tokens par morceau streamé
+    output_tokens: int = 400        # longueur des réponses générées
+    function_call_rate: float = 0.0 # probabilité qu'une réponse de chat soit un appel d'outil
+    function_call_name: str = "lancer_cascade_generation"
+    error_rate: float = 0.0         # probabilité d'une erreur 429 (ResourceExhausted)
+    seed: Optional[int] = None
+    replay_path: Optional[str] = None  # réponses enregistrées (JSONL) rejouées à la place du texte simulé
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMConfig":
+        """Variables FAKE_LLM_TTFT_MS, FAKE_LLM_TOKENS_PER_SECOND, FAKE_LLM_CHUNK_TOKENS, etc."""
+        seed = os.getenv("FAKE_LLM_SEED")
+        return cls(
+            ttft=int(os.getenv("FAKE_LLM_TTFT_MS", "300")) / 1000,
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200")),
+            chunk_tokens=int(os.getenv("FAKE_LLM_CHUNK_TOKENS", "20")),
+            output_tokens=int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "400")),
+            function_call_rate=float(os.getenv("FAKE_LLM_FUNCTION_CALL_RATE", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None,
+            replay_path=os.getenv("FAKE_LLM_REPLAY_PATH") or None,
+        )
+
+
+def _usage(prompt_text: str, output_text: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        prompt_token_count=max(len(prompt_text) // 4, 1),
+        candidates_token_count=max(len(output_text) // 4, 1),
+        cached_content_token_count=0,
+    )
+
+
+def _mime_type(generation_config: Any) -> Optional[str]:
+    """response_mime_type d'une configuration de génération (dict ou GenerationConfig)"""
+    if isinstance(generation_config, dict):
+        return generation_config.get('response_mime_type')
+    return getattr(generation_config, 'response_mime_type', None)
+
+
+def _response_schema(generation_config: Any) -> Optional[Dict]:
+    if isinstance(generation_config, dict):
+        return generation_config.get('response_schema')
+    return getattr(generation_config, 'response_schema', None)
+
+
+def _contents_text(contents: Any) -> str:
+    """Texte brut d'un prompt ou d'un historique au format Gemini"""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return " ".join(part.get('text', '') for part in contents.get('parts', []) if isinstance(part, dict))
+    if isinstance(contents, list):
+        return "\n".join(_contents_text(item) for item in contents)
+    return str(contents)
+
+
+def response_kind(system_instruction: Optional[str], generation_config: Any, contents: Any,
+                  stage: Optional[str] = None) -> str:
+    """
+    Catégorie d'appel, commune à l'enregistrement et au rejeu : site d'appel (étape de track_llm_call :
+    "compact", "draft", "draft_section", "modify_patch"...), puis JSON contraint par schéma (selon ses
+    champs), JSON libre, conversation avec prompt système, mise en forme HTML ou texte libre
+    """
+    stage = stage or current_llm_stage()
+    if _mime_type(generation_config) == "application/json":
+        schema = _response_schema(generation_config)
+        kind = "schema:" + ",".join(sorted(schema.get('properties', {}))) if isinstance(schema, dict) else "json"
+    elif system_instruction:
+        kind = "system:" + hashlib.sha1(system_instruction.encode('utf-8')).hexdigest()[:10]
+    else:
+        kind = "html" if "HTML" in _contents_text(contents) else "text"
+    return f"{stage}/{kind}" if stage else kind
+
+
+@lru_cache(maxsize=8)
+def load_recordings(path: str) -> Dict[str, List[Dict]]:
+    """Enregistrements JSONL {kind, text, function_call, ttft_ms, duration_ms}, groupés par catégorie"""
+    recordings: Dict[str, List[Dict]] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings.setdefault(entry['kind'], []).append(entry)
+    return recordings
+
+
+class FakeChunk:
+    """Morceau de réponse : même interface que les morceaux du SDK (text, candidates)"""
+
+    def __init__(self, text: str = "", function_call: Optional[str] = None):
+        self.text = text
+        parts = [SimpleNamespace(function_call=SimpleNamespace(name=function_call), text="")] if function_call else [
+            SimpleNamespace(function_call=None, text=text)
+        ]
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=parts))]
+
+
+class FakeResponse(FakeChunk):
+    def __init__(self, text: str, prompt_text: str, function_call: Optional[str] = None):
+        super().__init__(text, function_call)
+        self.usage_metadata = _usage(prompt_text, text)
+
+
+class FakeStreamResponse:
+    """Réponse streamée : itérable asynchrone, puis text et usage_metadata une fois consommée"""
+
+    def __init__(self, chunks: List[FakeChunk], config: FakeLLMConfig, prompt_text: str,
+                 ttft: Optional[float] = None, delay: Optional[float] = None):
+        self._chunks = chunks
+        self._config = config
+        self._prompt_text = prompt_text
+        self._ttft = config.ttft if ttft is None else ttft
+        self._delay = delay
+        self.text = ""
+        self.usage_metadata = None
+
+    async def __aiter__(self) -> AsyncIterator[FakeChunk]:
+        await asyncio.sleep(self._ttft)
+        delay = self._delay
+        if delay is None:
+            delay = self._config.chunk_tokens / self._config.tokens_per_second if self._config.tokens_per_second else 0
+        for index, chunk in enumerate(self._chunks):
+            if index:
+                await asyncio.sleep(delay)
+            self.text += chunk.text
+            yield chunk
+        self.usage_metadata = _usage(self._prompt_text, self.text)
+
+
+class FakeGenerativeModel:
+    """Remplaçant de genai.GenerativeModel pour les tests et benchmarks"""
+
+    def __init__(self, model_name: str = "fake-model", system_instruction: Optional[str] = None,
+                 generation_config: Any = None, config: Optional[FakeLLMConfig] = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.generation_config = generation_config
+        self.config = config or FakeLLMConfig()
+        self._random = random.Random(self.config.seed)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs):
+        prompt_text = _contents_text(contents)
+        if self._random.random() < self.config.error_rate:
+            await asyncio.sleep(self.config.ttft / 4)
+            raise api_exceptions.ResourceExhausted("429 Resource has been exhausted (fake backend)")
+
+        recording = self._recording(contents)
+        if recording is not None:
+            return await self._replay(recording, prompt_text, stream)
+
+        function_call = None
+        if self.system_instruction and self._random.random() < self.config.function_call_rate:
+            function_call = self.config.function_call_name
+        text = "" if function_call else self._response_text(prompt_text)
+
+        if stream:
+            return FakeStreamResponse(self._chunk(text, function_call), self.config, prompt_text)
+        tokens = len(text) // 4
+        await asyncio.sleep(self.config.ttft + (tokens / self.config.tokens_per_second if self.config.tokens_per_second else 0))
+        return FakeResponse(text, prompt_text, function_call)
+
+    def _recording(self, contents: Any) -> Optional[Dict]:
+        """Réponse enregistrée de la même catégorie, tirée au hasard ; None sans enregistrement"""
+        if not self.config.replay_path:
+            return None
+        recordings = load_recordings(self.config.replay_path)
+        kind = response_kind(self.system_instruction, self.generation_config, contents)
+        # Enregistrements antérieurs aux sites d'appel : catégorie seule
+        candidates = recordings.get(kind) or recordings.get(kind.rsplit("/", 1)[-1])
+        return self._random.choice(candidates) if candidates else None
+
+    async def _replay(self, recording: Dict, prompt_text: str, stream: bool):
+        """Rejoue le texte enregistré avec le temps du premier morceau et la durée totale mesurés"""
+        function_call = recording.get('function_call')
+        text = "" if function_call else recording.get('text', '')
+        ttft = recording.get('ttft_ms', 0) / 1000
+        duration = max(recording.get('duration_ms', 0) / 1000, ttft)
+        if stream:
+            chunks = self._chunk(text, function_call)
+            delay = (duration - ttft) / (len(chunks) - 1) if len(chunks) > 1 else 0
+            return FakeStreamResponse(chunks, self.config, prompt_text, ttft=ttft, delay=delay)
+        await asyncio.sleep(duration)
+        return FakeResponse(text, prompt_text, function_call)
+
+    def start_chat(self, history: Optional[List[Dict]] = None) -> "FakeChatSession":
+        return FakeChatSession(self, list(history or []))
+
+    def _chunk(self, text: str, function_call: Optional[str]) -> List[FakeChunk]:
+        if function_call:
+            return [FakeChunk(function_call=function_call)]
+        size = max(self.config.chunk_tokens * 4, 1)
+        return [FakeChunk(text[i:i + size]) for i in range(0, len(text), size)] or [FakeChunk("")]
+
+    def _response_text(self, prompt_text: str) -> str:
+        if _mime_type(self.generation_config) == "application/json":
+            return self._json_response(prompt_text)
+        words = [self._random.choice(LEGAL_WORDS) for _ in range(max(self.config.output_tokens * 3 // 4, 1))]
+        if "HTML" in prompt_text or "HTML" in (self.system_instruction or ""):
+            paragraphs = [" ".join(words[i:i + 60]) for i in range(0, len(words), 60)]
+            return "<h1>AGREEMENT</h1>\n" + "\n".join(f"<p>{p}.</p>" for p in paragraphs)
+        lines = ["# AGREEMENT", ""]
+        for index in range(0, len(words), 60):
+            lines += [f"## ARTICLE {index // 60 + 1}", "", " ".join(words[index:index + 60]) + ".", ""]
+        return "\n".join(lines)
+
+    def _json_response(self, prompt_text: str) -> str:
+        schema = _response_schema(self.generation_config)
+        if isinstance(schema, dict):
+            return json.dumps(self._sample(schema))
+        return self._patch_response(prompt_text)
+
+    def _sample(self, schema: Dict) -> Any:
+        """Valeur arbitraire conforme au schéma (sous-ensemble OpenAPI de response_schema)"""
+        kind = str(schema.get('type', 'string')).lower()
+        if kind == "object":
+            return {name: self._sample(prop) for name, prop in schema.get('properties', {}).items()}
+        if kind == "array":
+            return [self._sample(schema.get('items', {})) for _ in range(self._random.randint(1, 3))]
+        if kind in ("integer", "number"):
+            return self._random.randint(1, 1000)
+        if kind == "boolean":
+            return self._random.random() < 0.5
+        return " ".join(self._random.choice(LEGAL_WORDS) for _ in range(self._random.randint(2, 8)))
+
+    def _patch_response(self, prompt_text: str) -> str:
+        """Réponse au protocole de patchs de /api/modify_contract : réécrit la première section reçue"""
+        match = SECTION_MARKER_RE.search(prompt_text)
+        if not match:
+            return json.dumps({"patches": [], "message": "No change required."})
+        section_id, section_html = match.group(1), match.group(2)
+        return json.dumps({
+            "patches": [{"op": "replace", "section_id": section_id, "html": section_html + "\n<p>Amended.</p>"}],
+            "message": "Section amended."
+        })
+
+
+class FakeChatSession:
+    """Remplaçant de ChatSession : conserve l'historique et délègue la génération au modèle"""
+
+    def __init__(self, model: FakeGenerativeModel, history: List[Dict]):
+        self.model = model
+        self.history = history
+
+    async def send_message_async(self, content: Any, stream: bool = False, **kwargs):
+        prompt = self.history + [{"role": "user", "parts": [{"text": _contents_text(content)}]}]
+        response = await self.model.generate_content_async(prompt, stream=stream)
+        self.history = prompt
+        return response
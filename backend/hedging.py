@@ -0,0 +1,243 @@
+"""
+Couverture de latence et modèle de secours
+- stream : si le premier morceau n'arrive pas dans le délai fixé pour l'étape, une seconde
+  requête est lancée (sur le modèle de secours si configuré) ; le premier stream qui répond
+  est retenu et l'autre est annulé
+- appel simple ou stream en échec passager (quota, 5xx, délai dépassé) : l'appel est repris une fois
+  sur le modèle de secours ; les autres erreurs remontent telles quelles
+Le délai du premier morceau court à partir de l'attribution du créneau de l'ordonnanceur : une file
+d'attente saturée ne déclenche pas de couverture, qui ajouterait encore de la charge
+"""
+import asyncio
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from llm_scheduler import RateLimitExceeded, llm_scheduler, parse_mapping
+from llm_sdk import is_transient_error
+from observability import LLM_FALLBACKS, LLM_HEDGE_WINS, LLM_HEDGES
+from settings import LazySingleton
+
+_NO_CHUNK = object()
+
+
+@dataclass
+class HedgingConfig:
+    enabled: bool = True
+    fallback_model: Optional[str] = "gemini-2.5-flash"
+    # Délai max (s) avant le premier morceau, par étape ; pas de couverture pour les autres étapes
+    ttft_slo: Dict[str, float] = field(default_factory=lambda: {"chat": 6.0, "stream": 6.0})
+
+    @classmethod
+    def from_env(cls) -> "HedgingConfig":
+        """LLM_HEDGING (1/0), LLM_FALLBACK_MODEL (vide : pas de secours), LLM_TTFT_SLO_MS ("chat=6000,draft=20000")"""
+        slo = parse_mapping(os.getenv("LLM_TTFT_SLO_MS", "chat=6000,stream=6000"))
+        return cls(
+            enabled=os.getenv("LLM_HEDGING", "1") == "1",
+            fallback_model=os.getenv("LLM_FALLBACK_MODEL", "gemini-2.5-flash") or None,
+            ttft_slo={stage: int(value) / 1000 for stage, value in slo.items()},
+        )
+
+
+class _Attempt:
+    """Stream ouvert dans un créneau de l'ordonnanceur, premier morceau déjà reçu"""
+
+    def __init__(self, stage: str, model_name: str):
+        self.stage = stage
+        self.model_name = model_name
+        self.response: Any = None
+        self.iterator: Any = None
+        self.first: Any = _NO_CHUNK
+        self.dispatched = asyncio.Event()  # créneau attribué, requête envoyée
+        self._stack = AsyncExitStack()
+
+    def _dispatch(self, open_stream: Callable[[str], Awaitable[Any]]) -> Awaitable[Any]:
+        self.dispatched.set()
+        return open_stream(self.model_name)
+
+    async def open(self, open_stream: Callable[[str], Awaitable[Any]]) -> "_Attempt":
+        try:
+            self.response = await self._stack.enter_async_context(
+                llm_scheduler.stream(self.stage, self.model_name, lambda: self._dispatch(open_stream))
+            )
+            self.iterator = self.response.__aiter__()
+            try:
+                self.first = await self.iterator.__anext__()
+            except StopAsyncIteration:
+                pass
+        except BaseException:
+            # Échec ou annulation (couverture perdue) : le créneau est rendu tout de suite
+            await self._stack.aclose()
+            raise
+        return self
+
+    async def close(self):
+        # Lecture interrompue avant la fin (objet JSON complet, client parti) : le stream est fermé tout de suite
+        aclose = getattr(self.iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception as e:
+                print(f"⚠️ {self.stage} : fermeture du stream {self.model_name} en échec ({type(e).__name__}: {e})")
+        await self._stack.aclose()
+
+
+class HedgedStream:
+    """Stream retenu : itérable comme la réponse du SDK, usage_metadata compris"""
+
+    def __init__(self, attempt: _Attempt):
+        self._attempt = attempt
+        self.model_name = attempt.model_name
+
+    @property
+    def usage_metadata(self) -> Any:
+        return getattr(self._attempt.response, "usage_metadata", None)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        if self._attempt.first is not _NO_CHUNK:
+            yield self._attempt.first
+        if self._attempt.iterator is None:
+            return
+        while True:
+            try:
+                chunk = await self._attempt.iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+
+class HedgingPolicy:
+    """
+    Les appelants fournissent une fabrique par nom de modèle, pour pouvoir changer de modèle
+        async with hedging.stream("chat", model_name, lambda name: open_chat(name)) as response:
+            async for chunk in response: ...
+        response = await hedging.call("extract", model_name, lambda name: model_pool.get(name).generate_content_async(prompt))
+    """
+
+    def __init__(self, config: Optional[HedgingConfig] = None):
+        self.config = config or HedgingConfig()
+        self.streams = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    @asynccontextmanager
+    async def stream(self, stage: str, model_name: str,
+                     open_stream: Callable[[str], Awaitable[Any]]) -> AsyncIterator[HedgedStream]:
+        attempt = await self._open(stage, model_name, open_stream)
+        try:
+            yield HedgedStream(attempt)
+        finally:
+            await attempt.close()
+
+    async def call(self, stage: str, model_name: str, call_model: Callable[[str], Awaitable[Any]]) -> Any:
+        """Appel non streamé, repris sur le modèle de secours en cas d'erreur"""
+        try:
+            return await llm_scheduler.call(stage, model_name, lambda: call_model(model_name))
+        except Exception as e:
+            fallback = self._fallback_for(model_name, e)
+            if fallback is None:
+                raise
+            self._record_fallback(stage, model_name, fallback, e)
+            return await llm_scheduler.call(stage, fallback, lambda: call_model(fallback))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.config.enabled,
+            'fallback_model': self.config.fallback_model,
+            'streams': self.streams,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedge_rate': round(self.hedges / self.streams, 4) if self.streams else 0.0,
+            'hedge_win_rate': round(self.hedge_wins / self.hedges, 4) if self.hedges else 0.0,
+            'fallbacks': self.fallbacks,
+        }
+
+    def models_for(self, model_name: str) -> List[str]:
+        """Modèles sur lesquels un appel à model_name peut aboutir : lui-même, puis reprise ou couverture"""
+        fallback = self.config.fallback_model
+        if not self.config.enabled or not fallback or fallback == model_name:
+            return [model_name]
+        return [model_name, fallback]
+
+    def _fallback_for(self, model_name: str, error: BaseException) -> Optional[str]:
+        """Modèle de reprise pour une erreur passagère ; None pour les autres erreurs"""
+        fallback = self.config.fallback_model
+        if not self.config.enabled or not fallback or fallback == model_name:
+            return None
+        if not (isinstance(error, RateLimitExceeded) or is_transient_error(error)):
+            return None
+        return fallback
+
+    def _record_fallback(self, stage: str, model_name: str, fallback: str, error: BaseException):
+        self.fallbacks += 1
+        LLM_FALLBACKS.inc(stage=stage, error=type(error).__name__)
+        print(f"🔁 {stage} : échec sur {model_name} ({type(error).__name__}), reprise sur {fallback}")
+
+    async def _open(self, stage: str, model_name: str,
+                    open_stream: Callable[[str], Awaitable[Any]]) -> _Attempt:
+        self.streams += 1
+        slo = self.config.ttft_slo.get(stage) if self.config.enabled else None
+        attempt = _Attempt(stage, model_name)
+        primary = asyncio.create_task(attempt.open(open_stream))
+        tasks: List[asyncio.Task] = [primary]
+        winner: Optional[asyncio.Task] = None
+        try:
+            if slo is not None:
+                # Attente du créneau hors délai : seule la latence du fournisseur compte
+                dispatched = asyncio.create_task(attempt.dispatched.wait())
+                try:
+                    await asyncio.wait([primary, dispatched], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    dispatched.cancel()
+            done, _ = await asyncio.wait(tasks, timeout=slo)
+            if not done:
+                # Premier token en retard : requête de couverture, le premier stream qui répond gagne
+                hedge_model = self.config.fallback_model or model_name
+                self.hedges += 1
+                LLM_HEDGES.inc(stage=stage)
+                print(f"🏁 {stage} : pas de premier token après {slo}s, couverture sur {hedge_model}")
+                tasks.append(asyncio.create_task(_Attempt(stage, hedge_model).open(open_stream)))
+            winner = await self._first_success(tasks)
+            if winner is not primary:
+                self.hedge_wins += 1
+            if len(tasks) > 1:
+                LLM_HEDGE_WINS.inc(stage=stage, winner="primary" if winner is primary else "hedge")
+            return winner.result()
+        except Exception as e:
+            if len(tasks) > 1:
+                raise
+            fallback = self._fallback_for(model_name, e)
+            if fallback is None:
+                raise
+            self._record_fallback(stage, model_name, fallback, e)
+            return await _Attempt(stage, fallback).open(open_stream)
+        finally:
+            await self._discard(tasks, keep=winner)
+
+    async def _first_success(self, tasks: List[asyncio.Task]) -> asyncio.Task:
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    return task
+            for task in done:
+                error = task.exception()
+        raise error
+
+    async def _discard(self, tasks: List[asyncio.Task], keep: Optional[asyncio.Task]):
+        """Annule les tentatives perdantes et ferme celles qui avaient déjà répondu"""
+        for task in tasks:
+            if task is keep:
+                continue
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            elif not task.cancelled() and task.exception() is None:
+                await task.result().close()
+
+
+hedging = LazySingleton(lambda: HedgingPolicy(HedgingConfig.from_env()))
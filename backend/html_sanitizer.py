@@ -0,0 +1,262 @@
+"""
+Nettoyage du HTML produit par les LLM (mise en forme et modification des contrats)
+Une seule passe, incrémentale : retire les balises de bloc de code (```html), ne garde que le contenu
+du body, supprime <head>, <style>, <script>, <title> et <meta>, et vérifie l'imbrication des balises
+(balises fermantes orphelines ignorées, balises restées ouvertes refermées)
+Accepte le texte entier ou des morceaux au fil d'un flux. Les documents volumineux sont nettoyés
+dans un thread (sanitize_html_async) : la passe en Python pur ne bloque pas la boucle d'événements
+"""
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Clôtures de bloc de code en début de ligne ("```html", "```"), y compris collées au HTML ("```html<p>")
+FENCE_RE = re.compile(r'(?<=\n)[ \t]*```[\w-]*[ \t]*\n?')
+START_FENCE_RE = re.compile(r'[ \t]*```[\w-]*[ \t]*\n?')
+FENCE_ONLY_RE = re.compile(r'```[\w-]*')
+MAX_FENCE_LINE = 32
+
+# Balise, commentaire, doctype ou instruction ; les attributs entre guillemets peuvent contenir ">"
+TOKEN_RE = re.compile(
+    r'<(?:!--.*?-->|(/?)([a-zA-Z][\w:-]*)(?:[^>"\']|"[^"]*"|\'[^\']*\')*>|[!?][^>]*>)', re.DOTALL
+)
+TAG_START_CHARS = frozenset('/!?abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+MAX_TOKEN_CHARS = 8192  # au-delà, un "<" sans fin est traité comme du texte
+OFFLOAD_MIN_CHARS = 32 * 1024  # quelques millisecondes de nettoyage : au-delà, hors de la boucle d'événements
+
+# Éléments supprimés avec leur contenu (texte brut jusqu'à la balise fermante), et balises supprimées seules
+RAW_TEXT_ELEMENTS = {tag: re.compile(rf'</{tag}\s*>', re.IGNORECASE) for tag in ('style', 'script', 'title')}
+DROPPED_TAGS = {'html', 'body', 'meta', 'link', 'base'}
+HEAD_TAGS = {'meta', 'link', 'base', 'title', 'style', 'script'}
+VOID_TAGS = {'area', 'br', 'col', 'embed', 'hr', 'img', 'input', 'source', 'track', 'wbr'}
+# Fermeture implicite valide en HTML : pas d'anomalie si elle manque
+OPTIONAL_END_TAGS = {'p', 'li', 'dt', 'dd', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot', 'option'}
+# Balises traitées à part (supprimées, vides ou au contenu ignoré)
+SPECIAL_TAGS = {'head', *RAW_TEXT_ELEMENTS, *DROPPED_TAGS, *VOID_TAGS}
+# Balises ouvertes qu'une nouvelle balise peut refermer implicitement
+IMPLICIT_CLOSERS = {'p', 'li'}
+# Blocs qui referment un paragraphe encore ouvert
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer', 'form', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'ol', 'p', 'pre', 'section', 'table', 'ul',
+}
+
+
+class _FenceFilter:
+    """Retire les clôtures de bloc de code, en retenant seulement la fin de texte qui peut encore en être une"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.at_line_start = True
+
+    def feed(self, chunk: str) -> str:
+        data, self.buffer = self.buffer + chunk, ""
+        line_start = data.rfind('\n') + 1
+        if (line_start or self.at_line_start) and self._could_be_fence(data[line_start:]):
+            data, self.buffer = data[:line_start], data[line_start:]
+        else:
+            # Clôture finale collée au contenu ("...</p>```") : les accents graves sont retenus
+            stripped = data.rstrip()
+            ticks = len(stripped) - len(stripped.rstrip('`'))
+            if 0 < ticks <= 3:
+                cut = len(stripped) - ticks
+                data, self.buffer = data[:cut], data[cut:]
+        if not data:
+            return ""
+        if self.at_line_start:
+            match = START_FENCE_RE.match(data)
+            data = data[match.end():] if match else data
+        self.at_line_start = data.endswith('\n') or (not data and self.at_line_start)
+        return FENCE_RE.sub('', data)
+
+    def close(self) -> str:
+        rest, self.buffer = self.buffer.strip(), ""
+        if not rest or FENCE_ONLY_RE.fullmatch(rest):
+            return ""
+        if self.at_line_start:
+            match = START_FENCE_RE.match(rest)
+            rest = rest[match.end():] if match else rest
+        return rest
+
+    @staticmethod
+    def _could_be_fence(line: str) -> bool:
+        text = line.strip()
+        return len(line) <= MAX_FENCE_LINE and (not text or "```".startswith(text) or bool(FENCE_ONLY_RE.fullmatch(text)))
+
+
+class HtmlSanitizer:
+    """
+    sanitizer = HtmlSanitizer()
+    html = sanitizer.feed(chunk) + ... + sanitizer.close()   # HTML nettoyé, disponible au fil des morceaux
+    sanitizer.issues        # anomalies de structure ({'type': 'stray_end_tag' | 'misnested_tag' | 'unclosed_tag', 'tag'})
+    sanitizer.saw_markup    # au moins une balise : sinon le modèle a répondu en texte
+    Le texte entre les balises est recopié tel quel (entités comprises), seules les balises sont examinées
+    """
+
+    def __init__(self):
+        self.fences = _FenceFilter()
+        self.pending = ""     # balise incomplète en fin de morceau
+        self.issues: List[Dict[str, Any]] = []
+        self.saw_markup = False
+        self.stack: List[str] = []
+        self.skipping: Optional[str] = None
+        self.ended = False
+        self.started = False
+        self.held_whitespace = ""
+        self.out: List[str] = []
+
+    def feed(self, chunk: str) -> str:
+        self._parse(self.fences.feed(chunk), final=False)
+        return self._take()
+
+    def close(self) -> str:
+        self._parse(self.fences.close(), final=True)
+        self.skipping = None
+        while self.stack:
+            tag = self.stack.pop()
+            if tag not in OPTIONAL_END_TAGS:
+                self.issues.append({'type': 'unclosed_tag', 'tag': tag})
+            self.out.append(f"</{tag}>")
+        return self._take()
+
+    def _parse(self, data: str, final: bool):
+        data, self.pending = self.pending + data, ""
+        pos, size = 0, len(data)
+        out, stack = self.out, self.stack
+        while pos < size:
+            raw_end = RAW_TEXT_ELEMENTS.get(self.skipping)
+            if raw_end is not None:
+                # Contenu de <style>/<script>/<title> ignoré jusqu'à la balise fermante
+                match = raw_end.search(data, pos)
+                if match is None:
+                    self.pending = "" if final else data[max(pos, size - 16):]
+                    return
+                self.skipping = None
+                pos = match.end()
+                continue
+            for match in TOKEN_RE.finditer(data, pos):
+                start = match.start()
+                if start > pos and not self.skipping and not self.ended:
+                    out.append(data[pos:start])
+                pos = match.end()
+                closing, tag = match.group(1, 2)
+                if tag is None:
+                    self.saw_markup = True
+                    if not self.skipping and not self.ended and data.startswith('<!--', start):
+                        out.append(match.group())
+                    continue
+                tag = tag.lower()
+                if self.skipping or self.ended or tag in SPECIAL_TAGS:
+                    if closing:
+                        self._end(tag)
+                    else:
+                        raw = match.group()
+                        self._start(tag, raw, void=raw.endswith('/>'))
+                        if self.skipping in RAW_TEXT_ELEMENTS:
+                            break
+                elif closing:
+                    # Cas courant : fermeture de la dernière balise ouverte
+                    if stack and stack[-1] == tag:
+                        stack.pop()
+                        out.append(match.group())
+                    else:
+                        self._end(tag)
+                else:
+                    raw = match.group()
+                    if stack and stack[-1] in IMPLICIT_CLOSERS:
+                        self._start(tag, raw, void=raw.endswith('/>'))
+                    else:
+                        out.append(raw)
+                        if not raw.endswith('/>'):
+                            stack.append(tag)
+            else:
+                self._tail(data[pos:], final)
+                return
+
+    def _tail(self, text: str, final: bool):
+        """Texte après la dernière balise ; une balise coupée en fin de morceau est retenue"""
+        if not final:
+            lt = text.find('<')
+            while lt >= 0 and not (lt + 1 == len(text) or text[lt + 1] in TAG_START_CHARS):
+                lt = text.find('<', lt + 1)
+            if lt >= 0 and len(text) - lt <= MAX_TOKEN_CHARS:
+                text, self.pending = text[:lt], text[lt:]
+        if text and not self.skipping and not self.ended:
+            self.out.append(text)
+
+    def _start(self, tag: str, raw: str, void: bool):
+        self.saw_markup = True
+        if self.skipping == 'head' and tag not in HEAD_TAGS:
+            self.skipping = None  # fin implicite du head
+        if self.skipping or self.ended:
+            return
+        if tag == 'head' or tag in RAW_TEXT_ELEMENTS:
+            if not void:
+                self.skipping = tag
+            return
+        if tag in DROPPED_TAGS:
+            return
+        if self.stack and (
+            (self.stack[-1] == 'p' and tag in BLOCK_TAGS) or (tag == 'li' and self.stack[-1] == 'li')
+        ):
+            self.out.append(f"</{self.stack.pop()}>")
+        self.out.append(raw)
+        if not void and tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def _end(self, tag: str):
+        self.saw_markup = True
+        if self.skipping:
+            if tag == self.skipping:
+                self.skipping = None
+            return
+        if tag == 'body':
+            self.ended = True  # ce qui suit </body> est ignoré
+            return
+        if self.ended or tag in SPECIAL_TAGS:
+            return
+        if tag not in self.stack:
+            self.issues.append({'type': 'stray_end_tag', 'tag': tag})
+            return
+        while self.stack[-1] != tag:
+            inner = self.stack.pop()
+            if inner not in OPTIONAL_END_TAGS:
+                self.issues.append({'type': 'misnested_tag', 'tag': inner})
+            self.out.append(f"</{inner}>")
+        self.stack.pop()
+        self.out.append(f"</{tag}>")
+
+    def _take(self) -> str:
+        # Espaces de début et de fin retirés, comme str.strip() sur le document entier
+        text = "".join(self.out)
+        self.out.clear()
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self.started = True
+        body = text.rstrip()
+        if not body:
+            self.held_whitespace += text
+            return ""
+        text, self.held_whitespace = self.held_whitespace + body, text[len(body):]
+        return text
+
+
+def sanitize_html(text: str) -> str:
+    sanitizer = HtmlSanitizer()
+    return sanitizer.feed(text) + sanitizer.close()
+
+
+async def sanitize_html_async(text: str) -> Tuple[str, HtmlSanitizer]:
+    """
+    (HTML nettoyé, sanitizer pour issues / saw_markup) depuis le code asynchrone :
+    au-delà de OFFLOAD_MIN_CHARS, la passe tourne dans un thread
+    """
+    sanitizer = HtmlSanitizer()
+
+    def run() -> str:
+        return sanitizer.feed(text) + sanitizer.close()
+
+    html = run() if len(text) < OFFLOAD_MIN_CHARS else await asyncio.to_thread(run)
+    return html, sanitizer
@@ -0,0 +1,260 @@
+"""
+Tâches asynchrones : la génération de contrat tourne en arrière-plan, hors de la requête HTTP
+Soumission immédiate (identifiant de tâche), pool borné de workers, suivi par polling ou SSE.
+L'état de chaque tâche est écrit sur disque : il reste consultable après une déconnexion du
+client, et depuis les autres workers uvicorn ; lectures et écritures passent par un thread, hors de la
+boucle d'événements. Les tâches en cours signalent régulièrement qu'elles
+sont vivantes : celles d'un processus arrêté sont marquées interrompues au lieu d'être suivies sans fin
+"""
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from result_cache import DiskResultCache
+from settings import LazySingleton
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+# Exécution d'une tâche : reçoit la fonction de progression (nom d'étape), retourne le résultat
+JobRunner = Callable[[Callable[[str], None]], Awaitable[Dict[str, Any]]]
+
+
+class JobQueueFull(Exception):
+    """Trop de tâches en attente : le client doit réessayer plus tard"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str = "queued"
+    stage: str = "queued"
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    heartbeat_at: float = field(default_factory=time.time)  # dernier signe de vie du processus qui la porte
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        return cls(**data)
+
+
+class JobManager:
+    """
+    File de tâches bornée et workers démarrés à la première soumission, sur la boucle courante
+    Les tâches de ce processus sont suivies en mémoire, les autres sont relues sur disque
+    """
+
+    def __init__(self, store: DiskResultCache, max_workers: int = 2, max_queued: int = 100,
+                 poll_interval: float = 0.5, heartbeat_interval: float = 10.0, stale_after: float = 60.0):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after  # sans signe de vie depuis ce délai, la tâche est considérée interrompue
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._local: Dict[str, Job] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._writes: Dict[str, asyncio.Task] = {}  # écriture sur disque en cours, par tâche
+        self._dirty: Set[str] = set()                # tâches modifiées pendant leur écriture
+
+    @classmethod
+    def from_env(cls) -> "JobManager":
+        """JOB_WORKERS, JOB_MAX_QUEUED, JOBS_DIR, JOBS_MAX_BYTES, JOB_STALE_SECONDS"""
+        store = DiskResultCache(
+            directory=os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "counselai_jobs")),
+            max_bytes=int(os.getenv("JOBS_MAX_BYTES", str(100 * 1024 * 1024))),
+        )
+        return cls(
+            store=store,
+            max_workers=int(os.getenv("JOB_WORKERS", "2")),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", "100")),
+            stale_after=float(os.getenv("JOB_STALE_SECONDS", "60")),
+        )
+
+    def submit(self, kind: str, runner: JobRunner) -> Job:
+        """Met la tâche en file et retourne immédiatement"""
+        self._ensure_workers()
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"{self._queue.qsize()} tâches en attente")
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        job.events.append({'stage': 'queued', 'at': job.created_at})
+        self._local[job.id] = job
+        self._changed[job.id] = asyncio.Event()
+        self._save(job)
+        self._queue.put_nowait((job.id, runner))
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._local.get(job_id)
+        if job is not None:
+            return job
+        data = await self.store.aget(job_id)
+        return Job.from_dict(data) if data else None
+
+    async def follow(self, job_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Suit une tâche jusqu'à sa fin
+        Yields ('progress', étape) pour chaque étape franchie, puis ('done' | 'error', tâche complète)
+        Tâche disparue du disque, ou portée par un processus qui ne donne plus signe de vie : ('error', ...)
+        """
+        seen = 0
+        while True:
+            changed = self._changed.get(job_id)
+            job = await self.get(job_id)
+            if job is None:
+                yield 'error', {'id': job_id, 'status': 'failed', 'error': "Tâche inconnue ou expirée"}
+                return
+            for event in job.events[seen:]:
+                yield 'progress', event
+            seen = len(job.events)
+            if not job.finished and changed is None and time.time() - job.heartbeat_at > self.stale_after:
+                self._interrupt(job, "Tâche interrompue : le processus qui l'exécutait ne répond plus")
+            if job.finished:
+                # Fin annoncée une fois l'état final sur disque : relisible depuis les autres workers
+                await self._flush(job_id)
+                yield ('done' if job.status == "succeeded" else 'error'), job.to_dict()
+                return
+            if changed is not None:
+                # Tâche de ce processus : réveil immédiat à chaque étape
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Tâche d'un autre worker : relecture périodique sur disque
+                await asyncio.sleep(self.poll_interval)
+
+    async def shutdown(self):
+        """Arrête les workers (arrêt du serveur) ; les tâches en file ou en cours sont marquées interrompues"""
+        interrupted = list(self._local.values())
+        workers, self._workers = self._workers, []
+        if self._heartbeat is not None:
+            workers.append(self._heartbeat)
+            self._heartbeat = None
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for job in interrupted:
+            if not job.finished:
+                self._interrupt(job, "Tâche interrompue par l'arrêt du serveur, à relancer")
+        await asyncio.gather(*self._writes.values(), return_exceptions=True)
+        self._local.clear()
+        self._changed.clear()
+        self._loop = None
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._local.values() if job.status == "running")
+        return {
+            'workers': len([worker for worker in self._workers if not worker.done()]),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'running': running,
+            'store': self.store.stats(),
+        }
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Première soumission (ou nouvelle boucle d'événements, en test)
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._workers = []
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._work()))
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._beat())
+
+    async def _beat(self):
+        """Signe de vie des tâches de ce processus, relu par les autres workers qui les suivent"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.time()
+            for job in list(self._local.values()):
+                job.heartbeat_at = now
+                self._save(job)
+
+    def _interrupt(self, job: Job, error: str):
+        self._update(job, status="failed", stage="interrupted", error=error)
+        print(f"⚠️ Tâche {job.id} : {error}")
+
+    async def _work(self):
+        while True:
+            job_id, runner = await self._queue.get()
+            job = self._local[job_id]
+            self._update(job, status="running", stage="started")
+            try:
+                result = await runner(lambda stage: self._update(job, stage=stage))
+            except Exception as e:
+                print(f"❌ Tâche {job_id} en échec : {e}")
+                self._update(job, status="failed", stage="failed", error=str(e))
+            else:
+                self._update(job, status="succeeded", stage="done", result=result)
+            finally:
+                # La tâche terminée reste consultable sur disque, une fois son état final écrit
+                await self._flush(job_id)
+                self._local.pop(job_id, None)
+                self._changed.pop(job_id, None)
+                self._queue.task_done()
+
+    def _update(self, job: Job, stage: str, status: Optional[str] = None, **fields):
+        job.stage = stage
+        if status is not None:
+            job.status = status
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = job.heartbeat_at = time.time()
+        job.events.append({'stage': stage, 'at': job.updated_at})
+        self._save(job)
+        changed = self._changed.get(job.id)
+        if changed is not None:
+            changed.set()
+            self._changed[job.id] = asyncio.Event()
+
+    def _save(self, job: Job):
+        """
+        Écriture de la tâche dans un thread ; pendant une écriture, les mises à jour suivantes
+        sont regroupées en une seule écriture de l'état le plus récent
+        """
+        if job.id in self._writes:
+            self._dirty.add(job.id)
+            return
+        self._writes[job.id] = asyncio.get_running_loop().create_task(self._write(job))
+
+    async def _write(self, job: Job):
+        try:
+            while True:
+                self._dirty.discard(job.id)
+                try:
+                    await self.store.aset(job.id, job.to_dict())
+                except OSError as e:
+                    print(f"⚠️ Impossible d'enregistrer la tâche {job.id} : {e}")
+                if job.id not in self._dirty:
+                    return
+        finally:
+            self._writes.pop(job.id, None)
+
+    async def _flush(self, job_id: str):
+        write = self._writes.get(job_id)
+        if write is not None:
+            await asyncio.gather(write, return_exceptions=True)
+
+
+job_manager = LazySingleton(JobManager.from_env)
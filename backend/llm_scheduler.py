@@ -0,0 +1,315 @@
+"""
+Ordonnanceur des appels au modèle
+Tous les appels passent par ici : plafond de concurrence par modèle, file à priorités
+(le chat interactif passe avant la cascade et le simulateur d'avocat), budget de requêtes
+par clé d'API (seau à jetons) et nouvelles tentatives avec backoff exponentiel sur les 429
+"""
+import asyncio
+import bisect
+import itertools
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from llm_sdk import is_rate_limit_error
+from observability import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_RETRIES, LLM_SCHEDULER_WAIT
+from settings import LazySingleton
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # chat et modifications, l'utilisateur attend la réponse
+    CASCADE = 1      # génération de contrat
+    BACKGROUND = 2   # simulateur d'avocat
+
+
+STAGE_PRIORITIES = {
+    "chat": Priority.INTERACTIVE,
+    "stream": Priority.INTERACTIVE,
+    "modify": Priority.INTERACTIVE,
+    "modify_patch": Priority.INTERACTIVE,
+    "extract": Priority.CASCADE,
+    "draft": Priority.CASCADE,
+    "outline": Priority.CASCADE,
+    "draft_section": Priority.CASCADE,
+    "format": Priority.CASCADE,
+    "compact": Priority.CASCADE,
+    "lawyer": Priority.BACKGROUND,
+    "deal_sheet": Priority.BACKGROUND,
+}
+
+# Toutes les requêtes partent avec la clé GEMINI_API_KEY configurée au démarrage
+DEFAULT_API_KEY = "default"
+
+
+def parse_mapping(value: str) -> Dict[str, str]:
+    """Lit une variable d'environnement de la forme "clé=valeur,clé=valeur" """
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, item_value = item.split("=", 1)
+            mapping[key.strip()] = item_value.strip()
+    return mapping
+
+
+class RateLimitExceeded(Exception):
+    """Le fournisseur refuse encore l'appel (429) après toutes les tentatives"""
+
+    def __init__(self, model_name: str, retry_after: float):
+        super().__init__(f"Limite de débit atteinte pour {model_name}, réessayer dans {retry_after:.0f}s")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+@dataclass
+class SchedulerConfig:
+    max_concurrency: int = 8                      # appels simultanés par modèle
+    model_concurrency: Dict[str, int] = field(default_factory=dict)
+    requests_per_minute: float = 0                # budget par clé d'API, 0 = illimité
+    burst: int = 10                               # appels possibles d'un coup quand le seau est plein
+    max_retries: int = 3
+    backoff_base: float = 0.5                     # délai (s) avant la première nouvelle tentative
+    backoff_max: float = 20.0
+
+    @classmethod
+    def from_env(cls) -> "SchedulerConfig":
+        """
+        LLM_MAX_CONCURRENCY, LLM_MODEL_CONCURRENCY ("gemini-2.5-pro=4,gemini-2.5-flash=16"),
+        LLM_REQUESTS_PER_MINUTE, LLM_BURST, LLM_MAX_RETRIES, LLM_BACKOFF_BASE_MS, LLM_BACKOFF_MAX_MS
+        """
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            model_concurrency={name: int(value) for name, value in parse_mapping(os.getenv("LLM_MODEL_CONCURRENCY", "")).items()},
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+            burst=int(os.getenv("LLM_BURST", "10")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            backoff_base=int(os.getenv("LLM_BACKOFF_BASE_MS", "500")) / 1000,
+            backoff_max=int(os.getenv("LLM_BACKOFF_MAX_MS", "20000")) / 1000,
+        )
+
+    def concurrency_for(self, model_name: str) -> int:
+        return self.model_concurrency.get(model_name, self.max_concurrency)
+
+
+class TokenBucket:
+    """Seau à jetons : rate jetons par seconde, au plus capacity en réserve"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max((1 - self.tokens) / self.rate, 0.001)
+
+    def drain(self):
+        """Après un 429 : on vide le seau pour que les appels suivants ralentissent aussi"""
+        self._refill()
+        self.tokens = 0
+
+
+class LLMScheduler:
+    """
+    Admission des appels au modèle
+        response = await llm_scheduler.call("extract", model_name, lambda: model.generate_content_async(prompt))
+        async with llm_scheduler.stream("chat", model_name, lambda: session.send_message_async(text, stream=True)) as response:
+            async for chunk in response: ...
+    Le créneau est gardé pendant toute la durée d'un stream
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig] = None):
+        self.config = config or SchedulerConfig()
+        # File d'attente globale triée par (priorité, ordre d'arrivée)
+        self._waiters: List[Tuple[int, int, str, str, asyncio.Future]] = []
+        self._active: Dict[str, int] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._wakeup_at = 0.0
+        self._wakeup_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.retries = 0
+        self.rate_limited = 0
+
+    def configure(self, config: SchedulerConfig):
+        """Remplace la configuration (tests, benchmarks) ; les appels en cours ne sont pas touchés"""
+        self.config = config
+        self._buckets.clear()
+        self._dispatch()
+
+    async def acquire(self, model_name: str, priority: Priority = Priority.CASCADE, api_key: str = DEFAULT_API_KEY):
+        """Attend un créneau pour ce modèle ; à libérer avec release()"""
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._waiters, (int(priority), next(self._sequence), model_name, api_key, future))
+        self._dispatch()
+        started_at = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Créneau accordé au moment de l'annulation : on le rend
+                self.release(model_name)
+            else:
+                self._waiters = [entry for entry in self._waiters if entry[4] is not future]
+                self._update_gauges()
+            raise
+        LLM_SCHEDULER_WAIT.observe(time.perf_counter() - started_at, priority=Priority(priority).name.lower())
+
+    def release(self, model_name: str):
+        self._active[model_name] = max(self._active.get(model_name, 0) - 1, 0)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, stage: str, model_name: str, priority: Optional[Priority] = None) -> AsyncIterator[None]:
+        await self.acquire(model_name, self._priority(stage, priority))
+        try:
+            yield
+        finally:
+            self.release(model_name)
+
+    async def call(self, stage: str, model_name: str, factory: Callable[[], Awaitable[Any]],
+                   priority: Optional[Priority] = None) -> Any:
+        """Exécute factory() dans un créneau, avec nouvelles tentatives sur les 429"""
+        for attempt in range(self.config.max_retries + 1):
+            async with self.slot(stage, model_name, priority):
+                try:
+                    return await factory()
+                except Exception as e:
+                    if not is_rate_limit_error(e):
+                        raise
+                    error = e
+            await self._backoff(stage, model_name, attempt, error)
+
+    @asynccontextmanager
+    async def stream(self, stage: str, model_name: str, factory: Callable[[], Awaitable[Any]],
+                     priority: Optional[Priority] = None) -> AsyncIterator[Any]:
+        """
+        Ouvre un stream dans un créneau gardé jusqu'à la sortie du bloc
+        Seule l'ouverture est retentée : une fois des morceaux reçus, l'erreur remonte
+        """
+        priority = self._priority(stage, priority)
+        for attempt in range(self.config.max_retries + 1):
+            await self.acquire(model_name, priority)
+            try:
+                response = await factory()
+            except BaseException as e:
+                self.release(model_name)
+                if not isinstance(e, Exception) or not is_rate_limit_error(e):
+                    raise
+                await self._backoff(stage, model_name, attempt, e)
+                continue
+            try:
+                yield response
+            finally:
+                self.release(model_name)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        for priority, _, _, _, future in self._waiters:
+            if not future.done():
+                name = Priority(priority).name.lower()
+                queued[name] = queued.get(name, 0) + 1
+        return {
+            'in_flight': {name: count for name, count in self._active.items() if count},
+            'queued': queued,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+        }
+
+    def _priority(self, stage: str, priority: Optional[Priority]) -> Priority:
+        if priority is not None:
+            return priority
+        return STAGE_PRIORITIES.get(stage, Priority.CASCADE)
+
+    def _bucket(self, api_key: str) -> Optional[TokenBucket]:
+        if self.config.requests_per_minute <= 0:
+            return None
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.config.requests_per_minute / 60, self.config.burst)
+        return bucket
+
+    async def _backoff(self, stage: str, model_name: str, attempt: int, error: BaseException):
+        delay = min(self.config.backoff_max, self.config.backoff_base * 2 ** attempt)
+        # Jitter : moitié fixe, moitié aléatoire, pour désynchroniser les appels refusés ensemble
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if attempt >= self.config.max_retries:
+            self.rate_limited += 1
+            raise RateLimitExceeded(model_name, delay) from error
+        self.retries += 1
+        LLM_RETRIES.inc(stage=stage, model=model_name)
+        bucket = self._bucket(DEFAULT_API_KEY)
+        if bucket is not None:
+            bucket.drain()
+        print(f"⏳ Limite de débit ({stage}, {model_name}), nouvelle tentative dans {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    def _dispatch(self):
+        """Accorde les créneaux libres dans l'ordre de priorité, dans la limite du budget de chaque clé"""
+        remaining = []
+        blocked_keys = set()
+        for entry in self._waiters:
+            _, _, model_name, api_key, future = entry
+            if future.done():
+                continue
+            if self._active.get(model_name, 0) >= self.config.concurrency_for(model_name) or api_key in blocked_keys:
+                remaining.append(entry)
+                continue
+            bucket = self._bucket(api_key)
+            if bucket is not None and not bucket.try_take():
+                blocked_keys.add(api_key)
+                self._schedule_wakeup(bucket.time_until_token())
+                remaining.append(entry)
+                continue
+            self._active[model_name] = self._active.get(model_name, 0) + 1
+            future.set_result(None)
+        self._waiters = remaining
+        self._update_gauges()
+
+    def _schedule_wakeup(self, delay: float):
+        loop = asyncio.get_running_loop()
+        wakeup_at = loop.time() + delay
+        if self._wakeup is not None and self._wakeup_loop is loop and self._wakeup_at <= wakeup_at:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup_at = wakeup_at
+        self._wakeup_loop = loop
+        self._wakeup = loop.call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _update_gauges(self):
+        depth: Dict[Tuple[str, str], int] = {}
+        for priority, _, model_name, _, _ in self._waiters:
+            key = (model_name, Priority(priority).name.lower())
+            depth[key] = depth.get(key, 0) + 1
+        for model_name, active in self._active.items():
+            LLM_IN_FLIGHT.set(active, model=model_name)
+            for priority in Priority:
+                LLM_QUEUE_DEPTH.set(depth.get((model_name, priority.name.lower()), 0),
+                                    model=model_name, priority=priority.name.lower())
+        for (model_name, priority), count in depth.items():
+            LLM_QUEUE_DEPTH.set(count, model=model_name, priority=priority)
+
+
+llm_scheduler = LazySingleton(lambda: LLMScheduler(SchedulerConfig.from_env()))
@@ -0,0 +1,97 @@
+"""
+Chargement paresseux du SDK Gemini
+L'import de google.generativeai coûte près d'une seconde : il est repoussé au premier appel
+au modèle, et genai.configure n'est exécuté qu'une fois par processus (et par clé)
+"""
+import asyncio
+import importlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class LazyModule:
+    """Module importé au premier accès à l'un de ses attributs"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self._load(), attribute)
+
+
+genai = LazyModule("google.generativeai")
+api_exceptions = LazyModule("google.api_core.exceptions")
+
+_configured_key: Optional[str] = None
+_configure_lock = threading.Lock()
+
+
+def configure_once(api_key: Optional[str] = None) -> bool:
+    """Configure le SDK avec la clé (GEMINI_API_KEY par défaut) si ce n'est pas déjà fait"""
+    global _configured_key
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return False
+    if _configured_key == api_key:
+        return True
+    with _configure_lock:
+        if _configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+    return True
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """429 du fournisseur ; sans import du SDK si aucune erreur n'en provient"""
+    if not type(error).__module__.startswith("google."):
+        return False
+    return isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests))
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Erreur passagère (quota, 5xx, délai dépassé, coupure réseau) : l'appel peut être repris sur un autre modèle
+    Les erreurs de programmation ou de validation (400, prompt refusé) remontent telles quelles
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if not type(error).__module__.startswith("google."):
+        return False
+    return isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests,
+                              api_exceptions.ServerError, api_exceptions.DeadlineExceeded))
+
+
+async def warm_up(model_name: str) -> Dict[str, Any]:
+    """
+    Préchauffage au démarrage : import du SDK, configuration, puis un appel count_tokens
+    qui ouvre la connexion asynchrone utilisée ensuite par generate_content_async
+    """
+    from model_pool import model_pool
+
+    timings: Dict[str, Any] = {'backend': model_pool.backend}
+    started_at = time.perf_counter()
+    await asyncio.to_thread(genai._load)
+    timings['import_seconds'] = round(time.perf_counter() - started_at, 3)
+    if model_pool.backend != "gemini" or not configure_once():
+        return timings
+
+    model = model_pool.get(model_name)
+    started_at = time.perf_counter()
+    try:
+        await model.count_tokens_async("warm-up")
+        timings['connect_seconds'] = round(time.perf_counter() - started_at, 3)
+    except Exception as e:
+        timings['error'] = f"{type(e).__name__}: {e}"
+    return timings
@@ -1,18 +1,69 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 import asyncio
-from google.generativeai.types import GenerationConfig
+import os
 from fastapi import HTTPException
-from contract_generator import generate_contract_cascade
-
-load_dotenv()
-
-app = FastAPI()
+from contract_generator import generate_contract_batch, generate_contract_cascade, generate_contract_cascade_stream
+from contract_sections import (
+    apply_patches,
+    build_outline,
+    index_sections,
+    is_global_request,
+    parse_patch_response,
+    select_relevant_sections,
+)
+from session_store import create_session_store, make_message
+from model_pool import model_pool
+from result_cache import contract_cache, single_flight
+from streaming import coalesce_stream
+from compression import GZipJSONRoute
+from html_sanitizer import OFFLOAD_MIN_CHARS, sanitize_html_async
+from observability import MetricsMiddleware, render_metrics, tag_request, track_llm_call, usage_ledger
+from llm_scheduler import RateLimitExceeded, llm_scheduler
+from hedging import hedging
+from jobs import JobQueueFull, job_manager
+from llm_sdk import warm_up
+from conversation import Conversation
+from conversation_compactor import compactor, count_tokens
+from deal_sheet import deal_sheets
+from speculation import is_plain_confirmation, is_proceed_prompt, is_tool_call, speculation
+from document_store import Document, VersionConflict, document_store
+from token_budget import TokenBudgetExceeded, token_budget
+from contract_export import UnsupportedCharacters
+from export_pool import MEDIA_TYPES, exporter
+from clause_library import clause_library
+from settings import load_environment
+import json
+
+load_environment()
+
+async def run_warm_up():
+    timings = await warm_up(os.getenv("LLM_WARMUP_MODEL", "gemini-2.5-pro"))
+    print(f"🔥 Préchauffage du modèle : {timings}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Préchauffage optionnel (LLM_WARMUP=1) en tâche de fond : / répond sans attendre le SDK
+    warm_up_task = asyncio.create_task(run_warm_up()) if os.getenv("LLM_WARMUP", "0") == "1" else None
+    yield
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    # Arrêt : les workers des tâches de génération ne doivent pas survivre à la boucle
+    await job_manager.shutdown()
+    await deal_sheets.shutdown()
+    await speculation.shutdown()
+    await exporter.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Réponses JSON compressées route par route (contrats complets, documents, diffs) ; les flux (chat, SSE,
+# exports) ne passent pas par la compression, qui les mettrait en tampon
+app.router.route_class = GZipJSONRoute
 
 # Configuration du CORS pour autoriser les requêtes du frontend
 origins = [
@@ -23,6 +74,9 @@ origins = [
     "https://counselai-v2.onrender.com"
 ]
 
+# Durée de chaque requête (streaming compris), exposée sur /metrics
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -31,23 +85,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuration de l'API Gemini avec les variables d'environnement
-try:
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        raise ValueError("La clé d'API Gemini (GEMINI_API_KEY) n'est pas définie dans le fichier .env")
-    genai.configure(api_key=GEMINI_API_KEY)
-except Exception as e:
-    print(f"Erreur lors de la configuration de l'API Gemini : {e}")
+# Clé de l'API Gemini : le SDK est importé et configuré au premier appel au modèle (llm_sdk)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+if not GEMINI_API_KEY:
+    print("Erreur lors de la configuration de l'API Gemini : La clé d'API Gemini (GEMINI_API_KEY) n'est pas définie dans le fichier .env")
+
+# Conversations conservées côté serveur (en mémoire, ou SQLite si SESSION_DB_PATH est défini)
+session_store = create_session_store()
 
 class ChatRequest(BaseModel):
     text: str
-    history: list = []
+    history: Conversation = Field(default_factory=Conversation)
     model_name: str = "gemini-2.5-pro"  # Par défaut
+    session_id: Optional[str] = None  # Si fourni, l'historique est lu et complété côté serveur
 
 class GenerateLawyerResponseRequest(BaseModel):
-    history: list = []
+    history: Conversation = Field(default_factory=Conversation)
     model_name: str = "gemini-2.5-pro"
+    session_id: Optional[str] = None
+
+class CreateSessionRequest(BaseModel):
+    history: Conversation = Field(default_factory=Conversation)
+
+class DealSheetRequest(BaseModel):
+    history: Conversation = Field(default_factory=Conversation)
+    session_id: Optional[str] = None
 
 
 # The Master Prompt that guides the AI
@@ -93,59 +155,169 @@ CRITICAL RULES:
 5. The output should start with HTML tags (like <h1>, <p>, <div>, etc.)
 """
 
+CONTRACT_PATCH_PROMPT = """
+You are a legal document modification expert. You help lawyers modify contracts efficiently.
+
+You receive:
+1. The outline of an HTML legal document: one line per section, "[section_id] first words"
+2. The full HTML of the sections relevant to the request
+3. A modification request from the lawyer
+
+Your task is to apply the requested change with the smallest possible set of patches, preserving the HTML structure, styling and legal precision. Never return sections you do not change.
+
+Respond ONLY with JSON of this form:
+{"patches": [{"op": "replace" | "insert_before" | "insert_after" | "delete", "section_id": "s3", "html": "<p>...</p>"}], "message": "short summary of the change"}
+
+- "replace" gives the complete new HTML of the section; "delete" has no "html"
+- To add a clause, use "insert_after" on the section it should follow
+- If the request is advice rather than a change, return no patches and answer in "message"
+- If you cannot apply the change without seeing sections you were not given, return {"need_full_document": true}
+"""
+
+# Réponse JSON contrainte pour le protocole de patchs de /api/modify_contract
+PATCH_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+# Erreurs du chat écrites dans le flux : la réponse (HTTP 200) est déjà commencée quand elles surviennent
+CHAT_STREAM_ERRORS = ("Erreur critique inattendue", "Message trop long pour le modèle")
+
+def is_chat_error(reply: str) -> bool:
+    return any(marker in reply for marker in CHAT_STREAM_ERRORS)
+
 @app.get("/")
 def read_root():
     return {"status": "backend is running"}
 
-async def stream_generator(model, message_text):
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
     """
-    Générateur asynchrone qui produit les morceaux de la réponse de l'IA.
+    Métriques au format Prometheus : latences par endpoint et par étape, TTFT, tokens, erreurs.
     """
-    try:
-        # On active le streaming dans l'appel à l'API
-        stream = await model.generate_content_async(message_text, stream=True)
-        async for chunk in stream:
-            if chunk.text:
-                yield chunk.text
-                await asyncio.sleep(0.01) # Petite pause pour permettre l'envoi
-    except Exception as e:
-        print(f"Erreur pendant le streaming : {e}")
-        yield f"Erreur de communication avec le modèle d'IA : {e}"
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+def get_stats():
+    """
+    Compteurs des caches, du pool de modèles, de l'ordonnanceur, des tâches, de la compaction et de la bibliothèque de clauses.
+    """
+    return {
+        "model_pool": model_pool.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "hedging": hedging.stats(),
+        "jobs": job_manager.stats(),
+        "compaction": compactor.stats(),
+        "deal_sheets": deal_sheets.stats(),
+        "speculation": speculation.stats(),
+        "documents": document_store.stats(),
+        "exports": exporter.stats(),
+        "clause_library": clause_library.stats(),
+        "token_budget": token_budget.stats(),
+        "token_usage": usage_ledger.stats(),
+        "contract_cache": contract_cache.stats(),
+        "single_flight": single_flight.stats()
+    }
+
+async def resolve_history(history: Conversation, session_id: Optional[str]) -> Conversation:
+    """
+    Retourne l'historique de la session côté serveur si session_id est fourni,
+    sinon l'historique envoyé par le client (déjà validé à la lecture de la requête).
+    Lecture SQLite hors de la boucle d'événements
+    """
+    if session_id is None:
+        return history
+    session = await asyncio.to_thread(session_store.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session inconnue ou expirée")
+    # Tokens consommés par la requête imputés à la session
+    tag_request(session_id)
+    return Conversation.parse(session.history)
+
+def budget_exceeded(e: TokenBudgetExceeded) -> HTTPException:
+    return HTTPException(status_code=413, detail={
+        "message": str(e), "stage": e.stage, "prompt_tokens": e.prompt_tokens, "limit": e.limit
+    })
+
+@app.post("/api/sessions")
+def create_session(request: CreateSessionRequest):
+    """
+    Crée une conversation côté serveur, éventuellement initialisée avec un historique existant.
+    """
+    session = session_store.create(request.history.contents)
+    print(f"🗂️ Session créée: {session.id} ({len(session.history)} messages)")
+    return {"session_id": session.id, "length": len(session.history)}
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    history = await resolve_history(Conversation(), session_id)
+    return {"session_id": session_id, "history": history.contents, "length": len(history)}
+
+@app.get("/api/sessions/{session_id}/usage")
+async def get_session_usage(session_id: str):
+    """
+    Tokens consommés par la session, par étape (prompt, sortie, contexte en cache).
+    """
+    await resolve_history(Conversation(), session_id)
+    usage = usage_ledger.session(session_id) or {'calls': 0, 'prompt': 0, 'output': 0, 'cached': 0, 'stages': {}}
+    return {"session_id": session_id, **usage}
+
+@app.delete("/api/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session inconnue ou expirée")
+    return {"status": "deleted"}
+
+@app.post("/api/deal_sheet")
+async def get_deal_sheet(request: DealSheetRequest):
+    """
+    Fiche de l'opération (type de document, parties, termes clés, clauses, contexte).
+    Déjà tenue à jour après chaque tour de chat : seuls les messages non couverts sont extraits.
+    """
+    history = await resolve_history(request.history, request.session_id)
+    sheet = await deal_sheets.update(history)
+    return {"deal_sheet": sheet, "length": len(history)}
 
 @app.post("/api/generate_lawyer_response")
 async def generate_lawyer_response(request: GenerateLawyerResponseRequest):
     """
     Génère une réponse d'avocat simulée basée sur l'historique de la conversation.
     """
-    print(f"\n🔍 Historique reçu par le simulateur d'avocat:")
-    for i, msg in enumerate(request.history):
-        print(f"  [{i}] {msg['role']}: {msg['parts'][0]['text'][:100]}...")
+    history = await resolve_history(request.history, request.session_id)
+    print(f"\n🔍 Historique reçu par le simulateur d'avocat ({len(history)} messages), derniers messages:")
+    for i, message in enumerate(history[-3:], start=max(len(history) - 3, 0)):
+        print(f"  [{i}] {message.role}: {message.text[:100]}...")
     
     try:
-        # Utilise un modèle dédié avec le prompt du simulateur d'avocat
-        lawyer_model = genai.GenerativeModel(
-            model_name=request.model_name,
-            system_instruction=LAWYER_SIMULATOR_PROMPT
-        )
-        
-        chat_session = lawyer_model.start_chat(history=request.history)
         # On ne streame pas, on veut la réponse complète directement
-        # Extraire la dernière question de l'assistant
-        last_ai_question = None
-        for msg in reversed(request.history):
-            if msg['role'] == 'model':
-                last_ai_question = msg['parts'][0]['text']
-                break
+        # Dernière question de l'assistant
+        last_ai_question = history.last_model_text
         
         print(f"\n📝 Dernière question de l'assistant: {last_ai_question[:200]}...")
         
         prompt = f"Based on the conversation history, answer this specific question from the assistant: {last_ai_question}"
-        response = await chat_session.send_message_async(prompt)
+        # Historique borné au plafond de tokens (anciens messages résumés)
+        prompt_history = await compactor.compact(history, reserve_tokens=count_tokens(LAWYER_SIMULATOR_PROMPT + prompt))
+        plan = await token_budget.plan("lawyer", request.model_name, LAWYER_SIMULATOR_PROMPT, prompt_history.transcript, prompt)
+        
+        async def ask_lawyer(model_name: str):
+            # Utilise un modèle dédié avec le prompt du simulateur d'avocat
+            lawyer_model, remaining_history = await model_pool.get_with_context_cache(
+                model_name, LAWYER_SIMULATOR_PROMPT, prompt_history.contents, plan.generation_config()
+            )
+            chat_session = lawyer_model.start_chat(history=remaining_history)
+            return await chat_session.send_message_async(prompt)
+        
+        with track_llm_call("lawyer", request.model_name) as call:
+            response = await hedging.call("lawyer", request.model_name, ask_lawyer)
+            call.chunk(response.text)
+            call.usage(response)
         
         print(f"\n✅ Réponse générée: {response.text[:200]}...")
         
         return {"response": response.text}
 
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after), 1))})
+    except TokenBudgetExceeded as e:
+        raise budget_exceeded(e)
     except Exception as e:
         print(f"Erreur lors de la génération de la réponse de l'avocat : {e}")
         print(f"Type d'erreur: {type(e).__name__}")
@@ -153,14 +325,65 @@ async def generate_lawyer_response(request: GenerateLawyerResponseRequest):
         raise HTTPException(status_code=500, detail=f"Erreur interne du serveur: {str(e)}")
 
 class GenerateContractRequest(BaseModel):
-    history: list
+    history: Conversation = Field(default_factory=Conversation)
     model_name: str = "gemini-2.5-pro"
+    session_id: Optional[str] = None
+    html_renderer: Literal["local", "llm"] = "local"  # "llm" pour la mise en forme par Gemini
+    use_cache: bool = True  # False pour forcer une nouvelle génération
+    drafting_mode: Literal["single", "outline"] = "single"  # "outline" : plan puis sections en parallèle (hors SSE)
+
+class ContractVariant(BaseModel):
+    name: str
+    overrides: Dict[str, str] = {}  # ex. {"Buyer": "Beta GmbH", "Governing law": "English law"}
+
+class GenerateContractBatchRequest(GenerateContractRequest):
+    variants: List[ContractVariant]
+    max_concurrency: int = 4
+
+# Taille maximale d'un lot et concurrence maximale par lot
+MAX_BATCH_VARIANTS = int(os.getenv("MAX_BATCH_VARIANTS", "50"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("MAX_BATCH_CONCURRENCY", "8"))
 
 class ModifyContractRequest(BaseModel):
-    current_html: str
+    current_html: Optional[str] = None  # ou doc_id : le document est lu côté serveur
     modification_request: str
-    history: list = []
+    history: Conversation = Field(default_factory=Conversation)
     model_name: str = "gemini-2.5-pro"
+    mode: Literal["patch", "full"] = "patch"  # "full" pour renvoyer tout le document au modèle
+    doc_id: Optional[str] = None
+    base_version: Optional[int] = None  # version modifiée par le client (409 si elle n'est plus la dernière)
+
+class CreateDocumentRequest(BaseModel):
+    html: str
+
+class UndoRequest(BaseModel):
+    base_version: Optional[int] = None
+
+class ExportRequest(BaseModel):
+    format: Literal["pdf", "docx"] = "pdf"
+    html: Optional[str] = None          # contract_html, ou doc_id (et version) d'un document enregistré
+    doc_id: Optional[str] = None
+    version: Optional[int] = None
+    filename: str = "contrat"
+
+def speculation_options(model_name: str, html_renderer: str = "local", drafting_mode: str = "single") -> dict:
+    """Paramètres de cascade qu'une génération spéculative doit partager avec l'appel qui la réclame"""
+    return {"model_name": model_name, "html_renderer": html_renderer, "drafting_mode": drafting_mode}
+
+def start_speculative_generation(history: Conversation, model_name: str):
+    """Cascade lancée dès le résumé de l'assistant, avec les paramètres par défaut du frontend"""
+    speculation.start(history, speculation_options(model_name), lambda: generate_contract_cascade(
+        conversation_history=history,
+        api_key=GEMINI_API_KEY,
+        model_name=model_name
+    ))
+
+async def claim_speculative_generation(request: GenerateContractRequest, history: Conversation) -> Optional[dict]:
+    if not request.use_cache:
+        return None
+    return await speculation.claim(
+        history, speculation_options(request.model_name, request.html_renderer, request.drafting_mode)
+    )
 
 @app.post("/api/generate_contract")
 async def generate_contract(request: GenerateContractRequest):
@@ -168,45 +391,176 @@ async def generate_contract(request: GenerateContractRequest):
     Endpoint pour générer un contrat basé sur l'historique de conversation.
     Utilise l'architecture en cascade avec des LLMs spécialisés.
     """
-    print(f"🔥 /api/generate_contract appelé avec {len(request.history)} messages dans l'historique")
+    history = await resolve_history(request.history, request.session_id)
+    print(f"🔥 /api/generate_contract appelé avec {len(history)} messages dans l'historique")
     
     try:
-        # Utiliser la cascade de génération avec le modèle depuis l'environnement
-        print(f"🚀 Lancement de generate_contract_cascade...")
-        result = await generate_contract_cascade(
-            conversation_history=request.history,
-            api_key=GEMINI_API_KEY,
-            model_name=request.model_name
-        )
+        # Contrat déjà généré (ou en cours) depuis le résumé de l'assistant, sinon cascade de génération
+        result = await claim_speculative_generation(request, history)
+        if result is None:
+            print(f"🚀 Lancement de generate_contract_cascade...")
+            result = await generate_contract_cascade(
+                conversation_history=history,
+                api_key=GEMINI_API_KEY,
+                model_name=request.model_name,
+                html_renderer=request.html_renderer,
+                use_cache=request.use_cache,
+                drafting_mode=request.drafting_mode
+            )
         
+        # Document versionné : les modifications suivantes passent par doc_id et renvoient des diffs
+        document = await asyncio.to_thread(document_store.create, result['html'])
         return {
             "status": "success",
             "contract_markdown": result['markdown'],
             "contract_html": result['html'],
-            "extracted_data": result['data']
+            "extracted_data": result['data'],
+            "document": document_info(document)
         }
     
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after), 1))})
+    except TokenBudgetExceeded as e:
+        raise budget_exceeded(e)
     except Exception as e:
         print(f"Erreur lors de la génération du contrat : {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/modify_contract")
-async def modify_contract(request: ModifyContractRequest):
+@app.post("/api/generate_contract_stream")
+async def generate_contract_stream(request: GenerateContractRequest):
     """
-    Endpoint pour modifier un contrat existant basé sur les demandes de l'utilisateur.
-    Utilise le 4e assistant IA pour appliquer les modifications directement au HTML.
+    Variante streamée (SSE) de /api/generate_contract.
+    Émet le markdown au fil de la rédaction et les sections HTML dès qu'elles sont mises en forme.
     """
-    print(f"🔧 Modification request: {request.modification_request[:100]}...")
+    history = await resolve_history(request.history, request.session_id)
+    print(f"🔥 /api/generate_contract_stream appelé avec {len(history)} messages dans l'historique")
     
-    try:
-        # Créer un modèle avec le prompt de modification
-        modification_model = genai.GenerativeModel(
+    async def event_generator():
+        # Génération spéculative terminée ou en cours : même séquence qu'un contrat servi depuis le cache
+        speculative = await claim_speculative_generation(request, history)
+        if speculative is not None:
+            for event, data in (("markdown", {"text": speculative['markdown']}),
+                                ("html_section", {"index": 0, "html": speculative['html']}),
+                                ("done", speculative)):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            return
+        async for event in generate_contract_cascade_stream(
+            conversation_history=history,
+            api_key=GEMINI_API_KEY,
             model_name=request.model_name,
-            system_instruction=CONTRACT_MODIFICATION_PROMPT
-        )
-        
-        # Préparer le contexte pour l'assistant
-        context = f"""
+            html_renderer=request.html_renderer,
+            use_cache=request.use_cache
+        ):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        coalesce_stream(event_generator()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/generate_contract_batch")
+async def generate_contract_batch_endpoint(request: GenerateContractBatchRequest):
+    """
+    Lot de variantes d'un même contrat (contreparties, juridictions...) à partir d'une conversation.
+    Résultats en SSE au fil de l'eau : 'variant' ou 'variant_error' par variante terminée,
+    puis 'done' avec le débit du lot.
+    """
+    if not request.variants:
+        raise HTTPException(status_code=400, detail="Aucune variante fournie")
+    if len(request.variants) > MAX_BATCH_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Au plus {MAX_BATCH_VARIANTS} variantes par lot")
+    history = await resolve_history(request.history, request.session_id)
+    print(f"🔥 /api/generate_contract_batch appelé avec {len(history)} messages et {len(request.variants)} variantes")
+    
+    async def event_generator():
+        async for event in generate_contract_batch(
+            conversation_history=history,
+            api_key=GEMINI_API_KEY,
+            model_name=request.model_name,
+            variants=[variant.model_dump() for variant in request.variants],
+            html_renderer=request.html_renderer,
+            max_concurrency=min(max(request.max_concurrency, 1), MAX_BATCH_CONCURRENCY),
+            use_cache=request.use_cache,
+            drafting_mode=request.drafting_mode
+        ):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        coalesce_stream(event_generator()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/jobs/generate_contract", status_code=202)
+async def submit_contract_job(request: GenerateContractRequest):
+    """
+    Variante asynchrone de /api/generate_contract : retourne immédiatement un identifiant de tâche.
+    Suivi par GET /api/jobs/{job_id} ou en SSE par GET /api/jobs/{job_id}/events.
+    """
+    history = await resolve_history(request.history, request.session_id)
+    print(f"🔥 /api/jobs/generate_contract appelé avec {len(history)} messages dans l'historique")
+    
+    async def run(progress):
+        result = await claim_speculative_generation(request, history)
+        if result is None:
+            result = await generate_contract_cascade(
+                conversation_history=history,
+                api_key=GEMINI_API_KEY,
+                model_name=request.model_name,
+                html_renderer=request.html_renderer,
+                use_cache=request.use_cache,
+                on_progress=progress,
+                drafting_mode=request.drafting_mode
+            )
+        # Document versionné : les modifications suivantes passent par doc_id et renvoient des diffs
+        document = await asyncio.to_thread(document_store.create, result['html'])
+        return {
+            "status": "success",
+            "contract_markdown": result['markdown'],
+            "contract_html": result['html'],
+            "extracted_data": result['data'],
+            "document": document_info(document)
+        }
+    
+    try:
+        job = job_manager.submit("generate_contract", run)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"File de génération pleine ({e})", headers={"Retry-After": "30"})
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tâche inconnue ou expirée")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/events")
+async def follow_job(job_id: str):
+    """
+    Progression d'une tâche en SSE : un événement 'progress' par étape (queued, started,
+    drafting, formatting), puis 'done' avec le résultat complet ou 'error'.
+    """
+    if await job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Tâche inconnue ou expirée")
+    
+    async def event_generator():
+        async for event, data in job_manager.follow(job_id):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def modify_contract_full(request: ModifyContractRequest) -> dict:
+    """
+    Modification en mode document complet : le modèle reçoit et renvoie tout le HTML.
+    """
+    # Préparer le contexte pour l'assistant
+    context = f"""
 Current HTML Document:
 {request.current_html}
 
@@ -215,38 +569,264 @@ Modification Request:
 
 Remember: Return ONLY the modified HTML, no explanations.
 """
-        
-        # Générer la réponse
-        response = await modification_model.generate_content_async(context)
-        modified_html = response.text.strip()
-        
-        print(f"📝 Modification request: {request.modification_request}")
-        print(f"📄 Response length: {len(modified_html)} characters")
-        print(f"📄 Response preview: {modified_html[:200]}...")
-        
-        # Vérifier si la réponse contient du HTML
-        if '<' in modified_html and '>' in modified_html:
-            # Nettoyer le HTML si nécessaire
-            if '<body' in modified_html.lower():
-                # Extraire seulement le contenu du body
-                import re
-                body_match = re.search(r'<body[^>]*>(.*)</body>', modified_html, re.DOTALL | re.IGNORECASE)
-                if body_match:
-                    modified_html = body_match.group(1)
-            
-            print(f"✅ HTML modification successful")
-            return {
-                "response": "✓ Document updated successfully",
-                "modified_html": modified_html
-            }
-        else:
-            # Si pas de HTML, c'est que l'IA a donné des conseils au lieu de modifier
-            print(f"⚠️ No HTML in response, returning advice instead")
+    
+    # Sortie plafonnée ; un document trop long pour la fenêtre est refusé avant l'appel
+    plan = await token_budget.plan("modify", request.model_name, CONTRACT_MODIFICATION_PROMPT, context)
+    
+    # Générer la réponse
+    with track_llm_call("modify", request.model_name) as call:
+        # Modèle avec le prompt de modification
+        response = await hedging.call("modify", request.model_name, lambda name: model_pool.get(
+            name, CONTRACT_MODIFICATION_PROMPT, plan.generation_config()
+        ).generate_content_async(context))
+        call.chunk(response.text)
+        call.usage(response)
+    modified_html, sanitizer = await sanitize_html_async(response.text)
+    
+    print(f"📝 Modification request: {request.modification_request}")
+    print(f"📄 Response length: {len(response.text)} characters")
+    print(f"📄 Response preview: {response.text[:200]}...")
+    
+    # Vérifier si la réponse contient du HTML (déjà réduit au contenu du body)
+    if sanitizer.saw_markup:
+        if sanitizer.issues:
+            print(f"⚠️ Structure HTML corrigée : {sanitizer.issues[:5]}")
+        print(f"✅ HTML modification successful")
+        return {
+            "response": "✓ Document updated successfully",
+            "modified_html": modified_html
+        }
+    else:
+        # Si pas de HTML, c'est que l'IA a donné des conseils au lieu de modifier
+        print(f"⚠️ No HTML in response, returning advice instead")
+        return {
+            "response": response.text.strip(),
+            "modified_html": None
+        }
+
+async def modify_contract_with_patches(request: ModifyContractRequest) -> Optional[dict]:
+    """
+    Modification en mode patch : seules les sections pertinentes sont envoyées au modèle,
+    qui répond par des patchs ciblés appliqués ici. Retourne None pour basculer en mode complet.
+    """
+    if is_global_request(request.modification_request):
+        print(f"🌐 Demande globale, passage en mode document complet")
+        return None
+    
+    sections = index_sections(request.current_html)
+    relevant = select_relevant_sections(sections, request.modification_request)
+    print(f"🧩 {len(sections)} sections indexées, {len(relevant)} envoyées au modèle")
+    
+    relevant_html = "\n\n".join(f'<!-- section {section.id} -->\n{section.html}' for section in relevant)
+    context = f"""
+Document outline:
+{build_outline(sections)}
+
+Relevant sections:
+{relevant_html or "(none matched, use the outline to choose where to insert)"}
+
+Modification Request:
+{request.modification_request}
+"""
+    
+    try:
+        plan = await token_budget.plan("modify_patch", request.model_name, CONTRACT_PATCH_PROMPT, context)
+    except TokenBudgetExceeded as e:
+        print(f"⚠️ {e}, passage en mode document complet")
+        return None
+    
+    with track_llm_call("modify_patch", request.model_name) as call:
+        response = await hedging.call(
+            "modify_patch", request.model_name,
+            lambda name: model_pool.get(
+                name, CONTRACT_PATCH_PROMPT, plan.generation_config(PATCH_GENERATION_CONFIG)
+            ).generate_content_async(context)
+        )
+        call.chunk(response.text)
+        call.usage(response)
+    try:
+        data = parse_patch_response(response.text)
+        if data.get("need_full_document"):
+            print(f"📄 Le modèle demande le document complet")
+            return None
+        patches = data.get("patches", [])
+        if not patches:
+            # Pas de patch : l'IA a donné des conseils au lieu de modifier
             return {
-                "response": modified_html,
+                "response": data.get("message") or "No change was applied to the document.",
                 "modified_html": None
             }
+        editable = [section.id for section in relevant]
+        if len(response.text) < OFFLOAD_MIN_CHARS:
+            modified_html = apply_patches(sections, patches, editable=editable)
+        else:
+            # Fragments volumineux : nettoyage et assemblage hors de la boucle d'événements
+            modified_html = await asyncio.to_thread(apply_patches, sections, patches, editable)
+    except ValueError as e:
+        # json.JSONDecodeError hérite de ValueError
+        print(f"⚠️ Patchs inexploitables ({e}), passage en mode document complet")
+        return None
+    
+    print(f"✅ {len(patches)} patch(s) appliqué(s)")
+    return {
+        "response": data.get("message") or "✓ Document updated successfully",
+        "modified_html": modified_html,
+        "patched_sections": sorted({patch["section_id"] for patch in patches})
+    }
+
+def document_info(document: Document) -> dict:
+    return {"doc_id": document.id, "version": document.version, "hash": document.hash}
+
+def version_conflict(e: VersionConflict) -> HTTPException:
+    return HTTPException(status_code=409, detail={"message": str(e), **document_info(e.current)})
+
+async def resolve_document(doc_id: str, base_version: Optional[int] = None) -> Document:
+    """Dernière version du document ; 404 s'il est inconnu, 409 si le client modifie une version périmée"""
+    try:
+        document = await asyncio.to_thread(document_store.get, doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Document inconnu ou expiré")
+    if base_version is not None and base_version != document.version:
+        raise version_conflict(VersionConflict(doc_id, base_version, document))
+    return document
+
+async def commit_modification(document: Document, modification_request: str, result: dict) -> dict:
+    """
+    Réponse en mode document : nouvelle version et diff depuis la version de base, sans le HTML complet
+    diff est None quand le modèle a répondu par un conseil sans modifier le document
+    """
+    modified_html = result.pop("modified_html")
+    response = {**result, "base_version": document.version}
+    if modified_html is None:
+        return {**response, **document_info(document), "diff": None}
+    updated, diff = await asyncio.to_thread(document_store.commit, document.id, modified_html,
+                                            document.version, "modified", modification_request[:200])
+    print(f"🗃️ Document {document.id} : version {updated.version}, diff de {len(json.dumps(diff))} caractères")
+    return {**response, **document_info(updated), "diff": diff}
+
+@app.post("/api/documents")
+async def create_document(request: CreateDocumentRequest):
+    """
+    Enregistre un document existant (généré avant le stockage versionné) pour le modifier par doc_id.
+    """
+    return document_info(await asyncio.to_thread(document_store.create, request.html, "uploaded"))
+
+@app.get("/api/documents/{doc_id}")
+async def get_document(doc_id: str, version: Optional[int] = None):
+    """
+    Contenu complet d'une version (la dernière par défaut), reconstruit à partir des deltas.
+    """
+    try:
+        document = await asyncio.to_thread(document_store.get, doc_id, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Document ou version inconnu")
+    return {**document_info(document), "html": document.html}
+
+@app.get("/api/documents/{doc_id}/versions")
+async def list_document_versions(doc_id: str):
+    try:
+        versions = await asyncio.to_thread(document_store.versions, doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Document inconnu ou expiré")
+    return {"doc_id": doc_id, "versions": [asdict(version) for version in versions]}
+
+@app.post("/api/documents/{doc_id}/undo")
+async def undo_document(doc_id: str, request: UndoRequest):
+    """
+    Annule la dernière modification : nouvelle version reprenant la précédente, avec le diff à appliquer.
+    """
+    document = await resolve_document(doc_id, request.base_version)
+    if document.version == 1:
+        raise HTTPException(status_code=409, detail={"message": "Aucune modification à annuler", **document_info(document)})
+    try:
+        restored, diff = await asyncio.to_thread(document_store.restore, doc_id, document.version - 1, document.version)
+    except VersionConflict as e:
+        raise version_conflict(e)
+    except KeyError:
+        raise HTTPException(status_code=410, detail="Version précédente plus conservée")
+    return {**document_info(restored), "base_version": document.version, "diff": diff}
+
+async def export_response(html: str, export_format: str, filename: str) -> StreamingResponse:
+    """
+    Fichier rendu dans le pool d'export (ou lu dans son cache), renvoyé par morceaux (PDF et DOCX sont déjà compressés)
+    """
+    try:
+        data = await exporter.export(html, export_format)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Rendu de l'export trop long")
+    except UnsupportedCharacters as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        print(f"Erreur lors de l'export {export_format} : {e}")
+        raise HTTPException(status_code=500, detail="Erreur lors de l'export")
+    
+    chunk_bytes = exporter.config.chunk_bytes
+    async def chunks():
+        for start in range(0, len(data), chunk_bytes):
+            yield data[start:start + chunk_bytes]
+    
+    safe_name = "".join(char for char in filename if char.isalnum() or char in "-_ ").strip() or "contrat"
+    return StreamingResponse(chunks(), media_type=MEDIA_TYPES[export_format], headers={
+        "Content-Disposition": f'attachment; filename="{safe_name}.{export_format}"',
+        "Content-Length": str(len(data)),
+    })
+
+@app.post("/api/export")
+async def export_contract(request: ExportRequest):
+    """
+    Export PDF ou DOCX du contrat : HTML fourni (contract_html) ou document enregistré (doc_id).
+    """
+    if request.doc_id is not None:
+        try:
+            document = await asyncio.to_thread(document_store.get, request.doc_id, request.version)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Document ou version inconnu")
+        html = document.html
+    elif request.html is not None:
+        html = request.html
+    else:
+        raise HTTPException(status_code=400, detail="html ou doc_id requis")
+    return await export_response(html, request.format, request.filename)
+
+@app.get("/api/documents/{doc_id}/export")
+async def export_document(doc_id: str, format: Literal["pdf", "docx"] = "pdf", version: Optional[int] = None):
+    """
+    Variante GET pour un lien de téléchargement direct.
+    """
+    return await export_contract(ExportRequest(format=format, doc_id=doc_id, version=version))
+
+@app.post("/api/modify_contract")
+async def modify_contract(request: ModifyContractRequest):
+    """
+    Endpoint pour modifier un contrat existant basé sur les demandes de l'utilisateur.
+    Utilise le 4e assistant IA pour appliquer les modifications directement au HTML.
+    Par défaut, seules les sections concernées sont transmises et modifiées (mode "patch").
+    """
+    print(f"🔧 Modification request: {request.modification_request[:100]}...")
+    
+    document = None
+    if request.doc_id is not None:
+        document = await resolve_document(request.doc_id, request.base_version)
+        request = request.model_copy(update={"current_html": document.html})
+    elif request.current_html is None:
+        raise HTTPException(status_code=400, detail="current_html ou doc_id requis")
+    
+    try:
+        result = None
+        if request.mode == "patch":
+            result = await modify_contract_with_patches(request)
+        if result is None:
+            result = await modify_contract_full(request)
+        if document is not None:
+            return await commit_modification(document, request.modification_request, result)
+        return result
         
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after), 1))})
+    except TokenBudgetExceeded as e:
+        raise budget_exceeded(e)
+    except VersionConflict as e:
+        raise version_conflict(e)
     except Exception as e:
         print(f"Erreur lors de la modification du contrat : {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -255,23 +835,29 @@ Remember: Return ONLY the modified HTML, no explanations.
 async def chat(request: ChatRequest):
     """
     Endpoint de chat qui gère la logique du Master Prompt, des outils, et de l'historique.
+    Avec un session_id, l'historique est lu côté serveur et le nouveau tour y est ajouté.
     """
+    history = await resolve_history(request.history, request.session_id)
+    
     async def stream_response_generator():
         try:
-            model = genai.GenerativeModel(
-                model_name=request.model_name,
-                system_instruction=MASTER_PROMPT
+            # Historique complet (validé à la lecture de la requête) conservé pour la fiche de l'opération
+            full_history = history
+            # Historique borné au plafond de tokens : résumé glissant des anciens messages, derniers tours intacts
+            prompt_history = await compactor.compact(
+                full_history, reserve_tokens=count_tokens(MASTER_PROMPT + request.text)
+            )
+            plan = await token_budget.plan(
+                "chat", request.model_name, MASTER_PROMPT, prompt_history.transcript, request.text
             )
             
-            # Valider et nettoyer l'historique
-            cleaned_history = []
-            for msg in request.history:
-                if isinstance(msg, dict) and 'role' in msg and 'parts' in msg:
-                    cleaned_history.append(msg)
-                else:
-                    print(f"⚠️ Message mal formé dans l'historique: {msg}")
-            
-            chat_session = model.start_chat(history=cleaned_history)
+            async def open_chat(model_name: str):
+                # Modèle partagé, construit sur le contexte mis en cache si le préfixe de conversation l'est
+                model, remaining_history = await model_pool.get_with_context_cache(
+                    model_name, MASTER_PROMPT, prompt_history.contents, plan.generation_config()
+                )
+                chat_session = model.start_chat(history=remaining_history)
+                return await chat_session.send_message_async(request.text, stream=True)
             
             # Affichage sécurisé du message avec gestion des caractères spéciaux
             try:
@@ -280,63 +866,85 @@ async def chat(request: ChatRequest):
             except Exception as e:
                 print(f"\n📨 Message reçu (impossible d'afficher le preview): {e}")
             
-            # Vérifier si c'est une confirmation pour générer le document
-            confirmation_keywords = ["yes", "proceed", "go ahead", "please generate", "confirmed", "correct", "accurate"]
-            user_text_lower = request.text.lower()
-            is_confirmation = any(keyword in user_text_lower for keyword in confirmation_keywords)
-            
-            if is_confirmation:
-                print(f"✅ Confirmation détectée! Vérification du contexte...")
-                # Vérifier si on a assez d'infos dans l'historique
-                has_summary = False
-                for msg in request.history:
-                    if msg.get('role') == 'model':
-                        parts = msg.get('parts', [])
-                        if parts and len(parts) > 0 and isinstance(parts[0], dict):
-                            text = parts[0].get('text', '')
-                            if 'shall we proceed' in text.lower():
-                                has_summary = True
-                                break
-                if has_summary:
-                    print(f"📋 Résumé trouvé dans l'historique, activation de l'outil...")
+            # Réponse au résumé de l'assistant : la génération spéculative n'est acquise que si le modèle
+            # appelle l'outil de génération ; toute autre réponse (de l'avocat ou du modèle) l'abandonne
+            awaiting_confirmation = (
+                bool(full_history) and full_history[-1].role == 'model' and is_proceed_prompt(full_history[-1].text)
+            )
+            if awaiting_confirmation and not is_plain_confirmation(request.text):
+                speculation.discard(full_history)
+                awaiting_confirmation = False
             
-            response = await chat_session.send_message_async(request.text, stream=True)
-
-            # Boucle de streaming unique et propre pour corriger le bug de répétition.
-            async for chunk in response:
-                try:
-                    # Vérifier d'abord les appels de fonction
-                    if hasattr(chunk, 'candidates') and chunk.candidates and len(chunk.candidates) > 0:
-                        candidate = chunk.candidates[0]
-                        if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
-                            for part in candidate.content.parts:
-                                if hasattr(part, 'function_call') and part.function_call:
-                                    tool_name = part.function_call.name
-                                    print(f"🛠️ Détection d'un appel à l'outil : {tool_name}")
-                                    yield f"TOOL_CALL:{tool_name}"
-                                    return  # Arrêter le streaming après l'appel d'outil
-                    
-                    # Ensuite vérifier le texte
-                    if hasattr(chunk, 'text'):
+            with track_llm_call("chat", request.model_name) as call:
+                # Premier token en retard : couverture ; échec : reprise sur le modèle de secours
+                async with hedging.stream("chat", request.model_name, open_chat) as response:
+                    reply_parts = []
+
+                    # Boucle de streaming unique et propre pour corriger le bug de répétition.
+                    async for chunk in response:
                         try:
-                            text = chunk.text
-                            if text:
-                                yield text
-                                await asyncio.sleep(0.01)
-                        except Exception as text_error:
+                            # Vérifier d'abord les appels de fonction
+                            if hasattr(chunk, 'candidates') and chunk.candidates and len(chunk.candidates) > 0:
+                                candidate = chunk.candidates[0]
+                                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
+                                    for part in candidate.content.parts:
+                                        if hasattr(part, 'function_call') and part.function_call:
+                                            tool_name = part.function_call.name
+                                            print(f"🛠️ Détection d'un appel à l'outil : {tool_name}")
+                                            if awaiting_confirmation and speculation.confirm(full_history):
+                                                print("✅ Confirmation du résumé : génération spéculative acquise")
+                                            if request.session_id is not None:
+                                                await asyncio.to_thread(session_store.append, request.session_id,
+                                                                        make_message('user', request.text))
+                                            yield f"TOOL_CALL:{tool_name}"
+                                            return  # Arrêter le streaming après l'appel d'outil
+                    
+                            # Ensuite vérifier le texte
+                            if hasattr(chunk, 'text'):
+                                try:
+                                    text = chunk.text
+                                    if text:
+                                        call.chunk(text)
+                                        reply_parts.append(text)
+                                        yield text
+                                except Exception as text_error:
+                                    # Log l'erreur mais continuer le streaming
+                                    print(f"⚠️ Erreur lors du traitement du texte: {text_error}")
+                                    print(f"   Type de chunk: {type(chunk)}")
+                                    print(f"   Chunk complet: {chunk}")
+                        except Exception as chunk_error:
                             # Log l'erreur mais continuer le streaming
-                            print(f"⚠️ Erreur lors du traitement du texte: {text_error}")
+                            print(f"⚠️ Erreur lors du traitement du chunk: {chunk_error}")
                             print(f"   Type de chunk: {type(chunk)}")
-                            print(f"   Chunk complet: {chunk}")
-                except Exception as chunk_error:
-                    # Log l'erreur mais continuer le streaming
-                    print(f"⚠️ Erreur lors du traitement du chunk: {chunk_error}")
-                    print(f"   Type de chunk: {type(chunk)}")
-                    try:
-                        print(f"   Chunk complet: {chunk}")
-                    except:
-                        print("   Impossible d'afficher le chunk")
-
+                            try:
+                                print(f"   Chunk complet: {chunk}")
+                            except:
+                                print("   Impossible d'afficher le chunk")
+                    call.usage(response)
+            
+            # Enregistrer le tour complet dans la session serveur
+            reply = "".join(reply_parts)
+            if awaiting_confirmation:
+                if is_tool_call(reply):
+                    speculation.confirm(full_history)
+                else:
+                    speculation.discard(full_history)
+            turn = [make_message('user', request.text), make_message('model', reply)]
+            if request.session_id is not None:
+                await asyncio.to_thread(session_store.append, request.session_id, *turn)
+            
+            # Fiche de l'opération mise à jour en tâche de fond avec ce seul tour
+            updated_history = full_history + turn
+            deal_sheets.schedule(updated_history)
+            
+            # Résumé présenté : le contrat est généré pendant que l'avocat relit
+            if is_proceed_prompt(reply):
+                start_speculative_generation(updated_history, request.model_name)
+
+        except TokenBudgetExceeded as e:
+            # Réponse déjà commencée : le refus est signalé dans le flux
+            print(f"⚠️ {e}")
+            yield f"Message trop long pour le modèle ({e.prompt_tokens} tokens, limite {e.limit})."
         except Exception as e:
             import traceback
             error_details = traceback.format_exc()
@@ -351,4 +959,4 @@ async def chat(request: ChatRequest):
             error_msg = error_msg.replace('\n', ' ').replace('\r', ' ')
             yield error_msg
 
-    return StreamingResponse(stream_response_generator(), media_type="text/plain") 
\ No newline at end of file
+    return StreamingResponse(coalesce_stream(stream_response_generator()), media_type="text/plain") 
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Rendu local et déterministe du markdown des contrats en HTML
+Alternative instantanée à l'étape de mise en forme par LLM de la cascade
+"""
+import html
+import re
+from typing import List, Optional, Tuple
+
+# Styles en ligne : le frontend n'applique aucune feuille de style au contenu du contrat
+STYLES = {
+    'h1': "text-align: center; font-size: 1.6em; text-transform: uppercase; margin: 0 0 1.5em;",
+    'h2': "font-size: 1.2em; margin: 1.8em 0 0.8em;",
+    'h3': "font-size: 1.05em; margin: 1.4em 0 0.6em;",
+    'h4': "font-size: 1em; margin: 1.2em 0 0.5em;",
+    'p': "text-align: justify; line-height: 1.6; margin: 0 0 1em;",
+    'list': "line-height: 1.6; margin: 0 0 1em; padding-left: 2em;",
+    'blockquote': "margin: 0 0 1em 2em; font-style: italic;",
+    'table': "border-collapse: collapse; width: 100%; margin: 0 0 1em;",
+    'cell': "border: 1px solid #444; padding: 6px 10px; vertical-align: top;",
+    'hr': "border: none; border-top: 1px solid #999; margin: 2em 0;",
+}
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+HR_RE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+UNORDERED_ITEM_RE = re.compile(r'^\s*[-*+]\s+(.*)$')
+ORDERED_ITEM_RE = re.compile(r'^\s*(\d+|[a-zA-Z])[.)]\s+(.*)$')
+BLOCKQUOTE_RE = re.compile(r'^\s*>\s?(.*)$')
+TABLE_ROW_RE = re.compile(r'^\s*\|.*\|\s*$')
+TABLE_SEPARATOR_RE = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+# Les soulignés sont laissés tels quels : ce sont les lignes de signature ("________")
+BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+ITALIC_RE = re.compile(r'(?<![*\w])\*(?=\S)([^*]+?)(?<=\S)\*(?![*\w])')
+CODE_FENCE_RE = re.compile(r'^\s*```')
+# Lettre isolée qui est plutôt un chiffre romain ("I. DEFINITIONS") quand elle n'en suit pas une autre
+ROMAN_LETTERS = frozenset("IVXivx")
+
+
+def render_inline(text: str) -> str:
+    """Échappe le texte et applique le gras et l'italique"""
+    text = html.escape(text, quote=False)
+    text = BOLD_RE.sub(r'<strong>\1</strong>', text)
+    return ITALIC_RE.sub(r'<em>\1</em>', text)
+
+
+def _split_table_row(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+class _Renderer:
+    """Parseur par blocs, en une seule passe sur les lignes"""
+
+    def __init__(self):
+        self.out: List[str] = []
+        self.paragraph: List[str] = []
+        self.list_tag: Optional[str] = None
+        self.list_kind: Optional[str] = None  # 'ul', '1', 'a' ou 'A'
+        self.list_next = 0                    # numéro attendu de l'élément suivant
+        self.quote: List[str] = []
+        self.table: List[List[str]] = []
+
+    def render(self, markdown: str) -> str:
+        for line in markdown.splitlines():
+            self._line(line)
+        self._close_blocks()
+        return "\n".join(self.out)
+
+    def _line(self, line: str):
+        stripped = line.strip()
+
+        # Les LLM encadrent parfois le contrat dans un bloc de code : on ignore les clôtures
+        if CODE_FENCE_RE.match(line):
+            return
+        if not stripped:
+            # Une liste reste ouverte : "1. ...", ligne vide, "2. ..." forment une seule liste
+            self._close_blocks(keep='list')
+            return
+
+        if self.table and TABLE_SEPARATOR_RE.match(line):
+            return
+        if TABLE_ROW_RE.match(line):
+            self._close_blocks(keep='table')
+            self.table.append(_split_table_row(line))
+            return
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            self._close_blocks()
+            level = min(len(heading.group(1)), 4)
+            self.out.append(f'<h{level} style="{STYLES[f"h{level}"]}">{render_inline(heading.group(2))}</h{level}>')
+            return
+
+        if HR_RE.match(line):
+            self._close_blocks()
+            self.out.append(f'<hr style="{STYLES["hr"]}">')
+            return
+
+        quote = BLOCKQUOTE_RE.match(line)
+        if quote:
+            self._close_blocks(keep='quote')
+            self.quote.append(render_inline(quote.group(1)))
+            return
+
+        unordered = UNORDERED_ITEM_RE.match(line)
+        ordered = None if unordered else ORDERED_ITEM_RE.match(line)
+        kind, number = ('ul', 0) if unordered else self._ordered_marker(ordered)
+        if kind is not None:
+            if self.list_kind != kind:
+                self._close_blocks()
+                self.list_tag, self.list_kind = ('ul' if kind == 'ul' else 'ol'), kind
+                attributes = f' type="{kind}"' if kind in ('a', 'A') else ''
+                if number > 1:
+                    attributes += f' start="{number}"'
+                self.out.append(f'<{self.list_tag}{attributes} style="{STYLES["list"]}">')
+            self.list_next = number + 1
+            item = unordered.group(1) if unordered else ordered.group(2)
+            self.out.append(f'<li>{render_inline(item)}</li>')
+            return
+
+        # Ligne de continuation d'un élément de liste
+        if self.list_tag and line[:1].isspace() and self.out[-1].endswith('</li>'):
+            self.out[-1] = self.out[-1][:-5] + '<br>' + render_inline(stripped) + '</li>'
+            return
+
+        self._close_blocks(keep='paragraph')
+        self.paragraph.append(render_inline(stripped))
+
+    def _close_blocks(self, keep: Optional[str] = None):
+        if keep != 'paragraph' and self.paragraph:
+            # Les retours à la ligne simples sont conservés (blocs de signature, adresses)
+            self.out.append(f'<p style="{STYLES["p"]}">' + '<br>\n'.join(self.paragraph) + '</p>')
+            self.paragraph = []
+        if keep != 'list' and self.list_tag:
+            self.out.append(f'</{self.list_tag}>')
+            self.list_tag = self.list_kind = None
+        if keep != 'quote' and self.quote:
+            self.out.append(f'<blockquote style="{STYLES["blockquote"]}">' + '<br>\n'.join(self.quote) + '</blockquote>')
+            self.quote = []
+        if keep != 'table' and self.table:
+            self._emit_table()
+
+    def _ordered_marker(self, ordered: Optional[re.Match]) -> Tuple[Optional[str], int]:
+        """(type de liste, numéro) de l'élément, ou (None, 0) si la ligne n'est pas un élément de liste"""
+        if ordered is None:
+            return None, 0
+        marker = ordered.group(1)
+        if marker.isdigit():
+            return '1', int(marker)
+        kind, number = ('a' if marker.islower() else 'A'), ord(marker.lower()) - ord('a') + 1
+        if marker in ROMAN_LETTERS and not (self.list_kind == kind and self.list_next == number):
+            return None, 0
+        return kind, number
+
+    def _emit_table(self):
+        header, *rows = self.table
+        cells = "".join(f'<th style="{STYLES["cell"]}">{render_inline(c)}</th>' for c in header)
+        parts = [f'<table style="{STYLES["table"]}">', f'<tr>{cells}</tr>']
+        for row in rows:
+            cells = "".join(f'<td style="{STYLES["cell"]}">{render_inline(c)}</td>' for c in row)
+            parts.append(f'<tr>{cells}</tr>')
+        parts.append('</table>')
+        self.out.append("\n".join(parts))
+        self.table = []
+
+
+def render_markdown_to_html(markdown: str) -> str:
+    """
+    Convertit le markdown d'un contrat en fragment HTML mis en forme
+    Même structure que la sortie nettoyée de format_to_html (pas de <html>/<head>/<body>)
+    """
+    return _Renderer().render(markdown)
@@ -0,0 +1,285 @@
+"""
+Pool de modèles Gemini partagé entre les requêtes
+Évite de reconstruire un GenerativeModel (et son prompt système) à chaque appel,
+et met en cache côté fournisseur les préfixes statiques et les longues conversations
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from llm_sdk import configure_once, genai
+from fake_llm import FakeGenerativeModel, FakeLLMConfig
+from settings import LazySingleton
+
+# Modèles servis par le pool ; LLM_KNOWN_MODELS (séparés par des virgules) en ajoute.
+# Le nom du modèle vient du client : seuls ceux-ci deviennent des labels de métriques, les autres sont regroupés
+KNOWN_MODELS = frozenset((
+    "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite",
+    "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash",
+    *(name.strip() for name in os.getenv("LLM_KNOWN_MODELS", "").split(",") if name.strip()),
+))
+
+# Réflexion maximale des modèles "thinking" : le SDK ne permet pas de la borner, et elle est décomptée
+# de max_output_tokens (un plafond trop juste donne une réponse vide ou tronquée)
+THINKING_TOKENS = {
+    "gemini-2.5-pro": 32_768,
+    "gemini-2.5-flash": 24_576,
+    "gemini-2.5-flash-lite": 24_576,
+}
+
+
+def thinking_tokens(model_name: str) -> int:
+    return THINKING_TOKENS.get(model_name[len("models/"):] if model_name.startswith("models/") else model_name, 0)
+
+
+@dataclass
+class _ContextCacheEntry:
+    """Un contexte mis en cache par l'API (prompt système + préfixe de conversation)"""
+    cached_content: Any
+    expires_at: float
+
+
+def _estimate_tokens(text: str) -> int:
+    # Estimation grossière (≈ 4 caractères par token) suffisante pour le seuil de mise en cache
+    return len(text) // 4
+
+
+class ModelPool:
+    """
+    Handles GenerativeModel indexés par (modèle × prompt système × config), avec éviction LRU,
+    et mise en cache explicite des contextes (API caching de Gemini) avec compteurs hit/miss
+    """
+
+    def __init__(self, max_models: int = 64, context_cache: bool = False,
+                 min_cache_tokens: int = 4096, cache_ttl_seconds: int = 3600,
+                 backend: str = "gemini", fake_config: Optional[FakeLLMConfig] = None,
+                 max_contexts: int = 256, sweep_interval: float = 60.0):
+        self.max_models = max_models
+        self.max_contexts = max_contexts      # contextes conservés ; au-delà, le moins récent est supprimé chez le fournisseur
+        self.sweep_interval = sweep_interval  # purge périodique des contextes expirés
+        self.backend = backend
+        self.fake_config = fake_config
+        self.context_cache = context_cache
+        self.min_cache_tokens = min_cache_tokens
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._models: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._contexts: "OrderedDict[str, _ContextCacheEntry]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._uncacheable: "OrderedDict[str, None]" = OrderedDict()
+        self._deletions: Set[asyncio.Task] = set()
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self.counters = {
+            'model_hits': 0,
+            'model_misses': 0,
+            'context_hits': 0,
+            'context_misses': 0,
+            'context_created': 0,
+            'context_failures': 0,
+            'context_evictions': 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ModelPool":
+        """
+        GEMINI_CONTEXT_CACHE=1 active la mise en cache de contexte côté fournisseur
+        (GEMINI_CONTEXT_CACHE_MIN_TOKENS, _TTL_SECONDS, _MAX_ENTRIES)
+        LLM_BACKEND=fake remplace Gemini par le backend simulé (tests, benchmarks)
+        """
+        backend = os.getenv("LLM_BACKEND", "gemini")
+        return cls(
+            max_models=int(os.getenv("MODEL_POOL_MAX_MODELS", "64")),
+            context_cache=os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1",
+            min_cache_tokens=int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "4096")),
+            cache_ttl_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600")),
+            max_contexts=int(os.getenv("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", "256")),
+            backend=backend,
+            fake_config=FakeLLMConfig.from_env() if backend == "fake" else None,
+        )
+
+    def set_backend(self, backend: str, fake_config: Optional[FakeLLMConfig] = None):
+        """Bascule entre "gemini" et "fake" ; les handles existants sont abandonnés"""
+        if backend not in ("gemini", "fake"):
+            raise ValueError(f"Backend LLM inconnu : {backend}")
+        with self._lock:
+            self.backend = backend
+            self.fake_config = (fake_config or FakeLLMConfig()) if backend == "fake" else None
+            self._models.clear()
+            self._contexts.clear()
+
+    def get(self, model_name: str, system_instruction: Optional[str] = None,
+            generation_config: Any = None) -> Any:
+        """Retourne le handle partagé pour ce couple modèle × prompt système"""
+        key = (model_name, system_instruction or "", repr(generation_config))
+        if self.backend == "fake":
+            return self._get_or_build(key, lambda: FakeGenerativeModel(
+                model_name=model_name,
+                system_instruction=system_instruction,
+                generation_config=generation_config,
+                config=self.fake_config
+            ))
+        # Premier modèle Gemini du processus : import et configuration du SDK
+        configure_once()
+        return self._get_or_build(key, lambda: genai.GenerativeModel(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            generation_config=generation_config
+        ))
+
+    async def get_with_context_cache(self, model_name: str, system_instruction: Optional[str],
+                                     history: List[Dict], generation_config: Any = None) -> Tuple[Any, List[Dict]]:
+        """
+        Retourne (modèle, historique restant à envoyer)
+        Si un contexte mis en cache couvre le prompt système et un préfixe de l'historique,
+        le modèle est construit dessus et seul le reste de l'historique est renvoyé
+        """
+        if not self.context_cache or self.backend == "fake":
+            return self.get(model_name, system_instruction, generation_config), history
+
+        configure_once()
+        prefix_keys = self._prefix_keys(model_name, system_instruction, history)
+        now = time.time()
+        self._sweep(now)
+        for length in range(len(history), -1, -1):
+            entry = self._contexts.get(prefix_keys[length])
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._contexts.pop(prefix_keys[length], None)
+                continue
+            self._contexts.move_to_end(prefix_keys[length])
+            self.counters['context_hits'] += 1
+            model = self._get_or_build(
+                ('cached', entry.cached_content.name, repr(generation_config)),
+                lambda: genai.GenerativeModel.from_cached_content(
+                    cached_content=entry.cached_content,
+                    generation_config=generation_config
+                )
+            )
+            self._maybe_cache_prefix(model_name, system_instruction, history, prefix_keys[-1], already_cached=length)
+            return model, history[length:]
+
+        self.counters['context_misses'] += 1
+        self._maybe_cache_prefix(model_name, system_instruction, history, prefix_keys[-1], already_cached=0)
+        return self.get(model_name, system_instruction, generation_config), history
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'models': len(self._models),
+            'cached_contexts': len(self._contexts),
+            'uncacheable_prefixes': len(self._uncacheable),
+            'context_cache_enabled': self.context_cache,
+            'backend': self.backend,
+        }
+
+    def _get_or_build(self, key: Tuple, build) -> Any:
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.counters['model_hits'] += 1
+                return model
+            self.counters['model_misses'] += 1
+            model = build()
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+            return model
+
+    def _sweep(self, now: float):
+        """Purge des contextes expirés, au plus une fois par sweep_interval (le fournisseur les a supprimés)"""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        for key in [key for key, entry in self._contexts.items() if entry.expires_at <= now]:
+            del self._contexts[key]
+
+    def _remember_context(self, key: str, entry: _ContextCacheEntry):
+        self._contexts[key] = entry
+        self._contexts.move_to_end(key)
+        while len(self._contexts) > self.max_contexts:
+            _, evicted = self._contexts.popitem(last=False)
+            self.counters['context_evictions'] += 1
+            # Contexte encore facturé chez le fournisseur jusqu'à son expiration : suppression explicite
+            task = asyncio.get_running_loop().create_task(self._delete_remote(evicted.cached_content))
+            self._deletions.add(task)
+            task.add_done_callback(self._deletions.discard)
+
+    def _forget_prefix(self, key: str):
+        """Préfixe impossible à mettre en cache ; liste bornée comme les contextes"""
+        self._uncacheable[key] = None
+        self._uncacheable.move_to_end(key)
+        while len(self._uncacheable) > self.max_contexts:
+            self._uncacheable.popitem(last=False)
+
+    @staticmethod
+    async def _delete_remote(cached_content: Any):
+        try:
+            await asyncio.to_thread(cached_content.delete)
+        except Exception as e:
+            print(f"⚠️ Suppression du contexte {getattr(cached_content, 'name', '?')} impossible : {e}")
+
+    @staticmethod
+    def _prefix_keys(model_name: str, system_instruction: Optional[str], history: List[Dict]) -> List[str]:
+        """Empreintes chaînées de chaque préfixe : keys[n] identifie système + history[:n]"""
+        digest = hashlib.sha256(f"{model_name}\0{system_instruction or ''}".encode('utf-8'))
+        keys = [digest.hexdigest()]
+        for msg in history:
+            digest.update(json.dumps(msg, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    def _maybe_cache_prefix(self, model_name: str, system_instruction: Optional[str],
+                            history: List[Dict], key: str, already_cached: int):
+        """Crée en tâche de fond un contexte pour tout l'historique, si la partie non cachée est assez longue"""
+        if key in self._contexts or key in self._pending or key in self._uncacheable:
+            return
+        uncached_text = "".join(
+            part.get('text', '') for msg in history[already_cached:] for part in msg.get('parts', [])
+            if isinstance(part, dict)
+        )
+        if already_cached == 0:
+            uncached_text += system_instruction or ""
+        if _estimate_tokens(uncached_text) < self.min_cache_tokens:
+            return
+
+        def create():
+            return genai.caching.CachedContent.create(
+                model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+                system_instruction=system_instruction,
+                contents=list(history) or None,
+                ttl=datetime.timedelta(seconds=self.cache_ttl_seconds),
+            )
+
+        async def run():
+            try:
+                cached_content = await asyncio.to_thread(create)
+                # Marge d'une minute pour ne pas utiliser un contexte sur le point d'expirer
+                self._remember_context(key, _ContextCacheEntry(cached_content, time.time() + self.cache_ttl_seconds - 60))
+                self.counters['context_created'] += 1
+                print(f"🗄️ Contexte mis en cache pour {model_name} ({len(history)} messages)")
+            except Exception as e:
+                # Contexte trop court ou modèle non supporté : on ne réessaie pas pour ce préfixe
+                self._forget_prefix(key)
+                self.counters['context_failures'] += 1
+                print(f"⚠️ Mise en cache du contexte impossible : {e}")
+            finally:
+                self._pending.pop(key, None)
+
+        try:
+            self._pending[key] = asyncio.get_running_loop().create_task(run())
+        except RuntimeError:
+            # Pas de boucle d'événements (appel synchrone) : pas de mise en cache
+            pass
+
+
+# Pool partagé par main.py et contract_generator.py
+model_pool = LazySingleton(ModelPool.from_env)
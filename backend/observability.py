@@ -0,0 +1,433 @@
+"""
+Instrumentation des endpoints et des étapes de la cascade
+Histogrammes au format Prometheus (endpoint /metrics) et spans OpenTelemetry optionnels
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from settings import LazySingleton
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # OpenTelemetry est optionnel
+    _otel_trace = None
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+TOKEN_BUCKETS = (100, 1000, 5000, 10000, 50000, 100000, 250000, 500000, 1000000)
+
+# Requête HTTP en cours : {'started_at', 'waited', 'tokens', 'session_id'} pour mesurer l'attente avant
+# le premier appel au modèle et les tokens consommés (dict mutable : partagé avec les tâches filles, qui copient le contexte)
+_current_request: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+# Étape de l'appel au modèle en cours ("draft", "compact"...) : site d'appel repris par l'enregistrement
+# et le rejeu du backend simulé
+_current_llm_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_llm_stage", default=None)
+
+
+def current_llm_stage() -> Optional[str]:
+    return _current_llm_stage.get()
+
+
+def model_label(model_name: str) -> str:
+    """Label "model" borné à la liste du pool de modèles : un nom inconnu envoyé par un client devient 'other'"""
+    # Import différé : model_pool dépend de ce module (backend simulé)
+    from model_pool import KNOWN_MODELS
+    name = str(model_name)
+    name = name[len("models/"):] if name.startswith("models/") else name
+    return name if name in KNOWN_MODELS else "other"
+
+
+def _label_key(names: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(model_label(labels.get(name, "")) if name == "model" else str(labels.get(name, "")) for name in names)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labels, labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        # Par jeu de labels : [compte par bucket..., somme, compte total]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            series = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._values.get(_label_key(self.labels, labels))
+        return int(series[-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {int(series[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "Durée des requêtes HTTP, streaming compris", ("endpoint", "method", "status")
+))
+HTTP_REQUESTS_IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "Requêtes HTTP en cours"
+))
+LLM_QUEUE_WAIT = registry.register(Histogram(
+    "llm_queue_wait_seconds", "Attente entre l'arrivée de la requête et son premier appel au modèle", ("stage",)
+))
+LLM_TIME_TO_FIRST_TOKEN = registry.register(Histogram(
+    "llm_time_to_first_token_seconds", "Délai avant le premier morceau renvoyé par le modèle", ("stage", "model")
+))
+LLM_UPSTREAM_DURATION = registry.register(Histogram(
+    "llm_upstream_duration_seconds", "Durée totale des appels au modèle", ("stage", "model")
+))
+LLM_STREAM_CHUNKS = registry.register(Histogram(
+    "llm_stream_chunks", "Nombre de morceaux streamés par appel", ("stage",), SIZE_BUCKETS
+))
+LLM_STREAM_CHARACTERS = registry.register(Histogram(
+    "llm_stream_characters", "Nombre de caractères produits par appel", ("stage",),
+    SIZE_BUCKETS + (500000, 1000000)
+))
+LLM_TOKENS = registry.register(Counter(
+    "llm_tokens_total", "Tokens consommés d'après les métadonnées de réponse", ("stage", "model", "kind")
+))
+LLM_PLANNED_PROMPT_TOKENS = registry.register(Counter(
+    "llm_planned_prompt_tokens_total", "Tokens de prompt comptés avant l'appel (budget de tokens)", ("stage", "model")
+))
+LLM_BUDGET_REJECTIONS = registry.register(Counter(
+    "llm_budget_rejections_total", "Appels refusés avant envoi : prompt au-delà du budget de tokens", ("stage",)
+))
+HTTP_REQUEST_TOKENS = registry.register(Histogram(
+    "http_request_tokens", "Tokens consommés par requête HTTP, tous appels au modèle compris", ("endpoint", "kind"),
+    TOKEN_BUCKETS
+))
+LLM_ERRORS = registry.register(Counter(
+    "llm_errors_total", "Erreurs des appels au modèle, par classe", ("stage", "error")
+))
+LLM_SCHEDULER_WAIT = registry.register(Histogram(
+    "llm_scheduler_wait_seconds", "Attente dans la file de l'ordonnanceur avant l'appel au modèle", ("priority",)
+))
+LLM_QUEUE_DEPTH = registry.register(Gauge(
+    "llm_queue_depth", "Appels en attente dans l'ordonnanceur", ("model", "priority")
+))
+LLM_IN_FLIGHT = registry.register(Gauge(
+    "llm_in_flight", "Appels au modèle en cours", ("model",)
+))
+LLM_RETRIES = registry.register(Counter(
+    "llm_retries_total", "Nouvelles tentatives après une limite de débit (429)", ("stage", "model")
+))
+LLM_HEDGES = registry.register(Counter(
+    "llm_hedges_total", "Requêtes de couverture lancées après dépassement du délai du premier token", ("stage",)
+))
+LLM_HEDGE_WINS = registry.register(Counter(
+    "llm_hedge_wins_total", "Stream retenu après une couverture", ("stage", "winner")
+))
+LLM_FALLBACKS = registry.register(Counter(
+    "llm_fallbacks_total", "Appels repris sur le modèle de secours après une erreur", ("stage", "error")
+))
+STAGE_DURATION = registry.register(Histogram(
+    "cascade_stage_duration_seconds", "Durée des étapes de la cascade de génération", ("stage",)
+))
+EXPORT_RENDER_DURATION = registry.register(Histogram(
+    "contract_export_render_seconds", "Durée du rendu PDF/DOCX dans le pool d'export (hors cache)", ("format",)
+))
+EXPORT_REQUESTS = registry.register(Counter(
+    "contract_export_requests_total", "Exports de contrats, par format et origine du fichier", ("format", "source")
+))
+STANDARD_ARTICLES = registry.register(Counter(
+    "contract_standard_articles_total", "Articles repris de la bibliothèque de clauses au lieu d'être rédigés", ("mode",)
+))
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """Span OpenTelemetry si la librairie est installée et OTEL_TRACING=1, sinon rien"""
+    if _otel_trace is None or os.getenv("OTEL_TRACING", "0") != "1":
+        yield None
+        return
+    with _otel_trace.get_tracer("counselai").start_as_current_span(name) as current:
+        for key, value in attributes.items():
+            current.set_attribute(key, value)
+        yield current
+
+
+class UsageLedger:
+    """
+    Consommation de tokens pour la planification de capacité : totaux par endpoint (par requête)
+    et par session (LRU bornée), en tokens de prompt, de sortie et en cache
+    """
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._endpoints: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, session_id: Optional[str], stage: str, counts: Dict[str, int]):
+        if session_id is None:
+            return
+        with self._lock:
+            usage = self._sessions.get(session_id)
+            if usage is None:
+                usage = self._sessions[session_id] = {'calls': 0, 'prompt': 0, 'output': 0, 'cached': 0, 'stages': {}}
+            self._sessions.move_to_end(session_id)
+            usage['calls'] += 1
+            stage_usage = usage['stages'].setdefault(stage, {'prompt': 0, 'output': 0})
+            for kind, count in counts.items():
+                usage[kind] = usage.get(kind, 0) + count
+                if kind in stage_usage:
+                    stage_usage[kind] += count
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def record_request(self, endpoint: str, tokens: Dict[str, int]):
+        with self._lock:
+            usage = self._endpoints.setdefault(endpoint, {'requests': 0, 'prompt': 0, 'output': 0, 'cached': 0})
+            usage['requests'] += 1
+            for kind, count in tokens.items():
+                usage[kind] = usage.get(kind, 0) + count
+
+    def session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            usage = self._sessions.get(session_id)
+            return None if usage is None else {**usage, 'stages': {k: dict(v) for k, v in usage['stages'].items()}}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'endpoints': {k: dict(v) for k, v in self._endpoints.items()}}
+
+
+usage_ledger = LazySingleton(lambda: UsageLedger(int(os.getenv("TOKEN_USAGE_MAX_SESSIONS", "10000"))))
+
+
+def tag_request(session_id: Optional[str] = None):
+    """Rattache la requête HTTP en cours à une session (consommation de tokens par session)"""
+    request = _current_request.get()
+    if request is not None and session_id is not None:
+        request['session_id'] = session_id
+
+
+class LLMCallTracker:
+    """Mesures d'un appel au modèle : premier token, morceaux, caractères, tokens, erreur"""
+
+    def __init__(self, stage: str, model_name: str):
+        self.stage = stage
+        self.model_name = model_name
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.chunks = 0
+        self.characters = 0
+
+    def chunk(self, text: Optional[str]):
+        """À appeler pour chaque morceau reçu (ou une fois pour une réponse non streamée)"""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started_at,
+                                            stage=self.stage, model=self.model_name)
+        self.chunks += 1
+        self.characters += len(text or "")
+
+    def usage(self, response: Any):
+        """Relève les tokens consommés dans response.usage_metadata si disponible"""
+        try:
+            metadata = getattr(response, "usage_metadata", None)
+        except Exception:
+            metadata = None
+        if not metadata:
+            return
+        counts = {}
+        for kind, attribute in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                                ("cached", "cached_content_token_count")):
+            count = getattr(metadata, attribute, 0) or 0
+            if count:
+                LLM_TOKENS.inc(count, stage=self.stage, model=self.model_name, kind=kind)
+                counts[kind] = count
+        if not counts:
+            return
+        # Consommation rattachée à la requête HTTP en cours et à sa session
+        request = _current_request.get()
+        if request is not None:
+            tokens = request.setdefault('tokens', {})
+            for kind, count in counts.items():
+                tokens[kind] = tokens.get(kind, 0) + count
+        usage_ledger.record_call(request.get('session_id') if request else None, self.stage, counts)
+
+    def finish(self, error: Optional[BaseException] = None):
+        LLM_UPSTREAM_DURATION.observe(time.perf_counter() - self.started_at,
+                                      stage=self.stage, model=self.model_name)
+        LLM_STREAM_CHUNKS.observe(self.chunks, stage=self.stage)
+        LLM_STREAM_CHARACTERS.observe(self.characters, stage=self.stage)
+        if error is not None:
+            LLM_ERRORS.inc(stage=self.stage, error=type(error).__name__)
+
+
+@contextmanager
+def track_llm_call(stage: str, model_name: str) -> Iterator[LLMCallTracker]:
+    """
+    Instrumente un appel au modèle
+        with track_llm_call("chat", model_name) as call:
+            async for chunk in stream: call.chunk(chunk.text)
+            call.usage(stream)
+    """
+    request = _current_request.get()
+    if request is not None and not request['waited']:
+        request['waited'] = True
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - request['started_at'], stage=stage)
+    tracker = LLMCallTracker(stage, model_name)
+    stage_token = _current_llm_stage.set(stage)
+    try:
+        with span(f"llm.{stage}", model=model_name):
+            try:
+                yield tracker
+            except GeneratorExit:
+                # Générateur fermé par l'appelant (client déconnecté) : ce n'est pas une erreur du modèle
+                tracker.finish()
+                raise
+            except BaseException as e:
+                tracker.finish(error=e)
+                raise
+            tracker.finish()
+    finally:
+        try:
+            _current_llm_stage.reset(stage_token)
+        except ValueError:
+            # Générateur finalisé dans un autre contexte : rien à restaurer ici
+            pass
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Durée d'une étape de la cascade (et span associé)"""
+    started_at = time.perf_counter()
+    with span(f"cascade.{stage}"):
+        try:
+            yield
+        finally:
+            STAGE_DURATION.observe(time.perf_counter() - started_at, stage=stage)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : durée de chaque requête jusqu'au dernier octet envoyé (streaming compris),
+    étiquetée par route et non par chemin brut pour borner la cardinalité
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        token = _current_request.set({'started_at': started_at, 'waited': False})
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.inc(-1)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started_at,
+                                          endpoint=endpoint, method=scope.get("method", ""),
+                                          status=str(status["code"]))
+            tokens = _current_request.get().get('tokens')
+            if tokens:
+                for kind, count in tokens.items():
+                    HTTP_REQUEST_TOKENS.observe(count, endpoint=endpoint, kind=kind)
+                usage_ledger.record_request(endpoint, tokens)
+            _current_request.reset(token)
+
+
+def render_metrics() -> str:
+    return registry.render()
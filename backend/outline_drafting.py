@@ -0,0 +1,185 @@
+"""
+Rédaction par plan : un plan JSON (titre, termes définis, sections), puis chaque section rédigée
+en parallèle avec le même contexte de l'opération, et assemblage avec contrôle de cohérence
+(renvois vers des articles inexistants, termes définis plusieurs fois ou jamais utilisés)
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "definitions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"term": {"type": "string"}, "meaning": {"type": "string"}},
+                "required": ["term", "meaning"],
+            },
+        },
+        "sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "number": {"type": "integer"},
+                    "heading": {"type": "string"},
+                    "scope": {"type": "string"},
+                },
+                "required": ["number", "heading", "scope"],
+            },
+        },
+    },
+    "required": ["title", "sections"],
+}
+
+OUTLINE_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": OUTLINE_SCHEMA}
+
+OUTLINE_PROMPT = """You are the best business lawyer specializing in drafting high-value legal documents.
+
+{context}
+
+Plan an exceptional, absolutely COMPLETE legal document in English for this deal, worthy of a top-tier law firm.
+Return its outline as JSON:
+- title: the document title
+- definitions: every capitalized defined term the document will use, with its meaning
+- sections: the numbered articles in order (definitions and interpretation first, signatures last),
+  each with its heading and a precise scope listing the provisions it must contain
+"""
+
+SECTION_DRAFT_PROMPT = """You are the best business lawyer drafting a high-value legal document in English, one article at a time.
+The other articles are drafted in parallel from the same outline, so stay strictly within your scope.
+
+{context}
+
+DOCUMENT OUTLINE:
+{outline}
+
+DEFINED TERMS (use them exactly as written; only the definitions article may define terms):
+{definitions}
+
+Draft ONLY Article {number} ({heading}). Scope: {scope}
+Start with the line "## ARTICLE {number}. {heading}". Refer to other articles as "Article N" using the outline numbering.
+Use sophisticated legal language and cover the scope completely. Do not include any commentary before or after.
+"""
+
+HEADING_LINE_RE = re.compile(r'^\s*#{1,3}\s|^\s*\**\s*ARTICLE\b', re.IGNORECASE)
+# Renvoi interne ("Article 4", "Section 2.3"), sauf citation d'un texte extérieur ("Section 10 of the Companies Act")
+CROSS_REFERENCE_RE = re.compile(
+    r'\b(Article|Section|Clause)s?\s+(\d+)(?:\.\d+)*\b(?!\.\d)(?!\s+(?:of|under)\s+(?!this\b))'
+)
+DEFINITION_RE = re.compile(r'["“]([A-Z][\w&\'\- ]{1,60})["”]\s*(?:\)|means\b|shall mean\b|has the meaning\b)')
+
+
+@dataclass
+class OutlineSection:
+    number: int
+    heading: str
+    scope: str
+
+
+@dataclass
+class Outline:
+    title: str
+    definitions: Dict[str, str]
+    sections: List[OutlineSection]
+
+    def render(self) -> str:
+        return "\n".join(f"Article {section.number}. {section.heading}: {section.scope}" for section in self.sections)
+
+    def render_definitions(self) -> str:
+        return "\n".join(f'"{term}": {meaning}' for term, meaning in self.definitions.items()) or "(none)"
+
+
+def parse_outline(data: Dict[str, Any]) -> Optional[Outline]:
+    """Plan validé et renuméroté dans l'ordre ; None s'il est inexploitable (moins de deux sections)"""
+    sections = []
+    for entry in data.get("sections") or []:
+        if not isinstance(entry, dict) or not str(entry.get("heading") or "").strip():
+            continue
+        sections.append(OutlineSection(len(sections) + 1, str(entry["heading"]).strip(), str(entry.get("scope") or "").strip()))
+    if len(sections) < 2:
+        return None
+    definitions = {}
+    for entry in data.get("definitions") or []:
+        if isinstance(entry, dict) and str(entry.get("term") or "").strip():
+            definitions[str(entry["term"]).strip()] = str(entry.get("meaning") or "").strip()
+    return Outline(str(data.get("title") or "Agreement").strip(), definitions, sections)
+
+
+def outline_prompt(context: str) -> str:
+    return OUTLINE_PROMPT.format(context=context)
+
+
+def section_prompt(context: str, outline: Outline, section: OutlineSection) -> str:
+    # Contexte et plan communs en tête : seule la dernière ligne diffère d'une section à l'autre
+    return SECTION_DRAFT_PROMPT.format(
+        context=context,
+        outline=outline.render(),
+        definitions=outline.render_definitions(),
+        number=section.number,
+        heading=section.heading,
+        scope=section.scope,
+    )
+
+
+def normalize_section(text: str, section: OutlineSection) -> str:
+    """Retire les balises de code et un titre de document répété, garantit la ligne de titre de l'article"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0].strip()
+    lines = text.split("\n")
+    if lines and lines[0].startswith("# "):
+        lines = lines[1:]
+    text = "\n".join(lines).strip()
+    if not text or not HEADING_LINE_RE.match(text.split("\n", 1)[0]):
+        text = f"## ARTICLE {section.number}. {section.heading}\n\n{text}".strip()
+    return text
+
+
+def assemble(outline: Outline, sections: List[str]) -> str:
+    return f"# {outline.title}\n\n" + "\n\n".join(sections) + "\n"
+
+
+def check_consistency(outline: Outline, sections: List[str]) -> List[Dict[str, Any]]:
+    """
+    Problèmes de cohérence entre sections rédigées séparément :
+    renvois vers un article absent du plan, terme défini dans plusieurs articles, terme du plan jamais employé.
+    Les articles renvoient les uns aux autres par "Article N" : un "Section N" ou "Clause N" au-delà du
+    nombre d'articles vise un autre texte (loi, règlement) et n'est pas un renvoi manquant
+    """
+    issues = []
+    numbers = {section.number for section in outline.sections}
+    defined_in: Dict[str, List[int]] = {}
+    for section, text in zip(outline.sections, sections):
+        references = {
+            int(number) for kind, number in CROSS_REFERENCE_RE.findall(text)
+            if kind.lower() == "article" or int(number) <= len(numbers)
+        }
+        for reference in sorted(references - numbers):
+            issues.append({'type': 'dangling_reference', 'article': section.number, 'reference': reference})
+        for term in set(DEFINITION_RE.findall(text)):
+            defined_in.setdefault(term.strip(), []).append(section.number)
+    for term, articles in sorted(defined_in.items()):
+        if len(articles) > 1:
+            issues.append({'type': 'duplicate_definition', 'term': term, 'articles': articles})
+    document = "\n".join(sections)
+    for term in outline.definitions:
+        if term not in document:
+            issues.append({'type': 'unused_definition', 'term': term})
+    return issues
+
+
+def outline_report(outline: Outline, issues: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {'sections': len(outline.sections), 'definitions': len(outline.definitions), 'issues': issues}
+
+
+def parse_outline_response(text: str) -> Optional[Outline]:
+    try:
+        return parse_outline(json.loads(text))
+    except (ValueError, TypeError):
+        return None
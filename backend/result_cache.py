@@ -0,0 +1,155 @@
+"""
+Cache de résultats adressé par contenu, sur disque, avec coalescence des calculs identiques
+Sert à la cascade de génération (et à l'étape de mise en forme HTML) : un double-clic ou
+un retry du frontend réutilise le calcul en cours au lieu d'en relancer un second
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from conversation import Conversation
+from settings import LazySingleton
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Empreinte SHA-256 stable des éléments (sérialisés en JSON trié)"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def normalize_history(history: List[Dict]) -> List[List[str]]:
+    """Forme canonique de l'historique : (rôle, texte sans espaces superflus) par message"""
+    if isinstance(history, Conversation):
+        return history.normalized
+    normalized = []
+    for msg in history:
+        if not isinstance(msg, dict):
+            continue
+        text = " ".join(
+            part.get('text', '') for part in msg.get('parts', []) if isinstance(part, dict)
+        ) if 'parts' in msg else msg.get('text', '')
+        normalized.append([msg.get('role', ''), " ".join(text.split())])
+    return normalized
+
+
+class DiskResultCache:
+    """
+    Cache JSON sur disque, borné en taille, avec éviction des entrées les moins récemment lues
+    (la date de modification du fichier est mise à jour à chaque lecture)
+    """
+    suffix = ".json"
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "DiskResultCache":
+        """CONTRACT_CACHE_DIR, CONTRACT_CACHE_MAX_BYTES, CONTRACT_CACHE_ENABLED=0 pour désactiver"""
+        return cls(
+            directory=os.getenv("CONTRACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "counselai_contract_cache")),
+            max_bytes=int(os.getenv("CONTRACT_CACHE_MAX_BYTES", str(200 * 1024 * 1024))),
+            enabled=os.getenv("CONTRACT_CACHE_ENABLED", "1") == "1",
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        # Écriture atomique : un lecteur concurrent ne voit jamais un fichier partiel
+        os.replace(tmp_path, path)
+        self.counters['writes'] += 1
+        self._evict()
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any):
+        await asyncio.to_thread(self.set, key, value)
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.counters['evictions'] += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'enabled': self.enabled}
+
+
+class SingleFlight:
+    """
+    Coalescence des appels concurrents : tant qu'un calcul est en cours pour une clé,
+    les appels identiques attendent son résultat au lieu d'en lancer un autre
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.counters = {'leaders': 0, 'shared': 0}
+
+    def is_inflight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.counters['leaders'] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.counters['shared'] += 1
+        # shield : si le client qui a lancé le calcul se déconnecte, les autres continuent d'attendre
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'inflight': len(self._inflight)}
+
+
+# Cache et coalescence partagés par la cascade de génération
+contract_cache = LazySingleton(DiskResultCache.from_env)
+single_flight = SingleFlight()
@@ -2,6 +2,10 @@
 cd /Users/frederic/ProjetsDev/counselai-v2/backend
 source venv/bin/activate
 
+# Several workers share the versioned documents through a SQLite file (the in-memory store is per process)
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+export DOCUMENT_DB_PATH=${DOCUMENT_DB_PATH:-/tmp/counselai_documents.sqlite3}
+
 # Run uvicorn with production settings
 # --timeout-keep-alive: Keep-alive timeout in seconds (default 5)
 # --timeout-graceful-shutdown: Maximum wait time for graceful shutdown
@@ -13,4 +17,4 @@ uvicorn main:app \
     --timeout-keep-alive 120 \
     --timeout-graceful-shutdown 30 \
     --limit-concurrency 1000 \
-    --workers 4
\ No newline at end of file
+    --workers $WEB_CONCURRENCY
\ No newline at end of file
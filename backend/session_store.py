@@ -0,0 +1,198 @@
+"""
+Stockage côté serveur des conversations
+Les clients envoient un session_id au lieu de renvoyer tout l'historique à chaque requête
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+def make_message(role: str, text: str) -> Dict:
+    """Message au format attendu par Gemini (start_chat / history)"""
+    return {"role": role, "parts": [{"text": text}]}
+
+
+def is_valid_message(msg) -> bool:
+    return isinstance(msg, dict) and 'role' in msg and 'parts' in msg
+
+
+@dataclass
+class ConversationSession:
+    """Une conversation et son historique au format Gemini"""
+    id: str
+    history: List[Dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+
+class InMemorySessionStore:
+    """
+    Sessions en mémoire, avec éviction LRU (nombre max de sessions) et expiration (TTL)
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 6 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, history: Optional[List[Dict]] = None) -> ConversationSession:
+        session = ConversationSession(id=uuid.uuid4().hex)
+        valid = [msg for msg in (history or []) if is_valid_message(msg)]
+        with self._lock:
+            self._remember(session)
+        if valid:
+            self.append(session.id, *valid)
+        return session
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._is_expired(session):
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def append(self, session_id: str, *messages: Dict) -> ConversationSession:
+        """Ajoute des tours à la conversation (seuls les nouveaux messages sont traités)"""
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        with self._lock:
+            session.history.extend(msg for msg in messages if is_valid_message(msg))
+            session.updated_at = time.time()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _is_expired(self, session: ConversationSession) -> bool:
+        return time.time() - session.updated_at > self.ttl_seconds
+
+    def _remember(self, session: ConversationSession):
+        # Appelé avec le verrou : insère en tête et évince les sessions les moins récentes
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+
+class SQLiteSessionStore(InMemorySessionStore):
+    """
+    Sessions persistées dans SQLite, avec le cache LRU en mémoire devant
+    Les messages sont stockés un par ligne : un ajout n'écrit que les nouveaux tours,
+    et un cache périmé (autre worker uvicorn) ne recharge que les messages manquants
+    """
+
+    def __init__(self, db_path: str, max_sessions: int = 1000, ttl_seconds: float = 6 * 3600):
+        super().__init__(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, text TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, position))"
+            )
+
+    def create(self, history: Optional[List[Dict]] = None) -> ConversationSession:
+        session = ConversationSession(id=uuid.uuid4().hex)
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+                (session.id, session.created_at, session.updated_at)
+            )
+        with self._lock:
+            self._remember(session)
+        valid = [msg for msg in (history or []) if is_valid_message(msg)]
+        if valid:
+            self.append(session.id, *valid)
+        return session
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT created_at, updated_at, (SELECT COUNT(*) FROM messages WHERE session_id = ?) "
+                "FROM sessions WHERE id = ?",
+                (session_id, session_id)
+            ).fetchone()
+        if row is None:
+            super().delete(session_id)
+            return None
+        created_at, updated_at, count = row
+        if time.time() - updated_at > self.ttl_seconds:
+            self.delete(session_id)
+            return None
+
+        session = super().get(session_id)
+        if session is None:
+            session = ConversationSession(id=session_id, created_at=created_at, updated_at=updated_at)
+            with self._lock:
+                self._remember(session)
+        if len(session.history) < count:
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT role, text FROM messages WHERE session_id = ? AND position >= ? ORDER BY position",
+                    (session_id, len(session.history))
+                ).fetchall()
+            with self._lock:
+                session.history.extend(make_message(role, text) for role, text in rows)
+                session.updated_at = updated_at
+        return session
+
+    def append(self, session_id: str, *messages: Dict) -> ConversationSession:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        valid = [msg for msg in messages if is_valid_message(msg)]
+        now = time.time()
+        with self._db_lock, self._db:
+            # Position calculée dans la transaction : le cache peut ignorer les tours ajoutés par un autre worker
+            self._db.executemany(
+                "INSERT INTO messages (session_id, position, role, text) "
+                "SELECT ?, COALESCE(MAX(position) + 1, 0), ?, ? FROM messages WHERE session_id = ?",
+                [
+                    (session_id, msg['role'], msg['parts'][0].get('text', '') if msg['parts'] else '', session_id)
+                    for msg in valid
+                ]
+            )
+            self._db.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+        # Relecture des messages manquants : ceux des autres workers puis les nôtres, dans l'ordre
+        return self.get(session_id) or session
+
+    def delete(self, session_id: str) -> bool:
+        with self._db_lock, self._db:
+            deleted = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+            self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        return super().delete(session_id) or deleted
+
+
+def create_session_store() -> InMemorySessionStore:
+    """
+    Construit le store à partir des variables d'environnement:
+    SESSION_DB_PATH (active la persistance SQLite), SESSION_MAX_ENTRIES, SESSION_TTL_SECONDS
+    """
+    max_sessions = int(os.getenv("SESSION_MAX_ENTRIES", "1000"))
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+    db_path = os.getenv("SESSION_DB_PATH")
+    if db_path:
+        return SQLiteSessionStore(db_path, max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+    return InMemorySessionStore(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
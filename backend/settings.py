@@ -0,0 +1,57 @@
+"""
+Chargement de l'environnement et singletons des modules
+Le fichier .env est chargé une seule fois ; chaque singleton (model_pool, contract_cache, hedging...)
+lit sa configuration à son premier usage, après ce chargement, quel que soit l'ordre des imports
+"""
+import threading
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+_environment_lock = threading.Lock()
+_environment_loaded = False
+
+
+def load_environment():
+    """Charge le .env une seule fois (les variables déjà définies dans l'environnement restent prioritaires)"""
+    global _environment_loaded
+    with _environment_lock:
+        if not _environment_loaded:
+            load_dotenv()
+            _environment_loaded = True
+
+
+class LazySingleton:
+    """
+    model_pool = LazySingleton(ModelPool.from_env)
+    L'instance est construite au premier accès à un attribut ; lectures et affectations lui sont transmises
+    (monkeypatch.setattr(model_pool, "get", ...) dans les tests)
+    """
+    __slots__ = ('_factory', '_instance', '_lock')
+
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get(self) -> Any:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    load_environment()
+                    object.__setattr__(self, '_instance', self._factory())
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._get(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self._get(), name)
+
+    def __repr__(self) -> str:
+        return repr(self._get())
@@ -0,0 +1,212 @@
+"""
+Génération spéculative du contrat
+Dès que l'assistant présente son résumé ("Shall we proceed...?"), la cascade est lancée en tâche de
+fond pour cet état de la conversation. Elle n'est acquise qu'au signal explicite du modèle (appel de
+l'outil de génération en réponse à l'avocat) : l'appel de génération qui suit récupère alors le résultat
+(terminé ou en cours). Toute autre réponse de l'avocat ou du modèle abandonne la spéculation
+"""
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from conversation import Conversation, Message
+from result_cache import make_cache_key
+from settings import LazySingleton
+
+PROCEED_MARKERS = ("shall we proceed",)
+CONFIRMATION_KEYWORDS = ("yes", "proceed", "go ahead", "please generate", "confirmed", "correct", "accurate")
+TOOL_CALL_MARKERS = ("TOOL_CALL:", '"action": "generate_document"')
+MAX_CONFIRMATION_WORDS = 12
+
+# Mots ou expressions entiers : "yesterday", "incorrect" ou "inaccurate" ne confirment rien
+CONFIRMATION_RE = re.compile(r'\b(?:' + '|'.join(re.escape(keyword) for keyword in CONFIRMATION_KEYWORDS) + r')\b')
+# Négation ou correction : "not correct", "no, ...", "... instead", "yes but ..."
+NEGATION_RE = re.compile(r"\b(?:not|no|nope|never|don't|doesn't|isn't|wrong|instead|but|however|except|change)\b|n't\b")
+
+
+def is_proceed_prompt(text: str) -> bool:
+    """Résumé de l'assistant demandant confirmation avant la génération"""
+    lowered = text.lower()
+    return any(marker in lowered for marker in PROCEED_MARKERS)
+
+
+def is_confirmation(text: str) -> bool:
+    """Mot de confirmation entier, sans négation ni correction"""
+    lowered = text.lower().replace("’", "'")
+    return bool(CONFIRMATION_RE.search(lowered)) and not NEGATION_RE.search(lowered)
+
+
+def is_plain_confirmation(text: str) -> bool:
+    """
+    Confirmation sans nouvelle instruction ("Yes, go ahead") ; "yes but change the price" n'en est pas une,
+    pas plus qu'une réponse qui apporte un chiffre ("Correct, EUR 12m")
+    """
+    return (is_confirmation(text) and len(text.split()) <= MAX_CONFIRMATION_WORDS
+            and not any(char.isdigit() for char in text))
+
+
+def is_tool_call(text: str) -> bool:
+    """Réponse du modèle déclenchant la génération"""
+    return any(marker in text for marker in TOOL_CALL_MARKERS)
+
+
+def is_confirmation_turn(msg: Union[Message, Dict]) -> bool:
+    """Message postérieur au résumé qui ne change rien aux termes : confirmation ou appel d'outil"""
+    message = Message.from_raw(msg)
+    if message is None:
+        return False
+    if message.role == 'user':
+        return is_plain_confirmation(message.text)
+    return not message.text.strip() or is_tool_call(message.text)
+
+
+@dataclass
+class SpeculationConfig:
+    enabled: bool = True
+    ttl_seconds: float = 900      # résultat non réclamé au-delà : abandonné
+    max_entries: int = 20         # spéculations simultanées (les plus anciennes sont annulées)
+
+    @classmethod
+    def from_env(cls) -> "SpeculationConfig":
+        """SPECULATIVE_GENERATION=0 pour désactiver, SPECULATION_TTL_SECONDS, SPECULATION_MAX_ENTRIES"""
+        return cls(
+            enabled=os.getenv("SPECULATIVE_GENERATION", "1") == "1",
+            ttl_seconds=float(os.getenv("SPECULATION_TTL_SECONDS", "900")),
+            max_entries=int(os.getenv("SPECULATION_MAX_ENTRIES", "20")),
+        )
+
+
+@dataclass
+class _Speculation:
+    task: asyncio.Task
+    history_key: str
+    started_at: float = field(default_factory=time.monotonic)
+    confirmed: bool = False     # le modèle a appelé l'outil de génération après le résumé
+
+
+class SpeculativeGenerator:
+    """
+    speculation.start(history, options, run)   # l'assistant vient de demander confirmation
+    speculation.confirm(history)               # le modèle appelle l'outil de génération
+    speculation.discard(history)               # toute autre réponse de l'avocat ou du modèle
+    result = await speculation.claim(history, options)  # appel de génération après confirmation
+    options : paramètres de la cascade (modèle, rendu, mode de rédaction), qui doivent coïncider
+    """
+
+    def __init__(self, config: Optional[SpeculationConfig] = None):
+        self.config = config or SpeculationConfig()
+        self._entries: Dict[str, _Speculation] = {}
+        self.counters = {'started': 0, 'claimed': 0, 'claimed_in_progress': 0, 'discarded': 0,
+                         'expired': 0, 'failed': 0}
+
+    def start(self, history: Union[Conversation, List[Dict]], options: Dict[str, Any],
+              run: Callable[[], Awaitable[Dict]]) -> bool:
+        if not self.config.enabled:
+            return False
+        history = Conversation.parse(history)
+        self._expire()
+        key = self._key(history, options)
+        if key in self._entries:
+            return False
+        while len(self._entries) >= self.config.max_entries:
+            self._drop(next(iter(self._entries)), 'expired')
+        try:
+            task = asyncio.get_running_loop().create_task(run())
+        except RuntimeError:
+            return False
+        # Résultat jamais réclamé en échec : pas d'avertissement "exception never retrieved"
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._entries[key] = _Speculation(task, self._history_key(history))
+        self.counters['started'] += 1
+        print(f"🔮 Génération spéculative lancée ({len(history)} messages)")
+        return True
+
+    def confirm(self, history: Union[Conversation, List[Dict]]) -> bool:
+        """Signal explicite (appel de l'outil de génération) : les spéculations de cet état peuvent être réclamées"""
+        history_key = self._history_key(history)
+        entries = [entry for entry in self._entries.values() if entry.history_key == history_key]
+        for entry in entries:
+            entry.confirmed = True
+        return bool(entries)
+
+    def discard(self, history: Union[Conversation, List[Dict]]):
+        """Les termes changent : toutes les spéculations de cet état de conversation sont annulées"""
+        history_key = self._history_key(history)
+        for key in [key for key, entry in self._entries.items() if entry.history_key == history_key]:
+            self._drop(key, 'discarded')
+            print("🗑️ Génération spéculative abandonnée (termes modifiés)")
+
+    async def claim(self, history: Union[Conversation, List[Dict]], options: Dict[str, Any]) -> Optional[Dict]:
+        """
+        Résultat de la spéculation correspondant à l'historique, s'il n'y a eu depuis le résumé que des
+        confirmations et un signal explicite (confirm, ou appel d'outil dans l'historique) ; attend la fin
+        de la cascade si elle est en cours. None sinon, ou en cas d'échec
+        """
+        if not self._entries:
+            return None
+        self._expire()
+        history = Conversation.parse(history)
+        for length in self._candidate_lengths(history):
+            key = self._key(history[:length], options)
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            tool_called = any(message.role == 'model' and is_tool_call(message.text) for message in history[length:])
+            if not (entry.confirmed or tool_called):
+                return None
+            del self._entries[key]
+            in_progress = not entry.task.done()
+            try:
+                result = await asyncio.shield(entry.task)
+            except Exception as e:
+                self.counters['failed'] += 1
+                print(f"⚠️ Génération spéculative en échec ({type(e).__name__}: {e}), génération normale")
+                return None
+            self.counters['claimed'] += 1
+            self.counters['claimed_in_progress'] += in_progress
+            return {**result, 'data': {**result['data'], 'speculative': True}}
+        return None
+
+    async def shutdown(self):
+        tasks = [entry.task for entry in self._entries.values()]
+        self._entries.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'pending': len(self._entries), 'enabled': self.config.enabled}
+
+    @staticmethod
+    def _candidate_lengths(history: Conversation) -> List[int]:
+        """Longueurs de préfixe possibles : on remonte les confirmations finales jusqu'au résumé"""
+        lengths = [len(history)]
+        length = len(history)
+        while length > 0 and is_confirmation_turn(history[length - 1]):
+            length -= 1
+            lengths.append(length)
+        return lengths
+
+    @staticmethod
+    def _history_key(history: Union[Conversation, List[Dict]]) -> str:
+        return make_cache_key("speculation", Conversation.parse(history).normalized)
+
+    def _key(self, history: Conversation, options: Dict[str, Any]) -> str:
+        return make_cache_key("speculation", history.normalized, options)
+
+    def _drop(self, key: str, reason: str):
+        entry = self._entries.pop(key)
+        if not entry.task.done():
+            entry.task.cancel()
+        self.counters[reason] += 1
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if now - entry.started_at > self.config.ttl_seconds]:
+            self._drop(key, 'expired')
+
+
+speculation = LazySingleton(lambda: SpeculativeGenerator(SpeculationConfig.from_env()))
@@ -0,0 +1,98 @@
+"""
+Couche de streaming commune : regroupement des morceaux produits par le modèle
+Le premier morceau part immédiatement (latence du premier token), les suivants sont
+regroupés par taille ou par délai, et la lecture en amont suit le rythme du client
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+_END = object()
+
+
+@dataclass
+class CoalesceConfig:
+    """Seuils de regroupement des morceaux streamés"""
+    min_chars: int = 64          # taille à partir de laquelle le tampon est envoyé
+    max_delay: float = 0.05      # délai max (s) entre la réception d'un morceau et son envoi
+    max_pending_chunks: int = 32 # morceaux lus d'avance au plus, au-delà on cesse de lire le modèle
+
+    @classmethod
+    def from_env(cls) -> "CoalesceConfig":
+        """STREAM_COALESCE_MIN_CHARS, STREAM_COALESCE_MAX_DELAY_MS, STREAM_MAX_PENDING_CHUNKS"""
+        return cls(
+            min_chars=int(os.getenv("STREAM_COALESCE_MIN_CHARS", "64")),
+            max_delay=int(os.getenv("STREAM_COALESCE_MAX_DELAY_MS", "50")) / 1000,
+            max_pending_chunks=int(os.getenv("STREAM_MAX_PENDING_CHUNKS", "32")),
+        )
+
+
+async def coalesce_stream(source: AsyncIterator[str],
+                          config: Optional[CoalesceConfig] = None) -> AsyncIterator[str]:
+    """
+    Regroupe les morceaux de source
+    - le premier morceau est transmis sans attendre
+    - ensuite, le tampon est envoyé dès qu'il atteint min_chars, ou max_delay après son premier morceau
+    - la file de lecture est bornée : si le client lit lentement, on arrête de consommer le modèle
+    """
+    config = config or CoalesceConfig.from_env()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=config.max_pending_chunks)
+
+    async def pump():
+        try:
+            async for chunk in source:
+                if chunk:
+                    await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_END)
+
+    producer = asyncio.create_task(pump())
+    pending_get: Optional[asyncio.Future] = None
+    buffer = []
+    buffered_chars = 0
+    deadline = None
+    first = True
+
+    try:
+        while True:
+            if pending_get is None:
+                pending_get = asyncio.ensure_future(queue.get())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending_get}, timeout=timeout)
+
+            if not done:
+                # Délai écoulé : on envoie le tampon, la lecture en cours est conservée
+                yield "".join(buffer)
+                buffer, buffered_chars, deadline = [], 0, None
+                continue
+
+            item = pending_get.result()
+            pending_get = None
+            if item is _END or isinstance(item, Exception):
+                if buffer:
+                    yield "".join(buffer)
+                if isinstance(item, Exception):
+                    raise item
+                return
+
+            if first:
+                first = False
+                yield item
+                continue
+
+            buffer.append(item)
+            buffered_chars += len(item)
+            if deadline is None:
+                deadline = loop.time() + config.max_delay
+            if buffered_chars >= config.min_chars:
+                yield "".join(buffer)
+                buffer, buffered_chars, deadline = [], 0, None
+    finally:
+        # Client déconnecté ou fin du stream : on arrête la lecture du modèle
+        if pending_get is not None:
+            pending_get.cancel()
+        producer.cancel()
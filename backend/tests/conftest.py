@@ -0,0 +1,21 @@
+import pytest
+import contract_generator
+from result_cache import DiskResultCache
+
+@pytest.fixture(autouse=True)
+def isolated_contract_cache(tmp_path, monkeypatch):
+    """Chaque test utilise un cache de contrats vide, pour ne pas dépendre des exécutions précédentes."""
+    cache = DiskResultCache(str(tmp_path / "contract_cache"))
+    monkeypatch.setattr(contract_generator, "contract_cache", cache)
+    return cache
+
+@pytest.fixture(autouse=True)
+def isolated_deal_sheets(tmp_path, monkeypatch):
+    """
+    Fiches de l'opération enregistrées dans un répertoire propre au test, sans extraction par le modèle
+    (les tests de deal_sheet construisent leur propre tracker)
+    """
+    import deal_sheet
+    monkeypatch.setattr(deal_sheet.deal_sheets, "store", DiskResultCache(str(tmp_path / "deal_sheets")))
+    monkeypatch.setattr(deal_sheet.deal_sheets, "config", deal_sheet.DealSheetConfig(enabled=False))
+    return deal_sheet.deal_sheets
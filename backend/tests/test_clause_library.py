@@ -0,0 +1,121 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import contract_generator
+import llm_sdk
+from clause_library import (
+    STANDARD_ARTICLES_MARKER,
+    ClauseLibrary,
+    ClauseLibraryConfig,
+    StandardArticleInserter,
+    clause_library,
+    insert_standard_articles,
+)
+from contract_generator import ContractData, ContractGenerator
+from model_pool import model_pool
+
+SPA = "Share Purchase Agreement"
+TERMS = {"Governing Law": "French law", "Competent courts": "Commercial Court of Paris"}
+
+def test_search_ranks_by_heading_and_contract_type():
+    assert clause_library.search("severability of invalid provisions", SPA)[0][0].id == "severability"
+    assert "force_majeure" not in {clause.id for clause, _ in clause_library.search("force majeure", SPA)}
+    assert clause_library.search("force majeure", "Supply Agreement")[0][0].id == "force_majeure"
+
+def test_standard_articles_depend_on_terms_and_special_clauses():
+    ids = [clause.id for clause, _ in clause_library.standard_articles(SPA, TERMS)]
+    assert {"entire_agreement", "notices", "governing_law", "jurisdiction"} <= set(ids)
+    assert "governing_law" not in [clause.id for clause, _ in clause_library.standard_articles(SPA, {})]
+    bespoke = clause_library.standard_articles(SPA, TERMS, ["ICC arbitration seated in Geneva"])
+    assert "jurisdiction" not in [clause.id for clause, _ in bespoke]
+    # Sujet déjà négocié dans les termes clés : clause rédigée à partir de ces termes
+    negotiated = {**TERMS, "Assignment restrictions": "Buyer may assign to its affiliates", "Fees": "each party bears its own"}
+    ids = [clause.id for clause, _ in clause_library.standard_articles(SPA, negotiated)]
+    assert "assignment" not in ids and "costs" not in ids
+    assert {"notices", "governing_law", "jurisdiction"} <= set(ids)
+    assert clause_library.match_section(SPA, "Costs", "", negotiated) is None
+    assert clause_library.standard_articles("Power of attorney", TERMS) == []
+    assert clause_library.standard_articles("", TERMS) == []
+
+def test_section_match_requires_full_coverage():
+    match = clause_library.match_section(SPA, "Governing Law and Jurisdiction", "governing law, competent courts", TERMS)
+    assert [clause.id for clause, _ in match] == ["governing_law", "jurisdiction"]
+    assert clause_library.match_section(SPA, "Miscellaneous", "entire agreement, waiver", TERMS) is None
+    assert clause_library.match_section(SPA, "Confidentiality", "confidentiality, non-compete undertakings", TERMS) is None
+    assert clause_library.match_section(SPA, "Confidentiality", "", TERMS, ["Confidentiality for 5 years"]) is None
+
+def test_inserter_numbers_articles_after_the_last_one_when_streamed():
+    articles = clause_library.standard_articles(SPA, TERMS)[-2:]
+    markdown = f"# SPA\n\n## ARTICLE 1. Sale\n\nText\n\n**ARTICLE 12 - Price**\n\nText.\n\n{STANDARD_ARTICLES_MARKER}\n\nIN WITNESS WHEREOF\n"
+    full = insert_standard_articles(markdown, articles)
+    assert "## ARTICLE 13. Governing Law\n\n13.1 " in full and "the Commercial Court of Paris shall" in full
+    assert STANDARD_ARTICLES_MARKER not in full and full.index("ARTICLE 14.") < full.index("IN WITNESS")
+    for size in (1, 3, 17):
+        inserter = StandardArticleInserter(articles)
+        assert "".join(inserter.feed(markdown[i:i + size]) for i in range(0, len(markdown), size)) + inserter.flush() == full
+    # Marqueur oublié par le modèle : articles en fin de document
+    assert insert_standard_articles("## ARTICLE 1. Sale\n\nText", articles).endswith("Commercial Court of Paris shall "
+        "have exclusive jurisdiction to settle any dispute or claim, whether contractual or non-contractual, arising out "
+        "of or in connection with this Agreement or its subject matter or formation.")
+
+def test_missing_marker_inserts_articles_before_the_signatures():
+    articles = clause_library.standard_articles(SPA, TERMS)
+    markdown = ("## ARTICLE 1. Sale\n\nText\n\n## ARTICLE 2. Price\n\nText.\n\n"
+                "IN WITNESS WHEREOF the Parties have signed this Agreement.\n\n## SIGNATURES\n\nAlpha SAS ________\n")
+    full = insert_standard_articles(markdown, articles)
+    assert full.index("ARTICLE 3.") < full.index(f"ARTICLE {2 + len(articles)}.") < full.index("IN WITNESS WHEREOF")
+    assert full.endswith("## SIGNATURES\n\nAlpha SAS ________\n")
+    for size in (1, 4, 9):
+        inserter = StandardArticleInserter(articles)
+        assert "".join(inserter.feed(markdown[i:i + size]) for i in range(0, len(markdown), size)) + inserter.flush() == full
+
+def test_unreadable_library_is_disabled(tmp_path):
+    library = ClauseLibrary(ClauseLibraryConfig(path=str(tmp_path / "missing.json")))
+    assert library.standard_articles(SPA, TERMS) == [] and library.fingerprint is None
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    prompts = []
+
+    class StubModel:
+        def __init__(self, generation_config):
+            self.generation_config = generation_config
+
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            if self.generation_config and "response_schema" in self.generation_config:
+                return SimpleNamespace(text=json.dumps({"title": "SPA", "sections": [
+                    {"number": 1, "heading": "Sale", "scope": "sale of the shares"},
+                    {"number": 2, "heading": "Governing Law and Jurisdiction", "scope": "governing law, courts"},
+                ]}), usage_metadata=None)
+            if "Draft ONLY Article" in prompt:
+                return SimpleNamespace(text="## ARTICLE 1. Sale\n\nThe Seller sells the Shares.", usage_metadata=None)
+            return SimpleNamespace(text=f"# SPA\n\n## ARTICLE 1. Sale\n\nText.\n\n{STANDARD_ARTICLES_MARKER}\n\nSignatures",
+                                   usage_metadata=None)
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(model_pool, "get", lambda name, system_instruction=None, generation_config=None: StubModel(generation_config))
+    return prompts
+
+@pytest.mark.asyncio
+async def test_single_draft_inserts_standard_articles(stub_models):
+    data = ContractData(SPA, {}, dict(TERMS), [], "", [{"role": "user", "parts": [{"text": "Draft an SPA"}]}])
+    markdown = await ContractGenerator("test", "test").generate_contract(data)
+    assert "- Entire Agreement" in stub_models[0] and STANDARD_ARTICLES_MARKER in stub_models[0]
+    assert "## ARTICLE 2. Entire Agreement" in markdown and markdown.endswith("Signatures")
+
+@pytest.mark.asyncio
+async def test_outline_sections_from_library_skip_the_model(stub_models):
+    data = ContractData(SPA, {}, dict(TERMS), [], "", [{"role": "user", "parts": [{"text": "Draft an SPA"}]}])
+    markdown, report = await ContractGenerator("test", "test").generate_contract_outlined(data)
+    assert report["standard_sections"] == [2]
+    assert len(stub_models) == 2  # plan + article 1
+    assert "## ARTICLE 2. Governing Law and Jurisdiction\n\n2.1 " in markdown and "2.2 Each Party" in markdown
+
+def test_cache_key_tracks_library_version(monkeypatch):
+    history = [{"role": "user", "parts": [{"text": "Draft an SPA"}]}]
+    key = contract_generator.cascade_cache_key(history, "m", None, None, "local")
+    monkeypatch.setattr(clause_library.config, "enabled", False)
+    assert contract_generator.cascade_cache_key(history, "m", None, None, "local") != key
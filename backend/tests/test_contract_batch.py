@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import llm_sdk
+from contract_generator import ContractGenerator, generate_contract_batch
+
+@pytest.mark.asyncio
+async def test_batch_fans_out_variants_with_shared_prefix(monkeypatch):
+    prompts = []
+    running = []
+    peak = []
+
+    async def fake_generate(self, contract_data, custom_prompt=None):
+        prompts.append(self._build_generation_prompt(contract_data, custom_prompt))
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return f"# AGREEMENT\n\n{contract_data.overrides}"
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(ContractGenerator, "generate_contract", fake_generate)
+    history = [{"role": "user", "parts": [{"text": "Draft a distribution agreement"}]}]
+    variants = [{"name": country, "overrides": {"Territory": country}} for country in ("France", "Germany", "Spain")]
+
+    events = [event async for event in generate_contract_batch(history, "test", "test", variants, max_concurrency=2)]
+
+    assert [event["event"] for event in events] == ["variant"] * 3 + ["done"]
+    assert sorted(event["data"]["name"] for event in events[:3]) == ["France", "Germany", "Spain"]
+    assert max(peak) == 2
+    # Les prompts ne diffèrent qu'en fin de texte
+    prefix = prompts[0].split("VARIANT OVERRIDES")[0]
+    assert all(prompt.startswith(prefix) for prompt in prompts)
+    assert sorted(prompt.rsplit("Territory: ", 1)[1].strip() for prompt in prompts) == ["France", "Germany", "Spain"]
+    assert events[-1]["data"]["succeeded"] == 3 and events[-1]["data"]["contracts_per_minute"] > 0
+
+    # Chaque variante a sa propre entrée de cache
+    again = [event async for event in generate_contract_batch(history, "test", "test", variants)]
+    assert len(prompts) == 3
+    assert all(event["data"]["data"]["cache"] == "hit" for event in again[:3])
+
+@pytest.mark.asyncio
+async def test_failed_variant_does_not_stop_the_batch(monkeypatch):
+    async def fake_generate(self, contract_data, custom_prompt=None):
+        if contract_data.overrides.get("Territory") == "Mars":
+            raise RuntimeError("no jurisdiction")
+        return "# AGREEMENT"
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(ContractGenerator, "generate_contract", fake_generate)
+    history = [{"role": "user", "parts": [{"text": "Draft a distribution agreement"}]}]
+    variants = [{"name": "earth", "overrides": {"Territory": "France"}}, {"name": "mars", "overrides": {"Territory": "Mars"}}]
+
+    events = [event async for event in generate_contract_batch(history, "test", "test", variants)]
+
+    assert sorted(event["event"] for event in events[:2]) == ["variant", "variant_error"]
+    assert events[-1]["data"]["failed"] == 1
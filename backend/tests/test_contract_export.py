@@ -0,0 +1,108 @@
+import asyncio
+import io
+import multiprocessing
+import re
+import time
+import zipfile
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import export_pool
+import main
+from contract_export import UnsupportedCharacters, parse_blocks, pdf_page_count, render_docx, render_pdf
+from document_store import DocumentStore
+from export_pool import ContractExporter, ExportCache, ExportConfig
+
+CONTRACT_HTML = "".join(
+    f"<h2>Article {i}. Purchase Price</h2>\n"
+    f"<p>The Purchaser shall pay <strong>EUR {i * 1000}</strong> to the Seller &amp; the <em>Escrow Agent</em>.</p>\n"
+    "<ol><li>on the Closing Date;</li><li>by wire transfer.</li></ol>\n"
+    "<table><tr><th>Instalment</th><td>&#8364; 2,500</td></tr></table>\n"
+    for i in range(1, 60)
+)
+
+def test_blocks_keep_structure_and_emphasis():
+    blocks = parse_blocks("<h1>Title</h1><p> Pay  <b>now</b> <i>or</i>\nlater </p><ul><li>one</li></ul><p>a<br>b</p>")
+    assert [block.kind for block in blocks] == ["heading", "paragraph", "item", "paragraph"]
+    assert blocks[1].runs == [("Pay ", False, False), ("now", True, False), (" ", False, False),
+                              ("or", False, True), (" later", False, False)]
+    assert blocks[2].marker == "•" and blocks[3].runs[1] == ("\n", False, False)
+
+def test_pdf_is_paginated_with_valid_xref():
+    data = render_pdf(CONTRACT_HTML)
+    assert data.startswith(b"%PDF-1.4") and data.rstrip().endswith(b"%%EOF")
+    pages = pdf_page_count(data)
+    assert pages > 5
+
+    startxref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+    assert data[startxref:startxref + 4] == b"xref"
+    offsets = [int(offset) for offset in re.findall(rb"(\d{10}) 00000 n", data)]
+    assert all(data[offset:].startswith(b"%d 0 obj" % (index + 1)) for index, offset in enumerate(offsets))
+
+    first_stream = re.search(rb"stream\n(.*?)\nendstream", data, re.DOTALL).group(1)
+    text = zlib.decompress(first_stream)
+    assert b"(Article 1. Purchase Price) Tj" in text and b"/F2" in text
+    assert f"(1 / {pages}) Tj".encode() in text
+
+def test_docx_is_a_valid_package():
+    data = render_docx(CONTRACT_HTML)
+    assert data == render_docx(CONTRACT_HTML)  # octets stables : le cache et les ETags restent valides
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert {"[Content_Types].xml", "word/document.xml", "word/styles.xml"} <= set(archive.namelist())
+    document = archive.read("word/document.xml").decode()
+    assert '<w:pStyle w:val="Heading2"/>' in document
+    assert '<w:rPr><w:b/></w:rPr><w:t xml:space="preserve">EUR 1000</w:t>' in document
+    assert "&amp; the " in document and "<w:tbl>" in document
+
+def test_pdf_rejects_characters_outside_winansi():
+    assert render_pdf("<p>Prix\u202f: 10\u00a0000 € – “net”</p>").startswith(b"%PDF")
+    with pytest.raises(UnsupportedCharacters) as excinfo:
+        render_pdf("<p>Signed by Łukasz Wąs ≥ 2 parties</p>")
+    assert "Ł" in str(excinfo.value) and "≥" in str(excinfo.value)
+
+@pytest.mark.asyncio
+async def test_process_pool_renders_and_caches(tmp_path):
+    exporter = ContractExporter(ExportConfig(workers=1), ExportCache(str(tmp_path)))
+    try:
+        first, second = await asyncio.gather(exporter.export(CONTRACT_HTML, "pdf"), exporter.export(CONTRACT_HTML, "pdf"))
+        assert first == second == render_pdf(CONTRACT_HTML)
+        assert await exporter.export(CONTRACT_HTML, "pdf") == first
+        stats = exporter.stats()
+        assert stats["renders"] == 1 and stats["shared"] == 1 and stats["cache_hits"] == 1
+    finally:
+        await exporter.shutdown()
+
+def test_export_endpoint_streams_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "exporter", ContractExporter(ExportConfig(workers=0), ExportCache(str(tmp_path))))
+    monkeypatch.setattr(main, "document_store", DocumentStore())
+    client = TestClient(main.app)
+
+    response = client.post("/api/export", json={"html": CONTRACT_HTML, "format": "docx", "filename": "SPA draft"})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="SPA draft.docx"'
+    assert zipfile.is_zipfile(io.BytesIO(response.content))
+
+    doc_id = client.post("/api/documents", json={"html": CONTRACT_HTML}).json()["doc_id"]
+    response = client.get(f"/api/documents/{doc_id}/export", params={"format": "pdf"})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/pdf"
+    assert response.content.startswith(b"%PDF")
+    assert client.get("/api/documents/unknown/export").status_code == 404
+
+def hung_render(export_format, html):
+    time.sleep(30)
+
+@pytest.mark.asyncio
+async def test_timed_out_render_kills_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_pool, "render_document", hung_render)
+    exporter = ContractExporter(ExportConfig(workers=1, timeout_seconds=1), ExportCache(str(tmp_path)))
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await exporter.export(CONTRACT_HTML, "pdf")
+        # Worker bloqué tué, nouveau pool au prochain export
+        assert exporter.stats()["pool_restarts"] == 1 and exporter._executor is None
+        await asyncio.sleep(0.2)
+        assert multiprocessing.active_children() == []
+    finally:
+        await exporter.shutdown()
@@ -0,0 +1,79 @@
+import pytest
+from contract_sections import (
+    apply_patches,
+    index_sections,
+    is_global_request,
+    parse_patch_response,
+    select_relevant_sections,
+)
+
+CONTRACT_HTML = (
+    "<h1>SERVICES AGREEMENT</h1>\n<p>Between Alpha SA and Beta Ltd.</p>\n"
+    "<h2>Article 1 - Services</h2>\n<p>The Provider shall deliver consulting services.</p>\n"
+    "<p><strong>ARTICLE 2 - Fees</strong></p>\n<p>The Client shall pay a fee of EUR 10,000 per month.</p>\n"
+    "<h2>Article 3 - Governing Law</h2>\n<p>This Agreement is governed by French law.</p>\n"
+)
+
+def test_index_sections_is_lossless():
+    sections = index_sections(CONTRACT_HTML)
+
+    assert [s.id for s in sections] == ["s0", "s1", "s2", "s3"]
+    assert sections[2].title.startswith("ARTICLE 2 - Fees")
+    assert "".join(s.html for s in sections) == CONTRACT_HTML
+
+def test_long_sections_are_split_on_block_boundaries():
+    html = "<h2>Article 1</h2>" + ("<p>" + "y" * 50 + "</p>") * 6
+    sections = index_sections(html, max_section_chars=120)
+
+    assert len(sections) > 1
+    assert "".join(s.html for s in sections) == html
+
+def test_select_relevant_sections():
+    sections = index_sections(CONTRACT_HTML)
+
+    assert [s.id for s in select_relevant_sections(sections, "Change the monthly fee to EUR 12,000")] == ["s2"]
+    assert [s.id for s in select_relevant_sections(sections, "In Article 3, use English law")][0] == "s3"
+    assert is_global_request("Rewrite the document in plain English")
+    assert not is_global_request("Change the fee in Article 2")
+    assert is_global_request("Use 'Purchaser' throughout") and is_global_request("Check all articles for typos")
+    assert not is_global_request("Complete the notice address in Article 12")
+    assert not is_global_request("Strengthen the entire agreement clause")
+
+def test_apply_patches():
+    sections = index_sections(CONTRACT_HTML)
+    data = parse_patch_response(
+        '```json\n{"patches": ['
+        '{"op": "replace", "section_id": "s2", "html": "<h2>Article 2 - Fees</h2>\\n<p>EUR 12,000.</p>\\n"},'
+        '{"op": "insert_after", "section_id": "s3", "html": "<h2>Article 4 - Notices</h2>"},'
+        '{"op": "delete", "section_id": "s1"}'
+        '], "message": "ok"}\n```'
+    )
+
+    html = apply_patches(sections, data["patches"])
+
+    assert "EUR 12,000." in html and "EUR 10,000" not in html
+    assert "consulting services" not in html
+    assert html.endswith("<h2>Article 4 - Notices</h2>")
+    assert html.startswith("<h1>SERVICES AGREEMENT</h1>")
+
+def test_apply_patches_rejects_unknown_sections():
+    with pytest.raises(ValueError):
+        apply_patches(index_sections(CONTRACT_HTML), [{"op": "replace", "section_id": "s42", "html": ""}])
+
+def test_apply_patches_only_edits_sections_sent_to_the_model():
+    sections = index_sections(CONTRACT_HTML)
+    with pytest.raises(ValueError):
+        apply_patches(sections, [{"op": "delete", "section_id": "s1"}], editable=["s2"])
+    html = apply_patches(sections, [{"op": "insert_after", "section_id": "s3", "html": "<p>New</p>"}], editable=["s2"])
+    assert html.endswith("<p>New</p>")
+
+@pytest.mark.parametrize("patch", ["replace s2", None, {"op": "replace", "section_id": ["s2"]},
+                                   {"op": "replace", "section_id": "s2", "html": 42}])
+def test_apply_patches_rejects_malformed_patches(patch):
+    with pytest.raises(ValueError):
+        apply_patches(index_sections(CONTRACT_HTML), [patch])
+
+def test_apply_patches_rejects_conflicting_patches():
+    patches = [{"op": "replace", "section_id": "s2", "html": "<p>A</p>"}, {"op": "delete", "section_id": "s2"}]
+    with pytest.raises(ValueError):
+        apply_patches(index_sections(CONTRACT_HTML), patches)
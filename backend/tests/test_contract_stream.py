@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+import llm_sdk
+from contract_generator import (
+    ContractGenerator,
+    MarkdownSectionSplitter,
+    generate_contract_cascade_stream,
+)
+
+CONTRACT_MARKDOWN = (
+    "# SHARE PURCHASE AGREEMENT\n\nBetween Alpha SA and Beta Ltd.\n\n"
+    "## ARTICLE 1 - DEFINITIONS\n\n" + "Definition text. " * 10 + "\n\n"
+    "## ARTICLE 2 - PRICE\n\n" + "Price text. " * 10 + "\n"
+)
+
+def test_splitter_emits_sections_at_headings():
+    """Les sections ne sont émises qu'une fois le titre suivant reçu, même coupé entre deux morceaux."""
+    splitter = MarkdownSectionSplitter(min_section_chars=0)
+    sections = []
+    for i in range(0, len(CONTRACT_MARKDOWN), 7):
+        sections.extend(splitter.feed(CONTRACT_MARKDOWN[i:i + 7]))
+    sections.append(splitter.flush())
+
+    assert len(sections) == 3
+    assert sections[0].startswith("# SHARE PURCHASE AGREEMENT")
+    assert sections[1].startswith("## ARTICLE 1")
+    assert sections[2].startswith("## ARTICLE 2")
+    assert "\n".join(sections).strip() == CONTRACT_MARKDOWN.strip()
+
+def test_splitter_merges_small_sections():
+    splitter = MarkdownSectionSplitter(min_section_chars=10_000)
+    assert splitter.feed(CONTRACT_MARKDOWN) == []
+    assert splitter.flush() == CONTRACT_MARKDOWN.strip()
+
+@pytest.mark.asyncio
+async def test_cascade_stream_overlaps_drafting_and_formatting(monkeypatch):
+    """Le HTML des premières sections arrive avant la fin de la rédaction."""
+    chunks = [CONTRACT_MARKDOWN[i:i + 40] for i in range(0, len(CONTRACT_MARKDOWN), 40)]
+
+    async def fake_stream(self, contract_data, custom_prompt=None):
+        for chunk in chunks:
+            await asyncio.sleep(0.01)  # latence réseau simulée
+            yield chunk
+
+    async def fake_format(self, contract_text, html_prompt=None):
+        return f"<section>{contract_text.splitlines()[0]}</section>"
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(ContractGenerator, "generate_contract_stream", fake_stream)
+    monkeypatch.setattr(ContractGenerator, "format_to_html", fake_format)
+
+    events = [event async for event in generate_contract_cascade_stream(
+        [], api_key="test", model_name="test", html_renderer="llm", min_section_chars=0
+    )]
+
+    kinds = [event["event"] for event in events]
+    assert kinds[-1] == "done"
+    assert kinds.count("markdown") == len(chunks)
+    assert kinds.count("html_section") == 3
+    last_markdown = len(kinds) - 1 - kinds[::-1].index("markdown")
+    assert kinds.index("html_section") < last_markdown
+
+    indexes = [e["data"]["index"] for e in events if e["event"] == "html_section"]
+    assert indexes == [0, 1, 2]
+
+    done = events[-1]["data"]
+    assert done["markdown"] == CONTRACT_MARKDOWN
+    assert done["html"].startswith("<section># SHARE PURCHASE AGREEMENT</section>")
+    assert done["data"]["sections"] == 3
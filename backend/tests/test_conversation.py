@@ -0,0 +1,44 @@
+from conversation import Conversation, Message, history_prefix_keys
+from main import ChatRequest
+from result_cache import normalize_history
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+RAW = [message("model", "Quel  est le prix ?"), "bad", {"role": "user"}, {"role": "user", "text": "10 M€"}]
+
+def test_parse_drops_malformed_messages():
+    conversation = Conversation.parse(RAW)
+    assert [m.role for m in conversation] == ["model", "user"]
+    assert conversation.contents == [RAW[0], message("user", "10 M€")]
+    assert conversation.contents[0] is RAW[0]
+    assert Conversation.parse(conversation) is conversation
+
+def test_cached_views():
+    conversation = Conversation.parse(RAW)
+    assert conversation.transcript == "MODEL: Quel  est le prix ?\nUSER: 10 M€"
+    assert conversation.normalized == [["model", "Quel est le prix ?"], ["user", "10 M€"]]
+    assert conversation.prefix_keys == history_prefix_keys(conversation.normalized)
+    assert conversation.last_model_text == "Quel  est le prix ?"
+    assert conversation.transcript is conversation.transcript
+
+def test_prefix_slice_reuses_keys():
+    conversation = Conversation.parse(RAW) + [message("model", "Noté.")]
+    keys = conversation.prefix_keys
+    prefix = conversation[:2]
+    assert prefix._prefix_keys == keys[:3]
+    assert prefix.prefix_keys == Conversation(list(prefix)).prefix_keys
+    assert conversation[-1] == Message("model", "Noté.")
+
+def test_request_history_is_parsed_at_validation():
+    request = ChatRequest(text="ok", history=RAW)
+    assert isinstance(request.history, Conversation) and len(request.history) == 2
+    assert request.model_dump()["history"] == request.history.contents
+    assert len(ChatRequest(text="ok").history) == 0
+
+def test_keys_match_the_pre_parsing_derivation():
+    # Fiches et résumés déjà enregistrés : les empreintes ne doivent pas changer
+    history = [message("user", "Prix :  10 M€"), message("model", "Noté.")]
+    conversation = Conversation.parse(history)
+    assert conversation.prefix_keys == history_prefix_keys(normalize_history(history))
+    assert history_prefix_keys(conversation.contents) == history_prefix_keys(history)
@@ -0,0 +1,68 @@
+import pytest
+
+from conversation_compactor import CompactionConfig, ConversationCompactor, message_tokens
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+def conversation(turns, size=400):
+    history = []
+    for i in range(turns):
+        history.append(message("model", f"Question {i}? " + "q" * size))
+        history.append(message("user", f"Answer {i}. " + "a" * size))
+    return history
+
+def total(history):
+    return sum(message_tokens(msg) for msg in history)
+
+@pytest.fixture
+def compactor():
+    compactor = ConversationCompactor(CompactionConfig(max_prompt_tokens=1500, keep_recent_messages=4))
+    compactor.summarized = []
+
+    async def fake_summarize(summary, messages):
+        compactor.summarized.append(len(messages))
+        return (summary + " " if summary else "") + f"{len(messages)} messages"
+
+    compactor._summarize = fake_summarize
+    return compactor
+
+@pytest.mark.asyncio
+async def test_short_history_is_untouched(compactor):
+    history = conversation(2)
+    assert await compactor.compact(history) is history
+    assert compactor.summarized == []
+
+@pytest.mark.asyncio
+async def test_old_messages_are_summarized_incrementally(compactor):
+    history = conversation(10)
+    compacted = await compactor.compact(history, reserve_tokens=100)
+    assert total(compacted) <= 1400
+    assert compacted[-4:] == history[-4:]
+    assert "Summary of the earlier conversation" in compacted[0]['parts'][0]['text']
+    assert compactor.summarized == [16]
+
+    # Tour suivant : le résumé existant est réutilisé tant que le reste tient dans le budget
+    longer = history + conversation(1, size=40)
+    compacted = await compactor.compact(longer, reserve_tokens=100)
+    assert compactor.summarized == [16]
+    assert compacted[-2:] == longer[-2:]
+
+    # Beaucoup plus long : seuls les nouveaux messages anciens sont résumés
+    much_longer = history + conversation(6)
+    compacted = await compactor.compact(much_longer, reserve_tokens=100)
+    assert compactor.summarized == [16, 12]
+    assert total(compacted) <= 1400
+
+@pytest.mark.asyncio
+async def test_ceiling_holds_without_summary(compactor):
+    async def failing_summarize(summary, messages):
+        return None
+
+    compactor._summarize = failing_summarize
+    compacted = await compactor.compact(conversation(10), reserve_tokens=100)
+    assert total(compacted) <= 1400
+
+    huge = [message("user", "x" * 20000)]
+    compacted = await compactor.compact(huge)
+    assert total(compacted) <= 1500
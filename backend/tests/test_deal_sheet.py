@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+
+from contract_generator import cascade_cache_key
+from deal_sheet import DealSheetConfig, DealSheetTracker, JsonObjectStream, empty_deal_sheet, merge_deal_sheet
+from fake_llm import FakeLLMConfig
+from model_pool import model_pool
+from result_cache import DiskResultCache
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+def test_stream_parser_decodes_object_split_across_chunks():
+    payload = json.dumps({"contract_type": "SPA {draft}", "parties": [{"role": "Seller", "description": "Say \"hi\""}]})
+    text = "```json\n" + payload + "\n```"
+    parser = JsonObjectStream()
+    results = [parser.feed(text[i:i + 7]) for i in range(0, len(text), 7)]
+    assert parser.complete
+    assert parser.value == json.loads(payload)
+    # L'objet est disponible dès son accolade fermante, avant la fin du texte
+    assert results[-1] == parser.value and results.count(None) < len(results) - 1
+
+def test_merge_updates_by_key_and_dedupes_clauses():
+    sheet = merge_deal_sheet({}, {
+        "contract_type": "Share purchase agreement",
+        "parties": [{"role": "Seller", "description": "Alpha SAS"}],
+        "key_terms": [{"name": "Price", "value": "EUR 10m"}],
+        "special_clauses": ["Earn-out"],
+    })
+    sheet = merge_deal_sheet(sheet, {
+        "contract_type": "",
+        "parties": [{"role": "Buyer", "description": "Beta GmbH"}],
+        "key_terms": [{"name": "Price", "value": "EUR 12m"}],
+        "special_clauses": ["earn-out", "Non-compete"],
+    })
+    assert sheet["contract_type"] == "Share purchase agreement"
+    assert sheet["parties"] == {"Seller": "Alpha SAS", "Buyer": "Beta GmbH"}
+    assert sheet["key_terms"] == {"Price": "EUR 12m"}
+    assert sheet["special_clauses"] == ["Earn-out", "Non-compete"]
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = DealSheetTracker(DiskResultCache(str(tmp_path / "sheets")), DealSheetConfig())
+    tracker.extracted = []
+
+    async def fake_extract(sheet, messages):
+        tracker.extracted.append(len(messages))
+        return {"key_terms": [{"name": f"term{len(tracker.extracted)}", "value": messages[-1].text}]}
+
+    tracker._extract_delta = fake_extract
+    return tracker
+
+@pytest.mark.asyncio
+async def test_only_new_messages_are_extracted(tracker):
+    history = [message("model", "Objective?"), message("user", "Buy Alpha")]
+    sheet = await tracker.update(history)
+    assert sheet["key_terms"] == {"term1": "Buy Alpha"}
+
+    history += [message("model", "Price?"), message("user", "EUR 10m")]
+    sheet = await tracker.update(history)
+    assert tracker.extracted == [2, 2]
+    assert sheet["key_terms"] == {"term1": "Buy Alpha", "term2": "EUR 10m"}
+
+    # Historique déjà couvert : ni extraction ni appel au modèle
+    assert await tracker.update(history) == sheet
+    assert tracker.extracted == [2, 2]
+    assert await tracker.current(history + [message("model", "Shall we proceed?")]) == (4, sheet)
+
+@pytest.mark.asyncio
+async def test_failed_extraction_keeps_last_sheet(tracker):
+    history = [message("user", "Buy Alpha")]
+    sheet = await tracker.update(history)
+
+    async def failing_extract(sheet, messages):
+        raise RuntimeError("boom")
+
+    tracker._extract_delta = failing_extract
+    assert await tracker.update(history + [message("model", "Price?")]) == sheet
+    assert tracker.counters['failures'] == 1
+
+@pytest.fixture
+def fake_backend():
+    model_pool.set_backend("fake", FakeLLMConfig(ttft=0, tokens_per_second=0, chunk_tokens=3, seed=1))
+    yield
+    model_pool.set_backend("gemini")
+
+@pytest.mark.asyncio
+async def test_schema_constrained_extraction_on_fake_backend(tmp_path, fake_backend):
+    tracker = DealSheetTracker(DiskResultCache(str(tmp_path / "sheets")), DealSheetConfig(model_name="fake"))
+    sheet = await tracker.update([message("user", "Sell Alpha SAS to Beta GmbH for EUR 10m")])
+    assert sheet["contract_type"] and sheet["parties"] and sheet["key_terms"]
+    assert tracker.counters['updates'] == 1
+
+@pytest.mark.asyncio
+async def test_background_updates_are_debounced_per_conversation(tracker):
+    tracker.config.debounce_seconds = 0.05
+    history = [message("model", "Objective?"), message("user", "Buy Alpha")]
+    tracker.schedule(history)
+    tracker.schedule(history + [message("model", "Price?"), message("user", "EUR 10m")])
+    await asyncio.sleep(0.1)
+    # Deux tours rapprochés : une seule extraction, sur le dernier historique
+    assert tracker.extracted == [4]
+    assert tracker.counters['debounced'] == 1
+    await tracker.shutdown()
+
+@pytest.mark.asyncio
+async def test_conversations_sharing_the_opening_message_are_debounced_separately(tracker):
+    tracker.config.debounce_seconds = 0.05
+    opening = message("model", "For this new mandate, what is the primary strategic objective?")
+    tracker.schedule([opening, message("user", "Alice: buy Alpha SAS")])
+    tracker.schedule([opening, message("user", "Bob: lease offices in Lyon")])
+    await asyncio.sleep(0.1)
+    assert sorted(tracker.extracted) == [2, 2]
+    assert tracker.counters['debounced'] == 0
+    await tracker.shutdown()
+
+@pytest.mark.asyncio
+async def test_drafting_flushes_the_pending_update(tracker):
+    tracker.config.debounce_seconds = 60
+    history = [message("model", "Shall we proceed?"), message("user", "Price EUR 12m, yes")]
+    tracker.schedule(history)
+    sheet = await asyncio.wait_for(tracker.settle(history), timeout=1)
+    assert sheet["key_terms"] == {"term1": "Price EUR 12m, yes"}
+    assert tracker.counters['flushed'] == 1 and tracker._debounced == {}
+    # Fiche à jour : pas de nouvelle extraction
+    assert await tracker.settle(history) == sheet and tracker.extracted == [2]
+    await tracker.shutdown()
+
+def test_cache_key_tracks_the_stored_deal_sheet():
+    history = [message("user", "Draft an SPA")]
+    key = cascade_cache_key(history, "m", None, None, "local", deal_sheet=empty_deal_sheet())
+    assert cascade_cache_key(history, "m", None, None, "local") == key
+    sheet = {**empty_deal_sheet(), "key_terms": {"Price": "EUR 12m"}}
+    assert cascade_cache_key(history, "m", None, None, "local", deal_sheet=sheet) != key
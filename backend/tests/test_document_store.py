@@ -0,0 +1,86 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from document_store import DocumentStore, VersionConflict, apply_diff, diff_html
+
+CONTRACT_HTML = "".join(
+    f"<h2>Article {i}</h2>\n<p>The Purchaser shall pay EUR {i * 1000} to the Seller.</p>\n" for i in range(1, 200)
+)
+
+def test_diff_round_trip():
+    target = CONTRACT_HTML.replace("EUR 5000", "EUR 6000").replace("<h2>Article 150</h2>\n", "")
+    ops = diff_html(CONTRACT_HTML, target)
+    assert apply_diff(CONTRACT_HTML, ops) == target
+    assert len(str(ops)) < len(target) / 20
+
+    rng = random.Random(1)
+    pieces = ["<p>", "</p>", "<h2>", "a", "b", " "]
+    for _ in range(200):
+        base = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+        other = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+        assert apply_diff(base, diff_html(base, other)) == other
+    with pytest.raises(ValueError):
+        apply_diff("short", [["=", 10]])
+
+def test_versions_are_kept_as_deltas():
+    store = DocumentStore(max_versions=3)
+    document = store.create("<p>v1</p>")
+    store.commit(document.id, "<p>v2</p>", base_version=1)
+    latest, diff = store.commit(document.id, "<p>v3</p><p>more</p>", base_version=2)
+
+    assert latest.version == 3 and apply_diff("<p>v2</p>", diff) == latest.html
+    assert store.get(document.id, 1).html == "<p>v1</p>"
+    with pytest.raises(VersionConflict):
+        store.commit(document.id, "<p>late</p>", base_version=2)
+
+    restored, diff = store.restore(document.id, 1)
+    assert restored.version == 4 and restored.html == "<p>v1</p>"
+    assert [version.version for version in store.versions(document.id)] == [2, 3, 4]
+    with pytest.raises(KeyError):
+        store.get(document.id, 1)
+
+def test_modify_by_document_id_returns_a_diff(monkeypatch):
+    async def fake_patch(request):
+        return {"response": "✓ Document updated successfully",
+                "modified_html": request.current_html.replace("EUR 3000", "EUR 3500")}
+
+    monkeypatch.setattr(main, "document_store", DocumentStore())
+    monkeypatch.setattr(main, "modify_contract_with_patches", fake_patch)
+    client = TestClient(main.app)
+
+    document = client.post("/api/documents", json={"html": CONTRACT_HTML}).json()
+    response = client.post("/api/modify_contract", json={
+        "doc_id": document["doc_id"], "base_version": 1, "modification_request": "Raise the price in Article 3"
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert "modified_html" not in body and body["version"] == 2 and body["base_version"] == 1
+    assert apply_diff(CONTRACT_HTML, body["diff"]) == CONTRACT_HTML.replace("EUR 3000", "EUR 3500")
+
+    stale = client.post("/api/modify_contract", json={
+        "doc_id": document["doc_id"], "base_version": 1, "modification_request": "Anything"
+    })
+    assert stale.status_code == 409 and stale.json()["detail"]["version"] == 2
+
+    undo = client.post(f"/api/documents/{document['doc_id']}/undo", json={"base_version": 2}).json()
+    assert undo["version"] == 3
+    latest = client.get(f"/api/documents/{document['doc_id']}", headers={"Accept-Encoding": "gzip"})
+    assert latest.json()["html"] == CONTRACT_HTML and latest.headers["content-encoding"] == "gzip"
+    assert client.post("/api/modify_contract", json={"modification_request": "x"}).status_code == 400
+
+def test_streams_are_not_compressed_and_workers_need_a_shared_store(monkeypatch):
+    async def export(html, export_format):
+        return b"%PDF-1.4 " + b"x" * 4096
+
+    monkeypatch.setattr(main.exporter, "export", export)
+    client = TestClient(main.app)
+    response = client.post("/api/export", json={"html": CONTRACT_HTML}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and "content-encoding" not in response.headers
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.delenv("DOCUMENT_DB_PATH", raising=False)
+    with pytest.raises(ValueError):
+        DocumentStore.from_env()
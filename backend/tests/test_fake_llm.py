@@ -0,0 +1,97 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_sdk
+from fake_llm import FakeGenerativeModel, FakeLLMConfig, response_kind
+from main import app
+from model_pool import model_pool
+from observability import track_llm_call
+
+FAST = FakeLLMConfig(ttft=0, tokens_per_second=0, chunk_tokens=5, output_tokens=80, seed=1)
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    model_pool.set_backend("fake", FAST)
+    yield
+    model_pool.set_backend("gemini")
+
+@pytest.mark.asyncio
+async def test_fake_model_streams_in_chunks():
+    model = FakeGenerativeModel(config=FAST)
+    response = await model.generate_content_async("Draft the agreement", stream=True)
+    chunks = [chunk.text async for chunk in response]
+    assert len(chunks) > 1
+    assert response.text == "".join(chunks)
+    assert response.usage_metadata.candidates_token_count > 0
+
+@pytest.mark.asyncio
+async def test_fake_model_can_fail_with_429():
+    from google.api_core.exceptions import ResourceExhausted
+    model = FakeGenerativeModel(config=FakeLLMConfig(ttft=0, error_rate=1.0))
+    with pytest.raises(ResourceExhausted):
+        await model.generate_content_async("Draft the agreement")
+
+@pytest.mark.asyncio
+async def test_fake_model_replays_recordings_by_kind(tmp_path):
+    recordings = tmp_path / "recording.jsonl"
+    recordings.write_text("\n".join(json.dumps(entry) for entry in [
+        {"kind": response_kind("You are an assistant", None, "Hi"), "text": "Recorded chat reply.", "ttft_ms": 5, "duration_ms": 10},
+        {"kind": "text", "text": "# RECORDED AGREEMENT", "ttft_ms": 0, "duration_ms": 0},
+    ]))
+    config = FakeLLMConfig(replay_path=str(recordings), seed=1)
+
+    chat = FakeGenerativeModel(system_instruction="You are an assistant", config=config).start_chat()
+    response = await chat.send_message_async("Hello", stream=True)
+    assert "".join([chunk.text async for chunk in response]) == "Recorded chat reply."
+
+    draft = await FakeGenerativeModel(config=config).generate_content_async("Draft the agreement")
+    assert draft.text == "# RECORDED AGREEMENT"
+
+    # Catégorie sans enregistrement : texte simulé
+    html = await FakeGenerativeModel(config=FakeLLMConfig(ttft=0, tokens_per_second=0, replay_path=str(recordings))).generate_content_async("Format in HTML")
+    assert html.text.startswith("<h1>AGREEMENT</h1>")
+
+@pytest.mark.asyncio
+async def test_recordings_are_replayed_by_call_site(tmp_path):
+    recordings = tmp_path / "recording.jsonl"
+    recordings.write_text("\n".join(json.dumps(entry) for entry in [
+        {"kind": "compact/text", "text": "- recorded summary", "ttft_ms": 0, "duration_ms": 0},
+        {"kind": "draft/text", "text": "# RECORDED AGREEMENT", "ttft_ms": 0, "duration_ms": 0},
+    ]))
+    model = FakeGenerativeModel(config=FakeLLMConfig(replay_path=str(recordings)))
+
+    with track_llm_call("compact", "fake"):
+        assert (await model.generate_content_async("Summarize")).text == "- recorded summary"
+    with track_llm_call("draft", "fake"):
+        assert response_kind(None, None, "Draft") == "draft/text"
+        assert (await model.generate_content_async("Draft the agreement")).text == "# RECORDED AGREEMENT"
+    assert response_kind(None, None, "Draft") == "text"
+
+def test_endpoints_run_on_fake_backend(fake_backend):
+    client = TestClient(app)
+    history = [{"role": "user", "parts": [{"text": "Share purchase of Beta Ltd, English law."}]}]
+
+    chat = client.post("/api/chat", json={"text": "Bonjour", "history": history})
+    assert chat.status_code == 200
+    assert "AGREEMENT" in chat.text
+
+    contract = client.post("/api/generate_contract", json={"history": history, "use_cache": False})
+    assert contract.status_code == 200
+    assert contract.json()["status"] == "success"
+    assert "AGREEMENT" in contract.json()["contract_html"]
+
+    stats = client.get("/api/stats").json()
+    assert stats["model_pool"]["backend"] == "fake"
+
+def test_modify_contract_patches_on_fake_backend(fake_backend):
+    client = TestClient(app)
+    html = "<h1>AGREEMENT</h1>\n" + "\n".join(
+        f"<h2>Article {i}</h2>\n<p>{'Clause text. ' * 30}</p>" for i in range(1, 6)
+    )
+    response = client.post("/api/modify_contract", json={
+        "current_html": html, "modification_request": "In Article 2, add a notice clause."
+    })
+    assert response.status_code == 200
+    assert "Amended." in json.dumps(response.json())
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+
+from hedging import HedgingConfig, HedgingPolicy
+from llm_scheduler import SchedulerConfig, llm_scheduler
+from llm_sdk import api_exceptions
+
+class SlowStream:
+    def __init__(self, chunks, ttft):
+        self.chunks, self.ttft = chunks, ttft
+        self.usage_metadata = None
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.ttft)
+        for chunk in self.chunks:
+            yield chunk
+
+def opener(ttft_by_model, opened):
+    async def open_stream(model_name):
+        opened.append(model_name)
+        if ttft_by_model[model_name] is None:
+            raise api_exceptions.ServiceUnavailable("upstream failure")
+        return SlowStream([f"{model_name}-1", f"{model_name}-2"], ttft_by_model[model_name])
+    return open_stream
+
+def policy(**overrides):
+    config = HedgingConfig(fallback_model="flash", ttft_slo={"chat": 0.05})
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return HedgingPolicy(config)
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged():
+    hedger, opened = policy(), []
+    async with hedger.stream("chat", "pro", opener({"pro": 0, "flash": 0}, opened)) as response:
+        chunks = [chunk async for chunk in response]
+    assert chunks == ["pro-1", "pro-2"]
+    assert opened == ["pro"]
+    assert hedger.stats()['hedges'] == 0
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_loser_cancelled():
+    hedger, opened = policy(), []
+    async with hedger.stream("chat", "pro", opener({"pro": 1.0, "flash": 0}, opened)) as response:
+        chunks = [chunk async for chunk in response]
+        assert response.model_name == "flash"
+    assert chunks == ["flash-1", "flash-2"]
+    stats = hedger.stats()
+    assert (stats['hedges'], stats['hedge_wins'], stats['hedge_rate']) == (1, 1, 1.0)
+    # Les deux créneaux sont rendus : le perdant a été annulé
+    assert llm_scheduler.stats()['in_flight'] == {}
+
+@pytest.mark.asyncio
+async def test_failures_fall_back_to_the_fallback_model():
+    hedger, opened = policy(), []
+    async with hedger.stream("draft", "pro", opener({"pro": None, "flash": 0}, opened)) as response:
+        chunks = [chunk async for chunk in response]
+    assert chunks == ["flash-1", "flash-2"]
+
+    async def call_model(model_name):
+        if model_name == "pro":
+            raise api_exceptions.DeadlineExceeded("upstream timeout")
+        return model_name
+
+    assert await hedger.call("extract", "pro", call_model) == "flash"
+    assert hedger.stats()['fallbacks'] == 2
+
+    with pytest.raises(api_exceptions.DeadlineExceeded):
+        await policy(fallback_model=None).call("extract", "pro", call_model)
+
+@pytest.mark.asyncio
+async def test_programming_errors_are_not_retried_on_the_fallback():
+    hedger, opened = policy(), []
+
+    async def broken(model_name):
+        opened.append(model_name)
+        raise TypeError("bad argument")
+
+    with pytest.raises(TypeError):
+        await hedger.call("extract", "pro", broken)
+    with pytest.raises(TypeError):
+        async with hedger.stream("draft", "pro", broken):
+            pass
+    assert opened == ["pro", "pro"] and hedger.stats()['fallbacks'] == 0
+
+@pytest.mark.asyncio
+async def test_scheduler_queue_wait_does_not_trigger_a_hedge():
+    hedger, opened = policy(), []
+    previous = llm_scheduler.config
+    llm_scheduler.configure(SchedulerConfig(model_concurrency={"pro": 1}))
+    try:
+        await llm_scheduler.acquire("pro")
+        asyncio.get_running_loop().call_later(0.2, llm_scheduler.release, "pro")
+        async with hedger.stream("chat", "pro", opener({"pro": 0, "flash": 0}, opened)) as response:
+            chunks = [chunk async for chunk in response]
+    finally:
+        llm_scheduler.configure(previous)
+    assert chunks == ["pro-1", "pro-2"] and opened == ["pro"]
+    assert hedger.stats()['hedges'] == 0
+
+@pytest.mark.asyncio
+async def test_failed_stream_close_is_logged(capsys):
+    class BrokenStream(SlowStream):
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            return "pro-1"
+
+        async def aclose(self):
+            raise RuntimeError("socket already closed")
+
+    async def open_stream(model_name):
+        return BrokenStream([], 0)
+
+    async with policy().stream("chat", "pro", open_stream) as response:
+        async for chunk in response:
+            break
+    assert "socket already closed" in capsys.readouterr().out
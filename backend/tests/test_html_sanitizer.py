@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import html_sanitizer
+from html_sanitizer import OFFLOAD_MIN_CHARS, HtmlSanitizer, sanitize_html, sanitize_html_async
+
+FULL_DOCUMENT = """```html
+<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>SPA</title><style>p { color: red }</style></head>
+<body>
+<h1>Share Purchase Agreement</h1>
+<p>Price: EUR 10m &amp; escrow &#8364;1m</p>
+</body></html>
+```"""
+
+def test_document_is_reduced_to_body_content():
+    assert sanitize_html(FULL_DOCUMENT) == (
+        "<h1>Share Purchase Agreement</h1>\n<p>Price: EUR 10m &amp; escrow &#8364;1m</p>"
+    )
+    assert sanitize_html("```html<p>Text</p>```") == "<p>Text</p>"
+    assert sanitize_html("Use `escrow` instead.") == "Use `escrow` instead."
+
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_chunked_input_gives_the_same_result(size):
+    sanitizer = HtmlSanitizer()
+    chunks = [FULL_DOCUMENT[i:i + size] for i in range(0, len(FULL_DOCUMENT), size)]
+    assert "".join(sanitizer.feed(chunk) for chunk in chunks) + sanitizer.close() == sanitize_html(FULL_DOCUMENT)
+
+def test_tag_structure_is_repaired():
+    sanitizer = HtmlSanitizer()
+    html = sanitizer.feed("<p>One<p>Two <b>bold</i></b></div><ul><li>a<li>b</ul><section><em>x</section><div>") + sanitizer.close()
+    assert html == "<p>One</p><p>Two <b>bold</b></p><ul><li>a</li><li>b</li></ul><section><em>x</em></section><div></div>"
+    assert sanitizer.issues == [
+        {'type': 'stray_end_tag', 'tag': 'i'},
+        {'type': 'stray_end_tag', 'tag': 'div'},
+        {'type': 'misnested_tag', 'tag': 'em'},
+        {'type': 'unclosed_tag', 'tag': 'div'},
+    ]
+
+def test_plain_text_has_no_markup():
+    sanitizer = HtmlSanitizer()
+    sanitizer.feed("I would advise keeping the current clause.")
+    sanitizer.close()
+    assert not sanitizer.saw_markup
+
+@pytest.mark.asyncio
+async def test_large_documents_are_sanitized_off_the_event_loop(monkeypatch):
+    offloaded = []
+    to_thread = asyncio.to_thread
+
+    async def spy(func, *args):
+        offloaded.append(func)
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(html_sanitizer.asyncio, "to_thread", spy)
+    html, sanitizer = await sanitize_html_async(FULL_DOCUMENT)
+    assert html == sanitize_html(FULL_DOCUMENT) and sanitizer.saw_markup and offloaded == []
+
+    large = "<p>" + "clause " * OFFLOAD_MIN_CHARS + "</p>"
+    html, _ = await sanitize_html_async(large)
+    assert html == large and len(offloaded) == 1
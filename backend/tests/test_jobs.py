@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_sdk
+import main
+from fake_llm import FakeLLMConfig
+from jobs import JobManager, JobQueueFull
+from model_pool import model_pool
+from result_cache import DiskResultCache
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(DiskResultCache(str(tmp_path / "jobs")), max_workers=1, max_queued=1, poll_interval=0.01)
+
+@pytest.mark.asyncio
+async def test_job_progress_and_result_are_persisted(manager, tmp_path):
+    async def run(progress):
+        progress("drafting")
+        await asyncio.sleep(0.01)
+        progress("formatting")
+        return {"contract_html": "<p>ok</p>"}
+
+    job = manager.submit("generate_contract", run)
+    events = [event async for event in manager.follow(job.id)]
+
+    assert [data['stage'] for kind, data in events if kind == 'progress'] == [
+        "queued", "started", "drafting", "formatting", "done"
+    ]
+    assert events[-1][0] == 'done'
+    # Relisible depuis le disque, par exemple depuis un autre worker
+    other = JobManager(DiskResultCache(str(tmp_path / "jobs")))
+    assert (await other.get(job.id)).result == {"contract_html": "<p>ok</p>"}
+    await manager.shutdown()
+
+@pytest.mark.asyncio
+async def test_job_writes_run_in_a_thread_and_are_coalesced(manager):
+    writes = []
+    store_set = manager.store.set
+
+    def recording_set(key, value):
+        writes.append((threading.current_thread() is threading.main_thread(), value['stage']))
+        store_set(key, value)
+
+    manager.store.set = recording_set
+
+    async def run(progress):
+        for section in range(20):
+            progress(f"section {section}")
+        return {"contract_html": "<p>ok</p>"}
+
+    job = manager.submit("generate_contract", run)
+    events = [event async for event in manager.follow(job.id)]
+    assert len([kind for kind, _ in events if kind == 'progress']) == 23
+    assert not any(on_loop for on_loop, _ in writes) and len(writes) < 23
+    assert writes[-1][1] == "done"
+    await manager.shutdown()
+
+@pytest.mark.asyncio
+async def test_failed_job_and_full_queue(manager):
+    release = asyncio.Event()
+
+    async def blocked(progress):
+        await release.wait()
+        raise RuntimeError("boom")
+
+    first = manager.submit("generate_contract", blocked)
+    await asyncio.sleep(0)  # le worker prend la première tâche
+    manager.submit("generate_contract", blocked)
+    with pytest.raises(JobQueueFull):
+        manager.submit("generate_contract", blocked)
+
+    release.set()
+    events = [event async for event in manager.follow(first.id)]
+    assert events[-1][0] == 'error'
+    assert events[-1][1]['error'] == "boom"
+    await manager.shutdown()
+
+@pytest.mark.asyncio
+async def test_shutdown_marks_in_flight_jobs_as_interrupted(manager, tmp_path):
+    async def blocked(progress):
+        await asyncio.Event().wait()
+
+    job = manager.submit("generate_contract", blocked)
+    await asyncio.sleep(0)
+    await manager.shutdown()
+
+    other = JobManager(DiskResultCache(str(tmp_path / "jobs")), poll_interval=0.01)
+    events = [event async for event in other.follow(job.id)]
+    assert events[-1][0] == 'error'
+    assert events[-1][1]['stage'] == "interrupted"
+
+@pytest.mark.asyncio
+async def test_follow_stops_on_missing_or_orphaned_jobs(tmp_path):
+    store = DiskResultCache(str(tmp_path / "jobs"))
+    events = [event async for event in JobManager(store).follow("unknown")]
+    assert events == [('error', {'id': "unknown", 'status': 'failed', 'error': "Tâche inconnue ou expirée"})]
+
+    # Tâche restée "running" sur disque, sans signe de vie de son processus
+    store.set("orphan", {'id': "orphan", 'kind': "generate_contract", 'status': "running", 'stage': "started",
+                         'events': [], 'heartbeat_at': 0.0})
+    events = [event async for event in JobManager(store, poll_interval=0.01, stale_after=1).follow("orphan")]
+    assert events[-1][0] == 'error'
+    assert events[-1][1]['status'] == "failed"
+
+def test_job_endpoints_on_fake_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(main, "job_manager", JobManager(DiskResultCache(str(tmp_path / "jobs")), poll_interval=0.01))
+    model_pool.set_backend("fake", FakeLLMConfig(ttft=0, tokens_per_second=0, output_tokens=80))
+    try:
+        with TestClient(main.app) as client:
+            history = [{"role": "user", "parts": [{"text": "Share purchase of Beta Ltd."}]}]
+            submitted = client.post("/api/jobs/generate_contract", json={"history": history, "use_cache": False})
+            assert submitted.status_code == 202
+            job_id = submitted.json()["job_id"]
+
+            stream = client.get(f"/api/jobs/{job_id}/events")
+            assert "event: done" in stream.text
+            assert "drafting" in stream.text
+
+            job = client.get(f"/api/jobs/{job_id}").json()
+            assert job["status"] == "succeeded"
+            assert "AGREEMENT" in job["result"]["contract_html"]
+            assert client.get("/api/jobs/unknown").status_code == 404
+    finally:
+        model_pool.set_backend("gemini")
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+
+from llm_scheduler import LLMScheduler, Priority, RateLimitExceeded, SchedulerConfig
+
+FAST_BACKOFF = dict(backoff_base=0.001, backoff_max=0.002)
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped_per_model():
+    scheduler = LLMScheduler(SchedulerConfig(max_concurrency=2))
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return "ok"
+
+    results = await asyncio.gather(*(scheduler.call("draft", "model-a", work) for _ in range(6)))
+    assert results == ["ok"] * 6
+    assert peak == 2
+    assert scheduler.stats()['in_flight'] == {}
+
+@pytest.mark.asyncio
+async def test_interactive_calls_jump_the_queue():
+    scheduler = LLMScheduler(SchedulerConfig(max_concurrency=1))
+    order = []
+
+    async def work(name):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+    first = asyncio.create_task(scheduler.call("draft", "m", lambda: work("draft-1")))
+    await asyncio.sleep(0)
+    queued = [asyncio.create_task(scheduler.call("lawyer", "m", lambda: work("lawyer"))),
+              asyncio.create_task(scheduler.call("draft", "m", lambda: work("draft-2"))),
+              asyncio.create_task(scheduler.call("chat", "m", lambda: work("chat")))]
+    await asyncio.sleep(0)
+    assert scheduler.stats()['queued'] == {'interactive': 1, 'cascade': 1, 'background': 1}
+    await asyncio.gather(first, *queued)
+    assert order == ["draft-1", "chat", "draft-2", "lawyer"]
+
+@pytest.mark.asyncio
+async def test_rate_limited_calls_are_retried_then_surface():
+    scheduler = LLMScheduler(SchedulerConfig(max_retries=2, **FAST_BACKOFF))
+    attempts = 0
+
+    async def flaky():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise ResourceExhausted("429")
+        return "ok"
+
+    assert await scheduler.call("chat", "m", flaky) == "ok"
+    assert scheduler.retries == 2
+
+    async def always_limited():
+        raise ResourceExhausted("429")
+
+    with pytest.raises(RateLimitExceeded):
+        await scheduler.call("chat", "m", always_limited)
+    assert scheduler.stats()['in_flight'] == {}
+
+@pytest.mark.asyncio
+async def test_token_bucket_spaces_out_requests():
+    scheduler = LLMScheduler(SchedulerConfig(requests_per_minute=600, burst=1))
+    started = asyncio.get_running_loop().time()
+
+    async def work():
+        return asyncio.get_running_loop().time() - started
+
+    times = await asyncio.gather(*(scheduler.call("draft", "m", work) for _ in range(3)))
+    # 600/min = un appel toutes les 100 ms après le premier
+    assert times[0] < 0.05
+    assert times[2] >= 0.18
+
+@pytest.mark.asyncio
+async def test_stream_keeps_slot_until_closed_and_cancelled_waiters_leave():
+    scheduler = LLMScheduler(SchedulerConfig(max_concurrency=1))
+
+    async def open_stream():
+        return ["a", "b"]
+
+    async with scheduler.stream("chat", "m", open_stream) as stream:
+        assert stream == ["a", "b"]
+        waiter = asyncio.create_task(scheduler.acquire("m", Priority.CASCADE))
+        await asyncio.sleep(0)
+        assert scheduler.stats()['queued'] == {'cascade': 1}
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()['queued'] == {}
+    assert scheduler.stats()['in_flight'] == {}
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+import pytest
+
+import llm_sdk
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_the_app_does_not_load_the_sdk():
+    code = "import sys, main; print('google.generativeai' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "False"
+
+def test_sdk_is_configured_once_per_key(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: calls.append(kwargs['api_key']))
+    monkeypatch.setattr(llm_sdk, "_configured_key", None)
+
+    assert llm_sdk.configure_once("key-a") is True
+    assert llm_sdk.configure_once("key-a") is True
+    assert llm_sdk.configure_once("key-b") is True
+    assert calls == ["key-a", "key-b"]
+
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    monkeypatch.setattr(llm_sdk, "_configured_key", None)
+    assert llm_sdk.configure_once() is False
+
+def test_rate_limit_errors_are_recognised():
+    assert llm_sdk.is_rate_limit_error(llm_sdk.api_exceptions.ResourceExhausted("429"))
+    assert not llm_sdk.is_rate_limit_error(llm_sdk.api_exceptions.InternalServerError("500"))
+    assert not llm_sdk.is_rate_limit_error(ValueError("429"))
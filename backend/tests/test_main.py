@@ -38,4 +38,18 @@ def test_tool_call_is_triggered():
     2. Envoyer une requête POST à /api/chat avec un historique et un message déclencheur
     3. Vérifier que la réponse contient "TOOL_CALL:lancer_cascade_generation"
     """
-    pass 
\ No newline at end of file
+    pass 
+
+def test_sessions_endpoints():
+    """Teste la création et la lecture d'une conversation côté serveur."""
+    history = [{"role": "user", "parts": [{"text": "Bonjour"}]}]
+    created = client.post("/api/sessions", json={"history": history})
+    assert created.status_code == 200
+    session_id = created.json()["session_id"]
+
+    response = client.get(f"/api/sessions/{session_id}")
+    assert response.json()["history"] == history
+
+    assert client.delete(f"/api/sessions/{session_id}").status_code == 200
+    assert client.get(f"/api/sessions/{session_id}").status_code == 404
+    assert client.post("/api/chat", json={"text": "test", "session_id": session_id}).status_code == 404
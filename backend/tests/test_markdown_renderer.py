@@ -0,0 +1,51 @@
+from markdown_renderer import render_markdown_to_html
+
+def test_renders_contract_structure():
+    html = render_markdown_to_html(
+        "```markdown\n"
+        "# SERVICES AGREEMENT\n\n"
+        "This Agreement is made between **Alpha SA** and *Beta Ltd*.\n\n"
+        "## ARTICLE 1 - OBLIGATIONS\n\n"
+        "1. The Provider shall deliver the Services.\n"
+        "2. The Client shall pay the Fees.\n\n"
+        "- first item\n"
+        "- second item\n\n"
+        "---\n\n"
+        "| Party | Signature |\n"
+        "|-------|-----------|\n"
+        "| Alpha | ________ |\n"
+        "```"
+    )
+
+    assert "```" not in html
+    assert html.startswith('<h1 style="')
+    assert ">SERVICES AGREEMENT</h1>" in html
+    assert "<strong>Alpha SA</strong>" in html and "<em>Beta Ltd</em>" in html
+    assert ">ARTICLE 1 - OBLIGATIONS</h2>" in html
+    assert html.count("<li>") == 4
+    assert "<ol " in html and "<ul " in html
+    assert "<hr " in html
+    assert "<th " in html and "________</td>" in html
+
+def test_escapes_html_and_keeps_signature_lines():
+    html = render_markdown_to_html("Name: ________\nTitle: <CEO> & Director")
+
+    assert html.count("<p ") == 1
+    assert "Name: ________<br>" in html
+    assert "&lt;CEO&gt; &amp; Director" in html
+    assert "<em>" not in html
+
+def test_ordered_lists_keep_their_numbering():
+    html = render_markdown_to_html("1. First\n\n2. Second\n\n3. Third")
+    assert html.count("<ol ") == 1 and html.count("<li>") == 3
+    assert 'start=' not in html
+
+    assert '<ol start="5" ' in render_markdown_to_html("5. Fifth\n6. Sixth")
+    assert '<ol type="a" start="3" ' in render_markdown_to_html("c. third\nd. fourth")
+
+def test_roman_numeral_headings_are_not_lists():
+    html = render_markdown_to_html("I. DEFINITIONS\n\nText.\n\nII. PRICE")
+    assert "<ol" not in html and "<li>" not in html
+    assert ">I. DEFINITIONS</p>" in html and ">II. PRICE</p>" in html
+    # Lettre "i" qui suit "h" : élément de la liste alphabétique
+    assert render_markdown_to_html("h. eighth\ni. ninth").count("<li>") == 2
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+import model_pool as model_pool_module
+from model_pool import ModelPool
+
+class FakeModel:
+    def __init__(self, model_name=None, system_instruction=None, generation_config=None, cached_content=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+
+    @classmethod
+    def from_cached_content(cls, cached_content, generation_config=None):
+        return cls(cached_content=cached_content)
+
+class FakeCachedContent:
+    created = []
+    deleted = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def delete(self):
+        self.deleted.append(self.name)
+
+    @classmethod
+    def create(cls, model, system_instruction=None, contents=None, ttl=None):
+        cls.created.append((model, len(contents or [])))
+        return cls(f"cachedContents/{len(cls.created)}")
+
+@pytest.fixture
+def fake_genai(monkeypatch):
+    FakeCachedContent.created = []
+    FakeCachedContent.deleted = []
+    monkeypatch.setattr(model_pool_module.genai, "GenerativeModel", FakeModel)
+    monkeypatch.setattr(model_pool_module.genai.caching, "CachedContent", FakeCachedContent)
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+def test_models_are_reused_per_model_and_prompt(fake_genai):
+    pool = ModelPool(max_models=2)
+
+    first = pool.get("gemini-2.5-pro", "PROMPT A")
+    assert pool.get("gemini-2.5-pro", "PROMPT A") is first
+    assert pool.get("gemini-2.5-pro", "PROMPT B") is not first
+    assert pool.stats()["model_hits"] == 1 and pool.stats()["model_misses"] == 2
+
+    pool.get("gemini-2.5-flash", "PROMPT A")
+    assert pool.stats()["models"] == 2
+
+@pytest.mark.asyncio
+async def test_context_cache_covers_conversation_prefix(fake_genai):
+    pool = ModelPool(context_cache=True, min_cache_tokens=10)
+    history = [message("user", "long message " * 10), message("model", "reply " * 10)]
+
+    model, remaining = await pool.get_with_context_cache("gemini-2.5-pro", "SYSTEM", history)
+    assert remaining == history and model.cached_content is None
+    await asyncio.sleep(0.05)  # création du contexte en tâche de fond
+    assert FakeCachedContent.created == [("models/gemini-2.5-pro", 2)]
+
+    # Le tour suivant n'envoie que les messages postérieurs au préfixe en cache
+    longer = history + [message("user", "next")]
+    model, remaining = await pool.get_with_context_cache("gemini-2.5-pro", "SYSTEM", longer)
+    assert model.cached_content.name == "cachedContents/1"
+    assert remaining == [message("user", "next")]
+    assert pool.stats()["context_hits"] == 1 and pool.stats()["context_misses"] == 1
+
+@pytest.mark.asyncio
+async def test_short_contexts_are_not_cached(fake_genai):
+    pool = ModelPool(context_cache=True, min_cache_tokens=10_000)
+    await pool.get_with_context_cache("gemini-2.5-pro", "SYSTEM", [message("user", "hi")])
+    await asyncio.sleep(0.01)
+    assert FakeCachedContent.created == []
+
+@pytest.mark.asyncio
+async def test_evicted_contexts_are_deleted_upstream(fake_genai):
+    pool = ModelPool(context_cache=True, min_cache_tokens=10, max_contexts=1)
+    for topic in ("share purchase ", "lease "):
+        await pool.get_with_context_cache("gemini-2.5-pro", "SYSTEM", [message("user", topic * 20)])
+        await asyncio.sleep(0.05)
+    assert FakeCachedContent.deleted == ["cachedContents/1"]
+    assert pool.stats()["cached_contexts"] == 1 and pool.stats()["context_evictions"] == 1
+
+    # Contextes expirés purgés au balayage suivant
+    pool._contexts["other"] = model_pool_module._ContextCacheEntry(FakeCachedContent("stale"), 0)
+    pool._next_sweep = 0
+    await pool.get_with_context_cache("gemini-2.5-pro", "SYSTEM", [message("user", "hi")])
+    assert "other" not in pool._contexts
@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+from backend.main import app
+from observability import Histogram, LLM_ERRORS, LLM_TIME_TO_FIRST_TOKEN, track_llm_call
+
+client = TestClient(app)
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "test", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="draft")
+    histogram.observe(0.5, stage="draft")
+    histogram.observe(5, stage="draft")
+
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{stage="draft",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="draft",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="draft",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{stage="draft"} 3' in lines
+
+def test_llm_call_tracking_records_ttft_and_errors():
+    with track_llm_call("unit_test", "fake-model") as call:
+        call.chunk("hello")
+        call.chunk(" world")
+    assert call.chunks == 2 and call.characters == 11
+    assert LLM_TIME_TO_FIRST_TOKEN.count(stage="unit_test", model="fake-model") == 1
+
+    with pytest.raises(TimeoutError):
+        with track_llm_call("unit_test", "fake-model"):
+            raise TimeoutError()
+    assert LLM_ERRORS.value(stage="unit_test", error="TimeoutError") == 1
+
+def test_unknown_model_names_share_one_label():
+    for model_name in ("gemini-2.5-pro", "models/gemini-2.5-pro", "client-supplied-1", "client-supplied-2"):
+        with track_llm_call("label_test", model_name) as call:
+            call.chunk("ok")
+    assert LLM_TIME_TO_FIRST_TOKEN.count(stage="label_test", model="gemini-2.5-pro") == 2
+    lines = [line for line in LLM_TIME_TO_FIRST_TOKEN.render() if 'stage="label_test"' in line and "_count" in line]
+    assert sorted(lines) == ['llm_time_to_first_token_seconds_count{stage="label_test",model="gemini-2.5-pro"} 2',
+                             'llm_time_to_first_token_seconds_count{stage="label_test",model="other"} 2']
+
+def test_metrics_endpoint_exposes_request_durations():
+    client.get("/")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{endpoint="/",method="GET",status="200"}' in response.text
@@ -0,0 +1,136 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import llm_sdk
+from contract_generator import ContractData, ContractGenerator
+from model_pool import model_pool
+from outline_drafting import OutlineSection, check_consistency, normalize_section, parse_outline
+
+OUTLINE = {
+    "title": "Share Purchase Agreement",
+    "definitions": [{"term": "Shares", "meaning": "the shares of Alpha"}, {"term": "Escrow", "meaning": "..."}],
+    "sections": [
+        {"number": 1, "heading": "Definitions", "scope": "defined terms"},
+        {"number": 7, "heading": "Price", "scope": "price and payment"},
+        {"number": 3, "heading": "Signatures", "scope": "signature blocks"},
+    ],
+}
+
+def test_outline_is_renumbered_in_order():
+    outline = parse_outline(OUTLINE)
+    assert [(section.number, section.heading) for section in outline.sections] == [
+        (1, "Definitions"), (2, "Price"), (3, "Signatures")
+    ]
+    assert parse_outline({"sections": [{"heading": "Only one"}]}) is None
+
+def test_section_heading_is_guaranteed():
+    section = OutlineSection(2, "Price", "")
+    assert normalize_section("```markdown\n# SPA\nThe price is EUR 10m.\n```", section) == (
+        "## ARTICLE 2. Price\n\nThe price is EUR 10m."
+    )
+    assert normalize_section("## ARTICLE 2. Price\n\nText", section) == "## ARTICLE 2. Price\n\nText"
+
+def test_consistency_issues():
+    outline = parse_outline(OUTLINE)
+    sections = [
+        '## ARTICLE 1. Definitions\n"Shares" means the shares of Alpha.',
+        '## ARTICLE 2. Price\nThe price for the Shares (the "Shares") is paid as set out in Article 9.',
+        "## ARTICLE 3. Signatures\nSee Article 2.",
+    ]
+    issues = check_consistency(outline, sections)
+    assert {'type': 'dangling_reference', 'article': 2, 'reference': 9} in issues
+    assert {'type': 'duplicate_definition', 'term': 'Shares', 'articles': [1, 2]} in issues
+    assert {'type': 'unused_definition', 'term': 'Escrow'} in issues
+
+def test_references_to_other_texts_are_not_dangling():
+    outline = parse_outline(OUTLINE)
+    sections = [
+        "## ARTICLE 1. Definitions\nAs defined in Section 1782 and Section 10 of the Companies Act 2006.",
+        "## ARTICLE 2. Price\nWithholding under Article 1240 of the Civil Code, see Section 2.1 and Article 3.",
+        "## ARTICLE 3. Signatures\nSubject to Article 8 of this Agreement.",
+    ]
+    assert [issue for issue in check_consistency(outline, sections) if issue['type'] == 'dangling_reference'] == [
+        {'type': 'dangling_reference', 'article': 3, 'reference': 8}
+    ]
+
+@pytest.mark.asyncio
+async def test_sections_are_drafted_in_parallel(monkeypatch):
+    running, peak = [], []
+
+    class StubModel:
+        def __init__(self, generation_config):
+            self.generation_config = generation_config
+
+        async def generate_content_async(self, prompt):
+            if self.generation_config and "response_schema" in self.generation_config:
+                return SimpleNamespace(text=json.dumps(OUTLINE), usage_metadata=None)
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+            heading = prompt.rsplit("Draft ONLY Article ", 1)[1].split(" (", 1)[0]
+            return SimpleNamespace(text=f"## ARTICLE {heading}. X\n\nText of article {heading}.", usage_metadata=None)
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(model_pool, "get", lambda name, system_instruction=None, generation_config=None: StubModel(generation_config))
+    data = ContractData("", {}, {}, [], "", [{"role": "user", "parts": [{"text": "Draft an SPA"}]}])
+
+    markdown, report = await ContractGenerator("test", "test").generate_contract_outlined(data, max_parallel_sections=2)
+
+    assert max(peak) == 2
+    assert markdown.startswith("# Share Purchase Agreement")
+    assert markdown.index("ARTICLE 1.") < markdown.index("ARTICLE 2.") < markdown.index("ARTICLE 3.")
+    assert report["sections"] == 3
+
+@pytest.mark.asyncio
+async def test_custom_prompt_reaches_outline_and_sections(monkeypatch):
+    prompts = []
+
+    class StubModel:
+        def __init__(self, generation_config):
+            self.generation_config = generation_config
+
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            if self.generation_config and "response_schema" in self.generation_config:
+                return SimpleNamespace(text=json.dumps(OUTLINE), usage_metadata=None)
+            return SimpleNamespace(text="Text.", usage_metadata=None)
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(model_pool, "get", lambda name, system_instruction=None, generation_config=None: StubModel(generation_config))
+    data = ContractData("", {}, {}, [], "", [{"role": "user", "parts": [{"text": "Draft an SPA"}]}])
+
+    await ContractGenerator("test", "test").generate_contract_outlined(
+        data, custom_prompt="Use British spelling.\n{full_conversation}"
+    )
+    assert len(prompts) == 4
+    assert all("Use British spelling." in prompt and prompt.count("Draft an SPA") == 1 for prompt in prompts)
+
+@pytest.mark.asyncio
+async def test_single_section_outline_is_drafted_in_one_call(monkeypatch):
+    prompts = []
+
+    class StubModel:
+        def __init__(self, generation_config):
+            self.generation_config = generation_config
+
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            if self.generation_config and "response_schema" in self.generation_config:
+                outline = {"title": "Letter", "sections": [{"number": 1, "heading": "Body", "scope": "all"}]}
+                return SimpleNamespace(text=json.dumps(outline), usage_metadata=None)
+            return SimpleNamespace(text="# LETTER\n\nBody.", usage_metadata=None)
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(model_pool, "get", lambda name, system_instruction=None, generation_config=None: StubModel(generation_config))
+    data = ContractData("", {}, {}, [], "", [{"role": "user", "parts": [{"text": "Draft a comfort letter"}]}])
+
+    markdown, report = await ContractGenerator("test", "test").generate_contract_outlined(
+        data, custom_prompt="Keep it short.\n{full_conversation}"
+    )
+    assert report == {'fallback': 'invalid_outline'}
+    assert markdown.startswith("# LETTER") and len(prompts) == 2
+    assert "Keep it short." in prompts[1]
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+import pytest
+import llm_sdk
+from contract_generator import ContractGenerator, generate_contract_cascade
+from result_cache import DiskResultCache, SingleFlight, make_cache_key, normalize_history
+
+def test_keys_ignore_whitespace_differences():
+    a = [{"role": "user", "parts": [{"text": "Share  purchase\nagreement "}]}]
+    b = [{"role": "user", "parts": [{"text": "Share purchase agreement"}]}]
+    assert make_cache_key(normalize_history(a)) == make_cache_key(normalize_history(b))
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskResultCache(str(tmp_path), max_bytes=250)
+    cache.set("old", {"value": "x" * 100})
+    cache.set("recent", {"value": "y" * 100})
+    past = time.time() - 60
+    os.utime(tmp_path / "old.json", (past, past))
+    cache.get("recent")
+    cache.set("new", {"value": "z" * 100})
+
+    assert cache.get("old") is None
+    assert cache.get("recent") == {"value": "y" * 100}
+    assert cache.get("new") == {"value": "z" * 100}
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "shared": 4, "inflight": 0}
+
+@pytest.mark.asyncio
+async def test_identical_cascades_run_once(monkeypatch):
+    calls = []
+
+    async def fake_generate(self, contract_data, custom_prompt=None):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "# AGREEMENT\n\nText."
+
+    monkeypatch.setattr(llm_sdk.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(ContractGenerator, "generate_contract", fake_generate)
+    history = [{"role": "user", "parts": [{"text": "Draft an NDA"}]}]
+
+    first, second = await asyncio.gather(
+        generate_contract_cascade(history, api_key="test", model_name="test"),
+        generate_contract_cascade(history, api_key="test", model_name="test"),
+    )
+    third = await generate_contract_cascade(history, api_key="test", model_name="test")
+
+    assert len(calls) == 1
+    assert first["html"] == second["html"] == third["html"]
+    assert third["data"]["cache"] == "hit"
+
+    await generate_contract_cascade(history, api_key="test", model_name="test", use_cache=False)
+    assert len(calls) == 2
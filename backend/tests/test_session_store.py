@@ -0,0 +1,60 @@
+import threading
+import time
+from session_store import InMemorySessionStore, SQLiteSessionStore, make_message
+
+def test_in_memory_lru_and_ttl():
+    store = InMemorySessionStore(max_sessions=2, ttl_seconds=60)
+    first = store.create([make_message("user", "hello")])
+    second = store.create()
+    store.get(first.id)  # first devient la plus récente
+    third = store.create()
+
+    assert store.get(second.id) is None
+    assert store.get(first.id).history == [make_message("user", "hello")]
+    assert store.get(third.id) is not None
+
+    store.get(first.id).updated_at = time.time() - 120
+    assert store.get(first.id) is None
+
+def test_append_ignores_malformed_messages():
+    store = InMemorySessionStore()
+    session = store.create([{"text": "no role"}, make_message("user", "ok")])
+    store.append(session.id, make_message("model", "reply"), "garbage")
+
+    assert [m["role"] for m in store.get(session.id).history] == ["user", "model"]
+
+def test_sqlite_store_persists_and_syncs_between_instances(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    writer = SQLiteSessionStore(db_path)
+    reader = SQLiteSessionStore(db_path)
+
+    session = writer.create([make_message("user", "first")])
+    assert reader.get(session.id).history == [make_message("user", "first")]
+
+    # Le cache du second store est complété avec les seuls messages manquants
+    writer.append(session.id, make_message("model", "second"))
+    assert [m["parts"][0]["text"] for m in reader.get(session.id).history] == ["first", "second"]
+
+    assert reader.delete(session.id)
+    assert writer.get(session.id) is None
+
+def test_sqlite_concurrent_appends_from_two_workers(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    workers = [SQLiteSessionStore(db_path), SQLiteSessionStore(db_path)]
+    session = workers[0].create()
+    workers[1].get(session.id)
+
+    def chat(store, name):
+        for turn in range(10):
+            store.append(session.id, make_message("user", f"{name}-{turn}"))
+
+    threads = [threading.Thread(target=chat, args=(store, str(index))) for index, store in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    texts = [m["parts"][0]["text"] for m in SQLiteSessionStore(db_path).get(session.id).history]
+    assert sorted(texts) == sorted(f"{name}-{turn}" for name in "01" for turn in range(10))
+    assert [text for text in texts if text.startswith("0-")] == [f"0-{turn}" for turn in range(10)]
+    assert workers[0].get(session.id).history == workers[1].get(session.id).history
@@ -0,0 +1,15 @@
+import settings
+from settings import LazySingleton
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+def test_singleton_is_built_once_on_first_use(monkeypatch):
+    calls = []
+    loaded = []
+    monkeypatch.setattr(settings, "load_environment", lambda: loaded.append(True))
+    singleton = LazySingleton(lambda: calls.append(1) or Counter())
+    assert calls == []
+    singleton.value += 2
+    assert singleton.value == 2 and calls == [1] and loaded == [True]
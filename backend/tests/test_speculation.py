@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from speculation import SpeculationConfig, SpeculativeGenerator, is_confirmation_turn, is_plain_confirmation
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+SUMMARY_STATE = [
+    message("user", "Share purchase of Alpha SAS for EUR 10m"),
+    message("model", "Summary: ... Shall we proceed with generating the document?"),
+]
+OPTIONS = {"model_name": "test", "html_renderer": "local", "drafting_mode": "single"}
+
+def result(markdown):
+    return {"markdown": markdown, "html": f"<p>{markdown}</p>", "data": {"cache": "miss"}}
+
+def test_only_short_confirmations_keep_the_terms():
+    assert is_confirmation_turn(message("user", "Yes, go ahead."))
+    assert is_confirmation_turn(message("model", "TOOL_CALL:lancer_cascade_generation"))
+    assert not is_confirmation_turn(message("user", "Change the price to EUR 12m"))
+    assert not is_confirmation_turn(message("user", "Yes, but the price is EUR 12m and the escrow is released after 24 months instead"))
+
+def test_negated_or_corrective_replies_are_not_confirmations():
+    for text in ("Not correct, the price is EUR 12m", "No, that is inaccurate: Beta is the buyer",
+                 "Yesterday we agreed 24 months escrow instead", "That's incorrect", "Correct, EUR 12m"):
+        assert not is_plain_confirmation(text), text
+    assert is_plain_confirmation("Correct, please generate.")
+
+@pytest.mark.asyncio
+async def test_confirmed_generation_claims_in_progress_result():
+    speculation = SpeculativeGenerator(SpeculationConfig())
+    started = asyncio.Event()
+
+    async def run():
+        started.set()
+        await asyncio.sleep(0.02)
+        return result("# SPA")
+
+    assert speculation.start(SUMMARY_STATE, OPTIONS, run)
+    await started.wait()
+    # Sans appel de l'outil de génération, la spéculation n'est pas réclamée
+    assert await speculation.claim(SUMMARY_STATE + [message("user", "Yes, proceed")], OPTIONS) is None
+    assert speculation.confirm(SUMMARY_STATE)
+    claimed = await speculation.claim(SUMMARY_STATE + [message("user", "Yes, proceed")], OPTIONS)
+    assert claimed["markdown"] == "# SPA" and claimed["data"]["speculative"] is True
+    assert speculation.stats()["claimed_in_progress"] == 1
+
+    # Réclamée une seule fois ; d'autres paramètres de cascade ne correspondent pas
+    assert await speculation.claim(SUMMARY_STATE, OPTIONS) is None
+    speculation.start(SUMMARY_STATE, OPTIONS, run)
+    assert await speculation.claim(SUMMARY_STATE, {**OPTIONS, "html_renderer": "llm"}) is None
+    # Appel d'outil présent dans l'historique : signal explicite
+    tool_call = [message("user", "Yes"), message("model", "TOOL_CALL:lancer_cascade_generation")]
+    assert (await speculation.claim(SUMMARY_STATE + tool_call, OPTIONS))["markdown"] == "# SPA"
+    await speculation.shutdown()
+
+@pytest.mark.asyncio
+async def test_edited_terms_discard_the_speculation():
+    speculation = SpeculativeGenerator(SpeculationConfig())
+    finished = []
+
+    async def run():
+        await asyncio.sleep(1)
+        finished.append(1)
+        return result("# SPA")
+
+    speculation.start(SUMMARY_STATE, OPTIONS, run)
+    speculation.discard(SUMMARY_STATE)
+    await asyncio.sleep(0)
+    assert await speculation.claim(SUMMARY_STATE + [message("user", "Yes")], OPTIONS) is None
+    # Un historique modifié après le résumé ne correspond à aucune spéculation
+    speculation.start(SUMMARY_STATE, OPTIONS, run)
+    assert await speculation.claim(SUMMARY_STATE + [message("user", "Make it EUR 12m")], OPTIONS) is None
+    assert speculation.stats()["discarded"] == 1
+    await speculation.shutdown()
+    assert finished == []
+
+def test_generate_contract_returns_speculative_result(monkeypatch):
+    calls = []
+
+    async def fake_cascade(**kwargs):
+        calls.append(kwargs["conversation_history"])
+        return result("# SPA")
+
+    monkeypatch.setattr(main, "generate_contract_cascade", fake_cascade)
+    monkeypatch.setattr(main, "speculation", SpeculativeGenerator(SpeculationConfig()))
+
+    async def summary_then_start():
+        main.start_speculative_generation(SUMMARY_STATE, "gemini-2.5-pro")
+        main.speculation.confirm(SUMMARY_STATE)
+
+    with TestClient(main.app) as client:
+        client.portal.call(summary_then_start)
+        response = client.post("/api/generate_contract", json={"history": SUMMARY_STATE + [message("user", "Yes, go ahead")]})
+
+    assert response.status_code == 200
+    assert response.json()["extracted_data"]["speculative"] is True
+    assert calls == [SUMMARY_STATE]
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from streaming import CoalesceConfig, coalesce_stream
+
+async def chunks(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+@pytest.mark.asyncio
+async def test_first_chunk_is_sent_alone_then_coalesced_by_size():
+    config = CoalesceConfig(min_chars=6, max_delay=10)
+    out = [c async for c in coalesce_stream(chunks(["a", "bb", "cc", "dd", "e"]), config)]
+
+    assert out[0] == "a"
+    assert "".join(out) == "abbccdde"
+    assert out[1:] == ["bbccdd", "e"]
+
+@pytest.mark.asyncio
+async def test_buffer_is_flushed_after_max_delay():
+    config = CoalesceConfig(min_chars=1000, max_delay=0.02)
+    out = [c async for c in coalesce_stream(chunks(["a", "b", "c", "d"], delay=0.015), config)]
+
+    assert "".join(out) == "abcd"
+    assert 2 < len(out) <= 4
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_after_flushing():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("upstream")
+
+    out = []
+    with pytest.raises(RuntimeError):
+        async for c in coalesce_stream(failing(), CoalesceConfig(min_chars=100, max_delay=10)):
+            out.append(c)
+    assert out == ["a", "b"]
+
+@pytest.mark.asyncio
+async def test_slow_client_stops_upstream_reads():
+    produced = []
+
+    async def source():
+        for i in range(100):
+            produced.append(i)
+            yield "x"
+
+    stream = coalesce_stream(source(), CoalesceConfig(min_chars=1, max_delay=10, max_pending_chunks=4))
+    await stream.__anext__()
+    await asyncio.sleep(0.01)
+    assert len(produced) <= 7
+    await stream.aclose()
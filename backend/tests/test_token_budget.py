@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import token_budget as token_budget_module
+from observability import UsageLedger
+from token_budget import TokenBudget, TokenBudgetConfig, TokenBudgetExceeded
+
+@pytest.mark.asyncio
+async def test_plan_caps_output_and_rejects_oversized_prompts():
+    budget = TokenBudget(TokenBudgetConfig(max_prompt_tokens={"chat": 100}))
+
+    plan = await budget.plan("modify", "gemini-2.0-flash", "system", "<p>contract</p>")
+    # Plafond de l'étape borné par la sortie maximale du modèle
+    assert plan.max_output_tokens == 8192
+    assert plan.generation_config({"temperature": 0.1}) == {"temperature": 0.1, "max_output_tokens": 8192}
+
+    with pytest.raises(TokenBudgetExceeded) as excinfo:
+        await budget.plan("chat", "gemini-2.5-pro", "word " * 500)
+    assert excinfo.value.limit == 100 and excinfo.value.prompt_tokens > 100
+    assert budget.stats()["rejected"] == 1
+
+    disabled = TokenBudget(TokenBudgetConfig(enabled=False))
+    assert (await disabled.plan("chat", "gemini-2.5-pro", "hello")).generation_config() is None
+
+@pytest.mark.asyncio
+async def test_plan_fits_every_model_of_the_fallback_chain(monkeypatch):
+    monkeypatch.setattr(token_budget_module.hedging.config, "fallback_model", "gemini-2.0-flash")
+    plan = await TokenBudget().plan("draft", "gemini-2.5-pro", "prompt")
+    # La reprise sur gemini-2.0-flash ne sort que 8192 tokens : le plan de gemini-2.5-pro s'y plie
+    assert plan.max_output_tokens == 8192
+
+@pytest.mark.asyncio
+async def test_plan_leaves_room_for_thinking(monkeypatch):
+    monkeypatch.setattr(token_budget_module.hedging.config, "fallback_model", "gemini-2.5-flash")
+    plan = await TokenBudget().plan("lawyer", "gemini-2.5-pro", "prompt")
+    # La réflexion de gemini-2.5-pro est décomptée du même plafond que la réponse de 2048 tokens
+    assert plan.thinking_tokens == 32768
+    assert plan.max_output_tokens == 2048 + 32768
+    assert (await TokenBudget().plan("chat", "gemini-1.5-pro", "prompt")).max_output_tokens == 8192
+
+@pytest.mark.asyncio
+async def test_api_counting_is_cached(monkeypatch):
+    calls = []
+
+    class CountingModel:
+        async def count_tokens_async(self, text):
+            calls.append(text)
+            return SimpleNamespace(total_tokens=42)
+
+    monkeypatch.setattr(token_budget_module.model_pool, "get", lambda name, *args, **kwargs: CountingModel())
+    budget = TokenBudget(TokenBudgetConfig(counting="api"))
+
+    assert await budget.count("gemini-2.5-pro", "same prompt") == 42
+    assert await budget.count("gemini-2.5-pro", "same prompt") == 42
+    assert len(calls) == 1 and budget.stats()["count_cache_hits"] == 1
+
+def test_usage_is_recorded_per_session():
+    ledger = UsageLedger(max_sessions=1)
+    ledger.record_call("s1", "chat", {"prompt": 100, "output": 20})
+    ledger.record_call("s1", "modify", {"prompt": 50, "output": 30, "cached": 10})
+    usage = ledger.session("s1")
+    assert (usage["calls"], usage["prompt"], usage["output"], usage["cached"]) == (2, 150, 50, 10)
+    assert usage["stages"]["modify"] == {"prompt": 50, "output": 30}
+
+    ledger.record_call("s2", "chat", {"prompt": 1})
+    assert ledger.session("s1") is None
+
+def test_oversized_modification_returns_413(monkeypatch):
+    monkeypatch.setattr(main, "token_budget", TokenBudget(TokenBudgetConfig(max_prompt_tokens={"modify": 10})))
+    client = TestClient(main.app)
+
+    response = client.post("/api/modify_contract", json={
+        "current_html": "<p>" + "clause " * 200 + "</p>", "modification_request": "Rewrite everything", "mode": "full"
+    })
+    assert response.status_code == 413
+    assert response.json()["detail"]["limit"] == 10
+
+def test_session_usage_endpoint(monkeypatch):
+    ledger = UsageLedger()
+    monkeypatch.setattr(main, "usage_ledger", ledger)
+    client = TestClient(main.app)
+    session_id = client.post("/api/sessions", json={"history": []}).json()["session_id"]
+
+    ledger.record_call(session_id, "chat", {"prompt": 12, "output": 3})
+    body = client.get(f"/api/sessions/{session_id}/usage").json()
+    assert body["prompt"] == 12 and body["stages"]["chat"]["output"] == 3
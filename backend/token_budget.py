@@ -0,0 +1,185 @@
+"""
+Budget de tokens des appels au modèle
+Avant chaque appel : comptage du prompt, plafond de sortie (max_output_tokens) propre à l'étape,
+et refus immédiat d'un prompt qui ne tient pas dans la fenêtre du modèle (ou sous le plafond de l'étape)
+au lieu d'une erreur du fournisseur après l'attente
+Les limites retenues sont les plus petites de la chaîne de modèles (primaire, reprise, couverture) :
+le plan reste valable quel que soit le modèle qui répond. Les plafonds d'étape portent sur la réponse
+visible : la réflexion des modèles "thinking", comptée dans max_output_tokens, s'y ajoute
+Comptage par estimation, ou exact par l'API du modèle (TOKEN_COUNTING=api), mémorisé par hash du contenu
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from conversation_compactor import count_tokens
+from hedging import hedging
+from llm_scheduler import parse_mapping
+from model_pool import model_pool, thinking_tokens
+from observability import LLM_BUDGET_REJECTIONS, LLM_PLANNED_PROMPT_TOKENS
+from settings import LazySingleton
+
+# Sortie visible maximale par étape : réponses de chat courtes, documents complets pour la rédaction et la mise en forme
+DEFAULT_MAX_OUTPUT_TOKENS = {
+    "chat": 8192,
+    "stream": 8192,
+    "lawyer": 2048,
+    "modify": 65536,
+    "modify_patch": 16384,
+    "extract": 4096,
+    "draft": 32768,
+    "outline": 8192,
+    "draft_section": 8192,
+    "format": 65536,
+    "deal_sheet": 8192,
+}
+
+# (fenêtre de contexte, sortie maximale) par modèle
+MODEL_LIMITS = {
+    "gemini-2.5-pro": (1_048_576, 65_536),
+    "gemini-2.5-flash": (1_048_576, 65_536),
+    "gemini-2.5-flash-lite": (1_048_576, 65_536),
+    "gemini-2.0-flash": (1_048_576, 8_192),
+    "gemini-1.5-pro": (2_097_152, 8_192),
+    "gemini-1.5-flash": (1_048_576, 8_192),
+}
+DEFAULT_MODEL_LIMITS = (1_048_576, 8_192)
+
+
+class TokenBudgetExceeded(Exception):
+    """Le prompt dépasse la fenêtre du modèle ou le plafond de l'étape : l'appel n'est pas tenté"""
+
+    def __init__(self, stage: str, model_name: str, prompt_tokens: int, limit: int):
+        super().__init__(f"Prompt de {prompt_tokens} tokens pour {stage} ({model_name}), limite {limit}")
+        self.stage = stage
+        self.model_name = model_name
+        self.prompt_tokens = prompt_tokens
+        self.limit = limit
+
+
+@dataclass
+class TokenPlan:
+    stage: str
+    model_name: str
+    prompt_tokens: int
+    max_output_tokens: Optional[int]
+    prompt_limit: int
+    thinking_tokens: int = 0  # part de max_output_tokens réservée à la réflexion du modèle
+
+    def generation_config(self, base: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Configuration de génération de l'appel : celle de l'étape, plafonnée en sortie"""
+        if self.max_output_tokens is None:
+            return base
+        return {**(base or {}), "max_output_tokens": self.max_output_tokens}
+
+
+@dataclass
+class TokenBudgetConfig:
+    enabled: bool = True
+    counting: str = "estimate"     # "api" : comptage exact par le modèle (un appel de plus, mémorisé)
+    max_output_tokens: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_MAX_OUTPUT_TOKENS))
+    max_prompt_tokens: Dict[str, int] = field(default_factory=dict)  # plafonds par étape, en plus de la fenêtre
+    cache_entries: int = 4096
+
+    @classmethod
+    def from_env(cls) -> "TokenBudgetConfig":
+        """
+        TOKEN_BUDGET_ENABLED=0 pour désactiver, TOKEN_COUNTING (estimate | api), TOKEN_COUNT_CACHE_ENTRIES,
+        TOKEN_MAX_OUTPUT et TOKEN_MAX_PROMPT de la forme "modify=32768,chat=4096"
+        """
+        max_output = dict(DEFAULT_MAX_OUTPUT_TOKENS)
+        max_output.update({stage: int(value) for stage, value in parse_mapping(os.getenv("TOKEN_MAX_OUTPUT", "")).items()})
+        return cls(
+            enabled=os.getenv("TOKEN_BUDGET_ENABLED", "1") == "1",
+            counting=os.getenv("TOKEN_COUNTING", "estimate"),
+            max_output_tokens=max_output,
+            max_prompt_tokens={stage: int(value) for stage, value in parse_mapping(os.getenv("TOKEN_MAX_PROMPT", "")).items()},
+            cache_entries=int(os.getenv("TOKEN_COUNT_CACHE_ENTRIES", "4096")),
+        )
+
+
+class TokenBudget:
+    """
+    plan = await token_budget.plan("modify", model_name, CONTRACT_MODIFICATION_PROMPT, context)
+    model_pool.get(name, CONTRACT_MODIFICATION_PROMPT, plan.generation_config())
+    Lève TokenBudgetExceeded avant tout appel si le prompt ne tient pas
+    """
+
+    def __init__(self, config: Optional[TokenBudgetConfig] = None):
+        self.config = config or TokenBudgetConfig()
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'plans': 0, 'rejected': 0, 'api_counts': 0, 'count_cache_hits': 0, 'count_errors': 0}
+
+    async def count(self, model_name: str, text: str) -> int:
+        if self.config.counting != "api":
+            return count_tokens(text)
+        key = hashlib.sha1(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                self._counts.move_to_end(key)
+                self.counters['count_cache_hits'] += 1
+                return cached
+        try:
+            response = await model_pool.get(model_name).count_tokens_async(text)
+            tokens = int(response.total_tokens)
+        except Exception as e:
+            # Comptage indisponible (modèle simulé, réseau) : estimation, non mémorisée
+            self.counters['count_errors'] += 1
+            print(f"⚠️ Comptage des tokens impossible ({type(e).__name__}: {e}), estimation")
+            return count_tokens(text)
+        self.counters['api_counts'] += 1
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self.config.cache_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def model_limits(self, model_name: str) -> Tuple[int, int]:
+        """(fenêtre, sortie maximale) communes à tous les modèles qui peuvent servir l'appel"""
+        limits = [MODEL_LIMITS.get(name, DEFAULT_MODEL_LIMITS) for name in hedging.models_for(model_name)]
+        return min(context for context, _ in limits), min(output for _, output in limits)
+
+    def thinking_reserve(self, model_name: str) -> int:
+        """Réflexion maximale parmi les modèles qui peuvent servir l'appel"""
+        return max(thinking_tokens(name) for name in hedging.models_for(model_name))
+
+    def output_limit(self, stage: str, model_name: str) -> int:
+        """Plafond de l'étape plus la réflexion éventuelle, borné par la sortie maximale du modèle"""
+        model_output = self.model_limits(model_name)[1]
+        stage_output = self.config.max_output_tokens.get(stage)
+        if stage_output is None:
+            return model_output
+        return min(stage_output + self.thinking_reserve(model_name), model_output)
+
+    def prompt_limit(self, stage: str, model_name: str) -> int:
+        """Fenêtre du modèle moins la sortie réservée, bornée par le plafond de l'étape s'il y en a un"""
+        context = self.model_limits(model_name)[0]
+        limit = context - self.output_limit(stage, model_name)
+        return min(limit, self.config.max_prompt_tokens.get(stage, limit))
+
+    async def plan(self, stage: str, model_name: str, *parts: str) -> TokenPlan:
+        """Comptage du prompt (prompt système, contexte, message...) et plafond de sortie de l'appel"""
+        prompt_tokens = await self.count(model_name, "\n".join(part for part in parts if part))
+        if not self.config.enabled:
+            return TokenPlan(stage, model_name, prompt_tokens, None, self.model_limits(model_name)[0])
+        self.counters['plans'] += 1
+        limit = self.prompt_limit(stage, model_name)
+        LLM_PLANNED_PROMPT_TOKENS.inc(prompt_tokens, stage=stage, model=model_name)
+        if prompt_tokens > limit:
+            self.counters['rejected'] += 1
+            LLM_BUDGET_REJECTIONS.inc(stage=stage)
+            raise TokenBudgetExceeded(stage, model_name, prompt_tokens, limit)
+        return TokenPlan(stage, model_name, prompt_tokens, self.output_limit(stage, model_name), limit,
+                         self.thinking_reserve(model_name))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'counting': self.config.counting, 'cached_counts': len(self._counts),
+                'enabled': self.config.enabled}
+
+
+token_budget = LazySingleton(lambda: TokenBudget(TokenBudgetConfig.from_env()))